@@ -0,0 +1,26 @@
+-- 告警通知发件箱 - 迁移脚本
+-- 告警与通知任务在同一事务写入，通知工作池(ljwx-bigscreen/bigscreen/bigScreen/alert_outbox.py)在事务外发送微信/系统通知
+
+CREATE TABLE IF NOT EXISTS t_alert_notification_outbox (
+    id BIGINT NOT NULL AUTO_INCREMENT,
+    alert_id BIGINT NOT NULL COMMENT '告警ID',
+    channel VARCHAR(20) NOT NULL COMMENT '通知渠道:wechat/system',
+    dedup_key VARCHAR(128) NOT NULL COMMENT '去重键(告警ID:渠道)',
+    device_sn VARCHAR(50) NULL COMMENT '设备序列号',
+    payload JSON NULL COMMENT '通知内容',
+    status VARCHAR(20) NOT NULL DEFAULT 'pending' COMMENT '状态:pending/processing/sent/dead',
+    attempts INT NOT NULL DEFAULT 0 COMMENT '已尝试次数',
+    next_attempt_time DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '下次发送时间',
+    locked_by VARCHAR(64) NULL COMMENT '领取批次标识',
+    locked_until DATETIME NULL COMMENT '领取租约到期时间',
+    last_error VARCHAR(500) NULL COMMENT '最近一次错误',
+    create_time DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    sent_time DATETIME NULL COMMENT '发送成功时间',
+    PRIMARY KEY (id),
+    UNIQUE KEY uk_dedup_key (dedup_key),
+    KEY idx_status_next_attempt (status, next_attempt_time),
+    KEY idx_locked_by (locked_by)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='告警通知发件箱表';
+
+-- 已发送记录定期清理(可选)
+-- DELETE FROM t_alert_notification_outbox WHERE status = 'sent' AND sent_time < DATE_SUB(NOW(), INTERVAL 7 DAY);
@@ -0,0 +1,22 @@
+-- 设备历史差量存储 - 迁移脚本
+-- DEVICE_HISTORY_MODE=delta 时(ljwx-bigscreen/bigscreen/bigScreen/device_history_store.py)：
+--   电量/充电/佩戴按游程写入t_device_status_run，t_device_info_history只在静态字段变化时写入(电量等列为NULL)
+-- 已有整行历史执行 python compact_device_history.py 压缩(逐设备提交，可续跑)
+
+CREATE TABLE IF NOT EXISTS t_device_status_run (
+    id BIGINT NOT NULL AUTO_INCREMENT,
+    serial_number VARCHAR(255) NOT NULL COMMENT '设备唯一编号',
+    start_time DATETIME NOT NULL COMMENT '游程首次上报时间',
+    end_time DATETIME NOT NULL COMMENT '游程最后上报时间',
+    battery_level INT NULL COMMENT '电量',
+    charging_status VARCHAR(16) NULL COMMENT '充电状态',
+    wearable_status VARCHAR(16) NULL COMMENT '佩戴状态',
+    voltage INT NULL COMMENT '游程内最后一次上报的电压',
+    samples INT NOT NULL DEFAULT 1 COMMENT '游程内上报次数',
+    PRIMARY KEY (id),
+    UNIQUE KEY uk_sn_start (serial_number, start_time),
+    KEY idx_sn_end (serial_number, end_time)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='设备电量/充电/佩戴状态游程表';
+
+-- 压缩后历史表仅保留静态字段变更行，电量/充电/佩戴/电压列置为NULL(原表定义均允许NULL)
+-- 压缩完成后可回收空间: OPTIMIZE TABLE t_device_info_history;
@@ -0,0 +1,26 @@
+-- 健康数据分级汇总(5分钟/小时/天) - 迁移脚本
+-- 入库刷新时增量维护(ljwx-bigscreen/bigscreen/bigScreen/health_rollup.py)，历史数据执行 python backfill_health_rollups.py 重建
+
+CREATE TABLE IF NOT EXISTS t_health_rollup (
+    id BIGINT NOT NULL AUTO_INCREMENT,
+    bucket_level VARCHAR(4) NOT NULL COMMENT '汇总粒度:5m/1h/1d',
+    bucket_start DATETIME NOT NULL COMMENT '时间桶起点',
+    device_sn VARCHAR(50) NOT NULL COMMENT '设备序列号',
+    metric VARCHAR(32) NOT NULL COMMENT '指标名(与t_user_health_data字段一致)',
+    customer_id BIGINT NOT NULL DEFAULT 0 COMMENT '租户ID',
+    org_id BIGINT NULL COMMENT '组织ID',
+    user_id BIGINT NULL COMMENT '用户ID',
+    sample_count INT NOT NULL DEFAULT 0 COMMENT '有效样本数(不含空值和0)',
+    value_sum DOUBLE NOT NULL DEFAULT 0 COMMENT '取值合计',
+    value_min DOUBLE NULL COMMENT '最小值',
+    value_max DOUBLE NULL COMMENT '最大值',
+    update_time DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id),
+    UNIQUE KEY uk_level_device_metric_bucket (bucket_level, device_sn, metric, bucket_start),
+    KEY idx_org_level_metric_bucket (org_id, bucket_level, metric, bucket_start),
+    KEY idx_user_level_metric_bucket (user_id, bucket_level, metric, bucket_start),
+    KEY idx_level_bucket (bucket_level, bucket_start)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='健康数据分级汇总表';
+
+-- 5分钟粒度保留90天即可(小时/天粒度长期保留，可选)
+-- DELETE FROM t_health_rollup WHERE bucket_level = '5m' AND bucket_start < DATE_SUB(NOW(), INTERVAL 90 DAY);
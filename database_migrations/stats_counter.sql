@@ -0,0 +1,12 @@
+-- 大屏日计数快照 - 迁移脚本
+-- Redis日计数(ljwx-bigscreen/bigscreen/bigScreen/stats_counters.py)定期写入；Redis过期后的历史日期从此表读取
+
+CREATE TABLE IF NOT EXISTS t_stats_counter (
+    customer_id BIGINT NOT NULL COMMENT '租户ID',
+    stat_day DATE NOT NULL COMMENT '统计日期',
+    org_id BIGINT NOT NULL DEFAULT 0 COMMENT '组织ID(0为租户合计)',
+    kind VARCHAR(32) NOT NULL COMMENT '类型:health/alert/alert:<级别>/message/device',
+    value BIGINT NOT NULL DEFAULT 0 COMMENT '数量',
+    update_time DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (customer_id, stat_day, org_id, kind)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='大屏日计数快照表';
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""从t_user_health_data明细重建分级汇总t_health_rollup(5分钟/小时/天)
+
+用法:
+    python backfill_health_rollups.py --start 2025-01-01 --end 2025-06-30
+    python backfill_health_rollups.py --days 90 --device A5GTQ24B26000732
+按天分段重建并逐段提交，可中断后从任意日期续跑；重建幂等(先删后插)
+"""
+import os
+os.environ['IS_DOCKER'] = 'false'
+import argparse
+import time
+from datetime import datetime, timedelta
+import pymysql
+from config import MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DATABASE
+from bigScreen.health_rollup import rebuild_rollups
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='重建健康数据分级汇总')
+    parser.add_argument('--start', help='开始日期 YYYY-MM-DD(默认按--days推算)')
+    parser.add_argument('--end', help='结束日期 YYYY-MM-DD(含当天，默认今天)')
+    parser.add_argument('--days', type=int, default=30, help='未指定--start时回溯天数')
+    parser.add_argument('--device', action='append', help='只重建指定设备(可重复)')
+    parser.add_argument('--chunk-days', type=int, default=1, help='每段天数(每段一个事务)')
+    return parser.parse_args()
+
+def backfill(start, end, device_sns=None, chunk_days=1):
+    conn = pymysql.connect(host=MYSQL_HOST, port=MYSQL_PORT, user=MYSQL_USER,
+                           password=MYSQL_PASSWORD, database=MYSQL_DATABASE)
+    totals = {'5m': 0, '1h': 0, '1d': 0}
+    try:
+        current = start
+        while current < end:
+            chunk_end = min(current + timedelta(days=chunk_days), end)
+            began = time.time()
+            try:
+                with conn.cursor() as cursor:
+                    written = rebuild_rollups(cursor, current, chunk_end, device_sns)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                print(f"❌ {current:%Y-%m-%d} ~ {chunk_end:%Y-%m-%d} 重建失败: {e}")
+                raise
+            for level, count in written.items():
+                totals[level] += count
+            print(f"✅ {current:%Y-%m-%d} ~ {chunk_end:%Y-%m-%d}: 5分钟{written['5m']}行, 小时{written['1h']}行, "
+                  f"天{written['1d']}行, 耗时{time.time() - began:.1f}s")
+            current = chunk_end
+    finally:
+        conn.close()
+    print(f"🎉 汇总重建完成: {totals}")
+    return totals
+
+if __name__ == '__main__':
+    args = parse_args()
+    end = datetime.strptime(args.end, '%Y-%m-%d') + timedelta(days=1) if args.end else \
+        datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    start = datetime.strptime(args.start, '%Y-%m-%d') if args.start else end - timedelta(days=args.days)
+    backfill(start, end, args.device, max(1, args.chunk_days))
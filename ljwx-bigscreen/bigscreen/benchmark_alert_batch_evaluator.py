@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""批量告警评估基准：向量化BatchAlertEvaluator vs 逐条CompiledRuleIndex.evaluate(generate_alerts路径)
+用法: python benchmark_alert_batch_evaluator.py [样本数] [每指标规则数]
+"""
+import sys
+import time
+import random
+
+from bigScreen.alert_rule_index import compile_rules
+from bigScreen.alert_batch_evaluator import BatchAlertEvaluator
+
+SIGNS = {'heart_rate': ('heartRate', 40, 140), 'blood_oxygen': ('bloodOxygen', 85, 100),
+         'temperature': ('temperature', 35, 39), 'stress': ('stress', 10, 95)}
+
+def build_rules(per_sign):
+    rules, rule_id = [], 1
+    for sign, (_, low, high) in list(SIGNS.items()) + [('bloodPressure', ('pressureHigh', 50, 160))]:
+        for k in range(per_sign):
+            span = (high - low) * 0.05  # 阈值靠近量程两端，触发率与线上接近(少量异常)
+            rules.append({'id': rule_id, 'rule_type': f'{sign}_{k}', 'physical_sign': sign,
+                          'threshold_min': low + span * random.random(), 'threshold_max': high - span * random.random(),
+                          'trend_duration': 1, 'severity_level': 'medium', 'alert_message': sign})
+            rule_id += 1
+    return rules
+
+def build_samples(count):
+    samples = []
+    for i in range(count):
+        sample = {'deviceSn': f'SN{i % 500:05d}', 'timestamp': f'2025-01-01 {i // 60000:02d}:{i // 1000 % 60:02d}:{i % 60:02d}',
+                  'customerId': 1, 'pressureHigh': str(random.randint(50, 160)), 'pressureLow': str(random.randint(50, 100))}
+        for sign, (field, low, high) in SIGNS.items():
+            sample[field] = ''
+            sample[sign] = str(round(random.uniform(low, high), 1))
+        samples.append(sample)
+    return samples
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    per_sign = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    random.seed(42)
+    index = compile_rules(build_rules(per_sign))
+    samples = build_samples(count)
+    evaluator = BatchAlertEvaluator(index_getter=lambda cid: (index, True))
+
+    start = time.perf_counter()
+    scalar = [(i, r.id) for i, s in enumerate(samples) for r in index.evaluate(s)]
+    scalar_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = [(i, r.id) for i, r in evaluator.evaluate(samples)]
+    batch_s = time.perf_counter() - start
+
+    print(f"📊 样本{count}条, 规则{index.rule_count}条, 触发{len(batch)}条, 结果一致: {'✅' if batch == scalar else '❌'}")
+    print(f"   逐条评估: {scalar_s * 1000:.1f}ms ({count / scalar_s:.0f}条/s)")
+    print(f"   向量评估: {batch_s * 1000:.1f}ms ({count / batch_s:.0f}条/s), 加速{scalar_s / batch_s:.1f}x")
+
+if __name__ == '__main__':
+    main()
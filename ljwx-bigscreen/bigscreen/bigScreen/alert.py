@@ -11,6 +11,7 @@ from datetime import datetime, timedelta
 from decimal import Decimal
 from .device import get_device_user_org_info
 from .time_config import get_now #统一时间配置
+from .stats_counters import queue_counter_rows
 from typing import List, Dict, Optional, Tuple
 import os
 from dotenv import load_dotenv
@@ -2436,6 +2437,7 @@ class OptimizedEventProcessor:
             if alerts_to_insert:
                 try:
                     db.session.bulk_insert_mappings(AlertInfo, alerts_to_insert)
+                    queue_counter_rows(db.session, 'alert', alerts_to_insert)  # bulk插入不触发ORM事件
                     db.session.commit()
                     logger.info(f"批量插入告警成功: {len(alerts_to_insert)}条")
                 except Exception as e:
@@ -2570,144 +2572,46 @@ def get_event_processor_stats():
             "message": f"获取统计失败: {str(e)}"
         }), 500
 
-def send_simple_notifications(generated_alerts):
-    """
-    简单的通知发送函数 - 基于现有的微信通知功能
-    发送通知后更新告警状态为'responded'并记录操作日志
-    
-    Args:
-        generated_alerts: 生成的告警列表，包含alert_info、rule和device_info
-    """
-    try:
-        notifications_sent = 0
-        alerts_processed = 0
-        
-        for alert_data in generated_alerts:
-            alert_info = alert_data['alert_info']
-            rule = alert_data['rule'] 
-            device_info = alert_data['device_info']
-            
-            # 构建通知消息
-            user_name = device_info.get('user_name', 'Unknown') if device_info else 'Unknown'
-            org_name = device_info.get('org_name', 'Unknown') if device_info else 'Unknown'
-            alert_type = rule.get('rule_type', '未知告警')
-            alert_desc = rule.get('alert_message', '健康异常')
-            severity_level = rule.get('severity_level', 'medium')
-            user_id = device_info.get('user_id') if device_info else None
-            
-            notification_success = False
-            notification_type = 'system'  # 默认系统通知
-            
-            # 发送通知
-            try:
-                # 检查是否有微信openid信息
-                openid = device_info.get('openid') if device_info else None
-                
-                if openid and hasattr(sys.modules[__name__], 'send_wechat_alert'):
-                    # 调用现有的微信通知函数
-                    wechat_result = send_wechat_alert(
-                        alert_type=alert_type,
-                        user_openid=openid,
-                        user_name=user_name,
-                        severity_level=severity_level
-                    )
-                    notification_success = True
-                    notification_type = 'wechat'
-                    print(f"📱 微信通知已发送: {user_name} - {alert_type}")
-                    notifications_sent += 1
-                else:
-                    # 如果没有微信信息，记录系统通知
-                    print(f"🔔 系统通知 [{severity_level.upper()}]: {user_name}({org_name}) - {alert_type}: {alert_desc}")
-                    notification_success = True
-                    notifications_sent += 1
-                    
-            except Exception as e:
-                print(f"⚠️ 通知发送失败: {user_name} - {alert_type}, 错误: {e}")
-                notification_success = False
-            
-            # 🚀 发送成功后更新告警状态并记录日志
-            if notification_success:
-                try:
-                    # 更新告警状态为已响应
-                    alert_info.alert_status = 'responded'
-                    alert_info.responded_time = get_now()
-                    
-                    # 创建告警处理日志
-                    _create_alert_notification_log(
-                        alert_id=alert_info.id,
-                        user_name=user_name,
-                        user_id=user_id,
-                        notification_type=notification_type,
-                        success=True
-                    )
-                    
-                    alerts_processed += 1
-                    print(f"✅ 告警状态已更新: ID={alert_info.id}, 状态=responded")
-                    
-                except Exception as e:
-                    print(f"⚠️ 告警状态更新失败: ID={getattr(alert_info, 'id', 'Unknown')}, 错误: {e}")
-            else:
-                # 通知失败时记录失败日志
-                try:
-                    _create_alert_notification_log(
-                        alert_id=alert_info.id,
-                        user_name=user_name,
-                        user_id=user_id,
-                        notification_type=notification_type,
-                        success=False
-                    )
-                except Exception as e:
-                    print(f"⚠️ 失败日志记录异常: {e}")
-        
-        # 返回处理结果 (不在此处commit，由调用方统一处理)
-        print(f"📬 通知处理完成: 发送 {notifications_sent}/{len(generated_alerts)} 条通知, 更新状态 {alerts_processed} 个告警")
-        
-        return {
-            'sent': notifications_sent,
-            'processed': alerts_processed,
-            'total': len(generated_alerts)
-        }
-        
-    except Exception as e:
-        print(f"❌ 通知处理整体异常: {e}")
-        return {'sent': 0, 'processed': 0, 'total': len(generated_alerts) if generated_alerts else 0}
-
-def _create_alert_notification_log(alert_id, user_name, user_id, notification_type, success):
-    """
-    创建告警通知处理日志 - 简化版
+def resolve_alert_device_info(data):
+    """告警归属信息：优先使用上传数据，缺失时fallback到数据库查询"""
+    device_sn = data.get('deviceSn', 'Unknown')
+    device_info_cache = {
+        'customer_id': data.get('customer_id') or data.get('customerId'),
+        'org_id': data.get('org_id') or data.get('orgId'), 
+        'user_id': data.get('user_id') or data.get('userId'),
+        'device_sn': device_sn
+    }
     
-    Args:
-        alert_id: 告警ID
-        user_name: 用户名
-        user_id: 用户ID  
-        notification_type: 通知类型 (wechat/system)
-        success: 是否成功
-    """
-    try:
-        from .models import AlertLog
-        
-        # 构建处理结果描述
-        status = 'success' if success else 'failed'
-        handled_via = notification_type
-        result = f"Auto notification via {notification_type}: {status}"
-        
-        # 创建告警日志记录
-        alert_log = AlertLog(
-            alert_id=alert_id,
-            user_name=user_name,
-            user_id=user_id,
-            handled_time=get_now(),
-            handled_via=handled_via,
-            result=result,
-            action='auto_notification',
-            status=status
-        )
-        
-        db.session.add(alert_log)
-        print(f"📝 告警日志已创建: alert_id={alert_id}, type={notification_type}, status={status}")
-        
-    except Exception as e:
-        print(f"❌ 创建告警日志失败: alert_id={alert_id}, 错误: {e}")
+    # 如果上传数据缺少必要信息，fallback到数据库查询
+    if not all([device_info_cache['customer_id'], device_info_cache['org_id'], device_info_cache['user_id']]):
+        print(f"📊 上传数据不完整，fallback到数据库查询: {device_info_cache}")
+        try:
+            if device_sn and device_sn != 'Unknown':
+                fallback_info = get_device_user_org_info(device_sn)
+                if fallback_info:
+                    device_info_cache.update(fallback_info)
+                    print(f"📱 Fallback查询成功: {device_sn}")
+        except Exception as e:
+            print(f"⚠️ Fallback查询失败: {device_sn}, 错误: {e}")
+    else:
+        print(f"✅ 直接使用上传数据: customer_id={device_info_cache['customer_id']}, org_id={device_info_cache['org_id']}, user_id={device_info_cache['user_id']}")
+    return device_info_cache
+
+def build_alert_info_fields(rule_id, rule, data, health_data_id, device_user_org):
+    """AlertInfo字段(单条generate_alerts与批量告警写入共用)"""
+    return dict(
+        rule_id=rule_id,
+        alert_type=rule['rule_type'],
+        device_sn=data.get('deviceSn', 'Unknown'),
+        alert_timestamp=get_now(),  #使用统一时间配置
+        alert_desc=rule['alert_message'],
+        severity_level=rule['severity_level'],
+        alert_status='pending',
+        health_id=health_data_id,
+        customer_id=device_user_org.get('customer_id') if device_user_org.get('success') else None,
+        org_id=device_user_org.get('org_id') if device_user_org.get('success') else None,
+        user_id=device_user_org.get('user_id') if device_user_org.get('success') else None
+    )
 
 def generate_alerts(data, health_data_id):
     start_time = time.time()  # 开始计时
@@ -2717,260 +2621,54 @@ def generate_alerts(data, health_data_id):
         # 获取客户ID用于缓存查询
         customer_id = data.get('customer_id') or data.get('customerId')
         
-        # 优化：优先从Redis缓存获取告警规则
-        alert_rules_dict = {}
-        cache_hit = False
-        
-        if customer_id:
-            try:
-                # 尝试从Redis缓存获取告警规则
-                from alert_rules_cache_manager import get_alert_rules_cache_manager
-                cache_manager = get_alert_rules_cache_manager()
-                cached_rules = cache_manager.get_alert_rules(customer_id)
-                
-                if cached_rules:
-                    cache_hit = True
-                    print(f"🎯 Redis缓存命中：customer_id={customer_id}, 规则数量={len(cached_rules)}")
-                    
-                    # 转换缓存的AlertRule对象为字典格式
-                    for rule in cached_rules:
-                        if rule.is_enabled:  # 只处理启用的规则
-                            rule_dict = {
-                                'id': rule.id,
-                                'rule_type': rule.rule_type,
-                                'physical_sign': rule.physical_sign,
-                                'threshold_min': rule.threshold_min,
-                                'threshold_max': rule.threshold_max,
-                                'trend_duration': rule.trend_duration,
-                                'severity_level': rule.severity_level,
-                                'alert_message': rule.alert_message,
-                                'is_enabled': rule.is_enabled
-                            }
-                            alert_rules_dict[rule.id] = rule_dict
-                            
-                else:
-                    print(f"⚠️ Redis缓存未命中：customer_id={customer_id}")
-                    
-            except Exception as cache_e:
-                print(f"⚠️ Redis缓存获取失败，回退到数据库查询: {cache_e}")
-        
-        # 数据库兜底：如果Redis缓存失败或未命中，从数据库获取
-        if not cache_hit or not alert_rules_dict:
-            print("📊 使用数据库兜底查询告警规则")
-            
-            # 从数据库获取所有告警规则（AlertRules表无customer_id字段）
-            alert_rules = AlertRules.query.filter_by(is_deleted=False).all()
-            
-            # 将 SQLAlchemy 对象转换为字典
-            for rule in alert_rules:
-                rule_dict = {
-                    'id': rule.id,
-                    'rule_type': rule.rule_type,
-                    'physical_sign': rule.physical_sign,
-                    'threshold_min': rule.threshold_min,
-                    'threshold_max': rule.threshold_max,
-                    'trend_duration': rule.trend_duration,
-                    'severity_level': rule.severity_level,
-                    'alert_message': rule.alert_message,
-                    'is_enabled': True  # 默认启用，数据库表无此字段
-                }
-                alert_rules_dict[rule.id] = rule_dict
-                
-        print(f"📋 获取到告警规则 {len(alert_rules_dict)} 条 (Redis缓存: {'✅' if cache_hit else '❌'})")
-
-        # 🚀 优化1: 规则按数据类型过滤
-        current_physical_signs = set()
-        sign_mapping = {
-            'heartRate': 'heart_rate', 'bloodOxygen': 'blood_oxygen',
-            'pressureHigh': 'bloodPressure', 'pressureLow': 'bloodPressure',
-            'step': 'steps', 'calorie': 'calories', 'distance': 'distance',
-            'temperature': 'temperature', 'stress': 'stress', 'sleep': 'sleep'
-        }
-        
-        for key in data.keys():
-            if key in sign_mapping:
-                current_physical_signs.add(sign_mapping[key])
-        
-        # 过滤规则: 只处理当前数据相关的规则
-        filtered_rules = {}
-        for rule_id, rule in alert_rules_dict.items():
-            physical_sign = rule.get('physical_sign')
-            if physical_sign in current_physical_signs:
-                filtered_rules[rule_id] = rule
-        
-        print(f"🎯 规则过滤优化: {len(alert_rules_dict)} -> {len(filtered_rules)} 条 (数据类型: {current_physical_signs})")
-        
-        # 使用过滤后的规则替代原规则集
-        alert_rules_dict = filtered_rules
+        # 🚀 优化1: 租户规则编译索引(版本变化时才重建)，按数据类型直接查找相关规则
+        from .alert_rule_index import get_alert_rule_index_cache
+        rule_index, cache_hit = get_alert_rule_index_cache().get_index(customer_id)
+        current_physical_signs = set(rule_index.signs_in(data))
+        alert_rules_dict = {rule.id: rule.rule for rule in rule_index.rules_for(current_physical_signs)}
+        print(f"🎯 规则索引查找: 共{rule_index.rule_count}条 -> 相关{len(alert_rules_dict)}条 (数据类型: {current_physical_signs}, 租户缓存: {'✅' if cache_hit else '❌'})")
 
         # 🚀 优化2: 设备信息优先使用上传数据，fallback到查询
-        device_sn = data.get('deviceSn', 'Unknown')
-        device_info_cache = {
-            'customer_id': data.get('customer_id') or data.get('customerId'),
-            'org_id': data.get('org_id') or data.get('orgId'), 
-            'user_id': data.get('user_id') or data.get('userId'),
-            'device_sn': device_sn
-        }
-        
-        # 如果上传数据缺少必要信息，fallback到数据库查询
-        if not all([device_info_cache['customer_id'], device_info_cache['org_id'], device_info_cache['user_id']]):
-            print(f"📊 上传数据不完整，fallback到数据库查询: {device_info_cache}")
-            try:
-                if device_sn and device_sn != 'Unknown':
-                    fallback_info = get_device_user_org_info(device_sn)
-                    if fallback_info:
-                        device_info_cache.update(fallback_info)
-                        print(f"📱 Fallback查询成功: {device_sn}")
-            except Exception as e:
-                print(f"⚠️ Fallback查询失败: {device_sn}, 错误: {e}")
-        else:
-            print(f"✅ 直接使用上传数据: customer_id={device_info_cache['customer_id']}, org_id={device_info_cache['org_id']}, user_id={device_info_cache['user_id']}")
+        device_info_cache = resolve_alert_device_info(data)
 
-        # 初始化异常计数器和告警记录
-        abnormal_counts = {}
+        # 初始化告警记录
         generated_alerts = []  # 记录生成的告警信息，用于通知处理
 
-        # 遍历每个告警规则
-        for rule_id, rule in alert_rules_dict.items():
-            if not rule.get('is_enabled', True):
-                continue
-
-            physical_sign = rule.get('physical_sign')
-            
-            # 检查physical_sign是否为空
-            if not physical_sign:
-                print(f"Skipping rule {rule_id}: missing physical_sign")
-                continue
-            
-            # 修复threshold值的空值处理
-            try:
-                threshold_min_value = rule.get('threshold_min')
-                if threshold_min_value is None or threshold_min_value == '':
-                    threshold_min = 0
-                else:
-                    threshold_min = float(threshold_min_value)
-            except (TypeError, ValueError):
-                print(f"Invalid threshold_min for rule {rule_id}: {rule.get('threshold_min')}")
-                threshold_min = 0
-                
-            try:
-                threshold_max_value = rule.get('threshold_max')
-                if threshold_max_value is None or threshold_max_value == '':
-                    threshold_max = float('inf')
-                else:
-                    threshold_max = float(threshold_max_value)
-            except (TypeError, ValueError):
-                print(f"Invalid threshold_max for rule {rule_id}: {rule.get('threshold_max')}")
-                threshold_max = float('inf')
-            
-            try:
-                trend_duration_value = rule.get('trend_duration')
-                if trend_duration_value is None or trend_duration_value == '':
-                    trend_duration = 1
-                else:
-                    trend_duration = int(trend_duration_value)
-            except (TypeError, ValueError):
-                print(f"Invalid trend_duration for rule {rule_id}: {rule.get('trend_duration')}")
-                trend_duration = 1
-
-            # Special handling for blood pressure
-            if physical_sign == 'bloodPressure':
-                systolic = data.get('pressureHigh')
-                diastolic = data.get('pressureLow')
-                try:
-                    # 修复空值处理：检查None值和空字符串
-                    if systolic is None or systolic == '' or str(systolic).strip() == '':
-                        systolic = None
-                    else:
-                        systolic = float(systolic)
-                        
-                    if diastolic is None or diastolic == '' or str(diastolic).strip() == '':
-                        diastolic = None
-                    else:
-                        diastolic = float(diastolic)
-                except (TypeError, ValueError) as e:
-                    print(f"Invalid blood pressure values for rule {rule_id}: systolic={systolic}, diastolic={diastolic}, error={e}")
-                    abnormal_counts[physical_sign] = 0  # Reset count if conversion fails
-                    continue
-                
-                # Check if either systolic or diastolic is outside the thresholds
-                if (systolic is not None and (systolic < threshold_min or systolic > threshold_max)) or \
-                   (diastolic is not None and (diastolic < threshold_min or diastolic > threshold_max)):
-                    
-                    # Update abnormal count for this physical sign
-                    abnormal_counts[physical_sign] = abnormal_counts.get(physical_sign, 0) + 1
-                else:
-                    abnormal_counts[physical_sign] = 0  # Reset count if within range
-
-            else:
-                # General case for other physical signs
-                value = data.get(physical_sign)
-                
-                try:
-                    # 修复空字符串和None值的处理
-                    if value is None or value == '' or str(value).strip() == '':
-                        value = None
-                    else:
-                        value = float(value)
-                except (TypeError, ValueError) as e:
-                    print(f"Invalid value for rule {rule_id}, physical_sign={physical_sign}: value={value}, error={e}")
-                    abnormal_counts[physical_sign] = 0  # Reset count if conversion fails
-                    continue
-
-                if value is not None and (value < threshold_min or value > threshold_max):
-                    # Update abnormal count for this physical sign
-                    abnormal_counts[physical_sign] = abnormal_counts.get(physical_sign, 0) + 1
-                else:
-                    abnormal_counts[physical_sign] = 0  # Reset count if within range
+        # 评估触发的规则(阈值已预解析)；trend_duration按设备跨上传累计，状态持久化在Redis
+        from .alert_streak_store import get_alert_streak_store
+        triggered_rules = rule_index.evaluate(data, streak_store=get_alert_streak_store(),
+                                              device_sn=data.get('deviceSn'), ts=data.get('timestamp'))
+        for compiled_rule in triggered_rules:
+            rule_id, rule = compiled_rule.id, compiled_rule.rule
+            
+            # 🚀 使用缓存的设备信息，避免重复查询
+            device_user_org = device_info_cache
+            
+            # Create an alert
+            alert_info_instance = AlertInfo(**build_alert_info_fields(rule_id, rule, data, health_data_id, device_user_org))
+            print("generate_alerts:alert_info_instance:", alert_info_instance)
+            db.session.add(alert_info_instance)
+            
+            # 记录生成的告警信息，用于后续通知处理
+            generated_alerts.append({
+                'alert_info': alert_info_instance,
+                'rule': rule,
+                'device_info': device_user_org
+            })
 
-            # If abnormal count exceeds the trend_duration, generate alert
-            if abnormal_counts.get(physical_sign, 0) >= trend_duration:
-                print("generate_alerts:abnormal_counts:", abnormal_counts)
-                
-                # 🚀 使用缓存的设备信息，避免重复查询
-                device_user_org = device_info_cache
-                
-                # Create an alert
-                alert_info_instance = AlertInfo(
-                    rule_id=rule_id,
-                    alert_type=rule['rule_type'],
-                    device_sn=data.get('deviceSn', 'Unknown'),
-                    alert_timestamp=get_now(), #使用统一时间配置
-                    alert_desc=rule['alert_message'],
-                    severity_level=rule['severity_level'],
-                    alert_status='pending',
-                    health_id=health_data_id,
-                    customer_id=device_user_org.get('customer_id') if device_user_org.get('success') else None,
-                    org_id=device_user_org.get('org_id') if device_user_org.get('success') else None,
-                    user_id=device_user_org.get('user_id') if device_user_org.get('success') else None
-                )
-                print("generate_alerts:alert_info_instance:", alert_info_instance)
-                db.session.add(alert_info_instance)
-                
-                # 记录生成的告警信息，用于后续通知处理
-                generated_alerts.append({
-                    'alert_info': alert_info_instance,
-                    'rule': rule,
-                    'device_info': device_user_org
-                })
-
-        # 🚀 优化3: 简单通知处理 (在主数据库提交前处理)
-        notifications_result = {'sent': 0, 'processed': 0}
-        if generated_alerts:
-            try:
-                notifications_result = send_simple_notifications(generated_alerts)
-            except Exception as notify_error:
-                print(f"⚠️ 通知处理异常: {notify_error}")
+        # 🚀 优化3: 通知写入发件箱(与告警同一事务)，微信等外部调用由通知工作池在事务提交后发送
+        from .alert_outbox import enqueue_alert_notifications, get_alert_notifier
+        notifications_queued = enqueue_alert_notifications(generated_alerts) if generated_alerts else 0
         
-        # 统一提交所有数据库更改 (告警创建 + 状态更新 + 日志记录)
+        # 统一提交所有数据库更改 (告警创建 + 通知发件箱)
         db.session.commit()
+        if notifications_queued:
+            get_alert_notifier().wake()
         
         # 记录性能统计
         processing_time = time.time() - start_time if 'start_time' in locals() else 0
         print(f"✅ generate_alerts completed successfully")
-        notifications_sent = notifications_result.get('sent', 0)
-        alerts_processed = notifications_result.get('processed', 0)
-        print(f"📊 性能统计: 处理时间={processing_time:.3f}s, 规则数量={len(alert_rules_dict)}, 生成告警={len(generated_alerts)}条, 发送通知={notifications_sent}条, 状态更新={alerts_processed}个, Redis缓存={'命中' if cache_hit else '未命中'}")
+        print(f"📊 性能统计: 处理时间={processing_time:.3f}s, 规则数量={len(alert_rules_dict)}, 生成告警={len(generated_alerts)}条, 通知入队={notifications_queued}条, Redis缓存={'命中' if cache_hit else '未命中'}")
         
         return jsonify({
             'success': True,
@@ -2978,8 +2676,7 @@ def generate_alerts(data, health_data_id):
                 'processing_time': round(processing_time, 3),
                 'rules_count': len(alert_rules_dict),
                 'alerts_generated': len(generated_alerts),
-                'notifications_sent': notifications_sent,
-                'alerts_processed': alerts_processed,
+                'notifications_queued': notifications_queued,
                 'cache_hit': cache_hit,
                 'customer_id': customer_id,
                 'current_physical_signs': list(current_physical_signs) if 'current_physical_signs' in locals() else []
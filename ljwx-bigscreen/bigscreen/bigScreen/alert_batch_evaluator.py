@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+批量告警评估
+一次批量刷新的N条样本按指标转成NumPy列(heart_rate/blood_oxygen/temperature/pressureHigh/pressureLow...)，
+租户编译后的阈值以向量比较判断异常，触发的告警在同一事务内以一条多行INSERT写入t_alert_info，
+再用一次SELECT按(health_id, rule_id)取回各自的自增id。
+判断语义与generate_alerts(CompiledRuleIndex.observe/evaluate)一致：
+- 规则按上传字段(SIGN_MAPPING)匹配，取值按physical_sign字段
+- 血压规则同时检查pressureHigh/pressureLow，任一值无法解析时不告警
+- trend_duration通过AlertStreakStore跨上传累计
+"""
+
+import time
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .alert_rule_index import CompiledRule, CompiledRuleIndex, get_alert_rule_index_cache, parse_sample_value, _INVALID
+
+logger = logging.getLogger(__name__)
+
+def _column(samples: Sequence[Dict[str, Any]], rows: np.ndarray, field: str) -> Tuple[np.ndarray, np.ndarray]:
+    """取出指定样本的一列，返回(数值数组, 无法解析标记)；空值为NaN，NaN参与比较恒为False"""
+    raw = [samples[row].get(field) for row in rows.tolist()]
+    try:
+        return np.asarray(raw, dtype=np.float64), np.zeros(len(raw), dtype=bool)  # 快速路径：全部为有效数值
+    except (TypeError, ValueError):
+        pass
+    values = np.full(len(raw), np.nan)
+    invalid = np.zeros(len(raw), dtype=bool)
+    for pos, item in enumerate(raw):
+        value = parse_sample_value(item)
+        if value is _INVALID:
+            invalid[pos] = True
+        elif value is not None:
+            values[pos] = value
+    return values, invalid
+
+def _sample_ts(sample: Dict[str, Any]) -> str:
+    return str(sample.get('timestamp') or '')
+
+class BatchAlertEvaluator:
+    """按租户分组、按指标列向量化评估告警规则"""
+
+    def __init__(self, index_getter=None):
+        self._index_getter = index_getter or (lambda cid: get_alert_rule_index_cache().get_index(cid))
+        self.stats = {'batches': 0, 'samples': 0, 'comparisons': 0, 'triggered': 0, 'total_eval_ms': 0.0}
+
+    def evaluate(self, samples: Sequence[Dict[str, Any]], streak_store=None) -> List[Tuple[int, CompiledRule]]:
+        """返回[(样本下标, 触发规则)]，按样本顺序、样本内按generate_alerts的规则顺序排列。
+        样本需按设备+时间顺序传入，趋势规则才能正确累计"""
+        start = time.time()
+        groups: Dict[Any, List[int]] = {}
+        for i, sample in enumerate(samples):
+            groups.setdefault(sample.get('customer_id') or sample.get('customerId'), []).append(i)
+
+        results = []  # [(规则, 样本下标数组, 样本内顺序数组, 异常标记数组)]
+        for customer_id, members in groups.items():
+            index, _ = self._index_getter(customer_id)
+            self._evaluate_group(index, samples, members, results)
+
+        rules: List[CompiledRule] = []
+        hit_rows, hit_order, hit_rules = [], [], []
+        for rule, rows, order, abnormal in results:
+            if streak_store is not None:
+                abnormal = self._apply_streaks(streak_store, samples, rule, rows, abnormal)
+            elif rule.trend_duration > 1:
+                continue
+            if abnormal.any():
+                hit_rows.append(rows[abnormal])
+                hit_order.append(order[abnormal])
+                hit_rules.append(np.full(int(abnormal.sum()), len(rules)))
+                rules.append(rule)
+
+        triggered = []
+        if hit_rows:
+            rows, order, rule_pos = np.concatenate(hit_rows), np.concatenate(hit_order), np.concatenate(hit_rules)
+            sort = np.lexsort((order, rows))
+            triggered = [(row, rules[pos]) for row, pos in zip(rows[sort].tolist(), rule_pos[sort].tolist())]
+
+        self.stats['batches'] += 1
+        self.stats['samples'] += len(samples)
+        self.stats['triggered'] += len(triggered)
+        self.stats['total_eval_ms'] += (time.time() - start) * 1000
+        return triggered
+
+    @staticmethod
+    def _apply_streaks(streak_store, samples, rule: CompiledRule, rows: np.ndarray, abnormal: np.ndarray) -> np.ndarray:
+        """按设备跨上传累计趋势状态，返回触发标记；无deviceSn的样本与单条评估一致，只看本条"""
+        fired = abnormal & (rule.trend_duration <= 1)
+        observations, positions = [], []
+        for pos, (row, flag) in enumerate(zip(rows.tolist(), abnormal.tolist())):
+            sample = samples[row]
+            if sample.get('deviceSn'):
+                observations.append((sample['deviceSn'], rule.physical_sign, rule.id, flag,
+                                     rule.trend_duration, rule.trend_window, _sample_ts(sample)))
+                positions.append(pos)
+        if observations:
+            fired[positions] = streak_store.update_many(observations)
+        return fired
+
+    def _evaluate_group(self, index: CompiledRuleIndex, samples, members: List[int], results):
+        # 按字段集合归类样本，同一上传格式只计算一次signs_in(决定规则匹配及单条评估时的规则顺序)
+        by_keys: Dict[tuple, List[int]] = {}
+        for row in members:
+            by_keys.setdefault(tuple(samples[row]), []).append(row)
+        sign_rows: Dict[str, List[np.ndarray]] = {}
+        sign_base: Dict[str, List[np.ndarray]] = {}
+        for keys, rows in by_keys.items():
+            base = 0
+            for sign in index.signs_in(dict.fromkeys(keys)):
+                sign_rows.setdefault(sign, []).append(np.asarray(rows, dtype=np.int64))
+                sign_base.setdefault(sign, []).append(np.full(len(rows), base, dtype=np.int64))
+                base += len(index.by_sign[sign])
+
+        for sign, row_parts in sign_rows.items():
+            rows, base = np.concatenate(row_parts), np.concatenate(sign_base[sign])
+            ordered = np.argsort(rows, kind='stable')  # 恢复样本顺序，趋势状态按时间顺序累计
+            rows, base = rows[ordered], base[ordered]
+            if sign == 'bloodPressure':
+                systolic, bad_high = _column(samples, rows, 'pressureHigh')
+                diastolic, bad_low = _column(samples, rows, 'pressureLow')
+                valid = ~(bad_high | bad_low)
+                for offset, rule in enumerate(index.by_sign[sign]):
+                    abnormal = valid & ((systolic < rule.threshold_min) | (systolic > rule.threshold_max) |
+                                        (diastolic < rule.threshold_min) | (diastolic > rule.threshold_max))
+                    results.append((rule, rows, base + offset, abnormal))
+            else:
+                values, invalid = _column(samples, rows, sign)
+                valid = ~invalid
+                for offset, rule in enumerate(index.by_sign[sign]):
+                    abnormal = valid & ((values < rule.threshold_min) | (values > rule.threshold_max))
+                    results.append((rule, rows, base + offset, abnormal))
+            self.stats['comparisons'] += len(rows) * len(index.by_sign[sign])
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats['avg_eval_ms'] = round(stats['total_eval_ms'] / stats['batches'], 3) if stats['batches'] else 0.0
+        stats['total_eval_ms'] = round(stats['total_eval_ms'], 3)
+        return stats
+
+def _alert_insert_columns():
+    from .models import AlertInfo
+    return [c for c in AlertInfo.__table__.columns if not c.primary_key]
+
+def _column_default(column):
+    """ORM插入时的Python端默认值(is_deleted/create_time/经纬度等)，直接INSERT需显式写入"""
+    default = column.default
+    if default is None or not getattr(default, 'is_scalar', False) and not getattr(default, 'is_callable', False):
+        return None
+    return default.arg(None) if default.is_callable else default.arg
+
+def insert_alert_rows(cursor, rows: List[Dict[str, Any]]) -> List[int]:
+    """在调用方事务内多行INSERT告警，返回新告警id(按rows顺序)。
+    多行INSERT的自增id在innodb_autoinc_lock_mode=2(交错模式)下不保证连续，不能用lastrowid推算，
+    因此插入后一次SELECT按(health_id, rule_id)取回id；lastrowid为本语句首行id，以id >= lastrowid排除历史告警。
+    无health_id的告警无法按键取回，逐行INSERT取各自的lastrowid"""
+    if not rows:
+        return []
+    columns = _alert_insert_columns()
+    defaults = {c.name: _column_default(c) for c in columns}
+    placeholders = f"({', '.join(['%s'] * len(columns))})"
+    sql = f"INSERT INTO t_alert_info ({', '.join(c.name for c in columns)}) VALUES "
+
+    def values(row):
+        return tuple(row[c.name] if row.get(c.name) is not None else defaults[c.name] for c in columns)
+
+    ids: List[Optional[int]] = [None] * len(rows)
+    keyed = [index for index, row in enumerate(rows) if row.get('health_id') is not None]
+    if keyed:
+        cursor.execute(sql + ', '.join([placeholders] * len(keyed)), [v for index in keyed for v in values(rows[index])])
+        first_id = cursor.lastrowid
+        health_ids = list(dict.fromkeys(rows[index]['health_id'] for index in keyed))
+        cursor.execute(f"SELECT id, health_id, rule_id FROM t_alert_info "
+                       f"WHERE id >= %s AND health_id IN ({', '.join(['%s'] * len(health_ids))})",
+                       [first_id] + health_ids)
+        found = {(str(health_id), str(rule_id)): alert_id for alert_id, health_id, rule_id in cursor.fetchall()}
+        for index in keyed:
+            ids[index] = found.get((str(rows[index]['health_id']), str(rows[index]['rule_id'])))
+        missing = sum(ids[index] is None for index in keyed)
+        if missing:
+            raise RuntimeError(f"告警id取回不完整: 缺少{missing}条")
+    for index, row in enumerate(rows):
+        if row.get('health_id') is None:
+            cursor.execute(sql + placeholders, values(row))
+            ids[index] = cursor.lastrowid
+    return ids
+
+def generate_alerts_batch(samples: Sequence[Dict[str, Any]], health_data_ids: Optional[Sequence[Any]] = None,
+                          streak_store=None) -> Dict[str, Any]:
+    """批量版generate_alerts：向量化评估 + 告警多行INSERT(一次SELECT取回id) + 通知发件箱多行INSERT，一次提交"""
+    from .models import db
+    from .alert import resolve_alert_device_info, build_alert_info_fields
+    from .alert_outbox import build_outbox_entry, insert_outbox_rows, get_alert_notifier
+    from .alert_streak_store import get_alert_streak_store
+    from .stats_counters import get_stats_counter_store
+
+    start = time.time()
+    if not samples:
+        return {'success': True, 'alerts_generated': 0}
+    health_data_ids = list(health_data_ids) if health_data_ids is not None else [None] * len(samples)
+    if streak_store is None:
+        streak_store = get_alert_streak_store()
+    try:
+        triggered = batch_alert_evaluator.evaluate(samples, streak_store)
+        if not triggered:
+            return {'success': True, 'alerts_generated': 0, 'processing_time': round(time.time() - start, 3)}
+
+        device_infos, rows, row_devices = {}, [], []
+        for row, rule in triggered:
+            sample = samples[row]
+            device_sn = sample.get('deviceSn', 'Unknown')
+            if device_sn not in device_infos:  # 同一设备只解析一次归属信息
+                device_infos[device_sn] = resolve_alert_device_info(sample)
+            rows.append(build_alert_info_fields(rule.id, rule.rule, sample, health_data_ids[row], device_infos[device_sn]))
+            row_devices.append(device_infos[device_sn])
+
+        with db.session.connection().connection.cursor() as cursor:  # 告警与通知发件箱同一事务
+            alert_ids = insert_alert_rows(cursor, rows)
+            queued = insert_outbox_rows(cursor, [build_outbox_entry(alert_id, rule.rule, device_info, row['device_sn'])
+                                                 for alert_id, (_, rule), device_info, row
+                                                 in zip(alert_ids, triggered, row_devices, rows)])
+        db.session.commit()
+        get_stats_counter_store().record_alerts(rows)
+        notifier = get_alert_notifier()
+        notifier.ensure_started()
+        notifier.wake()
+
+        processing_time = time.time() - start
+        logger.info(f"📊 批量告警: 样本{len(samples)}条, 生成告警{len(alert_ids)}条, 耗时{processing_time:.3f}s")
+        return {'success': True, 'alerts_generated': len(alert_ids), 'alert_ids': alert_ids,
+                'notifications_queued': queued,
+                'processing_time': round(processing_time, 3)}
+    except Exception as e:
+        logger.error(f"❌ 批量告警生成失败: {e}", exc_info=True)
+        db.session.rollback()
+        return {'success': False, 'error': str(e)}
+
+# 全局批量评估器实例
+batch_alert_evaluator = BatchAlertEvaluator()
+
+def get_batch_alert_evaluator() -> BatchAlertEvaluator:
+    return batch_alert_evaluator
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+告警通知发件箱(transactional outbox)
+generate_alerts只把通知任务与告警写在同一事务里，微信等外部调用由通知工作池在事务外完成：
+- 领取：UPDATE ... ORDER BY id LIMIT n 租约领取，多进程部署互不重复，租约过期自动回收
+- 发送：按渠道独立线程池限制并发(微信接口慢时不占用其他渠道)
+- 失败：指数退避重试，超过最大次数标记dead并记录告警日志
+- 去重：发件箱唯一键(告警ID:渠道)防止重复入队，Redis幂等键防止崩溃重领后重复发送
+"""
+
+import json
+import time
+import uuid
+import random
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from .redis_helper import RedisHelper
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_LIMITS = {'wechat': 4, 'system': 8}  # 各渠道最大并发发送数
+SENT_KEY_PREFIX = 'alert_outbox_sent:'  # 已发送幂等键
+
+OUTBOX_INSERT_SQL = """
+    INSERT IGNORE INTO t_alert_notification_outbox
+    (alert_id, channel, dedup_key, device_sn, payload, status, attempts, next_attempt_time, create_time)
+    VALUES (%s, %s, %s, %s, %s, 'pending', 0, %s, %s)
+"""
+
+def resolve_channel(device_info: Optional[Dict[str, Any]]) -> str:
+    """通知渠道：有openid走微信，否则为系统通知"""
+    return 'wechat' if device_info and device_info.get('openid') else 'system'
+
+def build_outbox_entry(alert_id, rule: Dict[str, Any], device_info: Optional[Dict[str, Any]], device_sn: str) -> Dict[str, Any]:
+    device_info = device_info or {}
+    channel = resolve_channel(device_info)
+    return {
+        'alert_id': alert_id,
+        'channel': channel,
+        'dedup_key': f"{alert_id}:{channel}",
+        'device_sn': device_sn,
+        'payload': {
+            'alert_type': rule.get('rule_type', '未知告警'),
+            'alert_desc': rule.get('alert_message', '健康异常'),
+            'severity_level': rule.get('severity_level', 'medium'),
+            'user_name': device_info.get('user_name', 'Unknown'),
+            'org_name': device_info.get('org_name', 'Unknown'),
+            'user_id': device_info.get('user_id'),
+            'openid': device_info.get('openid'),
+        },
+    }
+
+def insert_outbox_rows(cursor, entries: List[Dict[str, Any]]) -> int:
+    """多行INSERT IGNORE写入发件箱(调用方保证与告警在同一事务)，返回写入条数"""
+    if not entries:
+        return 0
+    now = datetime.now()
+    params = [(e['alert_id'], e['channel'], e['dedup_key'], e['device_sn'],
+               json.dumps(e['payload'], ensure_ascii=False, default=str), now, now) for e in entries]
+    return cursor.executemany(OUTBOX_INSERT_SQL, params) or 0
+
+def enqueue_alert_notifications(generated_alerts: List[Dict[str, Any]]) -> int:
+    """generate_alerts用：flush取得告警ID后在同一事务写入发件箱，提交后调用get_alert_notifier().wake()"""
+    from .models import db
+    if not generated_alerts:
+        return 0
+    db.session.flush()
+    entries = [build_outbox_entry(item['alert_info'].id, item['rule'], item['device_info'], item['alert_info'].device_sn)
+               for item in generated_alerts]
+    with db.session.connection().connection.cursor() as cursor:
+        count = insert_outbox_rows(cursor, entries)
+    get_alert_notifier().ensure_started()
+    return count
+
+def backoff_delay(attempts: int, base: float = 5.0, cap: float = 600.0) -> float:
+    """第attempts次失败后的等待秒数：指数退避 + 抖动"""
+    delay = min(base * (2 ** max(attempts - 1, 0)), cap)
+    return delay * (0.5 + random.random() / 2)
+
+class OutboxStore:
+    """发件箱数据库操作(需在应用上下文中调用)"""
+
+    def claim(self, limit: int, lease_seconds: int) -> List[Dict[str, Any]]:
+        from sqlalchemy import text
+        from .models import db
+        token = uuid.uuid4().hex
+        now = datetime.now()
+        db.session.execute(text("""
+            UPDATE t_alert_notification_outbox
+            SET status = 'processing', locked_by = :token, locked_until = :until, attempts = attempts + 1
+            WHERE (status = 'pending' AND next_attempt_time <= :now)
+               OR (status = 'processing' AND locked_until < :now)
+            ORDER BY id LIMIT :limit
+        """), {'token': token, 'until': now + timedelta(seconds=lease_seconds), 'now': now, 'limit': limit})
+        rows = db.session.execute(text("""
+            SELECT id, alert_id, channel, device_sn, payload, attempts
+            FROM t_alert_notification_outbox WHERE locked_by = :token AND status = 'processing'
+        """), {'token': token}).mappings().all()
+        db.session.commit()
+        entries = []
+        for row in rows:
+            entry = dict(row)
+            if isinstance(entry['payload'], (str, bytes)):
+                entry['payload'] = json.loads(entry['payload'])
+            entries.append(entry)
+        return entries
+
+    def mark_sent(self, entry: Dict[str, Any]):
+        """标记已发送，更新告警状态为已响应并记录告警日志"""
+        from sqlalchemy import text
+        from .models import db
+        now = datetime.now()
+        db.session.execute(text("UPDATE t_alert_notification_outbox SET status = 'sent', sent_time = :now, "
+                                "locked_by = NULL, last_error = NULL WHERE id = :id"), {'now': now, 'id': entry['id']})
+        db.session.execute(text("UPDATE t_alert_info SET alert_status = 'responded', responded_time = :now "
+                                "WHERE id = :alert_id AND alert_status = 'pending'"), {'now': now, 'alert_id': entry['alert_id']})
+        self._add_alert_log(entry, 'success')
+        db.session.commit()
+
+    def mark_retry(self, entry: Dict[str, Any], error: str, delay: float):
+        from sqlalchemy import text
+        from .models import db
+        db.session.execute(text("UPDATE t_alert_notification_outbox SET status = 'pending', locked_by = NULL, "
+                                "next_attempt_time = :next, last_error = :error WHERE id = :id"),
+                           {'next': datetime.now() + timedelta(seconds=delay), 'error': error[:500], 'id': entry['id']})
+        db.session.commit()
+
+    def mark_dead(self, entry: Dict[str, Any], error: str):
+        from sqlalchemy import text
+        from .models import db
+        db.session.execute(text("UPDATE t_alert_notification_outbox SET status = 'dead', locked_by = NULL, "
+                                "last_error = :error WHERE id = :id"), {'error': error[:500], 'id': entry['id']})
+        self._add_alert_log(entry, 'failed')
+        db.session.commit()
+
+    def status_counts(self) -> Dict[str, int]:
+        from sqlalchemy import text
+        from .models import db
+        rows = db.session.execute(text("SELECT status, COUNT(*) FROM t_alert_notification_outbox "
+                                       "WHERE status IN ('pending', 'processing', 'dead') GROUP BY status")).fetchall()
+        return {status: int(count) for status, count in rows}
+
+    @staticmethod
+    def _add_alert_log(entry: Dict[str, Any], result: str):
+        from .models import db, AlertLog
+        payload = entry.get('payload') or {}
+        db.session.add(AlertLog(
+            alert_id=entry['alert_id'],
+            action='auto_notification',
+            action_timestamp=datetime.now(),
+            action_user=payload.get('user_name'),
+            action_user_id=payload.get('user_id'),
+            details=json.dumps({'channel': entry['channel'], 'attempts': entry.get('attempts')}, ensure_ascii=False),
+            handled_via=entry['channel'],
+            result=result
+        ))
+
+def _send_wechat(payload: Dict[str, Any]):
+    from .alert import send_wechat_alert
+    result = send_wechat_alert(alert_type=payload.get('alert_type'), user_openid=payload.get('openid'),
+                               user_name=payload.get('user_name'), severity_level=payload.get('severity_level'))
+    if isinstance(result, dict) and result.get('errcode') not in (None, 0):
+        raise RuntimeError(f"微信发送失败: {result.get('errmsg')}")
+
+def _send_system(payload: Dict[str, Any]):
+    logger.info(f"🔔 系统通知 [{str(payload.get('severity_level')).upper()}]: {payload.get('user_name')}({payload.get('org_name')}) - "
+                f"{payload.get('alert_type')}: {payload.get('alert_desc')}")
+
+DEFAULT_SENDERS: Dict[str, Callable[[Dict[str, Any]], None]] = {'wechat': _send_wechat, 'system': _send_system}
+
+class AlertNotifier:
+    """发件箱通知工作池"""
+
+    def __init__(self, store: Optional[OutboxStore] = None, senders: Optional[Dict[str, Callable]] = None,
+                 channel_limits: Optional[Dict[str, int]] = None, poll_interval: float = 1.0, lease_seconds: int = 120,
+                 max_attempts: int = 6, dedup_ttl: int = 86400):
+        self.store = store or OutboxStore()
+        self.senders = senders or dict(DEFAULT_SENDERS)
+        self.channel_limits = channel_limits or dict(CHANNEL_LIMITS)
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds  # 领取后未完成的任务在租约到期后被重新领取
+        self.max_attempts = max_attempts
+        self.dedup_ttl = dedup_ttl
+        self.redis = RedisHelper()
+        self.app = None
+
+        self._executors = {ch: ThreadPoolExecutor(max_workers=n, thread_name_prefix=f'AlertNotify-{ch}')
+                           for ch, n in self.channel_limits.items()}
+        self._inflight = {ch: 0 for ch in self.channel_limits}
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self.running = False
+        self.stats = {'claimed': 0, 'sent': 0, 'retried': 0, 'dead': 0, 'deduplicated': 0, 'claim_errors': 0,
+                      'channels': {ch: {'sent': 0, 'failed': 0, 'total_ms': 0.0} for ch in self.channel_limits}}
+
+    # ---------------- 生命周期 ----------------
+    def ensure_started(self):
+        """在应用上下文中首次入队时启动"""
+        if self.running:
+            return
+        try:
+            from flask import current_app
+            self.start(current_app._get_current_object())
+        except RuntimeError as e:
+            logger.warning(f"通知工作池启动失败(无应用上下文): {e}")
+
+    def start(self, app=None):
+        with self._cond:
+            if self.running:
+                return
+            self.app = app or self.app
+            self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True, name='AlertNotifierClaimer')
+        self._thread.start()
+        logger.info(f"🚀 告警通知工作池已启动，渠道并发: {self.channel_limits}")
+
+    def stop(self):
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+        for executor in self._executors.values():
+            executor.shutdown(wait=False)
+
+    def wake(self):
+        """告警提交后立即唤醒领取线程，减少通知延迟"""
+        with self._cond:
+            self._cond.notify()
+
+    # ---------------- 领取与分发 ----------------
+    def _free_slots(self) -> int:
+        with self._cond:
+            return sum(max(self.channel_limits[ch] * 2 - self._inflight[ch], 0) for ch in self.channel_limits)
+
+    def _run(self):
+        while self.running:
+            claimed = 0
+            try:
+                slots = self._free_slots()
+                if slots:
+                    claimed = self.poll_once(slots)
+            except Exception as e:
+                self.stats['claim_errors'] += 1
+                logger.error(f"通知发件箱领取失败: {e}")
+            if not claimed:
+                with self._cond:
+                    self._cond.wait(self.poll_interval)
+
+    def poll_once(self, limit: int) -> int:
+        """领取一批任务并按渠道提交发送，返回领取数量"""
+        entries = self._with_context(self.store.claim, limit, self.lease_seconds)
+        self.stats['claimed'] += len(entries)
+        for entry in entries:
+            channel = entry['channel'] if entry['channel'] in self._executors else 'system'
+            with self._cond:
+                self._inflight[channel] += 1
+            self._executors[channel].submit(self._deliver, channel, entry)
+        return len(entries)
+
+    def _with_context(self, func, *args):
+        if self.app is not None:
+            with self.app.app_context():
+                return func(*args)
+        return func(*args)
+
+    def _deliver(self, channel: str, entry: Dict[str, Any]):
+        start = time.time()
+        sent_key = f"{SENT_KEY_PREFIX}{entry['id']}"
+        try:
+            if not self._acquire_send(sent_key):
+                self.stats['deduplicated'] += 1  # 上次已发送但未来得及标记(进程崩溃/租约过期)
+                self._with_context(self.store.mark_sent, entry)
+                return
+            try:
+                self.senders.get(channel, _send_system)(entry.get('payload') or {})
+            except Exception as e:
+                self._release_send(sent_key)
+                self._on_failure(channel, entry, str(e))
+                return
+            self._with_context(self.store.mark_sent, entry)
+            with self._cond:
+                self.stats['sent'] += 1
+                self.stats['channels'][channel]['sent'] += 1
+                self.stats['channels'][channel]['total_ms'] += (time.time() - start) * 1000
+        except Exception as e:
+            logger.error(f"通知发件箱任务处理异常: id={entry.get('id')}, {e}")
+        finally:
+            with self._cond:
+                self._inflight[channel] -= 1
+                self._cond.notify()
+
+    def _on_failure(self, channel: str, entry: Dict[str, Any], error: str):
+        with self._cond:
+            self.stats['channels'][channel]['failed'] += 1
+        attempts = int(entry.get('attempts') or 1)
+        if attempts >= self.max_attempts:
+            self.stats['dead'] += 1
+            logger.warning(f"❌ 告警通知重试{attempts}次仍失败，放弃: alert_id={entry['alert_id']}, {error}")
+            self._with_context(self.store.mark_dead, entry, error)
+        else:
+            self.stats['retried'] += 1
+            self._with_context(self.store.mark_retry, entry, error, backoff_delay(attempts))
+
+    def _acquire_send(self, key: str) -> bool:
+        try:
+            return bool(self.redis.client.set(key, 1, nx=True, ex=self.dedup_ttl))
+        except Exception as e:
+            logger.warning(f"通知幂等键写入失败，按未发送处理: {e}")
+            return True
+
+    def _release_send(self, key: str):
+        try:
+            self.redis.client.delete(key)
+        except Exception:
+            pass
+
+    def get_stats(self, include_db: bool = False) -> Dict[str, Any]:
+        with self._cond:
+            stats = json.loads(json.dumps(self.stats))
+            for ch, ch_stats in stats['channels'].items():
+                ch_stats['inflight'] = self._inflight[ch]
+                ch_stats['limit'] = self.channel_limits[ch]
+                ch_stats['avg_ms'] = round(ch_stats['total_ms'] / ch_stats['sent'], 2) if ch_stats['sent'] else 0.0
+                ch_stats['total_ms'] = round(ch_stats['total_ms'], 2)
+        stats['running'] = self.running
+        if include_db:
+            try:
+                stats['outbox'] = self._with_context(self.store.status_counts)
+            except Exception as e:
+                stats['outbox'] = {'error': str(e)}
+        return stats
+
+# 全局通知工作池实例(首次入队时启动)
+alert_notifier = AlertNotifier()
+
+def get_alert_notifier() -> AlertNotifier:
+    return alert_notifier
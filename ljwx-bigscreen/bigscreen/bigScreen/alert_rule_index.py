@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+告警规则编译索引
+按customer_id把告警规则编译为 physical_sign -> [预解析阈值的规则] 索引，
+仅在alert_rules_channel通知版本变化(AlertRulesCacheManager替换本地规则列表)时重建，
+generate_alerts每条样本只需一次字典查找加数值比较
+"""
+
+import time
+import threading
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 上传数据字段 -> 规则physical_sign(与generate_alerts原过滤逻辑一致)
+SIGN_MAPPING = {
+    'heartRate': 'heart_rate', 'bloodOxygen': 'blood_oxygen',
+    'pressureHigh': 'bloodPressure', 'pressureLow': 'bloodPressure',
+    'step': 'steps', 'calorie': 'calories', 'distance': 'distance',
+    'temperature': 'temperature', 'stress': 'stress', 'sleep': 'sleep'
+}
+
+DB_FALLBACK_KEY = '__db__'  # 无租户缓存时数据库兜底规则集的索引键
+DB_FALLBACK_TTL = 60  # 数据库兜底规则集无版本通知，按TTL重建(秒)
+
+_INVALID = object()  # 数值解析失败标记
+
+def _parse_float(value, default: float) -> float:
+    if value is None or value == '':
+        return default
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        logger.warning(f"告警规则阈值格式错误: {value}")
+        return default
+
+def _parse_int(value, default: int) -> int:
+    if value is None or value == '':
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        logger.warning(f"告警规则持续次数格式错误: {value}")
+        return default
+
+def parse_sample_value(value):
+    """样本值解析：空值返回None，非数值返回_INVALID"""
+    if value is None or value == '' or str(value).strip() == '':
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return _INVALID
+
+@dataclass
+class CompiledRule:
+    """预解析阈值后的规则"""
+    id: Any
+    physical_sign: str
+    threshold_min: float
+    threshold_max: float
+    trend_duration: int
+    trend_window: Optional[int]  # 最近M次窗口(规则配置trend_window时启用"M次中N次"判断)
+    rule: Dict[str, Any]  # 原始规则字典(rule_type/severity_level/alert_message等)，供告警与通知使用
+
+    def is_abnormal(self, value: float) -> bool:
+        return value < self.threshold_min or value > self.threshold_max
+
+@dataclass
+class CompiledRuleIndex:
+    """单个租户的规则索引"""
+    by_sign: Dict[str, List[CompiledRule]] = field(default_factory=dict)
+    version: Any = None
+    built_at: float = 0.0
+    rule_count: int = 0
+
+    def signs_in(self, data: Dict[str, Any]) -> List[str]:
+        """样本中出现且有规则的physical_sign"""
+        signs = []
+        for key in data.keys():
+            sign = SIGN_MAPPING.get(key)
+            if sign and sign in self.by_sign and sign not in signs:
+                signs.append(sign)
+        return signs
+
+    def rules_for(self, signs: Iterable[str]) -> List[CompiledRule]:
+        return [rule for sign in signs for rule in self.by_sign.get(sign, ())]
+
+    def observe(self, data: Dict[str, Any]) -> List[tuple]:
+        """逐条规则判断样本是否异常，返回[(规则, 是否异常)]；数值无法解析时视为正常(重置连续计数)"""
+        observations = []
+        for sign in self.signs_in(data):
+            if sign == 'bloodPressure':
+                systolic = parse_sample_value(data.get('pressureHigh'))
+                diastolic = parse_sample_value(data.get('pressureLow'))
+                invalid = systolic is _INVALID or diastolic is _INVALID
+            else:
+                value = parse_sample_value(data.get(sign))
+                invalid = value is _INVALID
+            for rule in self.by_sign[sign]:
+                if invalid:
+                    abnormal = False
+                elif sign == 'bloodPressure':
+                    abnormal = (systolic is not None and rule.is_abnormal(systolic)) or \
+                               (diastolic is not None and rule.is_abnormal(diastolic))
+                else:
+                    abnormal = value is not None and rule.is_abnormal(value)
+                observations.append((rule, abnormal))
+        return observations
+
+    def evaluate(self, data: Dict[str, Any], streak_store=None, device_sn: Optional[str] = None,
+                 ts: Optional[str] = None) -> List[CompiledRule]:
+        """评估单条样本，返回触发的规则。
+        传入streak_store时按(设备, 规则)的跨上传窗口状态判断trend_duration；
+        否则只看本条样本(trend_duration<=1的规则异常即触发)"""
+        observations = self.observe(data)
+        if streak_store is not None and device_sn:
+            fired = streak_store.update_many([(device_sn, rule.physical_sign, rule.id, abnormal,
+                                               rule.trend_duration, rule.trend_window, ts)
+                                              for rule, abnormal in observations])
+            return [rule for (rule, _), hit in zip(observations, fired) if hit]
+        return [rule for rule, abnormal in observations if abnormal and rule.trend_duration <= 1]
+
+def _rule_to_dict(rule) -> Dict[str, Any]:
+    if isinstance(rule, dict):
+        return rule
+    return {
+        'id': rule.id,
+        'rule_type': rule.rule_type,
+        'physical_sign': rule.physical_sign,
+        'threshold_min': rule.threshold_min,
+        'threshold_max': rule.threshold_max,
+        'trend_duration': rule.trend_duration,
+        'severity_level': rule.severity_level,
+        'alert_message': rule.alert_message,
+        'trend_window': getattr(rule, 'trend_window', None),
+        'is_enabled': getattr(rule, 'is_enabled', True)
+    }
+
+def compile_rules(rules: Iterable[Any], version: Any = None) -> CompiledRuleIndex:
+    """编译规则列表(AlertRule对象或字典)，跳过停用和缺少physical_sign的规则，保持原有顺序"""
+    index = CompiledRuleIndex(version=version, built_at=time.time())
+    for raw in rules:
+        rule = _rule_to_dict(raw)
+        if not rule.get('is_enabled', True) or not rule.get('physical_sign'):
+            continue
+        compiled = CompiledRule(
+            id=rule.get('id'),
+            physical_sign=rule['physical_sign'],
+            threshold_min=_parse_float(rule.get('threshold_min'), 0),
+            threshold_max=_parse_float(rule.get('threshold_max'), float('inf')),
+            trend_duration=_parse_int(rule.get('trend_duration'), 1),
+            trend_window=_parse_int(rule.get('trend_window'), 0) or None,
+            rule=rule,
+        )
+        index.by_sign.setdefault(compiled.physical_sign, []).append(compiled)
+        index.rule_count += 1
+    return index
+
+class AlertRuleIndexCache:
+    """租户规则索引缓存 - 以AlertRulesCacheManager的规则列表和版本号为准，变化时才重新编译"""
+
+    def __init__(self, cache_manager_getter: Optional[Callable[[], Any]] = None,
+                 db_loader: Optional[Callable[[], List[Any]]] = None):
+        self._cache_manager_getter = cache_manager_getter or self._default_cache_manager
+        self._db_loader = db_loader or self._default_db_loader
+        self._indexes: Dict[Any, tuple] = {}  # key -> (规则列表对象, 版本, 索引)
+        self._lock = threading.Lock()
+        self._subscriber_attempted = False
+        self.stats = {'lookups': 0, 'index_hits': 0, 'rebuilds': 0, 'db_fallbacks': 0}
+
+    @staticmethod
+    def _default_cache_manager():
+        from alert_rules_cache_manager import get_alert_rules_cache_manager
+        return get_alert_rules_cache_manager()
+
+    @staticmethod
+    def _default_db_loader():
+        from .models import AlertRules
+        return [dict(_rule_to_dict(rule), is_enabled=True)  # 数据库表无is_enabled字段，默认启用
+                for rule in AlertRules.query.filter_by(is_deleted=False).all()]
+
+    def _ensure_subscriber(self, manager):
+        """首次使用时启动alert_rules_channel订阅，版本变化由管理器刷新规则列表"""
+        if self._subscriber_attempted:
+            return
+        self._subscriber_attempted = True
+        try:
+            manager.start_subscriber()
+        except Exception as e:
+            logger.warning(f"告警规则订阅者启动失败，规则变更需重启或手动失效: {e}")
+
+    def get_index(self, customer_id) -> tuple:
+        """返回(索引, 是否命中租户缓存)；租户规则缺失时回退数据库全量规则"""
+        self.stats['lookups'] += 1
+        if customer_id:
+            try:
+                manager = self._cache_manager_getter()
+                self._ensure_subscriber(manager)
+                rules = manager.get_alert_rules(customer_id)
+                if rules:
+                    version = manager.version_cache.get(customer_id)
+                    index = self._get_or_compile(customer_id, rules, version)
+                    if index.rule_count:  # 租户规则全部停用时与原逻辑一致，回退数据库
+                        return index, True
+            except Exception as e:
+                logger.warning(f"告警规则缓存获取失败，回退到数据库查询: {e}")
+        return self._get_db_index(), False
+
+    def _get_or_compile(self, key, rules, version) -> CompiledRuleIndex:
+        entry = self._indexes.get(key)
+        if entry and entry[0] is rules and entry[1] == version:
+            self.stats['index_hits'] += 1
+            return entry[2]
+        with self._lock:
+            entry = self._indexes.get(key)
+            if entry and entry[0] is rules and entry[1] == version:
+                return entry[2]
+            index = compile_rules(rules, version)
+            self._indexes[key] = (rules, version, index)
+            self.stats['rebuilds'] += 1
+            logger.info(f"告警规则索引已重建: key={key}, version={version}, rules={index.rule_count}")
+            return index
+
+    def _get_db_index(self) -> CompiledRuleIndex:
+        self.stats['db_fallbacks'] += 1
+        entry = self._indexes.get(DB_FALLBACK_KEY)
+        if entry and time.time() - entry[2].built_at < DB_FALLBACK_TTL:
+            self.stats['index_hits'] += 1
+            return entry[2]
+        rules = self._db_loader()
+        return self._get_or_compile(DB_FALLBACK_KEY, rules, int(time.time()))
+
+    def invalidate(self, customer_id=None):
+        with self._lock:
+            if customer_id is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(customer_id, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats['indexes'] = {str(k): {'version': v[1], 'rules': v[2].rule_count, 'signs': list(v[2].by_sign)}
+                            for k, v in list(self._indexes.items())}
+        return stats
+
+# 全局规则索引缓存实例
+alert_rule_index_cache = AlertRuleIndexCache()
+
+def get_alert_rule_index_cache() -> AlertRuleIndexCache:
+    return alert_rule_index_cache
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+告警趋势窗口状态存储
+按(设备, physical_sign)在Redis保存每条规则的连续异常次数和最近M次异常位图，使trend_duration>1的规则能跨多次上传生效。
+一批样本的读取-判断-写回由一个Lua脚本在Redis内原子完成(一次往返)，多个gunicorn worker并发上传同一设备时计数不丢失；
+进程内不缓存状态，Redis不可用时本批按空状态判断
+
+Redis结构: alert_streak:{device_sn}:{physical_sign} HASH  rule_id -> "连续次数,位图,最后样本时间"
+"""
+
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from .redis_helper import RedisHelper
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'alert_streak:'
+STREAK_SIGNS = ('heart_rate', 'blood_oxygen', 'bloodPressure', 'steps', 'calories', 'distance',
+                'temperature', 'stress', 'sleep')
+
+# KEYS: 涉及的HASH键；ARGV: ttl, 之后每6个一组(键下标, rule_id, 是否异常, N, M, 样本时间)
+# 逐条按StreakState.observe的语义更新并返回 1触发/0未触发/-1重放或乱序样本
+STREAK_SCRIPT = """
+local ttl = tonumber(ARGV[1])
+local result, touched = {}, {}
+for i = 2, #ARGV, 6 do
+    local key, field = KEYS[tonumber(ARGV[i])], ARGV[i + 1]
+    local abnormal, required, window, ts = tonumber(ARGV[i + 2]), tonumber(ARGV[i + 3]), tonumber(ARGV[i + 4]), ARGV[i + 5]
+    local streak, bits, last_ts = 0, 0, ''
+    local raw = redis.call('HGET', key, field)
+    if raw then
+        local s, b, l = string.match(raw, '^(%d+),(%d+),(.*)$')
+        if s then streak, bits, last_ts = tonumber(s), tonumber(b), l end
+    end
+    if ts ~= '' and last_ts ~= '' and ts <= last_ts then
+        result[#result + 1] = -1
+    else
+        bits = (bits * 2 + abnormal) % (2 ^ window)
+        if abnormal == 1 then streak = streak + 1 else streak = 0 end
+        local fired
+        if window == required then
+            fired = streak >= required
+        else
+            local ones, rest = 0, bits
+            while rest > 0 do
+                ones = ones + rest % 2
+                rest = math.floor(rest / 2)
+            end
+            fired = ones >= required
+        end
+        if fired then streak, bits = 0, 0 end
+        if ts ~= '' then last_ts = ts end
+        redis.call('HSET', key, field, string.format('%d,%d,%s', streak, bits, last_ts))
+        touched[key] = true
+        result[#result + 1] = fired and 1 or 0
+    end
+end
+for key in pairs(touched) do
+    redis.call('EXPIRE', key, ttl)
+end
+return result
+"""
+
+def _window(required: int, window: Optional[int]) -> int:
+    return max(window if window and window > required else required, 1)
+
+class StreakState:
+    """单条规则的窗口状态"""
+    __slots__ = ('streak', 'bits', 'last_ts')
+
+    def __init__(self, streak: int = 0, bits: int = 0, last_ts: str = ''):
+        self.streak = streak  # 连续异常次数
+        self.bits = bits  # 最近样本异常位图(最低位为最新样本)
+        self.last_ts = last_ts  # 最后计入的样本时间，用于忽略重放/乱序样本
+
+    def dumps(self) -> str:
+        return f"{self.streak},{self.bits},{self.last_ts}"
+
+    @classmethod
+    def loads(cls, raw) -> 'StreakState':
+        if isinstance(raw, bytes):
+            raw = raw.decode('utf-8')
+        try:
+            streak, bits, last_ts = str(raw).split(',', 2)
+            return cls(int(streak), int(bits), last_ts)
+        except (TypeError, ValueError):
+            return cls()
+
+    def observe(self, abnormal: bool, required: int, window: Optional[int] = None) -> bool:
+        """计入一次样本并判断是否触发(与STREAK_SCRIPT一致)：
+        window为空或<=required时按连续required次异常；否则按最近window次中至少required次异常。
+        触发后清零状态，持续异常时每满足一次条件才再次告警"""
+        window = _window(required, window)
+        mask = (1 << window) - 1
+        self.bits = ((self.bits << 1) | int(abnormal)) & mask
+        self.streak = self.streak + 1 if abnormal else 0
+        if window == required:
+            fired = self.streak >= required
+        else:
+            fired = bin(self.bits).count('1') >= required
+        if fired:
+            self.streak, self.bits = 0, 0
+        return fired
+
+class AlertStreakStore:
+    """趋势窗口状态存储 - Redis内Lua脚本原子更新"""
+
+    def __init__(self, redis_ttl: int = 86400):
+        self.redis_ttl = redis_ttl  # 设备长时间无数据后状态自动过期
+        self.redis = RedisHelper()
+        self.stats = {'observations': 0, 'fired': 0, 'stale_skipped': 0, 'script_calls': 0, 'redis_errors': 0}
+
+    # ---------------- 更新 ----------------
+    def update_many(self, observations: List[Tuple[str, str, Any, bool, int, Optional[int], Optional[str]]]) -> List[bool]:
+        """批量计入样本，observations为(device_sn, physical_sign, rule_id, 是否异常, N, M, 样本时间)，
+        需按样本时间顺序传入，返回与输入等长的是否触发列表"""
+        if not observations:
+            return []
+        keys: Dict[str, int] = {}
+        args: List[Any] = [self.redis_ttl]
+        for device_sn, sign, rule_id, abnormal, required, window, ts in observations:
+            required = max(int(required or 1), 1)
+            index = keys.setdefault(f"{KEY_PREFIX}{device_sn}:{sign}", len(keys) + 1)
+            args.extend((index, str(rule_id), int(bool(abnormal)), required, _window(required, window), str(ts or '')))
+        try:
+            results = [int(r) for r in self.redis.client.eval(STREAK_SCRIPT, len(keys), *keys, *args)]
+            self.stats['script_calls'] += 1
+        except Exception as e:
+            self.stats['redis_errors'] += 1
+            logger.warning(f"告警趋势状态更新失败，本批按空状态判断: {e}")
+            results = self._observe_without_redis(observations)
+        self.stats['observations'] += sum(r >= 0 for r in results)
+        self.stats['stale_skipped'] += results.count(-1)  # 重放或乱序样本不重复计数
+        self.stats['fired'] += results.count(1)
+        return [r == 1 for r in results]
+
+    @staticmethod
+    def _observe_without_redis(observations) -> List[int]:
+        states: Dict[Tuple[str, str, str], StreakState] = {}
+        results = []
+        for device_sn, sign, rule_id, abnormal, required, window, _ in observations:
+            state = states.setdefault((device_sn, sign, str(rule_id)), StreakState())
+            results.append(int(state.observe(bool(abnormal), max(int(required or 1), 1), window)))
+        return results
+
+    def update(self, device_sn: str, sign: str, rule_id, abnormal: bool, required: int,
+               window: Optional[int] = None, ts: Optional[str] = None) -> bool:
+        return self.update_many([(device_sn, sign, rule_id, abnormal, required, window, ts)])[0]
+
+    def reset_device(self, device_sn: str):
+        """清除设备全部趋势状态(设备解绑/换人时调用)"""
+        try:
+            self.redis.client.delete(*[f"{KEY_PREFIX}{device_sn}:{sign}" for sign in STREAK_SIGNS])
+        except Exception as e:
+            logger.warning(f"清除告警趋势状态失败: {device_sn}, {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats)
+
+# 全局趋势状态存储实例
+alert_streak_store = AlertStreakStore()
+
+def get_alert_streak_store() -> AlertStreakStore:
+    return alert_streak_store
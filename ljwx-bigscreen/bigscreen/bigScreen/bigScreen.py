@@ -4,7 +4,7 @@
 # =============================================================================
 
 from random import uniform
-from flask import Flask, render_template, request, jsonify, Response
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 from flask_compress import Compress
 from flask import request, jsonify
@@ -45,7 +45,7 @@ from redis import Redis
 # from .stream_monitoring_dashboard import monitoring_bp  # 模块不存在，暂时注释
 # from .stream_rollback_plan import get_rollback_plan  # 模块不存在，暂时注释
 # from .statistics_module import get_realtime_stats_data, get_statistics_overview_data  # 模块不存在，暂时注释
-from .message import save_device_message_data, send_device_message_data, receive_device_messages_data
+from .message import save_device_message_data, send_device_message_data, receive_device_messages_data, stream_device_messages
 from .device import get_device_analysis_data
 # from .health_analysis import get_customer_comprehensive_analysis, get_health_trends_analysis_data  # 模块不存在，暂时注释
 # from .license_manager import get_license_manager, license_required, check_device_license, get_license_dashboard_data  # 模块不存在，暂时注释
@@ -56,6 +56,16 @@ import json
 import threading
 import time
 from .models import db, DeviceMessage, UserHealthData, AlertInfo, DeviceInfo, UserInfo, OrgInfo
+from .health_rollup import ROLLUP_METRICS, merge_rollup_cells, query_rollup_series, should_use_rollup
+from .stats_counters import get_stats_counter_store, install_orm_hooks
+from .message_inbox import get_message_inbox, install_orm_hooks as install_inbox_hooks
+from .single_flight import get_single_flight
+from .device_presence import get_device_presence
+from .device_history_analytics import get_device_history_analytics
+from .device_resolver import get_device_resolver
+from .org_forest import get_org_forest
+from .cache_service import refreshable, REFRESH_LOADERS
+from .downsampling import downsample_points, parse_max_points
 from flask_socketio import SocketIO, emit
 from decimal import Decimal
 from sqlalchemy import func, and_
@@ -165,6 +175,8 @@ app.config['SQLALCHEMY_DATABASE_URI'] = SQLALCHEMY_DATABASE_URI
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 db.init_app(app)
+install_orm_hooks(db.session)  # 告警/消息提交后累加大屏日计数
+install_inbox_hooks(db.session)  # 消息/确认提交后更新设备收件箱
 
 # 注册蓝图
 app.register_blueprint(config_bp, url_prefix='/api')
@@ -197,6 +209,8 @@ except Exception as e:
 system_logger.info("✅ 使用V1消息系统")
 
 # 实时统计API - 重构后使用模块化实现
+from .realtime_stats_api import get_realtime_stats_data
+
 @app.route('/api/realtime_stats', methods=['GET'])
 def get_realtime_stats():
     """获取实时统计数据API - 支持日期对比"""
@@ -315,6 +329,7 @@ try:
     # =============================================================================
     from .cache_service import get_cache_service
     cache_service = get_cache_service(redis)
+    cache_service.start_refresher(app)  # 已注册加载器的热点键在过期前后台刷新
     system_logger.info('✅ 智能缓存服务初始化成功')
 except Exception as e:
     system_logger.error('Redis连接初始化失败，使用降级模式',extra={'error':str(e)})
@@ -326,6 +341,16 @@ except Exception as e:
     redis = SimpleRedis()
     cache_service = None  # 缓存服务降级
 
+single_flight = get_single_flight(redis)  # 热点接口单飞缓存(Redis降级时只做进程内合并)
+
+def refreshable_response(category, name, *args):
+    """读取后台刷新缓存，在performance中标注缓存年龄；缓存服务降级时直接调用加载器"""
+    if cache_service:
+        data, performance = cache_service.get_refreshable(category, name, *args)
+    else:
+        data, performance = REFRESH_LOADERS[(category, name)](*args), {'cached': False, 'age': 0, 'stale': False}
+    return dict(data, performance=performance)
+
 # 导入调试控制模块，批量禁用print调试输出
 import sys
 import os
@@ -539,6 +564,74 @@ def api_monitoring_shards():
             'error': str(e)
         }), 500
 
+@app.route('/api/monitoring/redis_write_behind', methods=['GET'])
+def api_monitoring_redis_write_behind():
+    """获取Redis最新值写后缓冲状态(刷新批量、延迟、合并次数)"""
+    try:
+        from .redis_write_behind import get_redis_write_behind
+        return jsonify({
+            'status': 'success',
+            'write_behind': get_redis_write_behind().get_stats()
+        }), 200
+    except Exception as e:
+        system_logger.error(f"获取Redis写后缓冲状态失败: {e}")
+        return jsonify({
+            'status': 'error',
+            'error': str(e)
+        }), 500
+
+def _monitoring_stats(key, get_stats, label):
+    """各子系统监控接口的统一返回：{'status': 'success', key: 统计}"""
+    try:
+        return jsonify({'status': 'success', key: get_stats()}), 200
+    except Exception as e:
+        system_logger.error(f"获取{label}状态失败: {e}")
+        return jsonify({
+            'status': 'error',
+            'error': str(e)
+        }), 500
+
+@app.route('/api/monitoring/db_pool', methods=['GET'])
+def api_monitoring_db_pool():
+    """获取原生MySQL连接池状态(借出次数、等待耗时、连接数)"""
+    from .db_pool import get_pool_stats
+    return _monitoring_stats('pools', get_pool_stats, '连接池')
+
+@app.route('/api/monitoring/partition_queries', methods=['GET'])
+def api_monitoring_partition_queries():
+    """获取分区并发查询(各分区耗时)与分区键集游标读取状态"""
+    from .partition_executor import get_partition_fanout_executor
+    from .health_data_cursor import get_keyset_partition_reader
+    return _monitoring_stats('partition_queries', lambda: {
+        'partition_fanout': get_partition_fanout_executor().get_stats(),
+        'keyset_reader': get_keyset_partition_reader().get_stats()
+    }, '分区查询')
+
+@app.route('/api/monitoring/stats_counters', methods=['GET'])
+def api_monitoring_stats_counters():
+    """获取大屏日计数状态(初始化、增量、检查点)"""
+    return _monitoring_stats('stats_counters', lambda: get_stats_counter_store().get_stats(), '大屏日计数')
+
+@app.route('/api/monitoring/single_flight', methods=['GET'])
+def api_monitoring_single_flight():
+    """获取热点接口单飞缓存状态"""
+    return _monitoring_stats('single_flight', single_flight.get_stats, '单飞缓存')
+
+@app.route('/api/monitoring/device_presence', methods=['GET'])
+def api_monitoring_device_presence():
+    """获取设备在线索引状态"""
+    return _monitoring_stats('device_presence', lambda: get_device_presence().get_stats(), '设备在线索引')
+
+@app.route('/api/monitoring/device_analytics', methods=['GET'])
+def api_monitoring_device_analytics():
+    """获取设备历史分析状态"""
+    return _monitoring_stats('device_analytics', lambda: get_device_history_analytics().get_stats(), '设备历史分析')
+
+@app.route('/api/monitoring/message_inbox', methods=['GET'])
+def api_monitoring_message_inbox():
+    """获取设备消息收件箱状态(重建、投递、撤回、长轮询)"""
+    return _monitoring_stats('message_inbox', lambda: get_message_inbox().get_stats(), '消息收件箱')
+
 @app.route('/api/monitoring/export', methods=['GET'])
 def api_monitoring_export():
     """导出监控指标数据"""
@@ -1011,10 +1104,20 @@ def send_device_message(data=None):
 @app.route('/DeviceMessage/receive', methods=['GET'])
 @log_api_request('/DeviceMessage/receive','GET')
 def received_messages(deviceSn=None):
-    """接收设备消息 - 重构后使用模块化实现"""
+    """接收设备消息 - 传入since(上次返回的version)和wait(秒)时为长轮询"""
     if deviceSn is None:
         deviceSn = request.args.get('deviceSn')
-    return receive_device_messages_data(deviceSn)
+    return receive_device_messages_data(deviceSn, wait=request.args.get('wait', 0, type=float),
+                                        since=request.args.get('since', type=int))
+
+@app.route('/DeviceMessage/stream', methods=['GET'])
+def stream_device_messages_api():
+    """手表端消息SSE推送 - 收件箱变化时推送最新消息列表，连接到期后手表重连"""
+    device_sn = request.args.get('deviceSn')
+    if not device_sn:
+        return jsonify({'success': False, 'message': '缺少设备序列号参数'}), 400
+    return Response(stream_with_context(stream_device_messages(device_sn)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/DeviceMessage/acknowledge', methods=['POST'])
 @log_api_request('/DeviceMessage/acknowledge','POST')
@@ -1361,6 +1464,31 @@ def handle_health_data():
         print(f"❌ 健康数据处理失败: {e}")
         raise
 
+@app.route("/upload_health_data_batch", methods=['POST'])
+@log_api_request('/upload_health_data_batch','POST')
+def handle_health_data_batch():
+    """批量健康数据上传接口 - 支持 {"data": [...]} 或直接数组，返回逐条结果"""
+    payload = request.get_json(silent=True)
+    items = payload.get('data') if isinstance(payload, dict) else payload
+    if isinstance(items, dict) and isinstance(items.get('data'), list):
+        items = items['data']  # 蓝牙上传的嵌套格式
+    if not isinstance(items, list) or not items:
+        return jsonify({"status": "error", "message": "data必须为非空数组"}), 400
+
+    from .health_batch_upload import process_health_data_batch
+    import time
+    start_time = time.time()
+    enable_alerts = str(request.args.get('alerts', 'true')).lower() != 'false'
+    result = process_health_data_batch(items, enable_alerts=enable_alerts)
+    device_sn = next((i.get('deviceSn') or i.get('id') for i in items if isinstance(i, dict)), None)
+    record_health_data_upload(
+        device_sn=device_sn or 'unknown',
+        upload_method='batch',
+        success=result['summary']['error'] == 0,
+        duration=time.time() - start_time
+    )
+    return jsonify({"status": "success", "message": "批量数据已处理", **result})
+
 @app.route("/upload_health_data_optimized", methods=['POST'])
 @log_api_request('/upload_health_data_optimized','POST')
 def handle_health_data_optimized():
@@ -2213,22 +2341,7 @@ def get_total_info(customer_id=None):
     customer_id=customer_id or request.args.get('customerId') or request.args.get('customer_id')
     if not customer_id:return jsonify({'success':False,'error':'缺少customer_id参数'}),400
     
-    #缓存检查
     cache_key=f"total_unified:{customer_id}"
-    try:
-        if redis:  # 检查Redis是否可用
-            cached=redis.get(cache_key)
-            if cached:
-                result=json.loads(cached)
-                result['performance']['cached']=True
-                result['performance']['response_time']=round(time.time()-start_time,3)
-                api_logger.info('统一缓存命中',extra={'customer_id':customer_id})
-                return jsonify(result)
-    except Exception as e:
-        system_logger.warning('缓存读取失败',extra={'error':str(e)})
-    
-    #统一并发查询-始终使用优化策略
-    system_logger.info('统一并发查询模式',extra={'customer_id':customer_id})
     app_context=current_app._get_current_object()
     
     #导入底层函数
@@ -2321,59 +2434,58 @@ def get_total_info(customer_id=None):
                 system_logger.error('用户查询失败', extra={'customer_id': customer_id, 'error': str(e)})
                 return {"success": False, "error": str(e), "data": {"users": [], "totalUsers": 0, "totalDevices": 0, "departmentCount": {}, "statusCount": {}, "deviceCount": {}, "departmentStats": {}}}
     
-    #并发执行所有查询
-    try:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-            futures={
-                'alert_info':executor.submit(query_with_context,'告警',fetch_alerts,severityLevel=None),
-                'message_info':executor.submit(query_with_context,'消息',fetch_messages,messageType=None),
-                'device_info':executor.submit(query_with_context,'设备',fetch_devices),
-                'health_data':executor.submit(query_health),
-                'user_info':executor.submit(query_users)
-            }
+    def compute_total():#统一并发查询-同一租户同一时刻只执行一次
+        system_logger.info('统一并发查询模式',extra={'customer_id':customer_id})
+        computed.append(True)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
+                futures={
+                    'alert_info':executor.submit(query_with_context,'告警',fetch_alerts,severityLevel=None),
+                    'message_info':executor.submit(query_with_context,'消息',fetch_messages,messageType=None),
+                    'device_info':executor.submit(query_with_context,'设备',fetch_devices),
+                    'health_data':executor.submit(query_health),
+                    'user_info':executor.submit(query_users)
+                }
             
-            results,errors={},{}
-            for key,future in futures.items():
-                try:
-                    results[key]=future.result(timeout=3)#3秒超时
-                    system_logger.info(f'{key}查询完成',extra={'customer_id':customer_id,'has_data':results[key] is not None})
-                except Exception as e:
-                    errors[key]=str(e)
-                    results[key]=None
-                    system_logger.error(f'{key}查询异常',extra={'customer_id':customer_id,'error':str(e)})
-    except Exception as e:
-        system_logger.error('并发查询失败，降级为空结果',extra={'customer_id':customer_id,'error':str(e)})
-        results={'alert_info':None,'message_info':None,'device_info':None,'health_data':None,'user_info':None}
-        errors={'executor_error':str(e)}
+                results,errors={},{}
+                for key,future in futures.items():
+                    try:
+                        results[key]=future.result(timeout=3)#3秒超时
+                        system_logger.info(f'{key}查询完成',extra={'customer_id':customer_id,'has_data':results[key] is not None})
+                    except Exception as e:
+                        errors[key]=str(e)
+                        results[key]=None
+                        system_logger.error(f'{key}查询异常',extra={'customer_id':customer_id,'error':str(e)})
+        except Exception as e:
+            system_logger.error('并发查询失败，降级为空结果',extra={'customer_id':customer_id,'error':str(e)})
+            results={'alert_info':None,'message_info':None,'device_info':None,'health_data':None,'user_info':None}
+            errors={'executor_error':str(e)}
     
-    #统一数据提取
-    def extract(data):
-        if not data:return None
-        if hasattr(data,'get_json'):return data.get_json().get('data')
-        if isinstance(data,dict):return data.get('data',data)
-        return data
+        #统一数据提取
+        def extract(data):
+            if not data:return None
+            if hasattr(data,'get_json'):return data.get_json().get('data')
+            if isinstance(data,dict):return data.get('data',data)
+            return data
     
-    response_data={
-        'success':True,
-        'data':{k:extract(v) for k,v in results.items()},
-        'performance':{
-            'cached':False,
-            'response_time':round(time.time()-start_time,3),
-            'unified_approach':True,#标记使用统一方法
-            'errors':errors if errors else None
+        response_data={
+            'success':True,
+            'data':{k:extract(v) for k,v in results.items()},
+            'performance':{
+                'cached':False,
+                'response_time':round(time.time()-start_time,3),
+                'unified_approach':True,#标记使用统一方法
+                'errors':errors if errors else None
+            }
         }
-    }
-    
-    #缓存结果
-    try:
-        if redis:  # 检查Redis是否可用
-            redis.setex(cache_key,30,json.dumps(response_data,default=str))
-            api_logger.info('统一缓存已保存',extra={'customer_id':customer_id,'ttl':30})
-        else:
-            system_logger.info('Redis不可用，跳过缓存',extra={'customer_id':customer_id})
-    except Exception as e:
-        system_logger.warning('缓存保存失败',extra={'error':str(e)})
+        return response_data
     
+    computed=[]
+    response_data=single_flight.fetch(cache_key,compute_total,ttl=30)
+    if not computed:
+        response_data['performance']['cached']=True
+        response_data['performance']['response_time']=round(time.time()-start_time,3)
+        api_logger.info('统一缓存命中',extra={'customer_id':customer_id})
     return jsonify(response_data)
 
 @app.route('/api/cache/status', methods=['GET']) #缓存状态检查接口
@@ -2736,7 +2848,8 @@ def health_data_trends():
         startDate = request.args.get('startDate')
         endDate = request.args.get('endDate')
         userId = request.args.get('userId')
-        result = get_health_trends(orgId, userId, startDate, endDate)  #添加userId参数并获取返回值
+        maxPoints = parse_max_points(request.args, default=300)  #时间点上限，覆盖完整时间范围
+        result = get_health_trends(orgId, userId, startDate, endDate, maxPoints)  #添加userId参数并获取返回值
         return result  #直接返回，因为get_health_trends已经返回了jsonify结果
     except Exception as e:
         api_logger.error(f"健康趋势接口错误: {str(e)}")
@@ -3513,7 +3626,10 @@ def health_data_page():
         endDate = request.args.get('endDate')
         page = request.args.get('page', 1)
         pageSize = request.args.get('pageSize', 100)
-        result = get_page_health_data_by_orgIdAndUserId(orgId, userId, startDate, endDate, page, pageSize)
+        cursor = request.args.get('cursor') or None  # 上一页返回的nextCursor
+        withCount = request.args.get('withCount')  # 默认仅首页统计总数
+        withCount = None if withCount is None else withCount.lower() in ('1', 'true', 'yes')
+        result = get_page_health_data_by_orgIdAndUserId(orgId, userId, startDate, endDate, page, pageSize, cursor, withCount)
         return jsonify(result)
     except Exception as e:
         api_logger.error(f"健康数据分页接口错误: {str(e)}")
@@ -3527,6 +3643,8 @@ def get_comprehensive_statistics_data(customer_id, user_id=None, target_date=Non
             target_date = date.today()
         
         target_date_str = target_date.strftime('%Y-%m-%d')
+        day_start = datetime.combine(target_date, datetime.min.time())  # 范围条件代替func.date()，可走时间索引
+        day_end = day_start + timedelta(days=1)
         
         # 初始化统计数据
         stats = {
@@ -3542,15 +3660,27 @@ def get_comprehensive_statistics_data(customer_id, user_id=None, target_date=Non
             'tenant_name': '未知租户'
         }
         
+        # 租户级健康/告警/消息/当日上报设备数直接读取预聚合日计数(O(1))
+        counters = None
+        if not user_id:
+            try:
+                counters = get_stats_counter_store().get_counters(customer_id, target_date)
+                stats['health_count'] = counters.get('health', 0)
+                stats['alert_count'] = counters.get('alert', 0)
+                stats['message_count'] = counters.get('message', 0)
+            except Exception as e:
+                logger.warning(f"日计数读取失败，改为明细统计: {e}")
+        
         # 健康数据统计
         try:
-            health_query = db.session.query(func.count(UserHealthData.id))
-            if user_id:
-                health_query = health_query.filter(UserHealthData.user_id == user_id)
-            else:
-                health_query = health_query.filter(UserHealthData.customer_id == customer_id)
-            health_query = health_query.filter(func.date(UserHealthData.timestamp) == target_date)
-            stats['health_count'] = health_query.scalar() or 0
+            if counters is None:
+                health_query = db.session.query(func.count(UserHealthData.id))
+                if user_id:
+                    health_query = health_query.filter(UserHealthData.user_id == user_id)
+                else:
+                    health_query = health_query.filter(UserHealthData.customer_id == customer_id)
+                health_query = health_query.filter(UserHealthData.timestamp >= day_start, UserHealthData.timestamp < day_end)
+                stats['health_count'] = health_query.scalar() or 0
         except Exception as e:
             logger.warning(f"健康数据统计失败: {e}")
         
@@ -3561,8 +3691,9 @@ def get_comprehensive_statistics_data(customer_id, user_id=None, target_date=Non
                 alert_query = alert_query.filter(AlertInfo.user_id == user_id)
             else:
                 alert_query = alert_query.filter(AlertInfo.customer_id == customer_id)
-            alert_query = alert_query.filter(func.date(AlertInfo.alert_timestamp) == target_date)
-            stats['alert_count'] = alert_query.scalar() or 0
+            alert_query = alert_query.filter(AlertInfo.alert_timestamp >= day_start, AlertInfo.alert_timestamp < day_end)
+            if counters is None:
+                stats['alert_count'] = alert_query.scalar() or 0
             
             # 待处理告警统计
             pending_alert_query = alert_query.filter(AlertInfo.alert_status == 'pending')
@@ -3578,8 +3709,9 @@ def get_comprehensive_statistics_data(customer_id, user_id=None, target_date=Non
                 message_query = message_query.filter(DeviceMessage.user_id == user_id)
             else:
                 message_query = message_query.filter(DeviceMessage.customer_id == customer_id)
-            message_query = message_query.filter(func.date(DeviceMessage.create_time) == target_date)
-            stats['message_count'] = message_query.scalar() or 0
+            message_query = message_query.filter(DeviceMessage.create_time >= day_start, DeviceMessage.create_time < day_end)
+            if counters is None:
+                stats['message_count'] = message_query.scalar() or 0
             
             # 未读消息统计
             unread_message_query = message_query.filter(DeviceMessage.message_status == 1)
@@ -3596,16 +3728,18 @@ def get_comprehensive_statistics_data(customer_id, user_id=None, target_date=Non
                 device_query = device_query.filter(DeviceInfo.customer_id == customer_id)
             stats['device_count'] = device_query.scalar() or 0
             
-            # 活跃设备统计（在线或最近24小时有数据的设备）
-            from datetime import datetime, timedelta
-            recent_time = datetime.now() - timedelta(hours=24)
-            active_device_query = device_query.filter(
-                db.or_(
-                    DeviceInfo.status == 'ACTIVE',
-                    DeviceInfo.update_time >= recent_time
+            # 活跃设备统计：租户级为当日有上报的设备数(日计数)，否则为在线或最近24小时有数据的设备
+            if counters is not None:
+                stats['active_devices'] = counters.get('device', 0)
+            else:
+                recent_time = datetime.now() - timedelta(hours=24)
+                active_device_query = device_query.filter(
+                    db.or_(
+                        DeviceInfo.status == 'ACTIVE',
+                        DeviceInfo.update_time >= recent_time
+                    )
                 )
-            )
-            stats['active_devices'] = active_device_query.scalar() or 0
+                stats['active_devices'] = active_device_query.scalar() or 0
         except Exception as e:
             logger.warning(f"设备数据统计失败: {e}")
         
@@ -3688,83 +3822,79 @@ def statistics_overview():
         else:
             target_date = date.today()
 
-        # 尝试从缓存获取（5分钟缓存）
-        cache_key = f'statistics_overview:{customer_id}:{user_id or "all"}:{target_date}'
-        if cache_service:
-            cached_data = cache_service.get('bigscreen_summary', cache_key)
-            if cached_data:
-                return jsonify(cached_data)
+        # 单飞缓存（5分钟）：同一租户同一日期只由一个请求计算，其余等待结果或返回旧值
+        from .cache_service import CacheService
+        cache_key = f'{CacheService.PREFIX}statistics_overview:{customer_id}:{user_id or "all"}:{target_date}'
 
-        # 计算对比日期（前一天）
-        compare_date = target_date - timedelta(days=1)
+        def compute_overview():
+            # 计算对比日期（前一天）
+            compare_date = target_date - timedelta(days=1)
         
-        # 获取统计数据
-        current_stats = get_comprehensive_statistics_data(customer_id, user_id, target_date)
-        compare_stats = get_comprehensive_statistics_data(customer_id, user_id, compare_date)
+            # 获取统计数据
+            current_stats = get_comprehensive_statistics_data(customer_id, user_id, target_date)
+            compare_stats = get_comprehensive_statistics_data(customer_id, user_id, compare_date)
         
-        # 计算变化趋势
-        def calculate_change(current, previous):
-            if previous == 0:
-                return "+100%" if current > 0 else "0%"
-            change = ((current - previous) / previous) * 100
-            return f"{'+' if change >= 0 else ''}{change:.1f}%"
+            # 计算变化趋势
+            def calculate_change(current, previous):
+                if previous == 0:
+                    return "+100%" if current > 0 else "0%"
+                change = ((current - previous) / previous) * 100
+                return f"{'+' if change >= 0 else ''}{change:.1f}%"
         
-        # 构建返回数据
-        result = {
-            'success': True,
-            'data': {
-                # 当前统计数据
-                'current': {
-                    'date': target_date.strftime('%Y-%m-%d'),
-                    'health_count': current_stats['health_count'],
-                    'alert_count': current_stats['alert_count'],
-                    'message_count': current_stats['message_count'],
-                    'device_count': current_stats['device_count'],
-                    'user_count': current_stats['user_count'],
-                    'org_count': current_stats['org_count'],
-                    'active_devices': current_stats['active_devices'],
-                    'pending_alerts': current_stats['pending_alerts'],
-                    'unread_messages': current_stats['unread_messages']
-                },
+            # 构建返回数据
+            result = {
+                'success': True,
+                'data': {
+                    # 当前统计数据
+                    'current': {
+                        'date': target_date.strftime('%Y-%m-%d'),
+                        'health_count': current_stats['health_count'],
+                        'alert_count': current_stats['alert_count'],
+                        'message_count': current_stats['message_count'],
+                        'device_count': current_stats['device_count'],
+                        'user_count': current_stats['user_count'],
+                        'org_count': current_stats['org_count'],
+                        'active_devices': current_stats['active_devices'],
+                        'pending_alerts': current_stats['pending_alerts'],
+                        'unread_messages': current_stats['unread_messages']
+                    },
                 
-                # 对比数据
-                'compare': {
-                    'date': compare_date.strftime('%Y-%m-%d'),
-                    'health_count': compare_stats['health_count'],
-                    'alert_count': compare_stats['alert_count'],
-                    'message_count': compare_stats['message_count'],
-                    'device_count': compare_stats['device_count']
-                },
+                    # 对比数据
+                    'compare': {
+                        'date': compare_date.strftime('%Y-%m-%d'),
+                        'health_count': compare_stats['health_count'],
+                        'alert_count': compare_stats['alert_count'],
+                        'message_count': compare_stats['message_count'],
+                        'device_count': compare_stats['device_count']
+                    },
                 
-                # 变化趋势
-                'changes': {
-                    'health_count': calculate_change(current_stats['health_count'], compare_stats['health_count']),
-                    'alert_count': calculate_change(current_stats['alert_count'], compare_stats['alert_count']),
-                    'message_count': calculate_change(current_stats['message_count'], compare_stats['message_count']),
-                    'device_count': calculate_change(current_stats['device_count'], compare_stats['device_count'])
-                },
+                    # 变化趋势
+                    'changes': {
+                        'health_count': calculate_change(current_stats['health_count'], compare_stats['health_count']),
+                        'alert_count': calculate_change(current_stats['alert_count'], compare_stats['alert_count']),
+                        'message_count': calculate_change(current_stats['message_count'], compare_stats['message_count']),
+                        'device_count': calculate_change(current_stats['device_count'], compare_stats['device_count'])
+                    },
                 
-                # 租户信息
-                'tenant_info': {
-                    'customer_id': customer_id,
-                    'tenant_name': current_stats.get('tenant_name', '智能科技有限公司'),
-                    'system_status': 'normal'
-                },
+                    # 租户信息
+                    'tenant_info': {
+                        'customer_id': customer_id,
+                        'tenant_name': current_stats.get('tenant_name', '智能科技有限公司'),
+                        'system_status': 'normal'
+                    },
                 
-                # 实时状态
-                'realtime_status': {
-                    'last_update': datetime.now().isoformat(),
-                    'data_freshness': 'realtime',
-                    'api_response_time': f"{datetime.now().timestamp():.3f}s"
-                }
-            },
-            'timestamp': datetime.now().isoformat()
-        }
-
-        # 存入缓存（5分钟）
-        if cache_service:
-            cache_service.set('bigscreen_summary', cache_key, data=result)
+                    # 实时状态
+                    'realtime_status': {
+                        'last_update': datetime.now().isoformat(),
+                        'data_freshness': 'realtime',
+                        'api_response_time': f"{datetime.now().timestamp():.3f}s"
+                    }
+                },
+                'timestamp': datetime.now().isoformat()
+            }
+            return result
 
+        result = single_flight.fetch(cache_key, compute_overview, ttl=CacheService.TTL_CONFIG['bigscreen_summary'])
         return jsonify(result)
 
     except Exception as e:
@@ -3808,12 +3938,8 @@ def statistics_kpi():
             DeviceInfo.status.in_(['offline', 'error'])
         ).scalar() or 0
 
-        # 获取今日告警数
-        from datetime import date
-        today_alerts = db.session.query(func.count(AlertInfo.id)).filter(
-            AlertInfo.customer_id == customer_id,
-            func.date(AlertInfo.create_time) == date.today()
-        ).scalar() or 0
+        # 获取今日告警数(预聚合日计数)
+        today_alerts = get_stats_counter_store().get_counters(customer_id).get('alert', 0)
 
         # 获取监测用户数
         monitored_users = db.session.query(func.count(func.distinct(DeviceInfo.user_id))).filter(
@@ -4159,85 +4285,80 @@ def get_fallback_response(message, customer_id):
     })
 
 
+@refreshable('alert_list', 'alerts_list')
+def load_alerts_list(customer_id, day):
+    """今日告警分级统计与最近告警(后台刷新缓存加载器)"""
+    from datetime import datetime
+    today = datetime.strptime(day, '%Y-%m-%d').date()
+
+    from sqlalchemy import func, desc
+
+    # 获取今日告警,按级别分类
+
+    high_count = db.session.query(func.count(AlertInfo.id)).filter(
+        AlertInfo.customer_id == customer_id,
+        func.date(AlertInfo.create_time) == today,
+        AlertInfo.severity_level == 'high'
+    ).scalar() or 0
+
+    medium_count = db.session.query(func.count(AlertInfo.id)).filter(
+        AlertInfo.customer_id == customer_id,
+        func.date(AlertInfo.create_time) == today,
+        AlertInfo.severity_level == 'medium'
+    ).scalar() or 0
+
+    low_count = db.session.query(func.count(AlertInfo.id)).filter(
+        AlertInfo.customer_id == customer_id,
+        func.date(AlertInfo.create_time) == today,
+        AlertInfo.severity_level == 'low'
+    ).scalar() or 0
+
+    # 获取最近的告警列表
+    alerts = db.session.query(AlertInfo).filter(
+        AlertInfo.customer_id == customer_id,
+        func.date(AlertInfo.create_time) == today
+    ).order_by(desc(AlertInfo.create_time)).limit(10).all()
+
+    alert_list = []
+    for alert in alerts:
+        # 计算时间差
+        time_diff = datetime.now() - alert.create_time
+        if time_diff.seconds < 60:
+            time_str = "刚刚"
+        elif time_diff.seconds < 3600:
+            time_str = f"{time_diff.seconds // 60}分钟前"
+        else:
+            time_str = f"{time_diff.seconds // 3600}小时前"
+
+        alert_list.append({
+            'id': alert.id,
+            'level': alert.severity_level or 'medium',
+            'title': alert.alert_type or '健康异常',
+            'user': alert.assigned_user or '未知用户',
+            'time': time_str,
+            'status': alert.alert_status or 'pending'
+        })
+
+    return {
+        'code': 200,
+        'message': 'success',
+        'data': {
+            'high': high_count,
+            'medium': medium_count,
+            'low': low_count,
+            'list': alert_list
+        }
+    }
+
+
 @app.route('/api/alerts/list', methods=['GET'])
 def alerts_list():
-    """告警列表 - 优化版大屏V2专用（缓存30秒）"""
+    """告警列表 - 优化版大屏V2专用（后台刷新缓存1分钟）"""
     try:
         customer_id = request.args.get('customerId', '1939964806110937090')
 
-        # 尝试从缓存获取（30秒缓存）
-        from datetime import date, datetime
-        today = date.today()
-        cache_key = f'alerts_list:{customer_id}:{today}'
-        if cache_service:
-            cached_data = cache_service.get('alert_list', cache_key)
-            if cached_data:
-                return jsonify(cached_data)
-
-        from sqlalchemy import func, desc
-
-        # 获取今日告警,按级别分类
-
-        high_count = db.session.query(func.count(AlertInfo.id)).filter(
-            AlertInfo.customer_id == customer_id,
-            func.date(AlertInfo.create_time) == today,
-            AlertInfo.severity_level == 'high'
-        ).scalar() or 0
-
-        medium_count = db.session.query(func.count(AlertInfo.id)).filter(
-            AlertInfo.customer_id == customer_id,
-            func.date(AlertInfo.create_time) == today,
-            AlertInfo.severity_level == 'medium'
-        ).scalar() or 0
-
-        low_count = db.session.query(func.count(AlertInfo.id)).filter(
-            AlertInfo.customer_id == customer_id,
-            func.date(AlertInfo.create_time) == today,
-            AlertInfo.severity_level == 'low'
-        ).scalar() or 0
-
-        # 获取最近的告警列表
-        alerts = db.session.query(AlertInfo).filter(
-            AlertInfo.customer_id == customer_id,
-            func.date(AlertInfo.create_time) == today
-        ).order_by(desc(AlertInfo.create_time)).limit(10).all()
-
-        alert_list = []
-        for alert in alerts:
-            # 计算时间差
-            time_diff = datetime.now() - alert.create_time
-            if time_diff.seconds < 60:
-                time_str = "刚刚"
-            elif time_diff.seconds < 3600:
-                time_str = f"{time_diff.seconds // 60}分钟前"
-            else:
-                time_str = f"{time_diff.seconds // 3600}小时前"
-
-            alert_list.append({
-                'id': alert.id,
-                'level': alert.severity_level or 'medium',
-                'title': alert.alert_type or '健康异常',
-                'user': alert.assigned_user or '未知用户',
-                'time': time_str,
-                'status': alert.alert_status or 'pending'
-            })
-
-        result = {
-            'code': 200,
-            'message': 'success',
-            'data': {
-                'high': high_count,
-                'medium': medium_count,
-                'low': low_count,
-                'list': alert_list
-            }
-        }
-
-        # 存入缓存（30秒）
-        if cache_service:
-            cache_service.set('alert_list', cache_key, data=result)
-
-        return jsonify(result)
+        from datetime import date
+        return jsonify(refreshable_response('alert_list', 'alerts_list', customer_id, date.today().isoformat()))
     except Exception as e:
         logger.error(f"告警列表获取失败: {str(e)}")
         return jsonify({
@@ -4322,80 +4443,73 @@ def personnel_ranking():
         }), 500
 
 
-@app.route('/api/statistics/area-ranking', methods=['GET'])
-def area_ranking():
-    """区域健康排行API（缓存5分钟）"""
-    try:
-        customer_id = request.args.get('customerId', '1939964806110937090')
-
-        # 尝试从缓存获取（5分钟缓存）
-        cache_key = f'area_ranking:{customer_id}'
-        if cache_service:
-            cached_data = cache_service.get('org_stats', cache_key)
-            if cached_data:
-                return jsonify(cached_data)
-
-        # 查询各组织的健康数据汇总
-        from sqlalchemy import func
-
-        # 获取各组织的设备和告警统计
-        org_stats = db.session.query(
-            OrgInfo.name,
-            OrgInfo.id,
-            func.count(DeviceInfo.id).label('device_count')
-        ).outerjoin(
-            UserInfo, UserInfo.org_id == OrgInfo.id
-        ).outerjoin(
-            DeviceInfo, DeviceInfo.user_id == UserInfo.id
+@refreshable('org_stats', 'area_ranking')
+def load_area_ranking(customer_id):
+    """各组织设备、告警数与健康评分(后台刷新缓存加载器)"""
+    # 查询各组织的健康数据汇总
+    from sqlalchemy import func
+
+    # 获取各组织的设备和告警统计
+    org_stats = db.session.query(
+        OrgInfo.name,
+        OrgInfo.id,
+        func.count(DeviceInfo.id).label('device_count')
+    ).outerjoin(
+        UserInfo, UserInfo.org_id == OrgInfo.id
+    ).outerjoin(
+        DeviceInfo, DeviceInfo.user_id == UserInfo.id
+    ).filter(
+        OrgInfo.customer_id == customer_id
+    ).group_by(
+        OrgInfo.id, OrgInfo.name
+    ).all()
+
+    ranking = []
+    for org in org_stats:
+        # 查询该组织的告警数
+        alert_count = db.session.query(func.count(AlertInfo.id)).join(
+            UserInfo, UserInfo.id == AlertInfo.user_id
         ).filter(
-            OrgInfo.customer_id == customer_id
-        ).group_by(
-            OrgInfo.id, OrgInfo.name
-        ).all()
-
-        ranking = []
-        for org in org_stats:
-            # 查询该组织的告警数
-            alert_count = db.session.query(func.count(AlertInfo.id)).join(
-                UserInfo, UserInfo.id == AlertInfo.user_id
-            ).filter(
-                UserInfo.org_id == org.id
-            ).scalar() or 0
+            UserInfo.org_id == org.id
+        ).scalar() or 0
 
-            # 查询异常人员数
-            abnormal_count = db.session.query(func.count(func.distinct(AlertInfo.user_id))).join(
-                UserInfo, UserInfo.id == AlertInfo.user_id
-            ).filter(
-                UserInfo.org_id == org.id,
-                AlertInfo.alert_status == 'pending'
-            ).scalar() or 0
+        # 查询异常人员数
+        abnormal_count = db.session.query(func.count(func.distinct(AlertInfo.user_id))).join(
+            UserInfo, UserInfo.id == AlertInfo.user_id
+        ).filter(
+            UserInfo.org_id == org.id,
+            AlertInfo.alert_status == 'pending'
+        ).scalar() or 0
 
-            # 计算健康评分（简化算法）
-            score = 100 - min(alert_count * 2 + abnormal_count * 5, 50)
+        # 计算健康评分（简化算法）
+        score = 100 - min(alert_count * 2 + abnormal_count * 5, 50)
 
-            ranking.append({
-                'name': org.name or f'组织{org.id}',
-                'score': score,
-                'alerts': alert_count,
-                'abnormal': abnormal_count
-            })
+        ranking.append({
+            'name': org.name or f'组织{org.id}',
+            'score': score,
+            'alerts': alert_count,
+            'abnormal': abnormal_count
+        })
 
-        # 按评分排序
-        ranking.sort(key=lambda x: x['score'], reverse=True)
+    # 按评分排序
+    ranking.sort(key=lambda x: x['score'], reverse=True)
 
-        result = {
-            'code': 200,
-            'message': 'success',
-            'data': {
-                'ranking': ranking
-            }
+    return {
+        'code': 200,
+        'message': 'success',
+        'data': {
+            'ranking': ranking
         }
+    }
 
-        # 存入缓存（5分钟）
-        if cache_service:
-            cache_service.set('org_stats', cache_key, data=result)
 
-        return jsonify(result)
+@app.route('/api/statistics/area-ranking', methods=['GET'])
+def area_ranking():
+    """区域健康排行API（后台刷新缓存10分钟）"""
+    try:
+        customer_id = request.args.get('customerId', '1939964806110937090')
+
+        return jsonify(refreshable_response('org_stats', 'area_ranking', customer_id))
     except Exception as e:
         logger.error(f"区域排行获取失败: {str(e)}")
         return jsonify({
@@ -4405,65 +4519,88 @@ def area_ranking():
         }), 500
 
 
-@app.route('/api/personnel/offline', methods=['GET'])
-def personnel_offline():
-    """离线人员列表API（缓存1分钟）"""
-    try:
-        customer_id = request.args.get('customerId', '1939964806110937090')
+def offline_time_text(seconds):
+    """离线时长文本"""
+    if seconds is None:
+        return '未知'
+    if seconds < 3600:
+        return f'{max(int(seconds / 60), 1)}分钟前'
+    if seconds < 86400:
+        return f'{int(seconds / 3600)}小时前'
+    return f'{int(seconds / 86400)}天前'
 
-        # 尝试从缓存获取（1分钟缓存）
-        cache_key = f'personnel_offline:{customer_id}'
-        if cache_service:
-            cached_data = cache_service.get('device_list', cache_key)
-            if cached_data:
-                return jsonify(cached_data)
 
-        from datetime import datetime, timedelta
+def presence_offline_response(customer_id, limit=50):
+    """离线人员(设备在线索引)：超过租户上报间隔未上报的设备，索引不可用时返回None"""
+    result = get_device_presence().offline_devices(customer_id, limit=limit)
+    if result is None:
+        return None
+    owners = get_device_resolver().resolve_many(sn for sn, _ in result['devices'])
+    now = time.time()
+    offline_list = []
+    for device_sn, last_seen in result['devices']:
+        owner = owners.get(device_sn) or {}
+        offline_list.append({
+            'name': owner.get('user_name') or '未知用户',
+            'dept': owner.get('org_name') or '未分配部门',
+            'deviceSn': device_sn,
+            'offlineTime': offline_time_text(now - last_seen if last_seen else None)
+        })
+    return {
+        'code': 200,
+        'message': 'success',
+        'data': offline_list,
+        'total': result['total'],
+        'performance': {'source': 'presence', 'interval': result['interval']}
+    }
 
-        # 查询最近24小时无数据上传的设备
-        cutoff_time = datetime.now() - timedelta(hours=24)
 
-        offline_devices = db.session.query(
-            UserInfo.user_name,
-            UserInfo.org_name,
-            DeviceInfo.update_time
-        ).join(
-            DeviceInfo, DeviceInfo.user_id == UserInfo.id
-        ).filter(
-            UserInfo.customer_id == customer_id,
-            DeviceInfo.update_time < cutoff_time
-        ).order_by(
-            DeviceInfo.update_time.desc()
-        ).limit(50).all()
-
-        offline_list = []
-        for device in offline_devices:
-            # 计算离线时长
-            if device.update_time:
-                offline_hours = (datetime.now() - device.update_time).total_seconds() / 3600
-                if offline_hours < 24:
-                    offline_time = f'{int(offline_hours)}小时前'
-                else:
-                    offline_time = f'{int(offline_hours / 24)}天前'
-            else:
-                offline_time = '未知'
+@refreshable('device_list', 'personnel_offline')
+def load_personnel_offline(customer_id):
+    """最近24小时无数据上传的设备及佩戴人员(在线索引不可用时的后台刷新缓存加载器)"""
+    from datetime import datetime, timedelta
 
-            offline_list.append({
-                'name': device.user_name or '未知用户',
-                'dept': device.org_name or '未分配部门',
-                'offlineTime': offline_time
-            })
+    # 查询最近24小时无数据上传的设备
+    cutoff_time = datetime.now() - timedelta(hours=24)
+
+    offline_devices = db.session.query(
+        UserInfo.user_name,
+        UserInfo.org_name,
+        DeviceInfo.update_time
+    ).join(
+        DeviceInfo, DeviceInfo.user_id == UserInfo.id
+    ).filter(
+        UserInfo.customer_id == customer_id,
+        DeviceInfo.update_time < cutoff_time
+    ).order_by(
+        DeviceInfo.update_time.desc()
+    ).limit(50).all()
+
+    offline_list = []
+    for device in offline_devices:
+        offline_list.append({
+            'name': device.user_name or '未知用户',
+            'dept': device.org_name or '未分配部门',
+            'offlineTime': offline_time_text((datetime.now() - device.update_time).total_seconds()
+                                             if device.update_time else None)
+        })
+
+    return {
+        'code': 200,
+        'message': 'success',
+        'data': offline_list
+    }
 
-        result = {
-            'code': 200,
-            'message': 'success',
-            'data': offline_list
-        }
 
-        # 存入缓存（1分钟）
-        if cache_service:
-            cache_service.set('device_list', cache_key, data=result)
+@app.route('/api/personnel/offline', methods=['GET'])
+def personnel_offline():
+    """离线人员列表API（设备在线索引直接查询，索引不可用时读取后台刷新缓存）"""
+    try:
+        customer_id = request.args.get('customerId', '1939964806110937090')
 
+        result = presence_offline_response(customer_id)
+        if result is None:
+            result = refreshable_response('device_list', 'personnel_offline', customer_id)
         return jsonify(result)
     except Exception as e:
         logger.error(f"离线人员获取失败: {str(e)}")
@@ -4474,75 +4611,94 @@ def personnel_offline():
         }), 500
 
 
-@app.route('/api/personnel/wearing-status', methods=['GET'])
-def personnel_wearing_status():
-    """佩戴状态统计API（缓存1分钟）"""
-    try:
-        customer_id = request.args.get('customerId', '1939964806110937090')
-
-        # 尝试从缓存获取（1分钟缓存）
-        cache_key = f'wearing_status:{customer_id}'
-        if cache_service:
-            cached_data = cache_service.get('device_stats', cache_key)
-            if cached_data:
-                return jsonify(cached_data)
-
-        from datetime import datetime, timedelta
-
-        # 总设备数
-        total_devices = db.session.query(func.count(DeviceInfo.id)).join(
-            UserInfo, UserInfo.id == DeviceInfo.user_id
-        ).filter(
-            UserInfo.customer_id == customer_id
-        ).scalar() or 0
-
-        # 在线设备（最近1小时有数据）
-        recent_time = datetime.now() - timedelta(hours=1)
-        online_devices = db.session.query(func.count(DeviceInfo.id)).join(
-            UserInfo, UserInfo.id == DeviceInfo.user_id
-        ).filter(
-            UserInfo.customer_id == customer_id,
-            DeviceInfo.update_time >= recent_time
-        ).scalar() or 0
-
-        # 离线设备（24小时无数据）
-        offline_time = datetime.now() - timedelta(hours=24)
-        offline_devices = db.session.query(func.count(DeviceInfo.id)).join(
-            UserInfo, UserInfo.id == DeviceInfo.user_id
-        ).filter(
-            UserInfo.customer_id == customer_id,
-            DeviceInfo.update_time < offline_time
-        ).scalar() or 0
-
-        # 异常佩戴（有告警的在线设备）
-        abnormal_devices = db.session.query(func.count(func.distinct(AlertInfo.user_id))).join(
-            UserInfo, UserInfo.id == AlertInfo.user_id
-        ).join(
-            DeviceInfo, DeviceInfo.user_id == UserInfo.id
-        ).filter(
-            UserInfo.customer_id == customer_id,
-            AlertInfo.alert_status == 'pending',
-            DeviceInfo.update_time >= recent_time
-        ).scalar() or 0
-
-        # 正常佩戴 = 在线设备 - 异常设备
-        normal_devices = max(online_devices - abnormal_devices, 0)
+@refreshable('device_stats', 'wearing_status')
+def load_wearing_status(customer_id):
+    """正常/异常/离线佩戴设备数及各组织佩戴率(后台刷新缓存加载器)"""
+    from datetime import datetime, timedelta
 
-        result = {
+    # 优先使用设备在线索引：在线/离线/佩戴均为范围计数，异常设备只需查询待处理告警的设备
+    presence = get_device_presence()
+    summary = presence.summary(customer_id)
+    if summary is not None:
+        alert_devices = [row[0] for row in db.session.query(func.distinct(AlertInfo.device_sn)).filter(
+            AlertInfo.customer_id == customer_id,
+            AlertInfo.alert_status == 'pending'
+        ).all() if row[0]]
+        statuses = presence.statuses(customer_id, alert_devices) or {}
+        abnormal_devices = sum(1 for online in statuses.values() if online)
+        forest = get_org_forest().get_forest(customer_id)
+        org_rates = [dict(rate, orgId=org_id, orgName=forest.nodes[org_id].name if forest and org_id in forest else None)
+                     for org_id, rate in (presence.org_wearing_rates(customer_id) or {}).items()]
+        return {
             'code': 200,
             'message': 'success',
             'data': {
-                'normal': normal_devices,
+                'normal': max(summary['worn_online'] - abnormal_devices, 0),
                 'abnormal': abnormal_devices,
-                'offline': offline_devices
+                'offline': summary['offline'],
+                'notWorn': summary['online'] - summary['worn_online'],
+                'charging': summary['charging'],
+                'orgRates': org_rates
             }
         }
 
-        # 存入缓存（1分钟）
-        if cache_service:
-            cache_service.set('device_stats', cache_key, data=result)
+    # 总设备数
+    total_devices = db.session.query(func.count(DeviceInfo.id)).join(
+        UserInfo, UserInfo.id == DeviceInfo.user_id
+    ).filter(
+        UserInfo.customer_id == customer_id
+    ).scalar() or 0
+
+    # 在线设备（最近1小时有数据）
+    recent_time = datetime.now() - timedelta(hours=1)
+    online_devices = db.session.query(func.count(DeviceInfo.id)).join(
+        UserInfo, UserInfo.id == DeviceInfo.user_id
+    ).filter(
+        UserInfo.customer_id == customer_id,
+        DeviceInfo.update_time >= recent_time
+    ).scalar() or 0
+
+    # 离线设备（24小时无数据）
+    offline_time = datetime.now() - timedelta(hours=24)
+    offline_devices = db.session.query(func.count(DeviceInfo.id)).join(
+        UserInfo, UserInfo.id == DeviceInfo.user_id
+    ).filter(
+        UserInfo.customer_id == customer_id,
+        DeviceInfo.update_time < offline_time
+    ).scalar() or 0
+
+    # 异常佩戴（有告警的在线设备）
+    abnormal_devices = db.session.query(func.count(func.distinct(AlertInfo.user_id))).join(
+        UserInfo, UserInfo.id == AlertInfo.user_id
+    ).join(
+        DeviceInfo, DeviceInfo.user_id == UserInfo.id
+    ).filter(
+        UserInfo.customer_id == customer_id,
+        AlertInfo.alert_status == 'pending',
+        DeviceInfo.update_time >= recent_time
+    ).scalar() or 0
+
+    # 正常佩戴 = 在线设备 - 异常设备
+    normal_devices = max(online_devices - abnormal_devices, 0)
 
-        return jsonify(result)
+    return {
+        'code': 200,
+        'message': 'success',
+        'data': {
+            'normal': normal_devices,
+            'abnormal': abnormal_devices,
+            'offline': offline_devices
+        }
+    }
+
+
+@app.route('/api/personnel/wearing-status', methods=['GET'])
+def personnel_wearing_status():
+    """佩戴状态统计API（后台刷新缓存5分钟）"""
+    try:
+        customer_id = request.args.get('customerId', '1939964806110937090')
+
+        return jsonify(refreshable_response('device_stats', 'wearing_status', customer_id))
     except Exception as e:
         logger.error(f"佩戴状态获取失败: {str(e)}")
         return jsonify({
@@ -4866,6 +5022,17 @@ def send_test_corp_wechat_alert():
             'message': '发送测试企业微信告警失败'
         }), 500
 
+HEALTH_METRIC_NORMAL_RANGES={
+    'heart_rate':[60,100],
+    'blood_oxygen':[95,100],
+    'temperature':[36.0,37.5],
+    'stress':[0,50],
+    'step':[8000,12000],
+    'distance':[3,10],
+    'calorie':[1500,3000],
+    'sleep':[6,9]
+}
+
 @app.route('/api/health/trends/<metric>', methods=['GET']) # 单个体征趋势接口
 def get_health_metric_trends(metric):
     try:
@@ -4873,6 +5040,8 @@ def get_health_metric_trends(metric):
         orgId=request.args.get('orgId')
         userId=request.args.get('userId')
         days=int(request.args.get('days',7)) # 默认7天
+        max_points=parse_max_points(request.args) # 返回点数上限，与时间范围无关
+        mode=request.args.get('mode','lttb') # lttb(附桶内min/max) 或 minmax(保留峰谷)
         
         if not deviceSn and not (orgId and userId):
             return jsonify({'success':False,'message':'需要deviceSn或orgId+userId参数'})
@@ -4907,6 +5076,39 @@ def get_health_metric_trends(metric):
         end_date=datetime.now()
         start_date=end_date-timedelta(days=days)
         
+        daily_cells=[]
+        if should_use_rollup(start_date,end_date) and metric in ROLLUP_METRICS and userId:
+            #30天以上读日汇总，每天一个点(取值为当天均值)
+            try:
+                series=query_rollup_series([metric],start_date,end_date,'1d',user_id=userId)
+                daily_cells=[(day,cells[metric]) for day,cells in sorted(series.items()) if cells.get(metric,{}).get('count')]
+            except Exception as e:
+                api_logger.warning(f"汇总趋势查询失败，回退明细: {e}")
+        if daily_cells:
+            trend_data=[{'timestamp':day.strftime('%Y-%m-%d %H:%M:%S'),'value':round(cell['avg'],2),'date':day.strftime('%Y-%m-%d'),
+                         'count':cell['count'],'min':cell['min'],'max':cell['max']} for day,cell in daily_cells]
+            summary=merge_rollup_cells(cell for _,cell in daily_cells)
+            return jsonify({
+                'success':True,
+                'data':{
+                    'metric':metric,
+                    'trend_data':trend_data,
+                    'statistics':{
+                        'count':summary['count'],
+                        'average':round(summary['avg'] or 0,2),
+                        'min':summary['min'] or 0,
+                        'max':summary['max'] or 0,
+                        'normal_range':HEALTH_METRIC_NORMAL_RANGES.get(metric,[0,100])
+                    },
+                    'chart_config':{
+                        'title':f'{metric}趋势图',
+                        'unit':get_metric_unit(metric),
+                        'color':get_metric_color(metric)
+                    },
+                    'data_source':'rollup_1d'
+                }
+            })
+        
         # 使用get_all_health_data_optimized获取数据
         health_result=get_all_health_data_optimized(
             orgId=orgId,
@@ -4963,25 +5165,20 @@ def get_health_metric_trends(metric):
             avg_value=min_value=max_value=0
         
         # 获取正常范围
-        normal_ranges={
-            'heart_rate':[60,100],
-            'blood_oxygen':[95,100],
-            'temperature':[36.0,37.5],
-            'stress':[0,50],
-            'step':[8000,12000],
-            'distance':[3,10],
-            'calorie':[1500,3000],
-            'sleep':[6,9]
-        }
-        normal_range=normal_ranges.get(metric,[0,100])
+        normal_range=HEALTH_METRIC_NORMAL_RANGES.get(metric,[0,100])
+        
+        # 统计基于全部数据，返回的曲线点降采样
+        count=len(trend_data)
+        trend_data=downsample_points(trend_data,max_points,mode)
         
         return jsonify({
             'success':True,
             'data':{
                 'metric':metric,
                 'trend_data':trend_data,
+                'maxPoints':max_points,
                 'statistics':{
-                    'count':len(trend_data),
+                    'count':count,
                     'average':round(avg_value,2),
                     'min':min_value,
                     'max':max_value,
@@ -5319,8 +5516,8 @@ def api_get_device_battery_prediction():
 @app.route('/api/device/analysis/comprehensive', methods=['GET'])
 @log_api_request('/api/device/analysis/comprehensive','GET')
 def api_get_comprehensive_device_analysis():
-    """获取设备综合分析数据"""
-    from .device import get_device_history_trends, get_device_battery_prediction, fetch_devices_by_orgIdAndUserId
+    """获取设备综合分析数据(趋势与电池预测共用按日缓存的设备累加器)"""
+    from .device import get_device_comprehensive_analysis, fetch_devices_by_orgIdAndUserId
     
     org_id = request.args.get('orgId')
     user_id = request.args.get('userId')
@@ -5335,19 +5532,17 @@ def api_get_comprehensive_device_analysis():
         if not devices_result.get('success'):
             return jsonify({"success": False, "message": "获取设备信息失败"})
         
-        # 获取历史趋势数据
-        trends_result = get_device_history_trends(org_id, user_id, days)
-        
-        # 获取电池预测数据
-        prediction_result = get_device_battery_prediction(org_id, user_id, days)
+        # 历史趋势与电池预测(一次流式累加)
+        analysis_result = get_device_comprehensive_analysis(org_id, user_id, days)
+        analysis_data = analysis_result.get('data', {}) if analysis_result.get('success') else {}
         
         # 合并所有数据
         comprehensive_data = {
             "success": True,
             "data": {
                 "devices": devices_result.get('data', {}),
-                "trends": trends_result.get('data', {}) if trends_result.get('success') else {},
-                "predictions": prediction_result.get('data', {}) if prediction_result.get('success') else {},
+                "trends": analysis_data.get('trends', {}),
+                "predictions": analysis_data.get('predictions', {}),
                 "analysis_time": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
                 "time_range_days": days
             }
@@ -7077,6 +7272,7 @@ def get_alert_system_status():
         processor = get_unified_processor()
         
         stats = processor.get_stats()
+        from .alert_outbox import get_alert_notifier
         
         return jsonify({
             'success': True,
@@ -7085,6 +7281,7 @@ def get_alert_system_status():
                 'worker_count': len(processor.workers),
                 'queue_stats': stats['queue_stats'],
                 'processing_stats': stats['processing_stats'],
+                'notification_outbox': get_alert_notifier().get_stats(include_db=True),
                 'uptime': datetime.now().isoformat()
             }
         })
@@ -7455,6 +7652,8 @@ def api_health_waveform():
         device_sn = request.args.get('deviceSn')
         metric = request.args.get('metric', 'heart_rate')  # heart_rate, blood_oxygen, temperature
         time_range = int(request.args.get('timeRange', 300))  # 默认5分钟
+        max_points = parse_max_points(request.args)  # 返回点数上限，与时间范围无关
+        mode = request.args.get('mode', 'lttb')  # lttb(附桶内min/max) 或 minmax(保留峰谷)
         
         if not device_sn:
             return jsonify({
@@ -7468,13 +7667,14 @@ def api_health_waveform():
         start_time = end_time - timedelta(seconds=time_range)
         
         from .user_health_data import get_waveform_data
-        waveform_data = get_waveform_data(device_sn, metric, start_time, end_time)
+        waveform_data = get_waveform_data(device_sn, metric, start_time, end_time, max_points, mode)
         
         return jsonify({
             'success': True,
             'data': {
                 'metric': metric,
                 'timeRange': time_range,
+                'maxPoints': max_points,
                 'points': waveform_data,
                 'startTime': start_time.isoformat(),
                 'endTime': end_time.isoformat()
@@ -7496,6 +7696,7 @@ def api_health_trends_comprehensive():
         device_sn = data.get('deviceSn')
         time_range = data.get('timeRange', '7d')  # 7d, 30d, 90d
         metrics = data.get('metrics', ['heart_rate', 'blood_oxygen', 'temperature', 'step'])
+        max_points = parse_max_points(data)
         
         if not device_sn:
             return jsonify({
@@ -7513,7 +7714,7 @@ def api_health_trends_comprehensive():
         
         # 获取趋势数据
         from .user_health_data import get_health_trends_comprehensive
-        trends_data = get_health_trends_comprehensive(device_sn, metrics, start_time, end_time)
+        trends_data = get_health_trends_comprehensive(device_sn, metrics, start_time, end_time, max_points)
         
         return jsonify({
             'success': True,
@@ -3,13 +3,40 @@
 # =============================================================================
 
 import json
+import os
+import time
+import threading
 import logging
 from functools import wraps
-from typing import Optional, Callable, Any
+from typing import Optional, Callable, Any, Dict, Tuple
 from datetime import timedelta
 
 logger = logging.getLogger(__name__)
 
+# 后台刷新缓存(stale-while-revalidate)配置
+LAST_GOOD_TTL = int(os.getenv('CACHE_LAST_GOOD_TTL', 86400))  # 最近一次成功结果的保留时长
+ACCESS_WINDOW = int(os.getenv('CACHE_ACCESS_WINDOW', 600))  # 该时间内被读取过的键才会后台刷新
+REFRESH_INTERVAL = float(os.getenv('CACHE_REFRESH_INTERVAL', 5))  # 调度线程扫描间隔
+REFRESH_AHEAD = 0.8  # 条目年龄超过TTL的80%即提前刷新
+TOUCH_INTERVAL = 10  # 同一键访问记录的最小写入间隔
+
+# 缓存加载器注册表: (类别, 名称) -> loader(*args)
+REFRESH_LOADERS: Dict[Tuple[str, str], Callable] = {}
+
+def refreshable(category: str, name: str):
+    """
+    装饰器：声明某类别某键的加载函数，由CacheService后台刷新
+
+    用法:
+    @refreshable('org_stats', 'area_ranking')
+    def load_area_ranking(customer_id):
+        return query_from_db(customer_id)
+    """
+    def decorator(func: Callable) -> Callable:
+        REFRESH_LOADERS[(category, name)] = func
+        return func
+    return decorator
+
 class CacheService:
     """
     智能缓存服务
@@ -17,6 +44,7 @@ class CacheService:
     - 分层TTL策略
     - 缓存预热
     - 缓存击穿防护
+    - 后台刷新：注册加载器的键在过期前由调度线程刷新，读取方总是立即拿到最近一次成功结果
     """
 
     # 缓存键前缀
@@ -58,6 +86,15 @@ class CacheService:
             redis_helper: RedisHelper实例
         """
         self.redis = redis_helper
+        self._app = None
+        self._refresher = None
+        self._wakeup = threading.Event()
+        self._pending = set()  # 读取时发现已过期、需尽快刷新的键
+        self._touched: Dict[str, float] = {}
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.refresh_stats = {'hits': 0, 'stale_hits': 0, 'cold_loads': 0, 'refreshes': 0,
+                              'refresh_skipped': 0, 'refresh_errors': 0}
         logger.info("✅ CacheService初始化成功")
 
     def _make_key(self, category: str, *args) -> str:
@@ -223,26 +260,179 @@ class CacheService:
 
     def warm_up(self, customer_id: str, user_ids: list = None):
         """
-        缓存预热 - 预先加载热点数据
+        缓存预热 - 立即刷新该客户最近被访问过的已注册缓存键
 
         Args:
             customer_id: 客户ID
-            user_ids: 用户ID列表（可选）
+            user_ids: 用户ID列表（可选，按用户维度的键只预热这些用户）
         """
         logger.info(f"🔥 开始缓存预热: customer_id={customer_id}")
 
         try:
-            # 预热逻辑可以根据实际情况调整
-            # 这里仅作为示例框架
-            if user_ids:
-                for user_id in user_ids[:100]:  # 最多预热100个用户
-                    # 这里可以调用实际的数据获取函数
-                    pass
-
-            logger.info(f"✅ 缓存预热完成: customer_id={customer_id}")
+            user_ids = {str(user_id) for user_id in (user_ids or [])[:100]}  # 最多预热100个用户
+            refreshed = 0
+            for member in self._recent_members():
+                category, name, *args = json.loads(member)
+                if (category, name) in REFRESH_LOADERS and args and \
+                        (str(args[0]) == str(customer_id) or str(args[0]) in user_ids):
+                    refreshed += self.refresh(category, name, *args)
+
+            logger.info(f"✅ 缓存预热完成: customer_id={customer_id}, 刷新{refreshed}个键")
         except Exception as e:
             logger.error(f"❌ 缓存预热失败: {e}")
 
+    # =============================================================================
+    # 后台刷新缓存(stale-while-revalidate)
+    # =============================================================================
+
+    def start_refresher(self, app=None):
+        """启动后台刷新线程；加载器在app上下文中执行"""
+        self._app = app or self._app
+        if self._refresher is not None:
+            return
+        with self._lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(target=self._refresh_loop, daemon=True, name='CacheRefresher')
+                self._refresher.start()
+                logger.info(f"🔄 缓存后台刷新已启动: 扫描间隔{REFRESH_INTERVAL}s, 访问窗口{ACCESS_WINDOW}s")
+
+    def get_refreshable(self, category: str, name: str, *args) -> Tuple[Any, dict]:
+        """
+        读取注册了加载器的缓存
+
+        总是立即返回最近一次成功结果(过期时安排后台刷新)；仅从未加载过的键同步加载一次
+
+        Returns:
+            (数据, performance信息{cached, age, stale})
+        """
+        key = self._make_key(category, name, *args)
+        member = json.dumps([category, name, *args], default=str)
+        self._touch(member)
+        entry = self._read_entry(key)
+        if entry is not None:
+            age = time.time() - entry['stored_at']
+            stale = age > self.TTL_CONFIG.get(category, 300)
+            if stale:
+                self.refresh_stats['stale_hits'] += 1
+                self._pending.add(member)
+                self._wakeup.set()
+            else:
+                self.refresh_stats['hits'] += 1
+            return entry['data'], {'cached': True, 'age': round(age, 1), 'stale': stale}
+        return self._cold_load(key, category, name, args), {'cached': False, 'age': 0, 'stale': False}
+
+    def refresh(self, category: str, name: str, *args) -> bool:
+        """立即执行加载器并写入缓存；其他进程正在刷新同一键时跳过"""
+        loader = REFRESH_LOADERS.get((category, name))
+        if loader is None:
+            return False
+        key = self._make_key(category, name, *args)
+        lock_key = f"{key}:refreshing"
+        client = getattr(self.redis, 'client', None)
+        try:
+            if client is not None and not client.set(lock_key, '1', nx=True, ex=max(self.TTL_CONFIG.get(category, 300), 30)):
+                self.refresh_stats['refresh_skipped'] += 1
+                return False
+        except Exception as e:
+            logger.warning(f"⚠️  刷新锁获取失败，本进程直接刷新 {key}: {e}")
+        try:
+            self._store_entry(key, self._run_loader(loader, args))
+            self.refresh_stats['refreshes'] += 1
+            return True
+        except Exception as e:
+            self.refresh_stats['refresh_errors'] += 1
+            logger.warning(f"⚠️  缓存后台刷新失败，继续使用旧值 {key}: {e}")
+            return False
+        finally:
+            if client is not None:
+                self.redis.delete(lock_key)
+
+    def _cold_load(self, key: str, category: str, name: str, args: tuple) -> Any:
+        """首次加载：同一进程内同一键只加载一次"""
+        with self._lock:
+            lock = self._load_locks.setdefault(key, threading.Lock())
+        with lock:
+            entry = self._read_entry(key)
+            if entry is not None:
+                return entry['data']
+            self.refresh_stats['cold_loads'] += 1
+            data = REFRESH_LOADERS[(category, name)](*args)
+            self._store_entry(key, data)
+            return data
+
+    def _run_loader(self, loader: Callable, args) -> Any:
+        if self._app is not None:
+            with self._app.app_context():
+                return loader(*args)
+        return loader(*args)
+
+    def _read_entry(self, key: str) -> Optional[dict]:
+        try:
+            data = self.redis.get(key)
+            if data:
+                entry = json.loads(data)
+                if isinstance(entry, dict) and 'stored_at' in entry:
+                    return entry
+        except Exception as e:
+            logger.warning(f"⚠️  缓存获取失败 {key}: {e}")
+        return None
+
+    def _store_entry(self, key: str, data: Any):
+        try:
+            self.redis.setex(key, LAST_GOOD_TTL, json.dumps({'stored_at': time.time(), 'data': data}, default=str))
+        except Exception as e:
+            logger.warning(f"⚠️  缓存设置失败 {key}: {e}")
+
+    def _touch(self, member: str):
+        """记录访问时间(跨进程共享)，调度线程只刷新最近被读取的键"""
+        now = time.time()
+        if now - self._touched.get(member, 0) < TOUCH_INTERVAL:
+            return
+        self._touched[member] = now
+        try:
+            self.redis.client.zadd(self.PREFIX + 'refresh:access', {member: now})
+        except Exception as e:
+            logger.debug(f"访问记录写入失败: {e}")
+
+    def _recent_members(self) -> set:
+        cutoff = time.time() - ACCESS_WINDOW
+        access_key = self.PREFIX + 'refresh:access'
+        try:
+            self.redis.client.zremrangebyscore(access_key, 0, cutoff)
+            members = set(self.redis.client.zrangebyscore(access_key, cutoff, '+inf'))
+        except Exception as e:
+            logger.debug(f"访问记录读取失败，使用本进程记录: {e}")
+            members = {member for member, touched in self._touched.items() if touched >= cutoff}
+        self._touched = {member: touched for member, touched in self._touched.items() if touched >= cutoff}
+        return members
+
+    def refresh_due(self) -> int:
+        """刷新最近被访问且即将过期(或已过期)的键，返回刷新数量"""
+        pending, self._pending = self._pending, set()
+        refreshed = 0
+        for member in pending | self._recent_members():
+            try:
+                category, name, *args = json.loads(member)
+            except (TypeError, ValueError):
+                continue
+            if (category, name) not in REFRESH_LOADERS:
+                continue
+            entry = self._read_entry(self._make_key(category, name, *args))
+            ttl = self.TTL_CONFIG.get(category, 300)
+            if entry is not None and time.time() - entry['stored_at'] < ttl * REFRESH_AHEAD:
+                continue
+            refreshed += self.refresh(category, name, *args)
+        return refreshed
+
+    def _refresh_loop(self):
+        while True:
+            self._wakeup.wait(REFRESH_INTERVAL)
+            self._wakeup.clear()
+            try:
+                self.refresh_due()
+            except Exception as e:
+                logger.error(f"❌ 缓存后台刷新异常: {e}")
+
     # =============================================================================
     # 缓存统计
     # =============================================================================
@@ -258,7 +448,9 @@ class CacheService:
             # 统计不同类别的缓存键数量
             stats = {
                 'total_keys': 0,
-                'by_category': {}
+                'by_category': {},
+                'refresh': dict(self.refresh_stats, loaders=len(REFRESH_LOADERS),
+                                running=self._refresher is not None)
             }
 
             # 这里可以扫描Redis键来统计
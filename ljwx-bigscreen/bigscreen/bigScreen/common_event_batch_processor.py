@@ -17,6 +17,7 @@ import logging
 from config import MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DATABASE
 import pymysql
 from .models import db, AlertInfo, AlertRules
+from .stats_counters import queue_counter_rows
 from sqlalchemy import and_
 
 class CommonEventBatchProcessor:
@@ -215,6 +216,7 @@ class CommonEventBatchProcessor:
                 if alerts_to_create:
                     try:
                         db.session.bulk_save_objects(alerts_to_create)
+                        queue_counter_rows(db.session, 'alert', alerts_to_create)  # bulk插入不触发ORM事件
                         db.session.commit()
                         
                         # 更新统计信息
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+原生pymysql连接池
+上传热路径(批处理刷新、用户组织查询、设备批处理、手表日志)共享的有界线程安全连接池，
+出池前按空闲时长ping检查，按存活时长回收，并统计每个池的等待耗时与借出次数
+"""
+
+import time
+import threading
+import logging
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+import pymysql
+from pymysql.constants import SERVER_STATUS
+
+from config import (MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DATABASE, RAW_DB_POOL_CONFIG,
+                    MYSQL_REPLICA_HOST, MYSQL_REPLICA_PORT, MYSQL_REPLICA_USER, MYSQL_REPLICA_PASSWORD)
+
+logger = logging.getLogger(__name__)
+
+class PoolTimeoutError(Exception):
+    """在checkout_timeout内未获取到连接"""
+
+class MySQLConnectionPool:
+    """有界pymysql连接池 - LIFO复用热连接，池满时在超时内等待归还"""
+
+    def __init__(self, name: str, host: str, port: int, user: str, password: str, database: str,
+                 max_size: int = 20, min_idle: int = 2, checkout_timeout: float = 5.0,
+                 ping_interval: int = 30, max_lifetime: int = 3600, charset: str = 'utf8mb4'):
+        self.name = name
+        self.connect_kwargs = {'host': host, 'port': port, 'user': user, 'password': password,
+                               'database': database, 'charset': charset, 'autocommit': False}
+        self.max_size = max(1, max_size)
+        self.min_idle = max(0, min(min_idle, self.max_size))
+        self.checkout_timeout = checkout_timeout
+        self.ping_interval = ping_interval
+        self.max_lifetime = max_lifetime
+
+        self._idle = deque()  # (conn, created_at, last_used)
+        self._created_at: Dict[int, float] = {}
+        self._size = 0  # 已创建且未关闭的连接数(含借出)
+        self._cond = threading.Condition(threading.Lock())
+        self.stats = {
+            'checkouts': 0, 'waits': 0, 'timeouts': 0, 'created': 0, 'closed': 0,
+            'ping_failures': 0, 'recycled': 0, 'connect_errors': 0,
+            'total_wait_ms': 0.0, 'max_wait_ms': 0.0,
+        }
+
+    def _connect(self):
+        conn = pymysql.connect(**self.connect_kwargs)
+        self._created_at[id(conn)] = time.time()
+        self.stats['created'] += 1
+        return conn
+
+    def _close(self, conn):
+        self._created_at.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass  # 连接可能已被服务端断开
+        with self._cond:
+            self._size -= 1
+            self.stats['closed'] += 1
+            self._cond.notify()
+
+    def warm_up(self):
+        """预建min_idle个空闲连接"""
+        for _ in range(self.min_idle):
+            with self._cond:
+                if self._size >= self.max_size or len(self._idle) >= self.min_idle:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception as e:
+                with self._cond:
+                    self._size -= 1
+                    self.stats['connect_errors'] += 1
+                logger.warning(f"⚠️ 连接池[{self.name}]预热失败: {e}")
+                return
+            with self._cond:
+                self._idle.append((conn, time.time()))
+                self._cond.notify()
+
+    def acquire(self):
+        """借出一个可用连接，池满时最多等待checkout_timeout秒"""
+        start = time.monotonic()
+        deadline = start + self.checkout_timeout
+        entry = None
+        waited = False
+        with self._cond:
+            while True:
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats['timeouts'] += 1
+                    raise PoolTimeoutError(f"连接池[{self.name}]获取连接超时({self.checkout_timeout}s)，当前连接数{self._size}")
+                if not waited:
+                    waited = True
+                    self.stats['waits'] += 1
+                self._cond.wait(remaining)
+
+        conn = self._validate(entry) if entry else None
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self.stats['connect_errors'] += 1
+                    self._cond.notify()
+                raise
+
+        wait_ms = (time.monotonic() - start) * 1000
+        with self._cond:
+            self.stats['checkouts'] += 1
+            self.stats['total_wait_ms'] += wait_ms
+            if wait_ms > self.stats['max_wait_ms']:
+                self.stats['max_wait_ms'] = wait_ms
+        return conn
+
+    def _validate(self, entry):
+        """检查空闲连接是否仍可用，不可用则关闭并返回None(保留名额用于新建)"""
+        conn, last_used = entry
+        now = time.time()
+        if now - self._created_at.get(id(conn), now) > self.max_lifetime:
+            self._discard_keep_slot(conn)
+            self.stats['recycled'] += 1
+            return None
+        if now - last_used > self.ping_interval:
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                self.stats['ping_failures'] += 1
+                self._discard_keep_slot(conn)
+                return None
+        return conn
+
+    def _discard_keep_slot(self, conn):
+        """关闭连接但不释放名额，调用方随后会在该名额上新建连接"""
+        self._created_at.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self.stats['closed'] += 1
+
+    def release(self, conn, discard: bool = False):
+        """归还连接；未结束的事务会被回滚，异常连接直接关闭"""
+        if discard or not conn.open:
+            self._close(conn)
+            return
+        if conn.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+            try:
+                conn.rollback()
+            except Exception:
+                self._close(conn)
+                return
+        with self._cond:
+            self._idle.append((conn, time.time()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """with pool.connection() as conn: ... 由调用方自行commit"""
+        conn = self.acquire()
+        discard = False
+        try:
+            yield conn
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            discard = True  # 网络/协议错误，连接状态不可信
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            stats = dict(self.stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+        stats['in_use'] = stats['size'] - stats['idle']
+        stats['max_size'] = self.max_size
+        stats['avg_wait_ms'] = round(stats['total_wait_ms'] / stats['checkouts'], 3) if stats['checkouts'] else 0.0
+        stats['total_wait_ms'] = round(stats['total_wait_ms'], 3)
+        stats['max_wait_ms'] = round(stats['max_wait_ms'], 3)
+        stats['host'] = f"{self.connect_kwargs['host']}:{self.connect_kwargs['port']}"
+        return stats
+
+    def close_all(self):
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, _ in idle:
+            self._close(conn)
+
+# 全局连接池(按进程懒加载)
+_pools: Dict[str, MySQLConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+def get_mysql_pool(readonly: bool = False) -> MySQLConnectionPool:
+    """获取主库连接池；readonly=True且配置了只读副本时返回副本连接池"""
+    name = 'replica' if readonly and MYSQL_REPLICA_HOST else 'primary'
+    pool = _pools.get(name)
+    if pool is not None:
+        return pool
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            if name == 'replica':
+                pool = MySQLConnectionPool(name, MYSQL_REPLICA_HOST, MYSQL_REPLICA_PORT, MYSQL_REPLICA_USER,
+                                           MYSQL_REPLICA_PASSWORD, MYSQL_DATABASE, **RAW_DB_POOL_CONFIG)
+            else:
+                pool = MySQLConnectionPool(name, MYSQL_HOST, MYSQL_PORT, MYSQL_USER,
+                                           MYSQL_PASSWORD, MYSQL_DATABASE, **RAW_DB_POOL_CONFIG)
+            pool.warm_up()
+            _pools[name] = pool
+            logger.info(f"🚀 MySQL连接池[{name}]已创建: {pool.connect_kwargs['host']}:{pool.connect_kwargs['port']}, 最大连接数={pool.max_size}")
+        return pool
+
+@contextmanager
+def get_db_connection(readonly: bool = False):
+    """借用一个池化连接: with get_db_connection() as conn: ..."""
+    with get_mysql_pool(readonly).connection() as conn:
+        yield conn
+
+def get_pool_stats() -> Dict[str, Any]:
+    """所有已创建连接池的统计信息"""
+    return {name: pool.get_stats() for name, pool in list(_pools.items())}
+
+def close_all_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close_all()
+        _pools.clear()
@@ -8,6 +8,11 @@ from typing import List, Dict, Optional, Tuple
 from .redis_helper import RedisHelper
 from .models import db, DeviceInfo, UserInfo, CustomerConfig, UserOrg, OrgInfo, DeviceInfoHistory, Interface
 from .device_batch_processor import get_batch_processor
+from .device_resolver import get_device_resolver
+from .device_presence import get_device_presence
+from .device_history_store import get_device_history_writer, load_device_snapshots, device_history_range, has_activity_since
+from .device_history_analytics import get_device_history_analytics
+from .db_pool import get_db_connection
 import logging
 
 logger = logging.getLogger(__name__)
@@ -832,8 +837,10 @@ def save_device_info(system_software_version, wifi_address, bluetooth_address, i
         d.system_software_version=system_software_version;d.wifi_address=wifi_address;d.bluetooth_address=bluetooth_address;d.ip_address=ip_address;d.network_access_mode=network_access_mode;d.device_name=device_name;d.imei=imei;d.battery_level=battery_level;d.charging_status=charging_status;d.wearable_status=wearable_status;d.status=status;d.update_time=update_time;d.is_deleted=is_deleted;d.voltage=voltage;d.timestamp=timestamp;d.customer_id=customerId;d.org_id=orgId;d.user_id=userId# 字段赋值#
         db.session.add(d);db.session.commit()# 更新或插入DeviceInfo#
         print(f"✅ DeviceInfo表更新成功: {serial_number}")
-        h=DeviceInfoHistory(serial_number=serial_number,system_software_version=system_software_version,ip_address=ip_address,network_access_mode=network_access_mode,battery_level=battery_level,charging_status=charging_status,wearable_status=wearable_status,status=status,update_time=update_time,is_deleted=is_deleted,voltage=voltage,timestamp=timestamp)# 新建历史#
-        db.session.add(h);db.session.commit()# 插入DeviceInfoHistory#
+        h=dict(serial_number=serial_number,system_software_version=system_software_version,ip_address=ip_address,network_access_mode=network_access_mode,battery_level=battery_level,charging_status=charging_status,wearable_status=wearable_status,status=status,update_time=update_time,is_deleted=is_deleted,voltage=voltage,timestamp=timestamp)# 新建历史#
+        with get_db_connection() as conn:# 插入DeviceInfoHistory(整行或差量)#
+            with conn.cursor() as cursor:get_device_history_writer().write(cursor,[h])
+            conn.commit()
         print(f"✅ DeviceInfoHistory表插入成功: {serial_number}")
         device_dict={k:v for k,v in d.to_dict().items() if v is not None}# 过滤None值#
         redis.hset_data(f"device_info:{serial_number}",device_dict)# 写入redis#
@@ -889,54 +896,18 @@ def fetch_device_info(serial_number):
 def fetch_user_info_by_deviceSn(deviceSn):
     """根据设备序列号获取完整的用户信息(customer_id, org_id, user_id)"""
     try:
-        result = (
-            db.session.query(UserInfo, UserOrg, OrgInfo)
-            .select_from(UserInfo)
-            .join(
-                UserOrg,
-                (UserInfo.id == UserOrg.user_id) & (UserOrg.is_deleted.is_(False))
-            )
-            .join(
-                OrgInfo,
-                (UserOrg.org_id == OrgInfo.id) & (OrgInfo.is_deleted.is_(False))
-            )
-            .filter(
-                UserInfo.device_sn == deviceSn,
-                UserInfo.is_deleted.is_(False)
-            )
-            .first()
-        )
-        
-        print("fetch_user_info_by_deviceSn:result:", result)
-
-        if not result:
+        info = get_device_resolver().resolve(deviceSn)
+        if not info or not info.get('org_name'):
             return {
                 'customer_id': '0',
                 'org_id': None,
                 'user_id': None
             }
 
-        user_info, user_org, org_info = result
-        
-        # 获取用户ID和直属组织ID
-        user_id = user_info.id
-        org_id = user_org.org_id
-        
-        # 处理祖先组织获取customer_id
-        customer_id = str(org_info.id)  # 默认使用当前组织ID
-        
-        if org_info.ancestors:
-            # 分割并查找第一个非零值作为customer_id
-            ancestor_ids = org_info.ancestors.split(',')
-            for ancestor_id in ancestor_ids:
-                if ancestor_id and ancestor_id != '0':
-                    customer_id = str(ancestor_id)
-                    break
-        
         return {
-            'customer_id': customer_id,
-            'org_id': org_id,
-            'user_id': user_id
+            'customer_id': str(info['customer_id']),
+            'org_id': info['org_id'],
+            'user_id': info['user_id']
         }
 
     except Exception as e:
@@ -1081,6 +1052,76 @@ def fetch_devices_by_orgIdAndUserId2(orgId, userId):
         }
     }
     return result
+def resolve_org_user_devices(orgId, userId):
+    """按组织(含子组织)或用户解析设备序列号，返回(设备序列号列表, 设备->用户信息映射, 组织ID列表)；管理员用户返回None"""
+    from .admin_helper import is_admin_user, filter_non_admin_users  # 导入admin判断工具
+    
+    device_serial_numbers = []
+    user_device_mapping = {}  # 存储设备号到用户信息的映射
+    org_ids = []  # 初始化org_ids变量，避免未定义错误
+    
+    if userId:
+        # 检查是否为管理员用户
+        if is_admin_user(userId):
+            return None
+        
+        # 🚀 优化：单用户模式 - 直接查询用户表，无需JOIN！
+        user = UserInfo.query.filter_by(
+            id=userId,
+            is_deleted=False
+        ).first()
+        
+        if user and user.device_sn:
+            device_serial_numbers.append(user.device_sn)
+            user_device_mapping[user.device_sn] = {
+                'user_id': user.id,
+                'user_name': user.user_name,
+                # 🎉 直接获取组织信息，无需JOIN！
+                'department_name': user.org_name or '未分配',
+                'org_id': user.org_id
+            }
+            # 为单用户模式设置org_ids
+            if user.org_id:
+                org_ids = [user.org_id]
+            
+    elif orgId:
+        # 🚀 优化：组织模式 - 直接通过org_id查询用户，无需关联表！
+        from .org import get_org_descendants
+        org_ids = get_org_descendants(orgId)  # 获取组织及其子组织ID列表
+        
+        # 🎉 直接查询用户表的org_id字段，消除JOIN操作！
+        users = UserInfo.query.filter(
+            UserInfo.org_id.in_(org_ids),
+            UserInfo.is_deleted.is_(False),
+            UserInfo.device_sn.isnot(None),
+            UserInfo.device_sn != '',
+            UserInfo.device_sn != '-'
+        ).all()
+        
+        # 🎉 构建用户列表，直接使用用户表字段，无需额外查询！
+        user_list = [{
+            'id': user.id,
+            'user_name': user.user_name,
+            'device_sn': user.device_sn,
+            # 🚀 直接访问组织名称，无需JOIN！
+            'department_name': user.org_name or '未分配',
+            'org_id': user.org_id
+        } for user in users]
+        
+        # 过滤掉管理员用户
+        filtered_users = filter_non_admin_users(user_list, 'id')
+        
+        for user in filtered_users:
+            if user['device_sn']:
+                device_serial_numbers.append(user['device_sn'])
+                user_device_mapping[user['device_sn']] = {
+                    'user_id': user['id'],
+                    'user_name': user['user_name'],
+                    'department_name': user['department_name'],
+                    'org_id': user['org_id']
+                }
+    return device_serial_numbers, user_device_mapping, org_ids
+
 def fetch_devices_by_orgIdAndUserId(orgId, userId, customerId=None):
     """🚀 优化后的设备查询 - 直接使用用户表的组织字段，消除JOIN操作"""
     print("fetch_devices_by_orgIdAndUserId:orgId:", orgId)
@@ -1088,72 +1129,10 @@ def fetch_devices_by_orgIdAndUserId(orgId, userId, customerId=None):
     print("fetch_devices_by_orgIdAndUserId:customerId:", customerId)
     
     try:
-        from .admin_helper import is_admin_user, filter_non_admin_users  # 导入admin判断工具
-        
-        device_serial_numbers = []
-        user_device_mapping = {}  # 存储设备号到用户信息的映射
-        org_ids = []  # 初始化org_ids变量，避免未定义错误
-        
-        if userId:
-            # 检查是否为管理员用户
-            if is_admin_user(userId):
-                return {'devices': [], 'statistics': {}}
-            
-            # 🚀 优化：单用户模式 - 直接查询用户表，无需JOIN！
-            user = UserInfo.query.filter_by(
-                id=userId,
-                is_deleted=False
-            ).first()
-            
-            if user and user.device_sn:
-                device_serial_numbers.append(user.device_sn)
-                user_device_mapping[user.device_sn] = {
-                    'user_id': user.id,
-                    'user_name': user.user_name,
-                    # 🎉 直接获取组织信息，无需JOIN！
-                    'department_name': user.org_name or '未分配',
-                    'org_id': user.org_id
-                }
-                # 为单用户模式设置org_ids
-                if user.org_id:
-                    org_ids = [user.org_id]
-                
-        elif orgId:
-            # 🚀 优化：组织模式 - 直接通过org_id查询用户，无需关联表！
-            from .org import get_org_descendants
-            org_ids = get_org_descendants(orgId)  # 获取组织及其子组织ID列表
-            
-            # 🎉 直接查询用户表的org_id字段，消除JOIN操作！
-            users = UserInfo.query.filter(
-                UserInfo.org_id.in_(org_ids),
-                UserInfo.is_deleted.is_(False),
-                UserInfo.device_sn.isnot(None),
-                UserInfo.device_sn != '',
-                UserInfo.device_sn != '-'
-            ).all()
-            
-            # 🎉 构建用户列表，直接使用用户表字段，无需额外查询！
-            user_list = [{
-                'id': user.id,
-                'user_name': user.user_name,
-                'device_sn': user.device_sn,
-                # 🚀 直接访问组织名称，无需JOIN！
-                'department_name': user.org_name or '未分配',
-                'org_id': user.org_id
-            } for user in users]
-            
-            # 过滤掉管理员用户
-            filtered_users = filter_non_admin_users(user_list, 'id')
-            
-            for user in filtered_users:
-                if user['device_sn']:
-                    device_serial_numbers.append(user['device_sn'])
-                    user_device_mapping[user['device_sn']] = {
-                        'user_id': user['id'],
-                        'user_name': user['user_name'],
-                        'department_name': user['department_name'],
-                        'org_id': user['org_id']
-                    }
+        resolved = resolve_org_user_devices(orgId, userId)
+        if resolved is None:  # 管理员用户不返回设备
+            return {'devices': [], 'statistics': {}}
+        device_serial_numbers, user_device_mapping, org_ids = resolved
         
         # 如果没有找到任何设备序列号，返回空结果
         if not device_serial_numbers:
@@ -1192,7 +1171,8 @@ def fetch_devices_by_orgIdAndUserId(orgId, userId, customerId=None):
         else:
             customer_id=fetch_customer_id_by_deviceSn(device_serial_numbers[0]) if device_serial_numbers else '0' #获取customer_id#
         
-        # 转换为字典格式，关联用户信息，动态判断状态
+        # 转换为字典格式，关联用户信息，动态判断状态(在线索引一次批量判断，索引中缺失的设备回退历史表)
+        presence_status=get_device_presence().statuses(customer_id,[d.serial_number for d in devices]) or {} #批量在线状态#
         devices_data = []
         for device in devices:
             user_info = user_device_mapping.get(device.serial_number, {
@@ -1203,7 +1183,7 @@ def fetch_devices_by_orgIdAndUserId(orgId, userId, customerId=None):
             })
             
             # 动态判断设备真实状态
-            real_status=check_device_real_status(device.serial_number,customer_id) #检查真实状态#
+            online=presence_status.get(device.serial_number);real_status=('ACTIVE' if online else 'INACTIVE') if online is not None else check_device_real_status(device.serial_number,customer_id) #检查真实状态#
             
             device_data = {
                 'id': device.id,
@@ -1234,7 +1214,7 @@ def fetch_devices_by_orgIdAndUserId(orgId, userId, customerId=None):
         statistics = generate_device_statistics_simple(devices_data)
         
         # 获取历史数据分析
-        history_analysis = get_device_history_analysis([d['serial_number'] for d in devices_data])
+        history_analysis = get_device_history_analysis([d['serial_number'] for d in devices_data], customer_id=customer_id)
         
         result = {
             'success': True,
@@ -1497,95 +1477,64 @@ def generate_device_statistics(devices):
     
     return statistics
 
-def get_device_history_analysis(serial_numbers, days=7):
-    """获取设备历史数据分析"""
+def get_device_history_analysis(serial_numbers, days=7, customer_id=None):
+    """获取设备历史数据分析(流式累加，按(租户, 日)缓存，最近days个整天 + 今天)"""
     if not serial_numbers:
         return {'battery_analysis': {}, 'trend_analysis': {}, 'alerts': []}
     
     try:
-        from datetime import timedelta
-        end_time = datetime.now()
-        start_time = end_time - timedelta(days=days)
-        
-        # 查询历史数据
-        history_data = db.session.query(DeviceInfoHistory).filter(
-            DeviceInfoHistory.serial_number.in_(serial_numbers),
-            DeviceInfoHistory.timestamp >= start_time,
-            DeviceInfoHistory.timestamp <= end_time
-        ).order_by(DeviceInfoHistory.timestamp.desc()).all()
+        accumulators = get_device_history_analytics().summarize(serial_numbers, days, customer_id=customer_id)
+        data_points = sum(acc.samples for acc in accumulators.values())
         
         # 电池分析
-        battery_analysis = analyze_battery_trends(history_data)
+        battery_analysis = analyze_battery_trends(accumulators)
         
         # 趋势分析
-        trend_analysis = analyze_device_trends(history_data)
+        trend_analysis = analyze_device_trends(accumulators)
         
         # 生成告警
-        alerts = generate_device_alerts(history_data, battery_analysis)
+        alerts = generate_device_alerts(data_points, battery_analysis)
         
         return {
             'battery_analysis': battery_analysis,
             'trend_analysis': trend_analysis,
             'alerts': alerts,
-            'data_points': len(history_data)
+            'data_points': data_points
         }
         
     except Exception as e:
         print(f"Error in get_device_history_analysis: {e}")
         return {'battery_analysis': {}, 'trend_analysis': {}, 'alerts': []}
 
-def analyze_battery_trends(history_data):
-    """分析电池趋势"""
+def analyze_battery_trends(accumulators):
+    """分析电池趋势(accumulators: {设备: DeviceAccumulator})"""
     battery_trends = {}
-    device_battery_data = {}
     
-    for record in history_data:
-        sn = record.serial_number
-        if sn not in device_battery_data:
-            device_battery_data[sn] = []
+    for sn, acc in accumulators.items():
+        if acc.battery_samples < 2 or acc.first_time is None: continue
         
-        try:
-            battery = int(record.battery_level) if record.battery_level and str(record.battery_level).isdigit() else None
-            if battery is not None:
-                device_battery_data[sn].append({
-                    'timestamp': record.timestamp,
-                    'battery': battery,
-                    'charging': record.charging_status == 'CHARGING'
-                })
-        except: pass
-    
-    # 计算每个设备的电池趋势
-    for sn, data in device_battery_data.items():
-        if len(data) < 2: continue
+        # 计算电池消耗率
+        time_diff = (acc.last_time - acc.first_time).total_seconds() / 3600  # 小时
+        battery_diff = acc.last_battery - acc.first_battery
         
-        # 排序数据
-        data.sort(key=lambda x: x['timestamp'])
+        consumption_rate = abs(battery_diff / time_diff) if time_diff > 0 else 0
         
-        # 计算趋势
-        batteries = [d['battery'] for d in data]
-        if len(batteries) >= 2:
-            # 计算电池消耗率
-            time_diff = (data[-1]['timestamp'] - data[0]['timestamp']).total_seconds() / 3600  # 小时
-            battery_diff = data[-1]['battery'] - data[0]['battery']
-            
-            consumption_rate = abs(battery_diff / time_diff) if time_diff > 0 else 0
-            
-            # 预测电池耗尽时间
-            current_battery = data[-1]['battery']
-            hours_remaining = current_battery / consumption_rate if consumption_rate > 0 else 0
-            
-            battery_trends[sn] = {
-                'consumption_rate': round(consumption_rate, 2),
-                'hours_remaining': round(hours_remaining, 1),
-                'current_battery': current_battery,
-                'trend': 'declining' if battery_diff < -10 else 'stable' if abs(battery_diff) <= 10 else 'increasing',
-                'data_points': len(data)
-            }
+        # 预测电池耗尽时间
+        current_battery = acc.last_battery
+        hours_remaining = current_battery / consumption_rate if consumption_rate > 0 else 0
+        
+        battery_trends[sn] = {
+            'consumption_rate': round(consumption_rate, 2),
+            'hours_remaining': round(hours_remaining, 1),
+            'current_battery': current_battery,
+            'trend': 'declining' if battery_diff < -10 else 'stable' if abs(battery_diff) <= 10 else 'increasing',
+            'data_points': acc.battery_samples
+        }
     
     return battery_trends
 
-def analyze_device_trends(history_data):
-    """分析设备使用趋势"""
+def analyze_device_trends(accumulators):
+    """分析设备使用趋势(佩戴/充电高峰小时按上报次数计)"""
     trends = {
         'wear_pattern': {},
         'charging_pattern': {},
@@ -1593,65 +1542,25 @@ def analyze_device_trends(history_data):
         'daily_summary': {}
     }
     
-    # 按设备分组
-    device_data = {}
-    for record in history_data:
-        sn = record.serial_number
-        if sn not in device_data:
-            device_data[sn] = []
-        device_data[sn].append(record)
-    
-    # 分析每个设备的趋势
-    for sn, data in device_data.items():
-        data.sort(key=lambda x: x.timestamp)
-        
-        # 佩戴模式分析
-        wear_times = []
-        charging_times = []
-        
-        for i, record in enumerate(data):
-            hour = record.timestamp.hour
-            
-            if record.wearable_status == 'WORN':
-                wear_times.append(hour)
-            
-            if record.charging_status == 'CHARGING':
-                charging_times.append(hour)
-        
-        # 计算佩戴高峰时间
-        if wear_times:
-            from collections import Counter
-            wear_counter = Counter(wear_times)
-            peak_wear_hour = wear_counter.most_common(1)[0][0]
-        else:
-            peak_wear_hour = None
-        
-        # 计算充电高峰时间
-        if charging_times:
-            from collections import Counter
-            charging_counter = Counter(charging_times)
-            peak_charging_hour = charging_counter.most_common(1)[0][0]
-        else:
-            peak_charging_hour = None
-        
+    for sn, acc in accumulators.items():
         trends['wear_pattern'][sn] = {
-            'peak_hour': peak_wear_hour,
-            'total_wear_records': len(wear_times)
+            'peak_hour': acc.peak_hour(acc.wear_hours),
+            'total_wear_records': acc.worn
         }
         
         trends['charging_pattern'][sn] = {
-            'peak_hour': peak_charging_hour,
-            'total_charging_records': len(charging_times)
+            'peak_hour': acc.peak_hour(acc.charge_hours),
+            'total_charging_records': acc.charging
         }
     
     return trends
 
-def generate_device_alerts(history_data, battery_analysis):
-    """生成设备告警 - 优化版，减少无效告警"""
+def generate_device_alerts(data_points, battery_analysis):
+    """生成设备告警 - 优化版，减少无效告警(data_points为窗口内上报总数)"""
     alerts = []
     
     # 只有当有足够历史数据时才生成告警
-    if not history_data or len(history_data) < 5:
+    if data_points < 5:
         return alerts
     
     for sn, battery_info in battery_analysis.items():
@@ -1782,72 +1691,33 @@ def get_interface_call_interval(customer_id): # 获取接口调用间隔配置#
 def check_device_real_status(device_sn,customer_id): # 检查设备真实在线状态#
     try:
         from datetime import datetime,timedelta
-        i=get_interface_call_interval(customer_id);t=datetime.now()-timedelta(seconds=i);h=db.session.query(DeviceInfoHistory).filter(DeviceInfoHistory.serial_number==device_sn,DeviceInfoHistory.timestamp>=t,DeviceInfoHistory.is_deleted.is_(False)).first();status='ACTIVE' if h else 'INACTIVE';print(f"设备{device_sn}状态检查:customer_id={customer_id},interval={i}s,cutoff_time={t},history_found={bool(h)},status={status}");return status # 有历史记录为在线，否则离线#
+        online=get_device_presence().is_online(customer_id,device_sn) # 优先读取心跳在线索引#
+        if online is not None:return 'ACTIVE' if online else 'INACTIVE'
+        i=get_interface_call_interval(customer_id);t=datetime.now()-timedelta(seconds=i);h=has_activity_since(device_sn,t);status='ACTIVE' if h else 'INACTIVE';print(f"设备{device_sn}状态检查:customer_id={customer_id},interval={i}s,cutoff_time={t},history_found={bool(h)},status={status}");return status # 有历史记录为在线，否则离线#
     except Exception as e:print(f"检查设备状态失败:{e}");return 'INACTIVE' # 异常时返回离线#
 
 def get_device_user_org_info(device_sn):
-    """根据device_sn获取绑定用户的user_id和org_id(缓存10分钟)"""
+    """根据device_sn获取绑定用户的user_id和org_id(经设备归属解析器两级缓存)"""
     try:
-        # Redis缓存key，10分钟有效期
-        cache_key = f"device_user_org:{device_sn}"
-        
-        # 尝试从Redis获取缓存数据
-        try:
-            cached_data = redis.get(cache_key)
-            if cached_data:
-                import json
-                user_org_info = json.loads(cached_data)
-                print(f"从缓存获取设备用户组织信息，device_sn:{device_sn}")
-                return user_org_info
-        except Exception as e:
-            print(f"设备用户组织信息缓存读取失败: {str(e)}")
-        
-        # 查询设备绑定的用户信息
-        user_info = db.session.query(
-            UserInfo.id.label('user_id'),
-            UserInfo.user_name,
-            UserOrg.org_id,
-            OrgInfo.name.label('org_name')
-        ).join(
-            UserOrg, UserInfo.id == UserOrg.user_id
-        ).join(
-            OrgInfo, UserOrg.org_id == OrgInfo.id
-        ).filter(
-            UserInfo.device_sn == device_sn,
-            UserInfo.is_deleted.is_(False),
-            OrgInfo.is_deleted.is_(False)
-        ).first()
-        
-        if user_info:
-            result = {
+        info = get_device_resolver().resolve(device_sn)
+        if info and info.get('org_name'):
+            return {
                 'success': True,
-                'user_id': user_info.user_id,
-                'user_name': user_info.user_name,
-                'org_id': user_info.org_id,
-                'org_name': user_info.org_name,
+                'user_id': info['user_id'],
+                'user_name': info['user_name'],
+                'org_id': info['org_id'],
+                'org_name': info['org_name'],
                 'device_sn': device_sn
             }
-        else:
-            result = {
-                'success': False,
-                'user_id': None,
-                'user_name': None,
-                'org_id': None,
-                'org_name': None,
-                'device_sn': device_sn,
-                'message': f'设备{device_sn}未绑定用户或用户信息不完整'
-            }
-        
-        # 缓存结果到Redis(10分钟)
-        try:
-            import json
-            cache_data = json.dumps(result, ensure_ascii=False)
-            redis.setex(cache_key, 600, cache_data)  # 10分钟缓存
-            print(f"设备用户组织信息已缓存到Redis，device_sn:{device_sn}")
-        except Exception as e:
-            print(f"设备用户组织信息缓存写入失败: {str(e)}")
-        
-        return result
+        return {
+            'success': False,
+            'user_id': None,
+            'user_name': None,
+            'org_id': None,
+            'org_name': None,
+            'device_sn': device_sn,
+            'message': f'设备{device_sn}未绑定用户或用户信息不完整'
+        }
         
     except Exception as e:
         print(f"获取设备用户组织信息失败: {str(e)}")
@@ -2059,18 +1929,15 @@ def configure_batch_processor(batch_size=None, max_wait_time=None, max_workers=N
 def get_device_history_timeline(serial_number, limit=60): #获取设备历史时序数据
     """获取设备历史记录的时序数据，用于图表展示"""
     try:
-        # 查询最近的历史记录，按时间倒序
-        history_records = DeviceInfoHistory.query.filter_by(
-            serial_number=serial_number,
-            is_deleted=0
-        ).order_by(DeviceInfoHistory.timestamp.desc()).limit(limit).all()
+        # 查询最近的历史快照，按时间正序
+        history_records = load_device_snapshots([serial_number], limit=limit)
         
         if not history_records:
             return jsonify({"status": "success", "data": {"timeline": [], "message": "暂无历史数据"}})
         
         # 构建时序数据
         timeline_data = []
-        for record in reversed(history_records):  # 反转以获得时间正序
+        for record in history_records:
             timeline_data.append({
                 "timestamp": record.timestamp.strftime("%Y-%m-%d %H:%M:%S") if record.timestamp else "",
                 "battery_level": record.battery_level or 0,
@@ -2120,18 +1987,12 @@ def get_device_history_trends(org_id, user_id=None, days=7, metrics=['battery_le
         
         device_sns = [device['serial_number'] for device in devices]
         
-        # 智能时间范围计算 - 先找到数据的实际时间范围
-        latest_data_sql = text("""
-            SELECT MAX(timestamp) as latest_time, MIN(timestamp) as earliest_time 
-            FROM t_device_info_history 
-            WHERE serial_number IN :device_sns AND is_deleted = 0
-        """)
-        
-        time_result = db.session.execute(latest_data_sql, {'device_sns': tuple(device_sns)}).first()
+        # 智能时间范围计算 - 先找到数据的实际时间范围(游程表与历史表合并)
+        _, latest_time = device_history_range(device_sns)
         
-        if time_result and time_result.latest_time:
+        if latest_time:
             # 使用数据的最新时间作为结束时间，往前推指定天数
-            end_time = time_result.latest_time
+            end_time = latest_time
             start_time = end_time - timedelta(days=days)
             print(f"📅 使用数据驱动时间范围: {start_time} ~ {end_time}")
         else:
@@ -2140,31 +2001,8 @@ def get_device_history_trends(org_id, user_id=None, days=7, metrics=['battery_le
             start_time = end_time - timedelta(days=days)
             print(f"📅 使用默认时间范围: {start_time} ~ {end_time}")
         
-        # 构建查询SQL
-        sql = text("""
-            SELECT 
-                serial_number,
-                timestamp,
-                battery_level,
-                wearable_status,
-                charging_status,
-                system_software_version,
-                voltage,
-                status
-            FROM t_device_info_history 
-            WHERE serial_number IN :device_sns 
-                AND timestamp >= :start_time 
-                AND timestamp <= :end_time
-                AND is_deleted = 0
-            ORDER BY serial_number, timestamp ASC
-        """)
-        
-        # 执行查询
-        result = db.session.execute(sql, {
-            'device_sns': tuple(device_sns),
-            'start_time': start_time,
-            'end_time': end_time
-        })
+        # 按需重建快照(兼容整行与差量存储)
+        result = load_device_snapshots(device_sns, start_time, end_time)
         
         # 处理查询结果
         history_data = {}
@@ -2194,14 +2032,10 @@ def get_device_history_trends(org_id, user_id=None, days=7, metrics=['battery_le
         print(f"📊 查询到 {row_count} 条历史记录，涉及 {len(history_data)} 个设备")
         
         # 如果没有数据，尝试扩大查询范围
-        if not history_data and time_result and time_result.latest_time:
+        if not history_data and latest_time:
             print("⚠️ 指定时间范围无数据，尝试查询最近30天数据...")
-            fallback_start = time_result.latest_time - timedelta(days=30)
-            fallback_result = db.session.execute(sql, {
-                'device_sns': tuple(device_sns),
-                'start_time': fallback_start,
-                'end_time': time_result.latest_time
-            })
+            fallback_start = latest_time - timedelta(days=30)
+            fallback_result = load_device_snapshots(device_sns, fallback_start, latest_time)
             
             for row in fallback_result:
                 sn = row.serial_number
@@ -2912,29 +2746,473 @@ def generate_trends_chart_data(history_data, trends_analysis):
     return chart_data
 
 def get_device_battery_prediction(org_id, user_id=None, days=30):
-    """获取设备电池使用预测"""
+    """获取设备电池使用预测(按设备流式累加回归量，不物化历史序列)"""
     try:
-        # 获取历史趋势数据
-        trends_data = get_device_history_trends(org_id, user_id, days)
-        if not trends_data.get('success'):
-            return trends_data
+        summary = summarize_org_device_history(org_id, user_id, days)
+        if summary is None:
+            return {"success": False, "message": "无设备数据"}
         
-        history_data = trends_data['data']['history_data']
+        return {"success": True, "data": battery_predictions_from_accumulators(summary[0])}
+        
+    except Exception as e:
+        print(f"电池预测分析失败: {e}")
+        return {"success": False, "message": f"预测分析失败: {str(e)}"}
+
+def get_device_comprehensive_analysis(org_id, user_id=None, days=7):
+    """设备综合分析(趋势+电池预测)：一次按日缓存的流式累加同时得到两部分结果，不加载原始快照"""
+    try:
+        summary = summarize_org_device_history(org_id, user_id, days)
+        if summary is None:
+            return {"success": False, "message": "无设备数据"}
+        
+        accumulators, device_sns, start_time, end_time = summary
+        trends_analysis = analyze_device_trends_from_accumulators(accumulators, days)
+        return {
+            "success": True,
+            "data": {
+                "trends": {
+                    "time_range": {
+                        "start": start_time.strftime('%Y-%m-%d %H:%M:%S'),
+                        "end": end_time.strftime('%Y-%m-%d %H:%M:%S'),
+                        "days": days
+                    },
+                    "devices_count": len(device_sns),
+                    "data_points": sum(acc.samples for acc in accumulators.values()),
+                    "trends_analysis": trends_analysis,
+                    "chart_data": {'device_health_radar': device_health_radar(trends_analysis),
+                                   'prediction_forecast': trends_analysis['predictions']}
+                },
+                "predictions": battery_predictions_from_accumulators(accumulators)
+            }
+        }
+        
+    except Exception as e:
+        print(f"设备综合分析失败: {e}")
+        return {"success": False, "message": f"综合分析失败: {str(e)}"}
+
+def summarize_org_device_history(org_id, user_id, days):
+    """组织/用户设备在数据驱动时间范围(以数据最新时间为截止)内的每设备累加器，无设备时返回None"""
+    resolved = resolve_org_user_devices(org_id, user_id)
+    device_sns = resolved[0] if resolved else []
+    if not device_sns:
+        return None
+    
+    _, latest_time = device_history_range(device_sns)
+    end_time = latest_time or datetime.now()
+    customer_id = fetch_customer_id_by_deviceSn(device_sns[0])
+    accumulators = get_device_history_analytics().summarize(device_sns, days, until=end_time,
+                                                            customer_id=customer_id)
+    start_time = end_time.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days)
+    return accumulators, device_sns, start_time, end_time
+
+def battery_predictions_from_accumulators(accumulators):
+    """按设备加权最小二乘斜率预测电池趋势"""
+    predictions = {}
+    
+    for sn, acc in accumulators.items():
+        if acc.battery_samples < 10:
+            continue
+        
+        battery_prediction = battery_life_from_slope(acc.slope_per_hour() / 3600, acc.last_battery)
+        
+        predictions[sn] = {
+            'current_battery': acc.last_battery,
+            'predicted_depletion_time': battery_prediction.get('depletion_hours', 0),
+            'recommended_charge_time': battery_prediction.get('charge_recommendation', ''),
+            'battery_health_score': battery_prediction.get('health_score', 0),
+            'usage_forecast': usage_forecast_from_rate(acc.worn / acc.samples if acc.samples else 0)  # 7天预测
+        }
+    
+    return {
+        "predictions": predictions,
+        "summary": generate_prediction_summary(predictions),
+        "recommendations": generate_fleet_recommendations(predictions)
+    }
+
+def analyze_device_trends_from_accumulators(accumulators, days):
+    """由每设备累加器生成趋势分析(字段与analyze_device_trends_advanced一致，按上报次数加权)"""
+    analysis = {
+        'battery_trends': {},
+        'usage_patterns': {},
+        'charging_patterns': {},
+        'predictions': {}
+    }
+    
+    for sn, acc in accumulators.items():
+        if not acc.samples:
+            continue
+        
+        if acc.battery_samples:
+            analysis['battery_trends'][sn] = {
+                'avg_battery': acc.mean_battery(),
+                'min_battery': acc.min_battery,
+                'max_battery': acc.max_battery,
+                'battery_variance': acc.battery_variance(),
+                'consumption_rate': -acc.slope_per_hour(),
+                'low_battery_events': acc.low_battery,
+                'critical_battery_events': acc.critical_battery
+            }
+        
+        # 假设每次上报代表5分钟的采样间隔
+        analysis['usage_patterns'][sn] = {
+            'wear_rate': acc.worn / acc.samples * 100,
+            'peak_hour': acc.peak_hour(acc.wear_hours),
+            'daily_wear_hours': min(24, acc.worn * 5 / 60 / max(1, days))
+        }
+        
+        analysis['charging_patterns'][sn] = {
+            'charging_frequency': acc.charging,
+            'charging_rate': acc.charging / acc.samples * 100,
+            'peak_hour': acc.peak_hour(acc.charge_hours)
+        }
+    
+    analysis['predictions'] = generate_device_predictions(analysis)
+    
+    return analysis
+
+def device_health_radar(trends_analysis):
+    """设备健康雷达图数据"""
+    radar = {}
+    for sn, usage_pattern in trends_analysis['usage_patterns'].items():
+        battery_trend = trends_analysis['battery_trends'].get(sn, {})
+        charging_pattern = trends_analysis['charging_patterns'].get(sn, {})
+        radar[sn] = {
+            'battery_health': min(100, max(0, 100 - battery_trend.get('consumption_rate', 0) * 10)),
+            'usage_efficiency': usage_pattern.get('wear_rate', 0),
+            'charging_health': min(100, max(0, 100 - charging_pattern.get('charging_frequency', 0) * 5)),
+            'overall_score': 0  # 将在前端计算
+        }
+    return radar
+
+def predict_battery_life(battery_levels, timestamps):
+    """预测电池寿命"""
+    try:
+        from datetime import datetime
+        import numpy as np
+        
+        if len(battery_levels) < 5:
+            return None
+        
+        # 转换时间戳为数值
+        time_values = []
+        for ts in timestamps:
+            try:
+                dt = datetime.strptime(ts, '%Y-%m-%d %H:%M:%S')
+                time_values.append(dt.timestamp())
+            except:
+                continue
+        
+        if len(time_values) != len(battery_levels):
+            return None
+        
+        # 使用简单线性回归预测
+        X = np.array(time_values).reshape(-1, 1)
+        y = np.array(battery_levels)
+        
+        # 计算趋势
+        if len(X) >= 2:
+            slope = (y[-1] - y[0]) / (X[-1][0] - X[0][0]) * 3600  # 每小时变化率
+            
+            current_battery = battery_levels[-1]
+            current_time = time_values[-1]
+            
+            # 预测未来7天的电池电量
+            future_predictions = []
+            future_dates = []
+            
+            for i in range(1, 8):  # 未来7天
+                future_time = current_time + (i * 24 * 3600)  # 每天
+                predicted_battery = max(0, current_battery + (slope * 24 * i))
+                
+                future_dt = datetime.fromtimestamp(future_time)
+                future_dates.append(future_dt.strftime('%m-%d'))
+                future_predictions.append(round(predicted_battery, 1))
+            
+            return {
+                'current_battery': current_battery,
+                'consumption_rate': abs(slope),
+                'predicted_levels': future_predictions,
+                'predicted_dates': future_dates,
+                'days_until_empty': max(1, int(current_battery / abs(slope) / 24)) if slope < 0 else 999,
+                'health_status': 'good' if abs(slope) < 2 else 'warning' if abs(slope) < 5 else 'critical'
+            }
+    
+    except Exception as e:
+        print(f"电池预测计算失败: {e}")
+        return None
+
+def generate_battery_prediction_chart_data(predictions):
+    """生成电池预测图表数据"""
+    if not predictions:
+        return {
+            'dates': [],
+            'historical': [],
+            'predicted': []
+        }
+    
+    # 使用第一个设备的预测数据作为示例
+    first_device = next(iter(predictions.values()))
+    
+    return {
+        'dates': first_device.get('predicted_dates', []),
+        'historical': [first_device.get('current_battery', 0)] * len(first_device.get('predicted_dates', [])),
+        'predicted': first_device.get('predicted_levels', [])
+    }
+
+def generate_usage_forecast(device_data, forecast_days):
+    """生成使用预测"""
+    return {
+        'forecast_days': forecast_days,
+        'predicted_usage': [],
+        'confidence_level': 0.8
+    }
+
+def generate_prediction_summary(predictions):
+    """生成预测摘要"""
+    if not predictions:
+        return {
+            'total_devices': 0,
+            'healthy_devices': 0,
+            'warning_devices': 0,
+            'critical_devices': 0
+        }
+    
+    total = len(predictions)
+    healthy = sum(1 for p in predictions.values() if p.get('health_status') == 'good')
+    warning = sum(1 for p in predictions.values() if p.get('health_status') == 'warning')
+    critical = sum(1 for p in predictions.values() if p.get('health_status') == 'critical')
+    
+    return {
+        'total_devices': total,
+        'healthy_devices': healthy,
+        'warning_devices': warning,
+        'critical_devices': critical,
+        'avg_days_until_empty': sum(p.get('days_until_empty', 0) for p in predictions.values()) / total if total > 0 else 0
+    }
+
+def generate_fleet_recommendations(predictions):
+    """生成车队建议"""
+    recommendations = []
+    
+    for sn, pred in predictions.items():
+        if pred.get('health_status') == 'critical':
+            recommendations.append({
+                'device_sn': sn,
+                'priority': 'high',
+                'action': '立即更换电池',
+                'reason': f'电池消耗率过高({pred.get("consumption_rate", 0):.2f}%/h)'
+            })
+        elif pred.get('days_until_empty', 999) < 3:
+            recommendations.append({
+                'device_sn': sn,
+                'priority': 'medium',
+                'action': '安排充电',
+                'reason': f'预计{pred.get("days_until_empty")}天后电量耗尽'
+            })
+    
+    return recommendations
+
+def calculate_avg_session_duration(statuses, timestamps, target_status):
+    """计算平均会话持续时间（分钟）"""
+    if len(statuses) != len(timestamps):
+        return 0
+    
+    from datetime import datetime
+    sessions = []
+    session_start = None
+    
+    for i, status in enumerate(statuses):
+        try:
+            current_time = datetime.strptime(timestamps[i], '%Y-%m-%d %H:%M:%S')
+            
+            if status == target_status and session_start is None:
+                session_start = current_time
+            elif status != target_status and session_start is not None:
+                duration = (current_time - session_start).total_seconds() / 60
+                sessions.append(duration)
+                session_start = None
+        except:
+            continue
+    
+    return sum(sessions) / len(sessions) if sessions else 0
+
+def estimate_daily_wear_hours(wear_statuses, timestamps):
+    """估算日均佩戴小时数"""
+    if not wear_statuses or not timestamps:
+        return 0
+    
+    from datetime import datetime
+    try:
+        start_time = datetime.strptime(timestamps[0], '%Y-%m-%d %H:%M:%S')
+        end_time = datetime.strptime(timestamps[-1], '%Y-%m-%d %H:%M:%S')
+        total_days = (end_time - start_time).days + 1
+        
+        worn_count = wear_statuses.count('WORN')
+        total_records = len(wear_statuses)
+        
+        # 假设每条记录代表5分钟的采样间隔
+        wear_minutes = (worn_count / total_records) * (len(timestamps) * 5)
+        daily_wear_hours = (wear_minutes / 60) / total_days
+        
+        return round(daily_wear_hours, 2)
+    except:
+        return 0
+
+def count_status_changes(statuses, from_status, to_status):
+    """计算状态变化次数"""
+    changes = 0
+    for i in range(1, len(statuses)):
+        if statuses[i-1] == from_status and statuses[i] == to_status:
+            changes += 1
+    return changes
+
+def generate_device_predictions(analysis):
+    """生成设备预测数据"""
+    predictions = {
+        'battery_health_forecast': {},
+        'maintenance_recommendations': {},
+        'usage_optimization': {}
+    }
+    
+    for sn in analysis['battery_trends'].keys():
+        battery_trend = analysis['battery_trends'].get(sn, {})
+        usage_pattern = analysis['usage_patterns'].get(sn, {})
+        charging_pattern = analysis['charging_patterns'].get(sn, {})
+        
+        # 电池健康预测
+        consumption_rate = battery_trend.get('consumption_rate', 0)
+        avg_battery = battery_trend.get('avg_battery', 0)
+        
+        if consumption_rate > 0:
+            estimated_life_hours = avg_battery / consumption_rate
+            predictions['battery_health_forecast'][sn] = {
+                'estimated_remaining_hours': round(estimated_life_hours, 1),
+                'health_status': 'good' if consumption_rate < 5 else 'warning' if consumption_rate < 10 else 'critical',
+                'replacement_needed_in_days': round(estimated_life_hours / 24, 1) if estimated_life_hours < 168 else None
+            }
+        
+        # 维护建议
+        recommendations = []
+        if battery_trend.get('low_battery_events', 0) > 5:
+            recommendations.append('频繁低电量，建议优化充电策略')
+        if usage_pattern.get('wear_rate', 0) < 50:
+            recommendations.append('佩戴率偏低，建议提醒用户佩戴')
+        if charging_pattern.get('charging_frequency', 0) > 10:
+            recommendations.append('充电频率过高，检查电池健康')
+        
+        predictions['maintenance_recommendations'][sn] = recommendations
+        
+        # 使用优化建议
+        optimizations = []
+        daily_wear = usage_pattern.get('daily_wear_hours', 0)
+        if daily_wear < 8:
+            optimizations.append(f'建议增加佩戴时间至8小时/天（当前{daily_wear}小时）')
+        if charging_pattern.get('avg_charging_duration', 0) > 120:
+            optimizations.append('充电时间过长，建议检查充电器')
+        
+        predictions['usage_optimization'][sn] = optimizations
+    
+    return predictions
+
+def generate_trends_chart_data(history_data, trends_analysis):
+    """生成图表数据"""
+    chart_data = {
+        'battery_trend_line': {},
+        'wear_status_timeline': {},
+        'charging_pattern_chart': {},
+        'status_uptime_chart': {},
+        'device_health_radar': {},
+        'prediction_forecast': {}
+    }
+    
+    # 电池趋势线图数据
+    for sn, data in history_data.items():
+        if data['battery_level']:
+            chart_data['battery_trend_line'][sn] = {
+                'timestamps': data['timestamps'],
+                'values': data['battery_level'],
+                'trend': trends_analysis['battery_trends'].get(sn, {})
+            }
+    
+    # 佩戴状态时间线
+    for sn, data in history_data.items():
+        if data['wearable_status']:
+            # 转换状态为数值：WORN=1, NOT_WORN=0
+            status_values = [1 if status == 'WORN' else 0 for status in data['wearable_status']]
+            chart_data['wear_status_timeline'][sn] = {
+                'timestamps': data['timestamps'],
+                'values': status_values,
+                'pattern': trends_analysis['usage_patterns'].get(sn, {})
+            }
+    
+    # 充电模式图表
+    for sn, data in history_data.items():
+        if data['charging_status']:
+            charging_values = [1 if status == 'CHARGING' else 0 for status in data['charging_status']]
+            chart_data['charging_pattern_chart'][sn] = {
+                'timestamps': data['timestamps'],
+                'values': charging_values,
+                'pattern': trends_analysis['charging_patterns'].get(sn, {})
+            }
+    
+    # 设备在线率图表
+    for sn, data in history_data.items():
+        if data['status']:
+            online_values = [1 if status == 'ACTIVE' else 0 for status in data['status']]
+            chart_data['status_uptime_chart'][sn] = {
+                'timestamps': data['timestamps'],
+                'values': online_values,
+                'stability': trends_analysis['status_stability'].get(sn, {})
+            }
+    
+    # 设备健康雷达图
+    for sn in history_data.keys():
+        battery_trend = trends_analysis['battery_trends'].get(sn, {})
+        usage_pattern = trends_analysis['usage_patterns'].get(sn, {})
+        charging_pattern = trends_analysis['charging_patterns'].get(sn, {})
+        status_stability = trends_analysis['status_stability'].get(sn, {})
+        
+        chart_data['device_health_radar'][sn] = {
+            'battery_health': min(100, max(0, 100 - battery_trend.get('consumption_rate', 0) * 10)),
+            'usage_efficiency': usage_pattern.get('wear_rate', 0),
+            'charging_health': min(100, max(0, 100 - charging_pattern.get('charging_frequency', 0) * 5)),
+            'connection_stability': status_stability.get('uptime_rate', 0),
+            'overall_score': 0  # 将在前端计算
+        }
+    
+    # 预测数据
+    chart_data['prediction_forecast'] = trends_analysis.get('predictions', {})
+    
+    return chart_data
+
+def get_device_battery_prediction(org_id, user_id=None, days=30):
+    """获取设备电池使用预测(按设备流式累加回归量，不物化历史序列)"""
+    try:
+        resolved = resolve_org_user_devices(org_id, user_id)
+        device_sns = resolved[0] if resolved else []
+        if not device_sns:
+            return {"success": False, "message": "无设备数据"}
+        
+        # 数据驱动时间范围：以数据最新时间为截止
+        _, latest_time = device_history_range(device_sns)
+        customer_id = fetch_customer_id_by_deviceSn(device_sns[0])
+        accumulators = get_device_history_analytics().summarize(device_sns, days, until=latest_time,
+                                                                customer_id=customer_id)
         predictions = {}
         
-        for sn, data in history_data.items():
-            if not data['battery_level'] or len(data['battery_level']) < 10:
+        for sn, acc in accumulators.items():
+            if acc.battery_samples < 10:
                 continue
             
-            # 使用线性回归预测电池趋势
-            battery_prediction = predict_battery_life(data['battery_level'], data['timestamps'])
+            # 加权最小二乘斜率预测电池趋势
+            battery_prediction = battery_life_from_slope(acc.slope_per_hour() / 3600, acc.last_battery)
             
             predictions[sn] = {
-                'current_battery': data['battery_level'][-1] if data['battery_level'] else 0,
+                'current_battery': acc.last_battery,
                 'predicted_depletion_time': battery_prediction.get('depletion_hours', 0),
                 'recommended_charge_time': battery_prediction.get('charge_recommendation', ''),
                 'battery_health_score': battery_prediction.get('health_score', 0),
-                'usage_forecast': generate_usage_forecast(data, 7)  # 7天预测
+                'usage_forecast': usage_forecast_from_rate(acc.worn / acc.samples if acc.samples else 0)  # 7天预测
             }
         
         return {
@@ -2972,42 +3250,42 @@ def predict_battery_life(battery_levels, timestamps):
         # 计算斜率（电池消耗率）
         if len(x) > 1:
             slope = np.polyfit(x, y, 1)[0]  # 每秒电量变化
-            
-            current_battery = battery_levels[-1]
-            current_time = time_values[-1]
-            
-            # 预测电量耗尽时间（小时）
-            if slope < 0:
-                depletion_seconds = current_battery / abs(slope)
-                depletion_hours = depletion_seconds / 3600
-            else:
-                depletion_hours = float('inf')  # 电量在增加
-            
-            # 健康评分（基于消耗率）
-            hourly_consumption = abs(slope) * 3600
-            health_score = max(0, min(100, 100 - hourly_consumption * 10))
-            
-            # 充电建议
-            if current_battery <= 20:
-                charge_recommendation = '立即充电'
-            elif depletion_hours <= 4:
-                charge_recommendation = '建议在4小时内充电'
-            elif depletion_hours <= 12:
-                charge_recommendation = '建议在12小时内充电'
-            else:
-                charge_recommendation = '电量充足'
-            
-            return {
-                'depletion_hours': round(depletion_hours, 1),
-                'health_score': round(health_score, 1),
-                'charge_recommendation': charge_recommendation,
-                'consumption_rate_per_hour': round(hourly_consumption, 2)
-            }
+            return battery_life_from_slope(slope, battery_levels[-1])
     except Exception as e:
         print(f"电池预测计算失败: {e}")
     
     return {'depletion_hours': 0, 'health_score': 0, 'charge_recommendation': '计算失败'}
 
+def battery_life_from_slope(slope, current_battery):
+    """由电量变化斜率(每秒)和当前电量计算耗尽时间/健康评分/充电建议"""
+    # 预测电量耗尽时间（小时）
+    if slope < 0:
+        depletion_seconds = current_battery / abs(slope)
+        depletion_hours = depletion_seconds / 3600
+    else:
+        depletion_hours = float('inf')  # 电量在增加
+    
+    # 健康评分（基于消耗率）
+    hourly_consumption = abs(slope) * 3600
+    health_score = max(0, min(100, 100 - hourly_consumption * 10))
+    
+    # 充电建议
+    if current_battery <= 20:
+        charge_recommendation = '立即充电'
+    elif depletion_hours <= 4:
+        charge_recommendation = '建议在4小时内充电'
+    elif depletion_hours <= 12:
+        charge_recommendation = '建议在12小时内充电'
+    else:
+        charge_recommendation = '电量充足'
+    
+    return {
+        'depletion_hours': round(depletion_hours, 1),
+        'health_score': round(health_score, 1),
+        'charge_recommendation': charge_recommendation,
+        'consumption_rate_per_hour': round(hourly_consumption, 2)
+    }
+
 def generate_usage_forecast(device_data, forecast_days):
     """生成使用预测"""
     if not device_data['wearable_status']:
@@ -3017,9 +3295,10 @@ def generate_usage_forecast(device_data, forecast_days):
     wear_statuses = device_data['wearable_status']
     total_records = len(wear_statuses)
     worn_records = wear_statuses.count('WORN')
-    wear_rate = (worn_records / total_records) if total_records > 0 else 0
-    
-    # 预测未来使用情况
+    return usage_forecast_from_rate((worn_records / total_records) if total_records > 0 else 0)
+
+def usage_forecast_from_rate(wear_rate):
+    """按历史佩戴率预测未来使用情况"""
     forecast = {
         'expected_daily_wear_hours': round(wear_rate * 24, 1),
         'expected_weekly_wear_hours': round(wear_rate * 24 * 7, 1),
@@ -8,8 +8,26 @@ from typing import Dict, List, Any
 from .redis_helper import RedisHelper
 from .time_config import get_now #统一时间配置
 import logging
-from config import MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DATABASE
-import pymysql
+from .db_pool import get_mysql_pool
+from .device_resolver import get_device_resolver
+from .device_presence import get_device_presence
+from .device_history_store import get_device_history_writer
+
+DEVICE_COLUMNS = ('serial_number', 'system_software_version', 'wifi_address', 'bluetooth_address',
+                  'ip_address', 'network_access_mode', 'device_name', 'imei', 'battery_level',
+                  'charging_status', 'wearable_status', 'status', 'voltage', 'timestamp',
+                  'update_time', 'is_deleted', 'create_time')
+DEVICE_UPDATE_COLUMNS = [c for c in DEVICE_COLUMNS if c not in ('serial_number', 'is_deleted', 'create_time')]
+
+# create_time作为参数传入(而非NOW())，使pymysql executemany能改写为单条多行INSERT (不更新org_id和user_id)
+DEVICE_UPSERT_SQL = f"""
+    INSERT INTO t_device_info ({', '.join(DEVICE_COLUMNS)})
+    VALUES ({', '.join(['%s'] * len(DEVICE_COLUMNS))})
+    ON DUPLICATE KEY UPDATE {', '.join(f'{c} = VALUES({c})' for c in DEVICE_UPDATE_COLUMNS)}
+"""
+
+def _row(data: Dict[str, Any], columns) -> tuple:
+    return tuple(data.get(column) for column in columns)
 
 # 高并发设备信息批量处理器 v2.0 - 参考health_data_batch_processor.py
 class DeviceBatchProcessor:
@@ -29,7 +47,9 @@ class DeviceBatchProcessor:
         self.redis = RedisHelper()
         self.running = False
         self.workers = []
-        self.stats = {'processed': 0, 'failed': 0, 'queued': 0}
+        self.stats = {'processed': 0, 'failed': 0, 'queued': 0, 'batches': 0, 'row_fallbacks': 0}
+        self.stage_seconds = {}  # 各处理阶段累计耗时(秒)
+        self.last_stage_ms = {}
         self.logger = logging.getLogger(__name__)
         self.app = app  # Flask应用实例
         self.processed_keys = set()  # 已处理记录键值集合
@@ -135,156 +155,120 @@ class DeviceBatchProcessor:
                 time.sleep(1)
                 
     def _process_batch(self, batch: List[Dict[str, Any]]):
-        """批量处理设备数据"""
+        """批量处理设备数据：整批一条upsert + 一条多行历史插入 + 一次Redis管道"""
         if not batch:
             return
             
         start_time = time.time()
+        timings = {}
         self.logger.info(f"🔄 开始批量处理设备数据: 数量={len(batch)}, 工作线程={threading.current_thread().name}")
         
-        # 使用pymysql直接连接数据库，避免SQLAlchemy问题
+        stage = time.time()
+        normalized = [data for data in (self._normalize_device_data(item) for item in batch) if data]
+        failed_count = len(batch) - len(normalized)
+        timings['normalize'] = time.time() - stage
+        
+        # 从共享连接池借用连接，避免每批次重新建连
+        pool = get_mysql_pool()
         conn = None
         try:
-            conn = pymysql.connect(
-                host=MYSQL_HOST,
-                port=MYSQL_PORT,
-                user=MYSQL_USER,
-                password=MYSQL_PASSWORD,
-                database=MYSQL_DATABASE,
-                autocommit=False
-            )
+            conn = pool.acquire()
+            stored = self._store_batch(conn, normalized, timings) if normalized else []
+            failed_count += len(normalized) - len(stored)
             
-            success_count = 0
-            failed_count = 0
-            
-            for item in batch:
-                try:
-                    if self._process_single_device(conn, item):
-                        success_count += 1
-                    else:
-                        failed_count += 1
-                except Exception as e:
-                    self.logger.error(f"❌ 处理单个设备失败: {e}, 设备: {item.get('SerialNumber', 'unknown')}")
-                    failed_count += 1
+            stage = time.time()
+            self._update_redis_cache(stored)
+            timings['redis'] = time.time() - stage
             
-            # 提交事务
-            conn.commit()
+            stage = time.time()
+            self._record_presence(stored)
+            timings['presence'] = time.time() - stage
             
             # 更新统计信息
-            self.stats['processed'] += success_count
+            self.stats['processed'] += len(stored)
             self.stats['failed'] += failed_count
             self.stats['queued'] -= len(batch)
+            self._record_timings(timings, time.time() - start_time)
             
             process_time = time.time() - start_time
-            self.logger.info(f"📊 批量处理完成: 成功{success_count}, 失败{failed_count}, 耗时{process_time:.2f}s")
+            self.logger.info(f"📊 批量处理完成: 成功{len(stored)}, 失败{failed_count}, 耗时{process_time:.2f}s")
             
         except Exception as e:
             self.logger.error(f"💥 批量处理异常: {e}")
             if conn:
                 conn.rollback()
             self.stats['failed'] += len(batch)
+            self.stats['queued'] -= len(batch)
         finally:
             if conn:
-                conn.close()
+                pool.release(conn)
                 
-    def _process_single_device(self, conn, raw_data: Dict[str, Any]) -> bool:
-        """处理单个设备数据"""
+    def _store_batch(self, conn, normalized: List[Dict[str, Any]], timings: Dict[str, float]) -> List[Dict[str, Any]]:
+        """整批写入设备表与历史表，失败时回滚并逐条写入以隔离异常数据，返回写入成功的数据"""
+        # 同一设备在批次内多次上报时，设备表只需最后一条(多行upsert中后面的行覆盖前面的行)
+        latest = list({data['serial_number']: data for data in normalized}.values())
         try:
-            # 标准化设备数据
-            normalized_data = self._normalize_device_data(raw_data)
-            if not normalized_data:
-                return False
-                
             with conn.cursor() as cursor:
-                # 1. 更新或插入设备信息表 (不更新org_id和user_id)
-                upsert_sql = """
-                    INSERT INTO t_device_info 
-                    (serial_number, system_software_version, wifi_address, bluetooth_address, 
-                     ip_address, network_access_mode, device_name, imei, battery_level, 
-                     charging_status, wearable_status, status, voltage, timestamp, 
-                     update_time, is_deleted, create_time)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
-                    ON DUPLICATE KEY UPDATE
-                        system_software_version = VALUES(system_software_version),
-                        wifi_address = VALUES(wifi_address),
-                        bluetooth_address = VALUES(bluetooth_address),
-                        ip_address = VALUES(ip_address),
-                        network_access_mode = VALUES(network_access_mode),
-                        device_name = VALUES(device_name),
-                        imei = VALUES(imei),
-                        battery_level = VALUES(battery_level),
-                        charging_status = VALUES(charging_status),
-                        wearable_status = VALUES(wearable_status),
-                        status = VALUES(status),
-                        voltage = VALUES(voltage),
-                        timestamp = VALUES(timestamp),
-                        update_time = VALUES(update_time)
-                """
-                
-                cursor.execute(upsert_sql, (
-                    normalized_data['serial_number'],
-                    normalized_data['system_software_version'],
-                    normalized_data['wifi_address'],
-                    normalized_data['bluetooth_address'],
-                    normalized_data['ip_address'],
-                    normalized_data['network_access_mode'],
-                    normalized_data['device_name'],
-                    normalized_data['imei'],
-                    normalized_data['battery_level'],
-                    normalized_data['charging_status'],
-                    normalized_data['wearable_status'],
-                    normalized_data['status'],
-                    normalized_data['voltage'],
-                    normalized_data['timestamp'],
-                    normalized_data['update_time'],
-                    normalized_data['is_deleted']
-                ))
+                stage = time.time()
+                cursor.executemany(DEVICE_UPSERT_SQL, [_row(data, DEVICE_COLUMNS) for data in latest])
+                timings['upsert'] = time.time() - stage
                 
-                # 2. 插入历史记录表 (不包含org_id和user_id)
-                history_sql = """
-                    INSERT INTO t_device_info_history 
-                    (serial_number, system_software_version, ip_address, network_access_mode, 
-                     battery_level, charging_status, wearable_status, status, voltage, 
-                     timestamp, update_time, is_deleted)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """
-                
-                cursor.execute(history_sql, (
-                    normalized_data['serial_number'],
-                    normalized_data['system_software_version'],
-                    normalized_data['ip_address'],
-                    normalized_data['network_access_mode'],
-                    normalized_data['battery_level'],
-                    normalized_data['charging_status'],
-                    normalized_data['wearable_status'],
-                    normalized_data['status'],
-                    normalized_data['voltage'],
-                    normalized_data['timestamp'],
-                    normalized_data['update_time'],
-                    normalized_data['is_deleted']
-                ))
-                
-                self.logger.info(f"✅ 设备历史记录插入成功: {normalized_data['serial_number']}")
-                
-                # 3. 更新Redis缓存
-                self._update_redis_cache(normalized_data)
-                
-                return True
+                stage = time.time()
+                get_device_history_writer().write(cursor, normalized)  # 整行或差量(DEVICE_HISTORY_MODE)
+                timings['history'] = time.time() - stage
                 
+            stage = time.time()
+            conn.commit()
+            timings['commit'] = time.time() - stage
+            return normalized
         except Exception as e:
-            self.logger.error(f"❌ 处理单个设备数据失败: {e}, 设备: {raw_data.get('SerialNumber', 'unknown')}")
-            return False
+            self.logger.error(f"❌ 设备数据批量写入失败，改为逐条写入: {e}, 数量: {len(normalized)}")
+            conn.rollback()
+            self.stats['row_fallbacks'] += 1
+            
+        stage = time.time()
+        stored = []
+        for data in normalized:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(DEVICE_UPSERT_SQL, _row(data, DEVICE_COLUMNS))
+                    get_device_history_writer().write(cursor, [data])
+                conn.commit()
+                stored.append(data)
+            except Exception as e:
+                conn.rollback()
+                self.logger.error(f"❌ 处理单个设备数据失败: {e}, 设备: {data['serial_number']}")
+        timings['row_fallback'] = time.time() - stage
+        return stored
+    
+    def _record_timings(self, timings: Dict[str, float], total: float):
+        self.stats['batches'] += 1
+        for name, seconds in timings.items():
+            self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + seconds
+        self.stage_seconds['total'] = self.stage_seconds.get('total', 0.0) + total
+        self.last_stage_ms = {name: round(seconds * 1000, 2) for name, seconds in timings.items()}
+        self.last_stage_ms['total'] = round(total * 1000, 2)
     
-    def _get_device_org_user(self, cursor, device_sn): #根据设备序列号查询org_id和user_id
+    def _record_presence(self, heartbeats: List[Dict[str, Any]]):
+        """设备上报写入在线索引(租户/组织经设备归属解析器获取，未绑定设备跳过)"""
+        if not heartbeats:
+            return
         try:
-            sql="SELECT u.id,o.org_id FROM t_user u JOIN t_user_org o ON u.id=o.user_id WHERE u.device_sn=%s AND u.is_deleted=0 AND o.is_deleted=0 LIMIT 1" #查询用户和组织关联
-            cursor.execute(sql,(device_sn,))
-            result=cursor.fetchone()
-            return (result[1],result[0]) if result else (None,None) #返回org_id,user_id
+            owners = get_device_resolver().resolve_many(d['serial_number'] for d in heartbeats)
+            events = []
+            for data in heartbeats:
+                owner = owners.get(data['serial_number']) or {}
+                events.append({
+                    'customer_id': owner.get('customer_id'),
+                    'org_id': owner.get('org_id'),
+                    'device_sn': data['serial_number'],
+                    'worn': data['wearable_status'] == 'WORN',
+                    'charging': None if data['charging_status'] == 'UNKNOWN' else data['charging_status'] == 'CHARGING'
+                })
+            get_device_presence().record_many(events)
         except Exception as e:
-            self.logger.error(f"❌ 查询设备组织用户失败: {e}, 设备: {device_sn}")
-            return (None,None)
-            
+            self.logger.error(f"❌ 在线索引更新失败: {e}, 设备数: {len(heartbeats)}")
+
     def _normalize_device_data(self, raw_data: Dict[str, Any]) -> Dict[str, Any]:
         """标准化设备数据"""
         try:
@@ -319,6 +303,7 @@ class DeviceBatchProcessor:
                 'status': data.get("status"),
                 'timestamp': timestamp,
                 'update_time': update_time,
+                'create_time': update_time,
                 'is_deleted': 0
             }
             
@@ -358,22 +343,25 @@ class DeviceBatchProcessor:
         """标准化佩戴状态"""
         return "WORN" if wearable_status and int(wearable_status) == 1 else "NOT_WORN"
         
-    def _update_redis_cache(self, normalized_data):
-        """更新Redis缓存"""
+    def _update_redis_cache(self, devices: List[Dict[str, Any]]):
+        """更新Redis缓存：整批设备哈希与变更通知走一次管道"""
+        if not devices:
+            return
         try:
-            serial_number = normalized_data['serial_number']
+            pipe = self.redis.client.pipeline(transaction=False)
+            for data in {data['serial_number']: data for data in devices}.values():
+                serial_number = data['serial_number']
+                # 过滤None值及入库专用的create_time，非基础类型转字符串(与RedisHelper.hset_data一致)
+                device_dict = {k: v if isinstance(v, (str, int, float, bytes)) else str(v)
+                               for k, v in data.items() if v is not None and k != 'create_time'}
+                pipe.hset(f"device_info:{serial_number}", mapping=device_dict)
+                pipe.publish(f"device_info_channel:{serial_number}", serial_number)
+            pipe.execute()
             
-            # 过滤None值
-            device_dict = {k: v for k, v in normalized_data.items() if v is not None}
-            
-            # 写入Redis
-            self.redis.hset_data(f"device_info:{serial_number}", device_dict)
-            self.redis.publish(f"device_info_channel:{serial_number}", serial_number)
-            
-            self.logger.debug(f"✅ Redis缓存更新成功: {serial_number}")
+            self.logger.debug(f"✅ Redis缓存更新成功: {len(devices)}条")
             
         except Exception as e:
-            self.logger.error(f"❌ Redis缓存更新失败: {e}, 设备: {normalized_data.get('serial_number', 'unknown')}")
+            self.logger.error(f"❌ Redis缓存更新失败: {e}, 设备数: {len(devices)}")
             
     def get_stats(self) -> Dict[str, Any]:
         """获取处理器统计信息"""
@@ -383,6 +371,12 @@ class DeviceBatchProcessor:
         current_stats['running'] = self.running
         current_stats['processed_keys_count'] = len(self.processed_keys)
         
+        # 各阶段耗时：平均每批次与最近一批次(毫秒)
+        batches = max(self.stats['batches'], 1)
+        current_stats['stage_avg_ms'] = {name: round(seconds * 1000 / batches, 2)
+                                         for name, seconds in self.stage_seconds.items()}
+        current_stats['last_stage_ms'] = dict(self.last_stage_ms)
+        
         # 计算处理速率
         if hasattr(self, 'start_time') and self.running:
             uptime = time.time() - self.start_time
@@ -3,6 +3,7 @@ from .models import db, DeviceInfo, DeviceUser, DeviceBindRequest, UserInfo
 import qrcode, io, base64, hmac, hashlib, time, uuid
 from datetime import datetime, timedelta
 from sqlalchemy import and_, or_, desc
+from .device_resolver import get_device_resolver
 
 device_bind_bp = Blueprint('device_bind', __name__, url_prefix='/api/device')
 
@@ -89,6 +90,8 @@ def approve_bind():
             success_count += 1
         
         db.session.commit()
+        for req in reqs:
+            if action == 'APPROVED': get_device_resolver().invalidate_device(req.device_sn)  # 广播设备归属变更
         return jsonify({'code': 200, 'msg': f'处理完成: {success_count}个申请'})
     except Exception as e:
         db.session.rollback()
@@ -108,6 +111,7 @@ def manual_bind():
         DeviceUser(device_sn=device_sn, user_id=user_id, user_name=f"用户{user_id}", status='BIND', create_user_id=operator_id).save()
         
         db.session.commit()
+        get_device_resolver().invalidate_device(device_sn)  # 广播设备归属变更
         return jsonify({'code': 200, 'msg': '绑定成功'})
     except Exception as e:
         db.session.rollback()
@@ -128,6 +132,7 @@ def unbind_device():
         DeviceUser(device_sn=device_sn, user_id=old_user_id, user_name=f"用户{old_user_id}", status='UNBIND', create_user_id=operator_id).save()
         
         db.session.commit()
+        get_device_resolver().invalidate_device(device_sn)  # 广播设备归属变更
         return jsonify({'code': 200, 'msg': '解绑成功'})
     except Exception as e:
         db.session.rollback()
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+设备历史流式分析(电池趋势/佩戴充电规律/电池预测)
+不再把窗口内全部历史物化为对象列表，而是单次流式读取(stream_status_rows)，按设备维护可合并的累加器：
+- 首末电量及时间、按样本数加权的线性回归累计量(Σx Σy Σxx Σxy Σyy)、电量极值与低电量计数、佩戴/充电的分小时计数
+- 内存为O(设备数)，与样本数无关
+游程的上报视为在起止时间内等间隔分布，按日边界裁剪后只计入落在当日的上报，游程延伸到次日不会改变已缓存日期的计数。
+累加器按自然日切分并缓存于Redis：device_analytics:v2:{customer_id}:{YYYYMMDD} HASH 设备 -> 当日累加器JSON，
+已结束的日期只计算一次，N天分析 = N个缓存日 + 当天(实时流式计算)合并
+"""
+
+import os
+import json
+import time
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .redis_helper import RedisHelper
+from .device_history_store import stream_status_rows
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'device_analytics:v2:'  # v2: 游程按日边界裁剪计数
+CACHE_TTL = int(os.getenv('DEVICE_ANALYTICS_CACHE_TTL', 8 * 86400))  # 日累加器保留时长(覆盖7天看板)
+ORIGIN = datetime(2024, 1, 1)  # 回归自变量原点，缩小累计量数值范围
+
+def _battery(value) -> Optional[int]:
+    if value is None:
+        return None
+    text = str(value).strip()
+    return int(text) if text.isdigit() else None
+
+def _hours(value: datetime) -> float:
+    return (value - ORIGIN).total_seconds() / 3600
+
+class DeviceAccumulator:
+    """单设备的可合并统计量，样本权重为该点代表的上报次数(游程边界裁剪点权重为0，只参与首末状态)"""
+    __slots__ = ('first_time', 'first_battery', 'last_time', 'last_battery', 'samples', 'battery_samples',
+                 'sx', 'sy', 'sxx', 'sxy', 'syy', 'min_battery', 'max_battery', 'low_battery', 'critical_battery',
+                 'worn', 'charging', 'wear_hours', 'charge_hours')
+
+    def __init__(self):
+        self.first_time = self.first_battery = self.last_time = self.last_battery = None
+        self.min_battery = self.max_battery = None
+        self.samples = self.battery_samples = self.worn = self.charging = 0
+        self.low_battery = self.critical_battery = 0
+        self.sx = self.sy = self.sxx = self.sxy = self.syy = 0.0
+        self.wear_hours: Dict[int, int] = {}
+        self.charge_hours: Dict[int, int] = {}
+
+    def add(self, timestamp: datetime, weight: int, battery_level, charging_status, wearable_status):
+        battery = _battery(battery_level)
+        if battery is not None:
+            if self.first_time is None or timestamp < self.first_time:
+                self.first_time, self.first_battery = timestamp, battery
+            if self.last_time is None or timestamp >= self.last_time:
+                self.last_time, self.last_battery = timestamp, battery
+        if not weight:
+            return
+        self.samples += weight
+        if battery is not None:
+            x = _hours(timestamp)
+            self.battery_samples += weight
+            self.sx += weight * x
+            self.sy += weight * battery
+            self.sxx += weight * x * x
+            self.sxy += weight * x * battery
+            self.syy += weight * battery * battery
+            self.min_battery = battery if self.min_battery is None else min(self.min_battery, battery)
+            self.max_battery = battery if self.max_battery is None else max(self.max_battery, battery)
+            if battery <= 20:
+                self.low_battery += weight
+            if battery <= 10:
+                self.critical_battery += weight
+        if wearable_status == 'WORN':
+            self.worn += weight
+            self.wear_hours[timestamp.hour] = self.wear_hours.get(timestamp.hour, 0) + weight
+        if charging_status == 'CHARGING':
+            self.charging += weight
+            self.charge_hours[timestamp.hour] = self.charge_hours.get(timestamp.hour, 0) + weight
+
+    def merge(self, other: 'DeviceAccumulator') -> 'DeviceAccumulator':
+        if other.first_time is not None and (self.first_time is None or other.first_time < self.first_time):
+            self.first_time, self.first_battery = other.first_time, other.first_battery
+        if other.last_time is not None and (self.last_time is None or other.last_time >= self.last_time):
+            self.last_time, self.last_battery = other.last_time, other.last_battery
+        for name in ('samples', 'battery_samples', 'worn', 'charging', 'low_battery', 'critical_battery',
+                     'sx', 'sy', 'sxx', 'sxy', 'syy'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for name, pick in (('min_battery', min), ('max_battery', max)):
+            theirs = getattr(other, name)
+            if theirs is not None:
+                mine = getattr(self, name)
+                setattr(self, name, theirs if mine is None else pick(mine, theirs))
+        for mine, theirs in ((self.wear_hours, other.wear_hours), (self.charge_hours, other.charge_hours)):
+            for hour, count in theirs.items():
+                mine[hour] = mine.get(hour, 0) + count
+        return self
+
+    @property
+    def empty(self) -> bool:
+        return self.first_time is None and not self.samples
+
+    def slope_per_hour(self) -> float:
+        """最小二乘电量变化率(%/小时)，与np.polyfit(x, y, 1)一致"""
+        n = self.battery_samples
+        denominator = n * self.sxx - self.sx * self.sx
+        if n < 2 or abs(denominator) < 1e-9:
+            return 0.0
+        return (n * self.sxy - self.sx * self.sy) / denominator
+
+    def mean_battery(self) -> float:
+        return self.sy / self.battery_samples if self.battery_samples else 0.0
+
+    def battery_variance(self) -> float:
+        """按上报次数加权的总体方差，与calculate_variance一致"""
+        n = self.battery_samples
+        return max(self.syy / n - (self.sy / n) ** 2, 0.0) if n >= 2 else 0.0
+
+    def peak_hour(self, hours: Dict[int, int]) -> Optional[int]:
+        return max(sorted(hours), key=lambda hour: hours[hour]) if hours else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {name: getattr(self, name) for name in self.__slots__}
+        for name in ('first_time', 'last_time'):
+            data[name] = data[name].strftime('%Y-%m-%d %H:%M:%S') if data[name] else None
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'DeviceAccumulator':
+        accumulator = cls()
+        for name in cls.__slots__:
+            if name in data:
+                setattr(accumulator, name, data[name])
+        for name in ('first_time', 'last_time'):
+            if data.get(name):
+                setattr(accumulator, name, datetime.strptime(data[name], '%Y-%m-%d %H:%M:%S'))
+        for name in ('wear_hours', 'charge_hours'):  # JSON键为字符串
+            setattr(accumulator, name, {int(hour): count for hour, count in (data.get(name) or {}).items()})
+        return accumulator
+
+def window_points(begin: datetime, end: datetime, samples, start: datetime,
+                  stop: datetime) -> List[Tuple[datetime, int]]:
+    """
+    游程在闭区间窗口[start, stop]内的点及权重：游程的samples次上报视为在[begin, end]内等间隔分布(按秒取整)，
+    先按窗口边界裁剪，只计落在窗口内的上报(首个计1次、末个计其余)；窗口内没有上报但游程跨过窗口时
+    以权重0的边界点提供状态。游程之后延伸到次日时，已缓存日期内的上报位置不变，按日切分后样本数不重复计算
+    """
+    samples = int(samples or 1)
+    span = int((end - begin).total_seconds())
+    if span <= 0 or samples == 1:
+        return [(begin, samples)] if start <= begin <= stop else []
+    if end < start or begin > stop:
+        return []
+    # 第i次上报位于 begin + ⌊i*span/(samples-1)⌋秒，求落在[start, stop]内的下标区间
+    start_offset = int((start - begin).total_seconds() // 1)
+    stop_offset = int((stop - begin).total_seconds() // 1)
+    first = max(0, -(-start_offset * (samples - 1) // span))
+    last = min(samples - 1, ((stop_offset + 1) * (samples - 1) - 1) // span)
+    if first > last:
+        return [(max(begin, start), 0)]
+    points = [(begin + timedelta(seconds=first * span // (samples - 1)), 1)]
+    if last > first:
+        points.append((begin + timedelta(seconds=last * span // (samples - 1)), last - first))
+    return points
+
+def day_windows(days: int, until: datetime) -> List[Tuple[datetime, datetime, bool]]:
+    """最近days个整天 + until当天(截至until)：[(起, 止, 是否已结束可缓存)]"""
+    today = until.replace(hour=0, minute=0, second=0, microsecond=0)
+    windows = []
+    for offset in range(max(int(days), 0), 0, -1):
+        start = today - timedelta(days=offset)
+        windows.append((start, start + timedelta(days=1) - timedelta(seconds=1), True))
+    windows.append((today, until, False))
+    return windows
+
+class DeviceHistoryAnalytics:
+    """按(租户, 日)缓存的设备历史流式分析"""
+
+    def __init__(self, redis=None, row_source: Optional[Callable] = None, resolver=None,
+                 clock: Callable[[], datetime] = datetime.now):
+        self.redis = redis or RedisHelper()
+        self._row_source = row_source or stream_status_rows
+        self._resolver = resolver
+        self._clock = clock
+        self.stats = {'requests': 0, 'cache_hits': 0, 'cache_misses': 0, 'passes': 0, 'rows_streamed': 0,
+                      'redis_errors': 0, 'last_pass_ms': 0}
+
+    @property
+    def _client(self):
+        return getattr(self.redis, 'client', None)
+
+    # ---------------- 流式累加 ----------------
+    def accumulate(self, serial_numbers: Sequence[str],
+                   windows: Sequence[Tuple[datetime, datetime]]) -> List[Dict[str, DeviceAccumulator]]:
+        """一次流式读取覆盖全部窗口，返回每个窗口的 {设备: 累加器}"""
+        result: List[Dict[str, DeviceAccumulator]] = [{} for _ in windows]
+        if not serial_numbers or not windows:
+            return result
+        began = time.time()
+        rows = 0
+        for sn, begin, end, battery, charging, wearing, samples in self._row_source(
+                serial_numbers, windows[0][0], windows[-1][1]):
+            rows += 1
+            for index, (start, stop) in enumerate(windows):
+                if end < start or begin > stop:
+                    continue
+                accumulator = result[index].get(sn)
+                if accumulator is None:
+                    accumulator = result[index][sn] = DeviceAccumulator()
+                for point_time, weight in window_points(begin, end, samples, start, stop):
+                    accumulator.add(point_time, weight, battery, charging, wearing)
+        self.stats['passes'] += 1
+        self.stats['rows_streamed'] += rows
+        self.stats['last_pass_ms'] = round((time.time() - began) * 1000, 1)
+        return result
+
+    def summarize(self, serial_numbers: Sequence[str], days: int = 7, until: Optional[datetime] = None,
+                  customer_id=None) -> Dict[str, DeviceAccumulator]:
+        """
+        最近days个整天 + 截至until的当天，合并为每设备一个累加器(无数据的设备不出现)
+
+        Args:
+            customer_id: 缓存键所属租户，未提供时按设备解析
+        """
+        serial_numbers = list(dict.fromkeys(sn for sn in serial_numbers if sn))
+        if not serial_numbers:
+            return {}
+        self.stats['requests'] += 1
+        windows = day_windows(days, until or self._clock())
+        customers = self._customers(serial_numbers, customer_id)
+        partials = self._read_cached(windows, serial_numbers, customers)
+
+        # 缓存缺失的日期按连续区段各流式计算一次(当天总是实时计算)
+        missing = [index for index, (_, _, cacheable) in enumerate(windows)
+                   if not cacheable or len(partials[index]) < len(serial_numbers)]
+        fresh: Dict[int, Dict[str, DeviceAccumulator]] = {}
+        for block in self._blocks(missing):
+            block_sns = [sn for sn in serial_numbers if any(sn not in partials[index] for index in block)]
+            computed = self.accumulate(block_sns, [windows[index][:2] for index in block])
+            for index, accumulators in zip(block, computed):
+                for sn in block_sns:
+                    if sn not in partials[index]:
+                        partials[index][sn] = accumulators.get(sn) or DeviceAccumulator()
+                        if windows[index][2]:
+                            fresh.setdefault(index, {})[sn] = partials[index][sn]
+        self._write_cached(windows, fresh, customers)
+
+        merged: Dict[str, DeviceAccumulator] = {}
+        for accumulators in partials:
+            for sn, accumulator in accumulators.items():
+                if not accumulator.empty:
+                    merged.setdefault(sn, DeviceAccumulator()).merge(accumulator)
+        return merged
+
+    @staticmethod
+    def _blocks(indexes: List[int]) -> List[List[int]]:
+        blocks: List[List[int]] = []
+        for index in indexes:
+            if blocks and blocks[-1][-1] == index - 1:
+                blocks[-1].append(index)
+            else:
+                blocks.append([index])
+        return blocks
+
+    # ---------------- 日缓存 ----------------
+    def _customers(self, serial_numbers: List[str], customer_id) -> Dict[str, str]:
+        if customer_id not in (None, ''):
+            return {sn: str(customer_id) for sn in serial_numbers}
+        try:
+            if self._resolver is None:
+                from .device_resolver import get_device_resolver
+                self._resolver = get_device_resolver()
+            resolved = self._resolver.resolve_many(serial_numbers)
+        except Exception as e:
+            logger.warning(f"⚠️ 设备分析解析租户失败，按租户0缓存: {e}")
+            resolved = {}
+        return {sn: str((resolved.get(sn) or {}).get('customer_id') or 0) for sn in serial_numbers}
+
+    @staticmethod
+    def _key(customer_id: str, day: datetime) -> str:
+        return f"{KEY_PREFIX}{customer_id}:{day.strftime('%Y%m%d')}"
+
+    def _read_cached(self, windows, serial_numbers: List[str],
+                     customers: Dict[str, str]) -> List[Dict[str, DeviceAccumulator]]:
+        partials: List[Dict[str, DeviceAccumulator]] = [{} for _ in windows]
+        cached_days = [index for index, window in enumerate(windows) if window[2]]
+        if not cached_days or self._client is None:
+            return partials
+        by_customer: Dict[str, List[str]] = {}
+        for sn in serial_numbers:
+            by_customer.setdefault(customers[sn], []).append(sn)
+        try:
+            pipe = self._client.pipeline(transaction=False)
+            requests = []
+            for index in cached_days:
+                for customer_id, sns in by_customer.items():
+                    pipe.hmget(self._key(customer_id, windows[index][0]), sns)
+                    requests.append((index, sns))
+            for (index, sns), values in zip(requests, pipe.execute()):
+                for sn, value in zip(sns, values):
+                    if value is not None:
+                        partials[index][sn] = DeviceAccumulator.from_dict(json.loads(value))
+        except Exception as e:
+            self.stats['redis_errors'] += 1
+            logger.warning(f"⚠️ 读取设备分析日缓存失败，全部实时计算: {e}")
+            return [{} for _ in windows]
+        hits = sum(len(partials[index]) for index in cached_days)
+        self.stats['cache_hits'] += hits
+        self.stats['cache_misses'] += len(cached_days) * len(serial_numbers) - hits
+        return partials
+
+    def _write_cached(self, windows, fresh: Dict[int, Dict[str, DeviceAccumulator]], customers: Dict[str, str]):
+        if not fresh or self._client is None:
+            return
+        try:
+            pipe = self._client.pipeline(transaction=False)
+            for index, accumulators in fresh.items():
+                grouped: Dict[str, Dict[str, str]] = {}
+                for sn, accumulator in accumulators.items():
+                    grouped.setdefault(customers[sn], {})[sn] = json.dumps(accumulator.to_dict())
+                for customer_id, mapping in grouped.items():
+                    key = self._key(customer_id, windows[index][0])
+                    pipe.hset(key, mapping=mapping)
+                    pipe.expire(key, CACHE_TTL)
+            pipe.execute()
+        except Exception as e:
+            self.stats['redis_errors'] += 1
+            logger.warning(f"⚠️ 写入设备分析日缓存失败: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats)
+
+# 全局设备分析实例
+device_history_analytics = DeviceHistoryAnalytics()
+
+def get_device_history_analytics() -> DeviceHistoryAnalytics:
+    return device_history_analytics
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+设备历史差量存储
+t_device_info_history每次上报写一整行，是增长最快的表。差量模式(DEVICE_HISTORY_MODE=delta)下：
+- 静态字段(系统版本/IP/网络模式/状态)仅在变化时写入t_device_info_history(电量/充电/佩戴/电压列为NULL)
+- 电量/充电/佩戴写入t_device_status_run，取值不变的连续上报合并为一段(游程)，只推进结束时间并累加样本数
+读取时按需重建快照：每段游程的起止两点 + 历史表中仍带电量的完整行(压缩前的旧数据)，
+静态字段取该时间点之前最近一次变更。旧数据由 compact_device_history.py 压缩(database_migrations/device_status_run.sql)
+"""
+
+import os
+import logging
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from pymysql.cursors import SSCursor
+
+logger = logging.getLogger(__name__)
+
+HISTORY_MODE = os.getenv('DEVICE_HISTORY_MODE', 'full').lower()  # full: 每次上报写整行; delta: 差量写入
+STATIC_FIELDS = ('system_software_version', 'ip_address', 'network_access_mode', 'status')
+RUN_FIELDS = ('battery_level', 'charging_status', 'wearable_status')
+HISTORY_COLUMNS = ('serial_number', 'system_software_version', 'ip_address', 'network_access_mode',
+                   'battery_level', 'charging_status', 'wearable_status', 'status', 'voltage',
+                   'timestamp', 'update_time', 'is_deleted')
+STATIC_COLUMNS = ('serial_number', 'system_software_version', 'ip_address', 'network_access_mode', 'status',
+                  'timestamp', 'update_time', 'is_deleted')
+
+HISTORY_INSERT_SQL = f"""
+    INSERT INTO t_device_info_history ({', '.join(HISTORY_COLUMNS)})
+    VALUES ({', '.join(['%s'] * len(HISTORY_COLUMNS))})
+"""
+STATIC_INSERT_SQL = f"""
+    INSERT INTO t_device_info_history ({', '.join(STATIC_COLUMNS)})
+    VALUES ({', '.join(['%s'] * len(STATIC_COLUMNS))})
+"""
+# 同一(设备, 起始时间)的游程重复写入时合并：结束时间取较大值、样本数累加、电压取最新
+RUN_UPSERT_SQL = """
+    INSERT INTO t_device_status_run
+    (serial_number, start_time, end_time, battery_level, charging_status, wearable_status, voltage, samples)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE end_time = GREATEST(end_time, VALUES(end_time)),
+        voltage = VALUES(voltage), samples = samples + VALUES(samples)
+"""
+LAST_RUN_SQL = """
+    SELECT r.serial_number, r.start_time, r.battery_level, r.charging_status, r.wearable_status
+    FROM t_device_status_run r
+    JOIN (SELECT serial_number, MAX(start_time) AS start_time FROM t_device_status_run
+          WHERE serial_number IN ({placeholders}) GROUP BY serial_number) last
+      ON r.serial_number = last.serial_number AND r.start_time = last.start_time
+"""
+LAST_STATIC_SQL = """
+    SELECT h.serial_number, h.system_software_version, h.ip_address, h.network_access_mode, h.status
+    FROM t_device_info_history h
+    JOIN (SELECT serial_number, MAX(timestamp) AS timestamp FROM t_device_info_history
+          WHERE serial_number IN ({placeholders}){before} GROUP BY serial_number) last
+      ON h.serial_number = last.serial_number AND h.timestamp = last.timestamp
+"""
+
+def _row(data: Dict[str, Any], columns: Sequence[str]) -> tuple:
+    return tuple(data.get(column) for column in columns)
+
+def _state(data: Dict[str, Any], fields: Sequence[str]) -> tuple:
+    """比较用状态(统一转字符串，避免数据库返回int而上报为str时误判为变化)"""
+    return tuple(None if data.get(field) is None else str(data.get(field)) for field in fields)
+
+def _placeholders(values: Sequence) -> str:
+    return ', '.join(['%s'] * len(values))
+
+def encode_history(devices: Iterable[Dict[str, Any]], runs: Dict[str, Tuple[Any, tuple]],
+                   statics: Dict[str, tuple]) -> Tuple[List[tuple], List[int]]:
+    """
+    把按时间排序的上报编码为差量记录
+
+    Args:
+        runs: {设备: (当前游程起始时间, 游程状态)}，原地更新
+        statics: {设备: 最近静态字段状态}，原地更新
+    Returns:
+        (游程upsert行, 需要写入静态变更行的上报下标)
+    """
+    run_rows: Dict[Tuple[str, Any], list] = {}
+    static_changes = []
+    for index, data in enumerate(devices):
+        device_sn, timestamp = data['serial_number'], data['timestamp']
+        state = _state(data, RUN_FIELDS)
+        current = runs.get(device_sn)
+        start = current[0] if current and current[1] == state else timestamp
+        runs[device_sn] = (start, state)
+        row = run_rows.get((device_sn, start))
+        if row:
+            row[2], row[6], row[7] = timestamp, data.get('voltage'), row[7] + 1
+        else:
+            run_rows[(device_sn, start)] = [device_sn, start, timestamp, data.get('battery_level'),
+                                            data.get('charging_status'), data.get('wearable_status'),
+                                            data.get('voltage'), 1]
+        static = _state(data, STATIC_FIELDS)
+        if statics.get(device_sn) != static:
+            statics[device_sn] = static
+            static_changes.append(index)
+    return [tuple(row) for row in run_rows.values()], static_changes
+
+class DeviceHistoryWriter:
+    """在调用方事务内写入设备历史(整行或差量)"""
+
+    def __init__(self, mode: str = HISTORY_MODE):
+        self.mode = mode
+        self.stats = {'reports': 0, 'full_rows': 0, 'run_rows': 0, 'static_rows': 0}
+
+    @property
+    def delta(self) -> bool:
+        return self.mode == 'delta'
+
+    def write(self, cursor, devices: List[Dict[str, Any]]):
+        """写入一批已标准化的上报(需含serial_number/timestamp及各字段)，由调用方提交"""
+        if not devices:
+            return
+        self.stats['reports'] += len(devices)
+        if not self.delta:
+            cursor.executemany(HISTORY_INSERT_SQL, [_row(data, HISTORY_COLUMNS) for data in devices])
+            self.stats['full_rows'] += len(devices)
+            return
+        # 每批从数据库读取各设备最后一段游程和静态字段(多进程写入时不依赖本地缓存)
+        runs, statics = self._last_state(cursor, list(dict.fromkeys(d['serial_number'] for d in devices)))
+        run_rows, static_changes = encode_history(devices, runs, statics)
+        cursor.executemany(RUN_UPSERT_SQL, run_rows)
+        if static_changes:
+            cursor.executemany(STATIC_INSERT_SQL, [_row(devices[i], STATIC_COLUMNS) for i in static_changes])
+        self.stats['run_rows'] += len(run_rows)
+        self.stats['static_rows'] += len(static_changes)
+
+    def _last_state(self, cursor, device_sns: List[str]) -> Tuple[Dict[str, Tuple[Any, tuple]], Dict[str, tuple]]:
+        cursor.execute(LAST_RUN_SQL.format(placeholders=_placeholders(device_sns)), device_sns)
+        runs = {row[0]: (row[1], _state(dict(zip(RUN_FIELDS, row[2:])), RUN_FIELDS)) for row in cursor.fetchall()}
+        cursor.execute(LAST_STATIC_SQL.format(placeholders=_placeholders(device_sns), before=''), device_sns)
+        statics = {row[0]: _state(dict(zip(STATIC_FIELDS, row[1:])), STATIC_FIELDS) for row in cursor.fetchall()}
+        return runs, statics
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats, mode=self.mode)
+
+# 全局历史写入器实例
+device_history_writer = DeviceHistoryWriter()
+
+def get_device_history_writer() -> DeviceHistoryWriter:
+    return device_history_writer
+
+# ---------------- 读取：重建快照 ----------------
+class DeviceSnapshot:
+    """某时间点的设备完整状态(字段与DeviceInfoHistory一致)，samples为该点代表的上报次数"""
+    __slots__ = ('serial_number', 'timestamp', 'samples', 'battery_level', 'charging_status', 'wearable_status',
+                 'voltage') + STATIC_FIELDS
+
+    def __init__(self, serial_number, timestamp, samples=1, **fields):
+        self.serial_number, self.timestamp, self.samples = serial_number, timestamp, samples
+        for name in self.__slots__[3:]:
+            setattr(self, name, fields.get(name))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+def _default_connection():
+    from .db_pool import get_db_connection
+    return get_db_connection(readonly=True)
+
+def _run_points(run: tuple, start_time, end_time) -> List[Tuple[datetime, int, Dict[str, Any]]]:
+    """游程 -> 起止两点(裁剪到查询窗口)，起点计1次上报，终点计其余上报"""
+    begin, end, battery, charging, wearing, voltage, samples = run
+    values = {'battery_level': battery, 'charging_status': charging, 'wearable_status': wearing, 'voltage': voltage}
+    first = max(begin, start_time) if start_time else begin
+    last = min(end, end_time) if end_time else end
+    if last <= first:
+        return [(first, int(samples or 1), values)]
+    return [(first, 1, values), (last, max(int(samples or 1) - 1, 1), values)]
+
+def load_device_snapshots(serial_numbers: Sequence[str], start_time: Optional[datetime] = None,
+                          end_time: Optional[datetime] = None, limit: Optional[int] = None,
+                          connection_factory: Optional[Callable] = None) -> List[DeviceSnapshot]:
+    """
+    重建设备在时间窗口内的快照(按时间升序)
+
+    Args:
+        limit: 每个设备只保留最近limit个点(时间线图表)
+    """
+    serial_numbers = list(dict.fromkeys(sn for sn in serial_numbers if sn))
+    if not serial_numbers:
+        return []
+    window, params = '', []
+    if start_time:
+        window += ' AND {end} >= %s'
+        params.append(start_time)
+    if end_time:
+        window += ' AND {start} <= %s'
+        params.append(end_time)
+    order = f' ORDER BY {{start}} DESC LIMIT {int(limit) * len(serial_numbers)}' if limit else ''
+    run_sql = (f"SELECT serial_number, start_time, end_time, battery_level, charging_status, wearable_status, "
+               f"voltage, samples FROM t_device_status_run WHERE serial_number IN ({_placeholders(serial_numbers)})"
+               + window + order).format(start='start_time', end='end_time')
+    history_sql = (f"SELECT serial_number, timestamp, battery_level, charging_status, wearable_status, voltage, "
+                   f"{', '.join(STATIC_FIELDS)} FROM t_device_info_history "
+                   f"WHERE serial_number IN ({_placeholders(serial_numbers)}) AND (is_deleted = 0 OR is_deleted IS NULL)"
+                   + window + order).format(start='timestamp', end='timestamp')
+
+    with (connection_factory or _default_connection)() as conn, conn.cursor() as cursor:
+        cursor.execute(run_sql, serial_numbers + params)
+        runs = cursor.fetchall()
+        cursor.execute(history_sql, serial_numbers + params)
+        history = cursor.fetchall()
+        times = [row[1] for row in runs] + [row[1] for row in history]
+        earliest = start_time or (min(times) if times else None)
+        prior = {}
+        if earliest:  # 窗口起点之前最近的静态字段
+            cursor.execute(LAST_STATIC_SQL.format(placeholders=_placeholders(serial_numbers),
+                                                  before=' AND timestamp < %s'), serial_numbers + [earliest])
+            prior = {row[0]: dict(zip(STATIC_FIELDS, row[1:])) for row in cursor.fetchall()}
+
+    # 事件按时间排序：同一时刻先应用静态变更再输出快照点
+    events: Dict[str, list] = {}
+    for sn, *run in runs:
+        for point_time, samples, values in _run_points(run, start_time, end_time):
+            events.setdefault(sn, []).append((point_time, 1, samples, values))
+    for sn, timestamp, battery, charging, wearing, voltage, *static in history:
+        events.setdefault(sn, []).append((timestamp, 0, 0, dict(zip(STATIC_FIELDS, static))))
+        if battery is not None or charging is not None or wearing is not None:  # 压缩前的完整行
+            events[sn].append((timestamp, 1, 1, {'battery_level': battery, 'charging_status': charging,
+                                                 'wearable_status': wearing, 'voltage': voltage}))
+    snapshots = []
+    for sn, items in events.items():
+        items.sort(key=lambda item: (item[0], item[1]))
+        static = dict(prior.get(sn, {}))
+        points = []
+        for point_time, is_point, samples, values in items:
+            if is_point:
+                points.append(DeviceSnapshot(sn, point_time, samples, **static, **values))
+            else:
+                static = values
+        snapshots.extend(points[-limit:] if limit else points)
+    snapshots.sort(key=lambda snapshot: snapshot.timestamp)
+    return snapshots
+
+def stream_status_rows(serial_numbers: Sequence[str], start_time: datetime, end_time: datetime,
+                       connection_factory: Optional[Callable] = None,
+                       batch_size: int = 2000) -> Iterator[Tuple[Any, ...]]:
+    """
+    流式读取时间窗口内的电量/充电/佩戴记录(不排序、不缓冲整个结果集)
+
+    Yields:
+        (设备, 起始时间, 结束时间, 电量, 充电状态, 佩戴状态, 样本数)；压缩前的完整历史行起止时间相同、样本数为1
+    """
+    serial_numbers = list(dict.fromkeys(sn for sn in serial_numbers if sn))
+    if not serial_numbers:
+        return
+    placeholders = _placeholders(serial_numbers)
+    sql = f"""
+        SELECT serial_number, start_time, end_time, battery_level, charging_status, wearable_status, samples
+        FROM t_device_status_run
+        WHERE serial_number IN ({placeholders}) AND end_time >= %s AND start_time <= %s
+        UNION ALL
+        SELECT serial_number, timestamp, timestamp, battery_level, charging_status, wearable_status, 1
+        FROM t_device_info_history
+        WHERE serial_number IN ({placeholders}) AND timestamp >= %s AND timestamp <= %s
+          AND (is_deleted = 0 OR is_deleted IS NULL)
+          AND (battery_level IS NOT NULL OR charging_status IS NOT NULL OR wearable_status IS NOT NULL)"""
+    params = serial_numbers + [start_time, end_time] + serial_numbers + [start_time, end_time]
+    with (connection_factory or _default_connection)() as conn, conn.cursor(SSCursor) as cursor:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+
+def device_history_range(serial_numbers: Sequence[str],
+                         connection_factory: Optional[Callable] = None) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """设备历史的最早/最晚时间(游程表与历史表合并)"""
+    serial_numbers = list(dict.fromkeys(sn for sn in serial_numbers if sn))
+    if not serial_numbers:
+        return None, None
+    placeholders = _placeholders(serial_numbers)
+    with (connection_factory or _default_connection)() as conn, conn.cursor() as cursor:
+        cursor.execute(f"SELECT MIN(start_time), MAX(end_time) FROM t_device_status_run "
+                       f"WHERE serial_number IN ({placeholders})", serial_numbers)
+        bounds = [cursor.fetchone() or (None, None)]
+        cursor.execute(f"SELECT MIN(timestamp), MAX(timestamp) FROM t_device_info_history "
+                       f"WHERE serial_number IN ({placeholders}) AND (is_deleted = 0 OR is_deleted IS NULL)",
+                       serial_numbers)
+        bounds.append(cursor.fetchone() or (None, None))
+    earliest = [row[0] for row in bounds if row[0]]
+    latest = [row[1] for row in bounds if row[1]]
+    return (min(earliest) if earliest else None), (max(latest) if latest else None)
+
+def has_activity_since(serial_number: str, since: datetime, connection_factory: Optional[Callable] = None) -> bool:
+    """设备在since之后是否有上报(游程结束时间或历史行时间)"""
+    with (connection_factory or _default_connection)() as conn, conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT EXISTS(SELECT 1 FROM t_device_status_run WHERE serial_number = %s AND end_time >= %s)
+                OR EXISTS(SELECT 1 FROM t_device_info_history WHERE serial_number = %s AND timestamp >= %s
+                          AND (is_deleted = 0 OR is_deleted IS NULL))""",
+                       (serial_number, since, serial_number, since))
+        row = cursor.fetchone()
+    return bool(row and row[0])
+
+# ---------------- 旧数据压缩 ----------------
+def compact_device_history(cursor, serial_number: str, before: datetime, batch_size: int = 1000) -> Dict[str, int]:
+    """
+    把设备before之前仍带电量等字段的完整历史行压缩为游程 + 静态变更行(幂等：已压缩的行不再处理)，由调用方提交
+    """
+    cursor.execute(f"""
+        SELECT id, {', '.join(HISTORY_COLUMNS)} FROM t_device_info_history
+        WHERE serial_number = %s AND timestamp < %s
+          AND (battery_level IS NOT NULL OR charging_status IS NOT NULL OR wearable_status IS NOT NULL)
+        ORDER BY timestamp, id""", (serial_number, before))
+    rows = cursor.fetchall()
+    if not rows:
+        return {'rows': 0, 'runs': 0, 'kept': 0, 'deleted': 0}
+    devices = [dict(zip(HISTORY_COLUMNS, row[1:])) for row in rows]
+    run_rows, static_changes = encode_history(devices, {}, {})
+    kept = [rows[i][0] for i in static_changes]
+    kept_set = set(kept)
+    deleted = [row[0] for row in rows if row[0] not in kept_set]
+    cursor.executemany(RUN_UPSERT_SQL, run_rows)
+    for i in range(0, len(kept), batch_size):
+        chunk = kept[i:i + batch_size]
+        cursor.execute(f"UPDATE t_device_info_history SET battery_level = NULL, charging_status = NULL, "
+                       f"wearable_status = NULL, voltage = NULL WHERE id IN ({_placeholders(chunk)})", chunk)
+    for i in range(0, len(deleted), batch_size):
+        chunk = deleted[i:i + batch_size]
+        cursor.execute(f"DELETE FROM t_device_info_history WHERE id IN ({_placeholders(chunk)})", chunk)
+    return {'rows': len(rows), 'runs': len(run_rows), 'kept': len(kept), 'deleted': len(deleted)}
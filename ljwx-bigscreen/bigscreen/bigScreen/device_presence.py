@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+设备在线索引(心跳)
+/upload_device_info 与 /upload_health_data 数据到达时记录设备最近上报时间，替代逐设备查询t_device_info_history：
+- presence:{customer_id}:seen:{org_id}  ZSET 设备 -> 最近上报时间(epoch秒)，org_id=0为租户合计
+- presence:{customer_id}:worn:{org_id}  ZSET 当前佩戴设备 -> 最近上报时间(摘下时移除)
+- presence:{customer_id}:wear / charge  位图，按设备槽位记录当前佩戴/充电状态
+在线/离线数量、"超过租户上报间隔未上报"列表及各组织佩戴率均为ZCOUNT/ZRANGEBYSCORE范围查询。
+租户首次查询时从t_device_info初始化一次(已绑定用户的设备，含从未上报的设备)
+"""
+
+import os
+import time
+import threading
+import logging
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .redis_helper import RedisHelper
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'presence:{customer_id}'
+TOTAL_ORG = 0
+DEFAULT_INTERVAL = 300  # 未配置上报接口时的默认间隔(秒)，与device.get_interface_call_interval一致
+INTERVAL_CACHE_SECONDS = int(os.getenv('PRESENCE_INTERVAL_CACHE_SECONDS', 60))
+LOCAL_CACHE_LIMIT = 200000  # 槽位/组织本地缓存上限，超过后清空重建
+SEED_LOCK_SECONDS = 300  # 初始化锁超时，持锁进程异常退出后可由其他进程重新初始化
+
+INTERVAL_SQL = """
+    SELECT call_interval FROM t_interface
+    WHERE customer_id = %s AND url LIKE %s AND (is_deleted = 0 OR is_deleted IS NULL)
+    LIMIT 1
+"""
+DEVICE_SQL = """
+    SELECT u.device_sn, uo.org_id, COALESCE(d.timestamp, d.update_time), d.wearable_status, d.charging_status
+    FROM sys_user u
+    JOIN t_device_info d ON d.serial_number = u.device_sn AND (d.is_deleted = 0 OR d.is_deleted IS NULL)
+    LEFT JOIN sys_user_org uo ON u.id = uo.user_id AND (uo.is_deleted = 0 OR uo.is_deleted IS NULL)
+    WHERE u.customer_id = %s AND u.is_deleted = 0 AND u.device_sn IS NOT NULL AND u.device_sn <> ''
+"""
+
+def _key(customer_id, kind: str, org_id=None) -> str:
+    key = f"{KEY_PREFIX.format(customer_id=customer_id)}:{kind}"
+    return key if org_id is None else f"{key}:{org_id}"
+
+def _org(value) -> Optional[int]:
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value != TOTAL_ORG else None
+
+def _epoch(value) -> Optional[float]:
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, (int, float)):
+        return float(value) / 1000 if value > 1e12 else float(value)
+    try:
+        return datetime.strptime(str(value)[:19], '%Y-%m-%d %H:%M:%S').timestamp()
+    except ValueError:
+        return None
+
+def _flag(value, on: str) -> Optional[bool]:
+    """WORN/CHARGING等状态值 -> bool，缺失为None"""
+    if value is None or value == '':
+        return None
+    return str(value).upper() == on
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+def _load_interval(customer_id) -> int:
+    from .db_pool import get_db_connection
+    with get_db_connection(readonly=True) as conn, conn.cursor() as cursor:
+        cursor.execute(INTERVAL_SQL, (customer_id, '%upload_device_info%'))
+        row = cursor.fetchone()
+    return int(row[0]) if row and row[0] else DEFAULT_INTERVAL
+
+def _load_devices(customer_id) -> List[Tuple]:
+    from .db_pool import get_db_connection
+    with get_db_connection(readonly=True) as conn, conn.cursor() as cursor:
+        cursor.execute(DEVICE_SQL, (customer_id,))
+        return list(cursor.fetchall())
+
+class DevicePresence:
+    """基于Redis有序集合/位图的设备在线索引"""
+
+    def __init__(self, redis=None, device_loader: Optional[Callable] = None,
+                 interval_loader: Optional[Callable] = None, clock: Callable[[], float] = time.time):
+        self.redis = redis or RedisHelper()
+        self._device_loader = device_loader or _load_devices
+        self._interval_loader = interval_loader or _load_interval
+        self._clock = clock
+        self._slots: Dict[Tuple[str, str], int] = {}
+        self._orgs: Dict[Tuple[str, str], int] = {}
+        self._intervals: Dict[str, Tuple[float, int]] = {}
+        self._seeded = set()
+        self._lock = threading.Lock()
+        self.stats = {'heartbeats': 0, 'skipped': 0, 'slot_allocations': 0, 'org_moves': 0, 'queries': 0,
+                      'seeds': 0, 'seeded_devices': 0, 'redis_errors': 0}
+
+    # ---------------- 写入 ----------------
+    def record(self, customer_id, device_sn: str, org_id=None, worn: Optional[bool] = None,
+               charging: Optional[bool] = None, seen_at: Optional[float] = None) -> int:
+        return self.record_many([{'customer_id': customer_id, 'device_sn': device_sn, 'org_id': org_id,
+                                  'worn': worn, 'charging': charging, 'seen_at': seen_at}])
+
+    def record_many(self, events: Iterable[Dict[str, Any]]) -> int:
+        """记录一批心跳(customer_id/device_sn必填，org_id/worn/charging/seen_at可选)，返回写入设备数"""
+        grouped: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for event in events:
+            customer_id, device_sn = event.get('customer_id'), event.get('device_sn')
+            if customer_id in (None, '') or not device_sn:
+                self.stats['skipped'] += 1
+                continue
+            grouped.setdefault(str(customer_id), {})[str(device_sn)] = event  # 批次内同一设备保留最后一条
+        written = 0
+        for customer_id, events_by_sn in grouped.items():
+            try:
+                written += self._write(customer_id, events_by_sn)
+            except Exception as e:
+                self.stats['redis_errors'] += 1
+                logger.warning(f"⚠️ 设备在线索引写入失败: customer_id={customer_id}, 设备数={len(events_by_sn)}, {e}")
+        self.stats['heartbeats'] += written
+        return written
+
+    def record_health(self, records: Iterable[Any]) -> int:
+        """健康数据入库后记录心跳(records需含customer_id/org_id/device_sn)"""
+        get = lambda row, name: row.get(name) if isinstance(row, dict) else getattr(row, name, None)
+        return self.record_many({'customer_id': get(row, 'customer_id'), 'device_sn': get(row, 'device_sn'),
+                                 'org_id': get(row, 'org_id')} for row in records)
+
+    def _write(self, customer_id: str, events_by_sn: Dict[str, Dict[str, Any]]) -> int:
+        now = self._clock()
+        stateful = [sn for sn, event in events_by_sn.items()
+                    if event.get('worn') is not None or event.get('charging') is not None]
+        slots = self._lookup_slots(customer_id, stateful)
+        known_orgs = self._lookup_orgs(customer_id, list(events_by_sn))
+        pipe = self.redis.client.pipeline(transaction=False)
+        for device_sn, event in events_by_sn.items():
+            seen_at = event.get('seen_at')
+            seen_at = now if seen_at is None else float(seen_at)
+            worn, charging = event.get('worn'), event.get('charging')
+            old_org, new_org = known_orgs.get(device_sn), _org(event.get('org_id'))
+            org_id = new_org or old_org
+            for scope in (TOTAL_ORG, org_id) if org_id else (TOTAL_ORG,):
+                pipe.zadd(_key(customer_id, 'seen', scope), {device_sn: seen_at}, gt=True)
+                worn_key = _key(customer_id, 'worn', scope)
+                if worn is None:  # 健康数据心跳不带佩戴状态，仅刷新仍处于佩戴中的设备
+                    pipe.zadd(worn_key, {device_sn: seen_at}, xx=True, gt=True)
+                elif worn:
+                    pipe.zadd(worn_key, {device_sn: seen_at}, gt=True)
+                else:
+                    pipe.zrem(worn_key, device_sn)
+            if worn is not None:
+                pipe.setbit(_key(customer_id, 'wear'), slots[device_sn], int(bool(worn)))
+            if charging is not None:
+                pipe.setbit(_key(customer_id, 'charge'), slots[device_sn], int(bool(charging)))
+            if new_org and new_org != old_org:
+                if old_org:  # 换组织：从原组织集合移除
+                    pipe.zrem(_key(customer_id, 'seen', old_org), device_sn)
+                    pipe.zrem(_key(customer_id, 'worn', old_org), device_sn)
+                    self.stats['org_moves'] += 1
+                pipe.hset(_key(customer_id, 'org_of'), device_sn, new_org)
+                pipe.sadd(_key(customer_id, 'orgs'), new_org)
+                self._remember(self._orgs, customer_id, device_sn, new_org)
+        pipe.execute()
+        return len(events_by_sn)
+
+    def _remember(self, cache: Dict, customer_id: str, device_sn: str, value: int):
+        if len(cache) >= LOCAL_CACHE_LIMIT:
+            cache.clear()
+        cache[(customer_id, device_sn)] = value
+
+    def _lookup_orgs(self, customer_id: str, device_sns: List[str]) -> Dict[str, int]:
+        found = {sn: self._orgs[(customer_id, sn)] for sn in device_sns if (customer_id, sn) in self._orgs}
+        missing = [sn for sn in device_sns if sn not in found]
+        if missing:
+            for device_sn, value in zip(missing, self.redis.client.hmget(_key(customer_id, 'org_of'), missing)):
+                if value is not None:
+                    found[device_sn] = int(value)
+                    self._remember(self._orgs, customer_id, device_sn, found[device_sn])
+        return found
+
+    def _lookup_slots(self, customer_id: str, device_sns: List[str]) -> Dict[str, int]:
+        """设备位图槽位：首次出现时由租户计数器批量分配，HSETNX保证多进程下槽位唯一"""
+        slots = {sn: self._slots[(customer_id, sn)] for sn in device_sns if (customer_id, sn) in self._slots}
+        missing = [sn for sn in device_sns if sn not in slots]
+        if not missing:
+            return slots
+        client, slot_key = self.redis.client, _key(customer_id, 'slots')
+        values = client.hmget(slot_key, missing)
+        fresh = [sn for sn, value in zip(missing, values) if value is None]
+        slots.update({sn: int(value) for sn, value in zip(missing, values) if value is not None})
+        if fresh:
+            end = int(client.incrby(_key(customer_id, 'slot_seq'), len(fresh)))
+            pipe = client.pipeline(transaction=False)
+            for offset, device_sn in enumerate(fresh):
+                pipe.hsetnx(slot_key, device_sn, end - len(fresh) + offset)
+            claimed = pipe.execute()
+            lost = [sn for sn, ok in zip(fresh, claimed) if not ok]
+            slots.update({sn: end - len(fresh) + offset for offset, (sn, ok) in enumerate(zip(fresh, claimed)) if ok})
+            if lost:  # 其他进程已分配
+                slots.update({sn: int(value) for sn, value in zip(lost, client.hmget(slot_key, lost))})
+            self.stats['slot_allocations'] += len(fresh) - len(lost)
+        for device_sn in missing:
+            self._remember(self._slots, customer_id, device_sn, slots[device_sn])
+        return slots
+
+    # ---------------- 初始化 ----------------
+    def seed(self, customer_id) -> bool:
+        """
+        从t_device_info初始化租户在线索引(多进程仅一个执行)，已有心跳不会被较早的时间覆盖
+        写入完成后才设置seeded标记；其他进程初始化期间返回False，调用方回退数据库
+        """
+        customer_id = str(customer_id)
+        client, marker, lock = self.redis.client, _key(customer_id, 'seeded'), _key(customer_id, 'seeding')
+        if not client.set(lock, int(self._clock()), nx=True, ex=SEED_LOCK_SECONDS):
+            return bool(client.exists(marker))
+        try:
+            if client.exists(marker):  # 等锁期间已由其他进程完成
+                return True
+            events = [{'customer_id': customer_id, 'device_sn': device_sn, 'org_id': org_id,
+                       'seen_at': _epoch(seen) or 0, 'worn': _flag(wear, 'WORN'),
+                       'charging': _flag(charge, 'CHARGING')}
+                      for device_sn, org_id, seen, wear, charge in self._device_loader(customer_id) if device_sn]
+            if events:
+                self._write(customer_id, {event['device_sn']: event for event in events})
+            client.set(marker, int(self._clock()))
+        except Exception as e:
+            logger.error(f"❌ 设备在线索引初始化失败: customer_id={customer_id}, {e}")
+            return False
+        finally:
+            client.delete(lock)
+        self.stats['seeds'] += 1
+        self.stats['seeded_devices'] += len(events)
+        logger.info(f"📍 设备在线索引初始化: customer_id={customer_id}, 设备数={len(events)}")
+        return True
+
+    def _ready(self, customer_id: str) -> bool:
+        if customer_id in self._seeded:
+            return True
+        if self.redis.client.exists(_key(customer_id, 'seeded')) or self.seed(customer_id):
+            with self._lock:
+                self._seeded.add(customer_id)
+            return True
+        return False
+
+    # ---------------- 查询 ----------------
+    def interval(self, customer_id) -> int:
+        """租户设备上报间隔(秒)，本地缓存INTERVAL_CACHE_SECONDS"""
+        customer_id = str(customer_id)
+        cached = self._intervals.get(customer_id)
+        now = self._clock()
+        if cached and now - cached[0] < INTERVAL_CACHE_SECONDS:
+            return cached[1]
+        try:
+            value = int(self._interval_loader(customer_id) or DEFAULT_INTERVAL)
+        except Exception as e:
+            logger.warning(f"⚠️ 获取接口上报间隔失败: customer_id={customer_id}, {e}")
+            value = cached[1] if cached else DEFAULT_INTERVAL
+        self._intervals[customer_id] = (now, value)
+        return value
+
+    def _query(self, customer_id, build: Callable, interval: Optional[int] = None):
+        """执行范围查询，Redis不可用或租户索引未就绪时返回None(调用方回退数据库)"""
+        customer_id = str(customer_id)
+        try:
+            if not self._ready(customer_id):
+                return None
+            interval = int(interval or self.interval(customer_id))
+            self.stats['queries'] += 1
+            return build(customer_id, self._clock() - interval, interval)
+        except Exception as e:
+            self.stats['redis_errors'] += 1
+            logger.warning(f"⚠️ 设备在线索引查询失败: customer_id={customer_id}, {e}")
+            return None
+
+    def summary(self, customer_id, interval: Optional[int] = None) -> Optional[Dict[str, int]]:
+        """租户设备总数/在线/离线/在线且佩戴/佩戴/充电数量"""
+        def build(customer_id, cutoff, interval):
+            pipe = self.redis.client.pipeline(transaction=False)
+            pipe.zcard(_key(customer_id, 'seen', TOTAL_ORG))
+            pipe.zcount(_key(customer_id, 'seen', TOTAL_ORG), cutoff, '+inf')
+            pipe.zcount(_key(customer_id, 'worn', TOTAL_ORG), cutoff, '+inf')
+            pipe.bitcount(_key(customer_id, 'wear'))
+            pipe.bitcount(_key(customer_id, 'charge'))
+            total, online, worn_online, worn, charging = (int(v or 0) for v in pipe.execute())
+            return {'total': total, 'online': online, 'offline': total - online, 'worn_online': worn_online,
+                    'worn': worn, 'charging': charging, 'interval': interval}
+        return self._query(customer_id, build, interval)
+
+    def offline_devices(self, customer_id, interval: Optional[int] = None,
+                        limit: int = 50) -> Optional[Dict[str, Any]]:
+        """超过上报间隔未上报的设备(最近上报的在前)：{'total', 'devices': [(device_sn, 最近上报epoch或None)]}"""
+        def build(customer_id, cutoff, interval):
+            key = _key(customer_id, 'seen', TOTAL_ORG)
+            pipe = self.redis.client.pipeline(transaction=False)
+            pipe.zcount(key, '-inf', f'({cutoff}')
+            pipe.zrevrangebyscore(key, f'({cutoff}', '-inf', start=0, num=limit, withscores=True)
+            total, rows = pipe.execute()
+            devices = [(_text(device_sn), float(score) if score > 0 else None) for device_sn, score in rows]
+            return {'total': int(total or 0), 'devices': devices, 'interval': interval}
+        return self._query(customer_id, build, interval)
+
+    def org_wearing_rates(self, customer_id, interval: Optional[int] = None,
+                          org_ids: Optional[Iterable] = None) -> Optional[Dict[int, Dict[str, Any]]]:
+        """各组织设备数/在线数/在线佩戴数及佩戴率(在线佩戴/在线)"""
+        def build(customer_id, cutoff, interval):
+            client = self.redis.client
+            orgs = sorted(int(o) for o in (org_ids if org_ids is not None
+                                           else client.smembers(_key(customer_id, 'orgs'))))
+            pipe = client.pipeline(transaction=False)
+            for org_id in orgs:
+                pipe.zcard(_key(customer_id, 'seen', org_id))
+                pipe.zcount(_key(customer_id, 'seen', org_id), cutoff, '+inf')
+                pipe.zcount(_key(customer_id, 'worn', org_id), cutoff, '+inf')
+            values = [int(v or 0) for v in pipe.execute()] if orgs else []
+            rates = {}
+            for i, org_id in enumerate(orgs):
+                total, online, worn = values[3 * i:3 * i + 3]
+                rates[org_id] = {'total': total, 'online': online, 'worn': worn,
+                                 'rate': round(worn / online, 4) if online else 0.0}
+            return rates
+        return self._query(customer_id, build, interval)
+
+    def statuses(self, customer_id, device_sns: List[str],
+                 interval: Optional[int] = None) -> Optional[Dict[str, Optional[bool]]]:
+        """批量判断在线(True/False)，索引中不存在的设备为None"""
+        def build(customer_id, cutoff, interval):
+            if not device_sns:
+                return {}
+            scores = self.redis.client.zmscore(_key(customer_id, 'seen', TOTAL_ORG), list(device_sns))
+            return {sn: None if score is None else float(score) >= cutoff for sn, score in zip(device_sns, scores)}
+        return self._query(customer_id, build, interval)
+
+    def is_online(self, customer_id, device_sn: str, interval: Optional[int] = None) -> Optional[bool]:
+        result = self.statuses(customer_id, [device_sn], interval)
+        return result.get(device_sn) if result else None
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats['seeded_tenants'] = len(self._seeded)
+        stats['cached_slots'] = len(self._slots)
+        return stats
+
+# 全局在线索引实例
+device_presence = DevicePresence()
+
+def get_device_presence() -> DevicePresence:
+    return device_presence
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+设备 -> (用户, 组织, 租户) 解析器
+进程内LRU+TTL一级缓存 + Redis二级缓存 + 批量IN查询，
+订阅两个Redis频道失效缓存：org_change_channel(ljwx-boot与org_forest发布的组织变更JSON事件)
+和device_org_channel(本服务设备绑定/解绑时广播的设备、用户失效消息)。
+用户/组织失效时按数据库(sys_user/sys_user_org/sys_org_closure)查出全部受影响设备删除Redis缓存，
+不依赖本进程LRU中恰好缓存过哪些设备
+"""
+
+import json
+import time
+import threading
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+from .redis_helper import RedisHelper
+from .db_pool import get_db_connection
+from .org_forest import ORG_CHANGE_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+DEVICE_ORG_CHANNEL = 'device_org_channel'  # 消息格式: device:{sn} | user:{user_id} | org:{org_id} | all
+REDIS_KEY_PREFIX = 'device_org_info:'
+
+def parse_customer_id(org_id, ancestors: Optional[str], org_customer_id=None) -> Optional[int]:
+    """计算租户ID：优先组织表customer_id，其次ancestors(0,X,Y...)中第一个非零节点，顶级组织取自身ID"""
+    try:
+        if org_customer_id and int(org_customer_id) > 0:
+            return int(org_customer_id)
+    except (TypeError, ValueError):
+        pass
+    if ancestors:
+        for part in str(ancestors).split(','):
+            part = part.strip()
+            if part and part != '0':
+                try:
+                    return int(part)
+                except ValueError:
+                    logger.warning(f'ancestors格式异常: {ancestors}')
+                    break
+    return int(org_id) if org_id else None
+
+class DeviceOrgResolver:
+    """设备归属解析器 - 两级缓存 + 批量查询 + pub/sub失效"""
+
+    def __init__(self, max_size: int = 50000, local_ttl: int = 300, redis_ttl: int = 600, negative_ttl: int = 60):
+        self.max_size = max_size
+        self.local_ttl = local_ttl
+        self.redis_ttl = redis_ttl
+        self.negative_ttl = negative_ttl  # 未绑定设备的缓存时间，避免未知设备反复打DB
+        self.redis = RedisHelper()
+
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()  # device_sn -> (expire_at, info)
+        self._lock = threading.Lock()
+        self.stats = {'lookups': 0, 'local_hits': 0, 'redis_hits': 0, 'db_queries': 0, 'db_rows': 0,
+                      'misses': 0, 'invalidations': 0, 'evictions': 0}
+
+        self.subscriber_thread = None
+        self.running = False
+        self.pubsub = None
+
+    # ---------------- 本地LRU ----------------
+    def _local_get(self, device_sn: str):
+        with self._lock:
+            entry = self._cache.get(device_sn)
+            if entry is None:
+                return None, False
+            expire_at, info = entry
+            if expire_at < time.time():
+                del self._cache[device_sn]
+                return None, False
+            self._cache.move_to_end(device_sn)
+            return info, True
+
+    def _local_put(self, device_sn: str, info: Optional[Dict[str, Any]]):
+        ttl = self.local_ttl if info else self.negative_ttl
+        with self._lock:
+            self._cache[device_sn] = (time.time() + ttl, info)
+            self._cache.move_to_end(device_sn)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    # ---------------- 对外接口 ----------------
+    def resolve(self, device_sn: str) -> Optional[Dict[str, Any]]:
+        """解析单个设备，未绑定返回None"""
+        if not device_sn:
+            return None
+        return self.resolve_many([device_sn]).get(device_sn)
+
+    def resolve_many(self, device_sns: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """批量解析设备归属，返回 {device_sn: info或None}"""
+        result: Dict[str, Optional[Dict[str, Any]]] = {}
+        pending: List[str] = []
+        for sn in dict.fromkeys(s for s in device_sns if s):
+            self.stats['lookups'] += 1
+            info, hit = self._local_get(sn)
+            if hit:
+                self.stats['local_hits'] += 1
+                result[sn] = info
+            else:
+                pending.append(sn)
+        if not pending:
+            return result
+
+        # L2: Redis批量读取
+        pending = self._resolve_from_redis(pending, result)
+        if not pending:
+            return result
+
+        # L3: 数据库一次IN查询(查询失败时不缓存，避免把设备误记为未绑定)
+        db_result = self._query_db(pending)
+        if db_result is None:
+            for sn in pending:
+                result[sn] = None
+            return result
+        pipe_data = {}
+        for sn in pending:
+            info = db_result.get(sn)
+            if info is None:
+                self.stats['misses'] += 1
+            result[sn] = info
+            self._local_put(sn, info)
+            pipe_data[sn] = info
+        self._write_redis(pipe_data)
+        return result
+
+    def _resolve_from_redis(self, pending: List[str], result: Dict[str, Any]) -> List[str]:
+        try:
+            values = self.redis.client.mget([f"{REDIS_KEY_PREFIX}{sn}" for sn in pending])
+        except Exception as e:
+            logger.warning(f"设备归属Redis读取失败: {e}")
+            return pending
+        remaining = []
+        for sn, raw in zip(pending, values):
+            if raw is None:
+                remaining.append(sn)
+                continue
+            try:
+                info = json.loads(raw) or None
+            except (TypeError, ValueError):
+                remaining.append(sn)
+                continue
+            self.stats['redis_hits'] += 1
+            result[sn] = info
+            self._local_put(sn, info)
+        return remaining
+
+    def _write_redis(self, data: Dict[str, Optional[Dict[str, Any]]]):
+        if not data:
+            return
+        try:
+            pipe = self.redis.client.pipeline(transaction=False)
+            for sn, info in data.items():
+                ttl = self.redis_ttl if info else self.negative_ttl
+                pipe.setex(f"{REDIS_KEY_PREFIX}{sn}", ttl, json.dumps(info or {}, ensure_ascii=False))
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"设备归属Redis写入失败: {e}")
+
+    def _query_db(self, device_sns: List[str]) -> Optional[Dict[str, Dict[str, Any]]]:
+        """一次查询sys_user + sys_user_org + sys_org_units，查询失败返回None"""
+        found: Dict[str, Dict[str, Any]] = {}
+        if not device_sns:
+            return found
+        placeholders = ','.join(['%s'] * len(device_sns))
+        sql = f"""
+            SELECT u.device_sn, u.id, u.user_name, uo.org_id, o.name, o.ancestors, o.customer_id
+            FROM sys_user u
+            LEFT JOIN sys_user_org uo ON u.id = uo.user_id AND (uo.is_deleted = 0 OR uo.is_deleted IS NULL)
+            LEFT JOIN sys_org_units o ON uo.org_id = o.id AND o.is_deleted = 0
+            WHERE u.device_sn IN ({placeholders}) AND u.is_deleted = 0
+            ORDER BY u.id
+        """
+        try:
+            with get_db_connection(readonly=True) as conn, conn.cursor() as cursor:
+                cursor.execute(sql, device_sns)
+                rows = cursor.fetchall()
+            self.stats['db_queries'] += 1
+            self.stats['db_rows'] += len(rows)
+        except Exception as e:
+            logger.error(f"批量查询设备归属失败: {e}, 设备数: {len(device_sns)}")
+            return None
+        for device_sn, user_id, user_name, org_id, org_name, ancestors, org_customer_id in rows:
+            if device_sn in found and found[device_sn].get('org_id'):
+                continue  # 一个设备多行时保留第一条有组织的记录
+            found[device_sn] = {
+                'device_sn': device_sn,
+                'user_id': user_id,
+                'user_name': user_name,
+                'org_id': org_id,
+                'org_name': org_name,
+                'customer_id': parse_customer_id(org_id, ancestors, org_customer_id) if org_id and org_name is not None else None,
+                'org_path': [int(p) for p in str(ancestors or '').split(',') if p.strip().isdigit() and p.strip() != '0'],
+            }
+        return found
+
+    # ---------------- 失效 ----------------
+    def _affected_devices(self, user_id=None, org_id=None) -> Optional[List[str]]:
+        """用户或组织(含下级组织，按sys_org_closure)名下全部设备，用于删除其他进程写入的Redis缓存；查询失败返回None"""
+        if user_id is not None:
+            sql, params = "SELECT device_sn FROM sys_user WHERE id = %s", [user_id]
+        else:
+            sql = """
+                SELECT DISTINCT u.device_sn
+                FROM sys_user u
+                JOIN sys_user_org uo ON u.id = uo.user_id
+                WHERE uo.org_id = %s
+                   OR uo.org_id IN (SELECT descendant_id FROM sys_org_closure WHERE ancestor_id = %s)
+            """
+            params = [org_id, org_id]
+        try:
+            with get_db_connection(readonly=True) as conn, conn.cursor() as cursor:
+                cursor.execute(sql, params)
+                return [row[0] for row in cursor.fetchall() if row[0]]
+        except Exception as e:
+            logger.error(f"查询失效范围内的设备失败: {e}, user_id={user_id}, org_id={org_id}")
+            return None
+
+    def _purge_redis(self, device_sns: Iterable[str]):
+        keys = [f"{REDIS_KEY_PREFIX}{sn}" for sn in dict.fromkeys(device_sns)]
+        if not keys:
+            return
+        try:
+            self.redis.client.delete(*keys)
+        except Exception as e:
+            logger.warning(f"删除设备归属Redis缓存失败: {e}")
+
+    def invalidate_device(self, device_sn: str, publish: bool = True):
+        self._evict_local(lambda sn, info: sn == device_sn)
+        self.redis.delete(f"{REDIS_KEY_PREFIX}{device_sn}")
+        if publish:
+            self.redis.publish(DEVICE_ORG_CHANNEL, f"device:{device_sn}")
+
+    def invalidate_user(self, user_id, publish: bool = True, purge: Optional[bool] = None):
+        """本进程缓存过的设备总是删除Redis缓存；purge(默认同publish)时再按数据库删除该用户全部设备的Redis缓存"""
+        victims = self._evict_local(lambda sn, info: info and str(info.get('user_id')) == str(user_id))
+        affected = self._affected_devices(user_id=user_id) if (publish if purge is None else purge) else None
+        self._purge_redis(victims + (affected or []))
+        if publish:
+            self.redis.publish(DEVICE_ORG_CHANNEL, f"user:{user_id}")
+
+    def invalidate_org(self, org_id, publish: bool = True, purge: Optional[bool] = None):
+        """组织变更(改名/移动/删除)会影响该组织及其所有下级组织的设备；purge(默认同publish)时删除其全部设备的Redis缓存"""
+        org_id = str(org_id)
+        victims = self._evict_local(lambda sn, info: info and (str(info.get('org_id')) == org_id or
+                                                               org_id in (str(p) for p in info.get('org_path', []))))
+        affected = self._affected_devices(org_id=org_id) if (publish if purge is None else purge) else None
+        self._purge_redis(victims + (affected or []))
+        if publish:
+            self.redis.publish(DEVICE_ORG_CHANNEL, f"org:{org_id}")
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+        self.stats['invalidations'] += 1
+
+    def _evict_local(self, predicate) -> List[str]:
+        with self._lock:
+            victims = [sn for sn, (_, info) in self._cache.items() if predicate(sn, info)]
+            for sn in victims:
+                del self._cache[sn]
+        self.stats['invalidations'] += 1
+        return victims
+
+    # ---------------- 订阅 ----------------
+    def start_subscriber(self):
+        """启动Redis订阅者监听用户/组织变更"""
+        if self.running:
+            return
+        self.running = True
+        self.pubsub = self.redis.pubsub()
+        self.pubsub.subscribe(DEVICE_ORG_CHANNEL, ORG_CHANGE_CHANNEL)
+        self.subscriber_thread = threading.Thread(target=self._subscriber_loop, daemon=True, name="DeviceOrgSubscriber")
+        self.subscriber_thread.start()
+        logger.info(f"设备归属订阅者已启动，监听 {DEVICE_ORG_CHANNEL}, {ORG_CHANGE_CHANNEL}")
+
+    def stop_subscriber(self):
+        self.running = False
+        if self.pubsub:
+            try:
+                self.pubsub.unsubscribe(DEVICE_ORG_CHANNEL, ORG_CHANGE_CHANNEL)
+                self.pubsub.close()
+            except Exception:
+                pass
+        logger.info("设备归属订阅者已停止")
+
+    def _subscriber_loop(self):
+        while self.running:
+            try:
+                for message in self.pubsub.listen():
+                    if not self.running:
+                        break
+                    if message['type'] == 'message':
+                        self.handle_message(message['data'], message.get('channel'))
+            except Exception as e:
+                logger.error(f"设备归属订阅者错误: {e}")
+                if self.running:
+                    time.sleep(5)
+
+    def handle_message(self, message, channel=None):
+        """处理失效消息(本进程发布的消息也会收到，重复失效无副作用)；发布方已按数据库范围删除Redis缓存，这里不再查询数据库"""
+        if isinstance(message, bytes):
+            message = message.decode('utf-8')
+        if isinstance(channel, bytes):
+            channel = channel.decode('utf-8')
+        if channel == ORG_CHANGE_CHANNEL:
+            self.handle_org_change(message)
+            return
+        try:
+            kind, _, value = str(message).partition(':')
+            if kind == 'device':
+                self._evict_local(lambda sn, info: sn == value)
+            elif kind == 'user':
+                self.invalidate_user(value, publish=False)
+            elif kind == 'org':
+                self.invalidate_org(value, publish=False)
+            elif kind == 'all':
+                self.clear()
+        except Exception as e:
+            logger.error(f"处理设备归属失效消息失败: {message}, error: {e}")
+
+    def handle_org_change(self, message):
+        """处理组织变更事件 {"customer_id", "org_id", "action", "org": {...}}，失效该组织及下级组织的设备"""
+        try:
+            event = json.loads(message)
+            if isinstance(event, str):  # RedisTemplate的JSON序列化会把消息再包一层字符串
+                event = json.loads(event)
+            org_id = event.get('org_id') or (event.get('org') or {}).get('id')
+        except (TypeError, ValueError, AttributeError) as e:
+            logger.warning(f"组织变更消息无法解析，清空设备归属缓存: {message}, error: {e}")
+            self.clear()
+            return
+        if org_id:
+            self.invalidate_org(org_id, publish=False, purge=True)  # 外部发布的事件，各进程按数据库范围删除Redis缓存
+        else:
+            self.clear()
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        with self._lock:
+            stats['local_cache_size'] = len(self._cache)
+        lookups = stats['lookups']
+        stats['local_hit_rate'] = round(stats['local_hits'] / lookups * 100, 2) if lookups else 0.0
+        stats['redis_hit_rate'] = round(stats['redis_hits'] / lookups * 100, 2) if lookups else 0.0
+        stats['subscriber_running'] = self.running
+        return stats
+
+# 全局解析器实例
+device_resolver = DeviceOrgResolver()
+_subscriber_lock = threading.Lock()
+_subscriber_attempted = False
+
+def get_device_resolver() -> DeviceOrgResolver:
+    """获取设备归属解析器实例(首次获取时启动订阅者，失败则仅依赖TTL失效)"""
+    global _subscriber_attempted
+    if not _subscriber_attempted:
+        with _subscriber_lock:
+            if not _subscriber_attempted:
+                _subscriber_attempted = True
+                try:
+                    device_resolver.start_subscriber()
+                except Exception as e:
+                    logger.warning(f"设备归属订阅者启动失败，仅依赖TTL失效: {e}")
+                    device_resolver.running = False
+    return device_resolver
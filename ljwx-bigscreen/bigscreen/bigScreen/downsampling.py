@@ -0,0 +1,130 @@
+"""
+图表数据降采样
+直接对查询行生成的NumPy数组做确定性降采样，返回点数不超过max_points，与时间范围无关：
+- LTTB(Largest-Triangle-Three-Buckets)：保留曲线形状，同时给出每个桶的最小/最大值作为包络
+- 桶内最小/最大值：波形类数据保留峰谷
+- 多序列对齐：共用时间轴的多条曲线取各自LTTB选中点的并集
+- 已组装的趋势点列表({'timestamp', 'value', ...})：按上述两种方式挑选原始点
+"""
+
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+DEFAULT_MAX_POINTS = 500
+MAX_POINTS_LIMIT = 5000
+
+def parse_max_points(args, default: int = DEFAULT_MAX_POINTS) -> int:
+    """从请求参数读取maxPoints/max_points，限制在[3, MAX_POINTS_LIMIT]"""
+    value = (args.get('maxPoints') or args.get('max_points')) if args is not None else None
+    try:
+        value = int(value) if value else default
+    except (TypeError, ValueError):
+        value = default
+    return max(3, min(value, MAX_POINTS_LIMIT))
+
+def _bucket_edges(n: int, max_points: int) -> np.ndarray:
+    """首尾点单独成桶，中间n-2个点均分为max_points-2个桶，返回桶边界(长度max_points-1)"""
+    return np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, max_points: int,
+                 with_envelope: bool = False) -> Tuple[np.ndarray, Optional[np.ndarray], Optional[np.ndarray]]:
+    """
+    LTTB降采样，x需升序
+
+    Returns:
+        (选中点下标, 各选中点所在桶的最小值, 最大值)；with_envelope=False时后两项为None
+    """
+    n = len(x)
+    if n <= max_points or max_points < 3:
+        indices = np.arange(n)
+        return (indices, y.copy(), y.copy()) if with_envelope else (indices, None, None)
+
+    edges = _bucket_edges(n, max_points)
+    indices = np.empty(max_points, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    mins = maxs = None
+    if with_envelope:
+        mins, maxs = np.empty(max_points), np.empty(max_points)
+        mins[0] = maxs[0] = y[0]
+        mins[-1] = maxs[-1] = y[-1]
+
+    selected = 0
+    for bucket in range(max_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_x = x[end:edges[bucket + 2]].mean()
+            next_y = y[end:edges[bucket + 2]].mean()
+        else:  # 最后一个桶的下一桶是末尾点
+            next_x, next_y = x[n - 1], y[n - 1]
+        bucket_x, bucket_y = x[start:end], y[start:end]
+        areas = np.abs((x[selected] - next_x) * (bucket_y - y[selected]) -
+                       (x[selected] - bucket_x) * (next_y - y[selected]))
+        selected = start + int(np.argmax(areas))
+        indices[bucket + 1] = selected
+        if with_envelope:
+            mins[bucket + 1], maxs[bucket + 1] = bucket_y.min(), bucket_y.max()
+    return indices, mins, maxs
+
+def minmax_indices(y: np.ndarray, max_points: int) -> np.ndarray:
+    """每个桶保留最小值和最大值所在点(按时间顺序)，共不超过max_points个"""
+    n = len(y)
+    if n <= max_points:
+        return np.arange(n)
+    buckets = max(1, max_points // 2)
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)
+    picked = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        if end <= start:
+            continue
+        segment = y[start:end]
+        picked.extend((start + int(np.argmin(segment)), start + int(np.argmax(segment))))
+    return np.unique(np.asarray(picked, dtype=np.int64))
+
+def aligned_indices(x: np.ndarray, series: Sequence[np.ndarray], max_points: int) -> np.ndarray:
+    """
+    共用时间轴的多条序列降采样(序列中缺失值为NaN)：每条序列分到max_points/序列数的点数做LTTB，
+    取选中时间点的并集，保证任一序列的峰谷都落在返回的时间轴上
+    """
+    n = len(x)
+    if n <= max_points:
+        return np.arange(n)
+    series = [np.asarray(values, dtype=float) for values in series]
+    budget = max(3, max_points // max(1, len(series)))
+    picked = [np.array([0, n - 1], dtype=np.int64)]
+    for values in series:
+        positions = np.flatnonzero(~np.isnan(values))
+        if len(positions):
+            chosen, _, _ = lttb_indices(x[positions], values[positions], budget)
+            picked.append(positions[chosen])
+    indices = np.unique(np.concatenate(picked))
+    if len(indices) > max_points:
+        indices = indices[np.linspace(0, len(indices) - 1, max_points).astype(np.int64)]
+    return indices
+
+def rows_to_arrays(rows: Iterable[Tuple]) -> Tuple[np.ndarray, np.ndarray, List]:
+    """(时间, 数值)查询行 -> (epoch秒数组, 数值数组, 原始时间列表)"""
+    rows = list(rows)
+    times = [row[0] for row in rows]
+    x = np.fromiter((t.timestamp() for t in times), dtype=float, count=len(rows))
+    y = np.fromiter((float(row[1]) for row in rows), dtype=float, count=len(rows))
+    return x, y, times
+
+def downsample_points(points: List[Dict[str, Any]], max_points: int, mode: str = 'lttb') -> List[Dict[str, Any]]:
+    """
+    按时间升序的趋势点(timestamp为'%Y-%m-%d %H:%M:%S'字符串)降采样到不超过max_points个：
+    lttb时选中点附桶内min/max，minmax时保留每桶峰谷；时间无法解析时按序号作为横轴
+    """
+    if not max_points or len(points) <= max_points:
+        return points
+    y = np.fromiter((float(point['value']) for point in points), dtype=float, count=len(points))
+    if mode == 'minmax':
+        return [points[i] for i in minmax_indices(y, max_points)]
+    try:
+        x = np.fromiter((datetime.strptime(str(point['timestamp'])[:19], '%Y-%m-%d %H:%M:%S').timestamp()
+                         for point in points), dtype=float, count=len(points))
+    except ValueError:
+        x = np.arange(len(points), dtype=float)
+    indices, mins, maxs = lttb_indices(x, y, max_points, with_envelope=True)
+    return [dict(points[i], min=float(lo), max=float(hi)) for i, lo, hi in zip(indices, mins, maxs)]
@@ -11,6 +11,7 @@ from typing import Dict, List, Optional, Tuple
 import logging
 from .redis_helper import RedisHelper
 from .user_health_data import get_all_health_data_optimized
+from .health_columns import HealthColumns, fetch_health_columns
 from .models import db, HealthBaseline
 from sqlalchemy import text, and_
 import json
@@ -169,14 +170,8 @@ class RealTimeHealthBaselineEngine:
         logger.info(f"🔄 开始实时生成用户 {user_id} 健康基线，数据范围: {start_date_str} - {target_date}")
         
         try:
-            # 使用统一的health data查询接口
-            health_result = get_all_health_data_optimized(
-                userId=user_id,
-                startDate=start_date_str,
-                endDate=target_date,
-                latest_only=False,
-                pageSize=None  # 获取所有数据，不分页
-            )
+            # 列式读取指标(失败时回退统一的health data查询接口)
+            health_result = self._load_health_data(user_id, start_date_str, target_date)
             
             if not health_result.get('success'):
                 logger.warning(f"⚠️ 用户 {user_id} 获取健康数据失败: {health_result.get('message')}")
@@ -254,8 +249,20 @@ class RealTimeHealthBaselineEngine:
                 'execution_time': round(time.time() - start_time, 3)
             }
     
-    def _convert_to_dataframe(self, health_data: List[Dict]) -> pd.DataFrame:
-        """将健康数据转换为pandas DataFrame"""
+    def _load_health_data(self, user_id: int, start_date: str, end_date: str) -> Dict:
+        """列式读取用户健康指标，失败时回退get_all_health_data_optimized(逐行字典)"""
+        try:
+            columns = fetch_health_columns(start_date, end_date, user_id=user_id, features=self.HEALTH_FEATURES)
+            return {'success': True, 'data': {'healthData': columns}}
+        except Exception as e:
+            logger.warning(f"⚠️ 列式读取失败，回退统一查询接口: {e}")
+            return get_all_health_data_optimized(userId=user_id, startDate=start_date, endDate=end_date,
+                                                 latest_only=False, pageSize=None)
+    
+    def _convert_to_dataframe(self, health_data) -> pd.DataFrame:
+        """将健康数据(HealthColumns或字典列表)转换为pandas DataFrame"""
+        if isinstance(health_data, HealthColumns):
+            return health_data.to_dataframe(self.FEATURE_RANGES)  # 列式数据直接按列清洗，无逐行转换
         if not health_data:
             return pd.DataFrame()
         
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+健康数据批量上传
+手表离线重连后一次推送数百条样本：整批解析 -> 批次内/Redis去重 -> 一次IN查询补全设备归属 ->
+一次已存在查询 + 一次多行INSERT(同时维护分级汇总) -> 写后缓冲合并Redis最新值 -> 按设备时间顺序告警检测，返回逐条结果
+"""
+
+import time
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from .db_pool import get_db_connection
+from .device_resolver import get_device_resolver
+from .health_dedup import get_health_dedup, make_dedup_key, MAIN_FIELDS, MAIN_INSERT_SQL
+from .device_presence import get_device_presence
+from .health_rollup import get_health_rollup_maintainer
+from .stats_counters import get_stats_counter_store
+from .redis_write_behind import get_redis_write_behind
+from .alert_batch_evaluator import generate_alerts_batch
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_ITEMS = 2000  # 单次请求条数上限，超出部分返回rejected
+
+def _query_existing(cursor, keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], int]:
+    """一次查询批次涉及的设备+时间范围内已有记录，返回 {(device_sn, ts): id}"""
+    if not keys:
+        return {}
+    sns = sorted({sn for sn, _ in keys})
+    timestamps = [ts for _, ts in keys]
+    placeholders = ','.join(['%s'] * len(sns))
+    cursor.execute(f"""
+        SELECT id, device_sn, timestamp FROM t_user_health_data
+        WHERE device_sn IN ({placeholders}) AND timestamp BETWEEN %s AND %s
+    """, sns + [min(timestamps), max(timestamps)])
+    wanted = set(keys)
+    found = {}
+    for row_id, device_sn, ts in cursor.fetchall():
+        key = make_dedup_key(device_sn, ts)
+        if key in wanted:
+            found[key] = row_id
+    return found
+
+def process_health_data_batch(items: List[Dict[str, Any]], enable_alerts: bool = True) -> Dict[str, Any]:
+    """批量处理健康数据，返回 {'summary': {...}, 'results': [逐条结果]}"""
+    from .user_health_data import normalize_health_item, build_health_redis_mapping, parse_sleep_data, save_daily_weekly_data
+
+    start = time.time()
+    timings = {}
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    dedup = get_health_dedup()
+
+    #1. 解析与校验
+    parsed = []  # (index, item, key)
+    for i, raw in enumerate(items):
+        if i >= MAX_BATCH_ITEMS:
+            results[i] = {'index': i, 'status': 'rejected', 'message': f'单次最多{MAX_BATCH_ITEMS}条'}
+            continue
+        if not isinstance(raw, dict):
+            results[i] = {'index': i, 'status': 'invalid', 'message': '数据格式错误'}
+            continue
+        item = normalize_health_item(raw)
+        if not item['deviceSn']:
+            results[i] = {'index': i, 'status': 'invalid', 'message': '设备SN不能为空'}
+            continue
+        parsed.append((i, item, make_dedup_key(item['deviceSn'], item['timestamp'])))
+    timings['parse_ms'] = round((time.time() - start) * 1000, 2)
+
+    #2. 批次内去重 + Redis近期键过滤
+    t = time.time()
+    unique, _ = dedup.dedup_batch(parsed, lambda p: p[2])
+    first_index = {p[2]: p[0] for p in unique}
+    unique_ids = {id(p) for p in unique}
+    for p in parsed:
+        if id(p) not in unique_ids:
+            results[p[0]] = {'index': p[0], 'device_sn': p[2][0], 'timestamp': p[2][1], 'status': 'duplicate', 'duplicate_of': first_index[p[2]]}
+    recent_flags = dedup.filter_recent([p[2] for p in unique])
+    pending = []
+    for p, recent in zip(unique, recent_flags):
+        if recent:
+            results[p[0]] = {'index': p[0], 'device_sn': p[2][0], 'timestamp': p[2][1], 'status': 'duplicate'}
+        else:
+            pending.append(p)
+    timings['dedup_ms'] = round((time.time() - t) * 1000, 2)
+
+    #3. 一次IN查询补全缺失的用户/组织/租户
+    t = time.time()
+    missing_sns = {item['deviceSn'] for _, item, _ in pending if not (item['customerId'] and item['orgId'] and item['userId'])}
+    device_infos = get_device_resolver().resolve_many(missing_sns) if missing_sns else {}
+    for _, item, _ in pending:
+        info = device_infos.get(item['deviceSn']) or {}
+        item['customerId'] = item['customerId'] or info.get('customer_id')
+        item['orgId'] = item['orgId'] or info.get('org_id')
+        item['userId'] = item['userId'] or info.get('user_id')
+    timings['resolve_ms'] = round((time.time() - t) * 1000, 2)
+
+    #4. 已存在查询 + 一次多行INSERT + 回查新记录ID
+    t = time.time()
+    inserted = []  # (index, item, key, id)
+    if pending:
+        try:
+            with get_db_connection() as conn, conn.cursor() as cursor:
+                existing = _query_existing(cursor, [p[2] for p in pending])
+                to_insert = [p for p in pending if p[2] not in existing]
+                if to_insert:
+                    now = datetime.now()
+                    rows = [(item['deviceSn'], item['userId'], item['orgId'], item['customerId'], item['heartRate'],
+                             item['bloodOxygen'], item['temperature'], item['pressureHigh'], item['pressureLow'],
+                             item['stress'], item['step'], item['distance'], item['calorie'], item['latitude'],
+                             item['longitude'], item['altitude'], parse_sleep_data(item['sleepData']),
+                             item['timestamp'], item['uploadMethod'], now)
+                            for _, item, _ in to_insert]
+                    rows = [tuple(None if v == ' ' else v for v in row) for row in rows]  # 与convert_empty_to_none一致
+                    affected = cursor.executemany(MAIN_INSERT_SQL, rows) or 0
+                    conn.commit()
+                    dedup.record_insert(len(rows) + len(existing), affected)
+                    #分级汇总：全部为新记录时增量upsert，否则(并发写入同一键)按受影响时间段重算
+                    records = [dict(zip(MAIN_FIELDS, row)) for row in rows]
+                    get_health_rollup_maintainer().apply(conn, records, all_new=affected == len(rows))
+                    #大屏日计数：全部为新记录时直接累加，否则让读取方按明细重新统计
+                    if affected == len(rows):
+                        get_stats_counter_store().record_health(records)
+                    else:
+                        get_stats_counter_store().invalidate(records)
+                    new_ids = _query_existing(cursor, [p[2] for p in to_insert])
+                else:
+                    dedup.record_insert(len(existing), 0)
+                    new_ids = {}
+            for i, item, key in pending:
+                if key in existing:
+                    results[i] = {'index': i, 'device_sn': key[0], 'timestamp': key[1], 'status': 'duplicate', 'id': existing[key]}
+                elif key in new_ids:
+                    # 与并发写入竞争时也可能是对方刚插入的记录，此处统一视为已入库
+                    results[i] = {'index': i, 'device_sn': key[0], 'timestamp': key[1], 'status': 'inserted', 'id': new_ids[key]}
+                    inserted.append((i, item, key, new_ids[key]))
+                else:
+                    results[i] = {'index': i, 'device_sn': key[0], 'timestamp': key[1], 'status': 'error', 'message': '入库后未找到记录'}
+            dedup.mark_recent(p[2] for p in pending)
+        except Exception as e:
+            logger.error(f"批量写入健康数据失败: {e}, 条数: {len(pending)}", exc_info=True)
+            for i, _, key in pending:
+                results[i] = {'index': i, 'device_sn': key[0], 'timestamp': key[1], 'status': 'error', 'message': f'数据保存失败: {e}'}
+    timings['db_ms'] = round((time.time() - t) * 1000, 2)
+
+    #4.1 数据到达即心跳：刷新设备在线索引
+    if inserted:
+        get_device_presence().record_health({'customer_id': item['customerId'], 'org_id': item['orgId'],
+                                             'device_sn': item['deviceSn']} for _, item, _, _ in inserted)
+
+    #5. Redis最新值：按时间顺序提交写后缓冲，同一设备合并为最新一条，由后台pipeline统一刷新
+    t = time.time()
+    inserted.sort(key=lambda r: (r[2][0], r[2][1]))
+    mappings = {}
+    write_behind = get_redis_write_behind()
+    for i, item, key, row_id in inserted:
+        mappings[i] = build_health_redis_mapping(item, item['customerId'], item['orgId'], item['userId'])
+        write_behind.submit(key[0], mappings[i])
+    timings['redis_ms'] = round((time.time() - t) * 1000, 2)
+
+    #6. 告警检测：整批向量化评估(按设备+时间顺序传入，保证趋势类规则的连续性)，告警一次多行写入
+    t = time.time()
+    alert_errors = 0
+    alerts_generated = 0
+    if enable_alerts and inserted:
+        alert_result = generate_alerts_batch([mappings[i] for i, _, _, _ in inserted],
+                                             [row_id for _, _, _, row_id in inserted])
+        if alert_result.get('success'):
+            alerts_generated = alert_result.get('alerts_generated', 0)
+        else:
+            alert_errors = len(inserted)
+            logger.error(f"批量告警检测失败: {alert_result.get('error')}")
+    timings['alerts_ms'] = round((time.time() - t) * 1000, 2)
+
+    #7. 每日/每周数据：同一设备同一天只保存最新一条
+    t = time.time()
+    daily_latest = {}
+    for i, item, key, row_id in inserted:
+        if item['sleepData'] or item['exerciseDailyData'] or item['workoutData'] or item['exerciseDailyWeekData']:
+            daily_latest[(key[0], item['timestamp'].date())] = item
+    for item in daily_latest.values():
+        save_daily_weekly_data(item['deviceSn'], item['sleepData'], item['exerciseDailyData'], item['workoutData'],
+                               item['exerciseDailyWeekData'], item['scientificSleepData'], item['timestamp'])
+    timings['daily_weekly_ms'] = round((time.time() - t) * 1000, 2)
+
+    summary = {'total': len(items), 'inserted': 0, 'duplicate': 0, 'invalid': 0, 'rejected': 0, 'error': 0}
+    for r in results:
+        summary[r['status']] = summary.get(r['status'], 0) + 1
+    summary['alert_errors'] = alert_errors
+    summary['alerts_generated'] = alerts_generated
+    summary['elapsed_ms'] = round((time.time() - start) * 1000, 2)
+    summary['timings'] = timings
+    logger.info(f"📦 健康数据批量上传完成: {summary}")
+    return {'summary': summary, 'results': results}
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+健康数据列式读取
+分析类查询(基线/评分/画像)只需要指标数值，不需要逐行拼装字典：
+SQL中把空值换成哨兵值并统一转为DOUBLE，服务端游标按块读取，每块一次转换为定长NumPy数组，
+最终拼接为HealthColumns(每列一个数组，指标列float64、缺失为NaN，时间为datetime64[s])，
+可零拷贝构造pandas DataFrame或按时间掩码切片复用。
+取表规则与get_all_health_data_optimized一致：7天内的窗口读主表，更早的窗口依次读覆盖的月度分区表(分区均无数据时回退主表)，
+过滤软删除记录。各表按分区目录中的实际字段生成查询：月度分区没有的指标列(如sleep)读为缺失值，
+缺少过滤字段(如customer_id)的表跳过(与游标分页_keyset_sources一致)
+"""
+
+import time
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from .partition_catalog import get_partition_catalog
+
+logger = logging.getLogger(__name__)
+
+HEALTH_FEATURES = ["heart_rate", "blood_oxygen", "temperature", "pressure_high", "pressure_low",
+                   "stress", "step", "calorie", "distance", "sleep"]
+MISSING = -1  # 指标均为非负数，空值在SQL中替换为-1后转NaN
+CHUNK_SIZE = 5000
+MAIN_TABLE = 't_user_health_data'
+RECENT_DAYS = 7  # 与_determine_query_strategy一致：开始时间在7天内读主表，否则读月度分区
+COLUMN_SQL = """
+    SELECT device_sn, {user_id}, {org_id},
+           TIMESTAMPDIFF(SECOND, '1970-01-01 00:00:00', timestamp) * 1E0, {features}
+    FROM {table}
+    WHERE {scope} AND timestamp >= %s AND timestamp < %s{deleted}
+    ORDER BY timestamp
+"""
+
+class HealthColumns:
+    """列式健康数据：device_sn(object)、user_id/org_id(int64)、timestamp(datetime64[s])及各指标(float64)"""
+
+    def __init__(self, columns: Dict[str, np.ndarray], features: Sequence[str] = HEALTH_FEATURES):
+        self.columns = columns
+        self.features = list(features)
+
+    @classmethod
+    def empty(cls, features: Sequence[str] = HEALTH_FEATURES) -> 'HealthColumns':
+        columns = {'device_sn': np.empty(0, dtype=object), 'user_id': np.empty(0, dtype=np.int64),
+                   'org_id': np.empty(0, dtype=np.int64), 'timestamp': np.empty(0, dtype='datetime64[s]')}
+        columns.update({feature: np.empty(0) for feature in features})
+        return cls(columns, features)
+
+    @classmethod
+    def concat(cls, parts: Sequence['HealthColumns'], features: Sequence[str] = HEALTH_FEATURES) -> 'HealthColumns':
+        """按顺序拼接(各部分已按时间升序且时间不重叠，如按月份排列的分区)"""
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return cls.empty(features)
+        if len(parts) == 1:
+            return parts[0]
+        return cls({name: np.concatenate([part.columns[name] for part in parts]) for name in parts[0].columns},
+                   features)
+
+    def __len__(self) -> int:
+        return len(self.columns['timestamp'])
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.columns
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in self.columns.values())
+
+    def since(self, start: datetime) -> 'HealthColumns':
+        """按开始时间切片(数据已按时间升序)，返回视图不复制"""
+        position = int(np.searchsorted(self.columns['timestamp'], np.datetime64(start, 's')))
+        return HealthColumns({name: array[position:] for name, array in self.columns.items()}, self.features)
+
+    def to_dataframe(self, ranges: Optional[Dict[str, tuple]] = None) -> pd.DataFrame:
+        """构造DataFrame；给定ranges时超出范围的指标值置为NaN(与逐行清洗规则一致)"""
+        data = dict(self.columns)
+        if ranges:
+            for feature in self.features:
+                low, high = ranges.get(feature, (0, 10000))
+                values = data[feature]
+                data[feature] = np.where((values >= low) & (values <= high), values, np.nan)
+        return pd.DataFrame(data, copy=False)
+
+def _chunk_to_arrays(rows: Sequence[tuple], features: Sequence[str]) -> Dict[str, np.ndarray]:
+    block = np.array(rows, dtype=object)
+    numeric = block[:, 1:].astype(np.float64)
+    metrics = numeric[:, 3:]
+    metrics[metrics == MISSING] = np.nan
+    chunk = {'device_sn': block[:, 0], 'user_id': numeric[:, 0].astype(np.int64),
+             'org_id': numeric[:, 1].astype(np.int64), 'timestamp': numeric[:, 2].astype('datetime64[s]')}
+    chunk.update({feature: metrics[:, i].copy() for i, feature in enumerate(features)})
+    return chunk
+
+def read_columns(cursor, sql: str, params: Sequence, features: Sequence[str] = HEALTH_FEATURES,
+                 chunk_size: int = CHUNK_SIZE) -> HealthColumns:
+    """执行查询并按块读取为列数组(cursor建议使用服务端游标SSCursor)"""
+    cursor.execute(sql, params)
+    chunks = []
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        chunks.append(_chunk_to_arrays(rows, features))
+    if not chunks:
+        return HealthColumns.empty(features)
+    if len(chunks) == 1:
+        return HealthColumns(chunks[0], features)
+    return HealthColumns({name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}, features)
+
+def _build_scope(user_id=None, org_ids: Optional[Iterable[int]] = None, customer_id=None):
+    """返回(过滤字段, 条件, 参数)"""
+    if user_id is not None:
+        return 'user_id', 'user_id = %s', [user_id]
+    if org_ids:
+        org_ids = list(org_ids)
+        return 'org_id', f"org_id IN ({', '.join(['%s'] * len(org_ids))})", org_ids
+    if customer_id is not None:
+        return 'customer_id', 'customer_id = %s', [customer_id]
+    raise ValueError('必须指定user_id、org_ids或customer_id')
+
+def _default_connection():
+    from .db_pool import get_db_connection
+    return get_db_connection(readonly=True)
+
+def source_tables(start: datetime, end: datetime, now: Optional[datetime] = None) -> List[str]:
+    """窗口[start, end)需要读取的表：近期为主表，历史为实际存在的月度分区(按月份升序)"""
+    now = now or datetime.now()
+    if (now - start).days <= RECENT_DAYS:
+        return [MAIN_TABLE]
+    return get_partition_catalog().partitions_between(start, end - timedelta(seconds=1)) or [MAIN_TABLE]
+
+def _table_sql(table: str, scope_column: str, scope: str, features: Sequence[str]) -> Optional[str]:
+    """按表的实际字段生成查询：缺少的指标列读为缺失值，缺少过滤字段或timestamp的表返回None(跳过)；
+    目录不可用时主表按完整字段处理"""
+    columns = get_partition_catalog().columns(table)
+    if not columns and table != MAIN_TABLE:
+        logger.warning(f"⚠️ 表 {table} 不存在，跳过")
+        return None
+
+    def has(column):
+        return not columns or column in columns
+
+    if not has(scope_column) or not has('timestamp'):
+        logger.warning(f"⚠️ 表 {table} 缺少过滤字段 {scope_column}，跳过")
+        return None
+    select = ', '.join(f"IFNULL({feature}, {MISSING}) * 1E0" if has(feature) else f"{MISSING} * 1E0"
+                       for feature in features)
+    ids = {column: f"IFNULL({column}, 0) * 1E0" if has(column) else '0E0' for column in ('user_id', 'org_id')}
+    deleted = ' AND is_deleted = 0' if has('is_deleted') else ''
+    return COLUMN_SQL.format(features=select, table=table, scope=scope, deleted=deleted, **ids)
+
+def fetch_health_columns(start_date, end_date, user_id=None, org_id=None, customer_id=None,
+                         features: Sequence[str] = HEALTH_FEATURES, table: Optional[str] = None,
+                         connection_factory: Optional[Callable] = None) -> HealthColumns:
+    """
+    按用户/组织(含下级组织)/租户读取时间范围内的健康指标列
+
+    Args:
+        start_date: 开始日期(YYYY-MM-DD或datetime)
+        end_date: 结束日期(含当天)
+        org_id: 组织ID，组织森林命中时覆盖整棵子树
+        table: 指定读取的表；缺省按时间窗口选择主表或月度分区
+    """
+    import pymysql
+    begin = time.time()
+    sd = datetime.strptime(start_date, '%Y-%m-%d') if isinstance(start_date, str) else start_date
+    ed = datetime.strptime(end_date, '%Y-%m-%d') if isinstance(end_date, str) else end_date
+    ed = ed + timedelta(days=1)
+    org_ids = None
+    if org_id is not None and user_id is None:
+        from .org_forest import get_org_forest
+        org_ids = get_org_forest().descendants(org_id) or [org_id]
+    scope_column, scope, params = _build_scope(user_id, org_ids, customer_id)
+    tables = [table] if table else source_tables(sd, ed)
+
+    def read(conn, table_name):
+        sql = _table_sql(table_name, scope_column, scope, features)
+        if sql is None:
+            return HealthColumns.empty(features)
+        with conn.cursor(pymysql.cursors.SSCursor) as cursor:
+            return read_columns(cursor, sql, params + [sd, ed], features)
+
+    with (connection_factory or _default_connection)() as conn:
+        columns = HealthColumns.concat([read(conn, table_name) for table_name in tables], features)
+        if not len(columns) and MAIN_TABLE not in tables:
+            logger.info(f"❗️ 分区表无数据，回退到主表: {tables}")
+            tables = [MAIN_TABLE]
+            columns = read(conn, MAIN_TABLE)
+    logger.info(f"📊 列式读取健康数据: {len(columns)}行, 表{len(tables)}个, {columns.nbytes / 1024:.0f}KB, "
+                f"耗时{(time.time() - begin) * 1000:.0f}ms")
+    return columns
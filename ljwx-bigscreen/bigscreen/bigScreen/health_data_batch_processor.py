@@ -4,10 +4,18 @@ from datetime import datetime,timedelta,date
 from .models import db,UserHealthData,UserHealthDataDaily,UserHealthDataWeekly,HealthDataConfig
 from .redis_helper import RedisHelper
 from .alert import generate_alerts
+from .alert_batch_evaluator import generate_alerts_batch, get_batch_alert_evaluator
 import json,threading,queue,time,asyncio
 from sqlalchemy import text,and_,or_
 from concurrent.futures import ThreadPoolExecutor
 from config import MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DATABASE
+from .db_pool import get_mysql_pool
+from .device_resolver import get_device_resolver
+from .redis_write_behind import get_redis_write_behind
+from .health_dedup import get_health_dedup,make_dedup_key,MAIN_FIELDS,MAIN_INSERT_SQL
+from .health_rollup import get_health_rollup_maintainer
+from .stats_counters import get_stats_counter_store
+from .device_presence import get_device_presence
 import pymysql
 import psutil
 from dataclasses import dataclass
@@ -20,6 +28,12 @@ from logging_config import health_logger,db_logger,redis_logger,log_health_data_
 redis=RedisHelper()
 logger=health_logger#使用健康数据专用记录器
 
+class UserOrgInfo:#设备归属信息(兼容原SQLAlchemy结果的属性访问)
+    def __init__(self,user_id,org_id,customer_id):
+        self.user_id=user_id
+        self.org_id=org_id
+        self.customer_id=customer_id
+
 class HealthDataOptimizer:#健康数据性能优化器V5.0 - 多队列分片版本
     def __init__(self):
         # CPU自适应配置
@@ -99,6 +113,17 @@ class HealthDataOptimizer:#健康数据性能优化器V5.0 - 多队列分片版
             
             db_logger.info('批处理开始',extra={'batch_size':len(batch_data),'data_count':len(batch_data)})
             
+            #批次内去重 + Redis近期键过滤(数据库唯一键uk_device_timestamp兜底)
+            dedup=get_health_dedup()
+            batch_data,batch_dups=dedup.dedup_batch(batch_data,lambda it:make_dedup_key(it['device_sn'],it['main_data'].get('timestamp')))
+            recent_flags=dedup.filter_recent([make_dedup_key(it['device_sn'],it['main_data'].get('timestamp')) for it in batch_data])
+            redis_dups=sum(recent_flags)
+            batch_data=[it for it,dup in zip(batch_data,recent_flags) if not dup]
+            if batch_dups or redis_dups:
+                self._legacy_stats['duplicates']+=batch_dups+redis_dups
+                db_logger.info('批次去重完成',extra={'batch_duplicates':batch_dups,'redis_duplicates':redis_dups,'data_count':len(batch_data)})
+            if not batch_data:return
+            
             #分离不同类型的数据
             main_records=[]
             daily_records=[]
@@ -115,105 +140,35 @@ class HealthDataOptimizer:#健康数据性能优化器V5.0 - 多队列分片版
             
             db_logger.info('数据分离完成',extra={'main_count':len(main_records),'daily_count':len(daily_records),'weekly_count':len(weekly_records)})
             
-            # 使用pymysql直接连接
-            conn = pymysql.connect(
-                host=MYSQL_HOST,
-                port=MYSQL_PORT,
-                user=MYSQL_USER,
-                password=MYSQL_PASSWORD,
-                database=MYSQL_DATABASE,
-                autocommit=False
-            )
+            # 从共享连接池借用连接
+            pool = get_mysql_pool()
+            conn = pool.acquire()
             
             try:
                 with conn.cursor() as cursor:
-                    #批量插入主表
+                    #批量插入主表：多行INSERT，重复键由唯一索引忽略(id=id不修改行，受影响行数即新插入条数)
                     if main_records:
+                        rows=[self._main_row(record) for record in main_records]
                         try:
-                            insert_sql = """
-                                INSERT INTO t_user_health_data 
-                                (device_sn, user_id, org_id, customer_id, heart_rate, blood_oxygen, temperature, 
-                                 pressure_high, pressure_low, stress, step, distance, calorie, 
-                                 latitude, longitude, altitude, sleep, timestamp, upload_method, create_time)
-                                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
-                            """
-                            
-                            for record in main_records:
-                                cursor.execute(insert_sql, (
-                                    record.get('device_sn'),
-                                    record.get('user_id'),
-                                    record.get('org_id'),
-                                    record.get('customer_id'),
-                                    record.get('heart_rate'),
-                                    record.get('blood_oxygen'),
-                                    record.get('temperature'),
-                                    record.get('pressure_high'),
-                                    record.get('pressure_low'),
-                                    record.get('stress'),
-                                    record.get('step'),
-                                    record.get('distance'),
-                                    record.get('calorie'),
-                                    record.get('latitude'),
-                                    record.get('longitude'),
-                                    record.get('altitude'),
-                                    record.get('sleep'),
-                                    record.get('timestamp'),
-                                    record.get('upload_method')
-                                ))
-                            
+                            inserted=cursor.executemany(MAIN_INSERT_SQL,rows) or 0
                             conn.commit()
-                            db_logger.info('主表批量插入成功',extra={'data_count':len(main_records)})
+                            dedup.record_insert(len(rows),inserted)
+                            self._legacy_stats['duplicates']+=len(rows)-inserted
+                            dedup.mark_recent(make_dedup_key(r['device_sn'],r.get('timestamp')) for r in main_records)
+                            db_logger.info('主表批量插入成功',extra={'data_count':len(rows),'inserted':inserted,'db_duplicates':len(rows)-inserted})
+                            #分级汇总：全部为新记录时增量upsert，否则按受影响时间段重算
+                            get_health_rollup_maintainer().apply(conn,main_records,all_new=inserted==len(rows))
+                            #大屏日计数：全部为新记录时直接累加，否则让读取方按明细重新统计
+                            if inserted==len(rows):get_stats_counter_store().record_health(main_records)
+                            else:get_stats_counter_store().invalidate(main_records)
                         except Exception as e:
-                            print(f"❌ 主表批量插入失败详细错误: {str(e)}")
-                            print(f"❌ 错误类型: {type(e).__name__}")
-                            import traceback
-                            print(f"❌ 错误堆栈: {traceback.format_exc()}")
-                            db_logger.error('主表批量插入失败，尝试单条插入处理重复',extra={'error':str(e),'data_count':len(main_records)})
+                            db_logger.error('主表批量插入失败，改为逐条插入',extra={'error':str(e),'data_count':len(rows)},exc_info=True)
                             conn.rollback()
-                            # 批量插入失败时，使用单条插入处理重复记录
-                            try:
-                                for record in main_records:
-                                    cursor.execute("""
-                                        SELECT id FROM t_user_health_data 
-                                        WHERE device_sn = %s AND timestamp = %s
-                                    """, (record.get('device_sn'), record.get('timestamp')))
-                                    
-                                    existing = cursor.fetchone()
-                                    if not existing:
-                                        cursor.execute(insert_sql, (
-                                            record.get('device_sn'),
-                                            record.get('user_id'),
-                                            record.get('org_id'),
-                                            record.get('customer_id'),
-                                            record.get('heart_rate'),
-                                            record.get('blood_oxygen'),
-                                            record.get('temperature'),
-                                            record.get('pressure_high'),
-                                            record.get('pressure_low'),
-                                            record.get('stress'),
-                                            record.get('step'),
-                                            record.get('distance'),
-                                            record.get('calorie'),
-                                            record.get('latitude'),
-                                            record.get('longitude'),
-                                            record.get('altitude'),
-                                            record.get('sleep'),
-                                            record.get('timestamp'),
-                                            record.get('upload_method')
-                                        ))
-                                    else:
-                                        self.stats['duplicates'] += 1
-                                        db_logger.debug('跳过重复记录',extra={'device_sn':record.get('device_sn'),'timestamp':record.get('timestamp')})
-                                
-                                conn.commit()
-                                db_logger.info('主表单条插入完成',extra={'data_count':len(main_records)})
-                            except Exception as fallback_error:
-                                print(f"❌ 主表单条插入失败详细错误: {str(fallback_error)}")
-                                print(f"❌ 单条插入错误类型: {type(fallback_error).__name__}")
-                                import traceback
-                                print(f"❌ 单条插入错误堆栈: {traceback.format_exc()}")
-                                db_logger.error('主表单条插入也失败',extra={'error':str(fallback_error),'data_count':len(main_records)})
-                                conn.rollback()
+                            self._insert_main_one_by_one(conn,main_records)
+                            get_health_rollup_maintainer().apply(conn,main_records,all_new=False)
+                            get_stats_counter_store().invalidate(main_records)
+                        #数据到达即心跳：刷新设备在线索引
+                        get_device_presence().record_health(main_records)
                     
                     #批量处理每日表
                     if daily_records:
@@ -306,21 +261,29 @@ class HealthDataOptimizer:#健康数据性能优化器V5.0 - 多队列分片版
                             conn.rollback()
                             
             finally:
-                conn.close()
+                pool.release(conn)
             
-            #异步处理Redis和告警
+            #异步处理Redis，告警整批向量化评估(一次多行写入t_alert_info)
+            alert_items=[item for item in batch_data if item.get('enable_alerts',True)]
             try:
                 for item in batch_data:
                     if not self.executor._shutdown:  #检查线程池是否已关闭
-                        self.executor.submit(self._async_process,item)
+                        self.executor.submit(self._async_process,item,False)
                     else:
                         #如果线程池已关闭，直接同步处理
-                        self._async_process(item)
+                        self._async_process(item,False)
+                if alert_items:
+                    if not self.executor._shutdown:
+                        self.executor.submit(self._process_alerts_batch,alert_items)
+                    else:
+                        self._process_alerts_batch(alert_items)
             except RuntimeError as re:
                 if 'cannot schedule new futures after shutdown' in str(re):
                     #线程池已关闭，改为同步处理
                     for item in batch_data:
-                        self._async_process(item)
+                        self._async_process(item,False)
+                    if alert_items:
+                        self._process_alerts_batch(alert_items)
                 else:
                     raise re
                 
@@ -332,46 +295,40 @@ class HealthDataOptimizer:#健康数据性能优化器V5.0 - 多队列分片版
             self.stats['errors']+=1
             health_logger.error('批处理失败',extra={'error':str(e),'data_count':len(batch_data) if batch_data else 0},exc_info=True)
             
-    def _insert_main_one_by_one(self,main_records):#单条插入主表处理重复
+    def _main_row(self,record):#主表记录转插入参数
+        return tuple(record.get(f) for f in MAIN_FIELDS)+(datetime.now(),)
+    
+    def _insert_main_one_by_one(self,conn,main_records):#批量失败时逐条插入，隔离异常记录
+        dedup=get_health_dedup()
+        inserted_keys=[]
         success_count=0
-        for record in main_records:
-            try:
-                existing=db.session.query(UserHealthData.id).filter(
-                    and_(UserHealthData.device_sn==record['device_sn'],
-                        UserHealthData.timestamp==record['timestamp'])
-                ).first()
-                
-                if existing:
-                    self.stats['duplicates']+=1
-                    continue
-                    
-                health_record=UserHealthData(**record)
-                db.session.add(health_record)
-                db.session.commit()
-                success_count+=1
-                
-            except Exception as e:
+        duplicate_count=0
+        with conn.cursor() as cursor:
+            for record in main_records:
                 try:
-                    db.session.rollback()
-                except:
-                    pass#忽略回滚错误
-                if 'Duplicate entry' not in str(e):
-                    logger.error(f'单条插入失败: {e}')
-                else:
-                    self.stats['duplicates']+=1
-                    
-        logger.info(f'主表单条插入完成: {success_count}条成功')
-            
-    def _async_process(self,item):#异步处理Redis和告警
+                    if cursor.execute(MAIN_INSERT_SQL,self._main_row(record)):
+                        success_count+=1
+                    else:
+                        duplicate_count+=1
+                    conn.commit()
+                    inserted_keys.append(make_dedup_key(record.get('device_sn'),record.get('timestamp')))
+                except Exception as e:
+                    conn.rollback()
+                    logger.error(f'单条插入失败: {e}, device_sn={record.get("device_sn")}, timestamp={record.get("timestamp")}')
+        dedup.record_insert(success_count+duplicate_count,success_count)
+        dedup.mark_recent(inserted_keys)
+        self._legacy_stats['duplicates']+=duplicate_count
+        logger.info(f'主表单条插入完成: {success_count}条成功, {duplicate_count}条重复')
+            
+    def _async_process(self,item,with_alerts=True):#异步处理Redis和告警(批量刷新时告警由_process_alerts_batch统一处理)
         try:
             device_sn=item['device_sn']
             redis_logger.info('Redis数据更新开始',extra={'device_sn':device_sn})
             
-            redis.hset_data(f"health_data:{device_sn}",mapping=item['redis_data'])
-            redis.publish(f"health_data_channel:{device_sn}",device_sn)
-            redis_logger.info('Redis数据更新完成',extra={'device_sn':device_sn,'data_count':len(item['redis_data'])})
+            get_redis_write_behind().submit(device_sn,item['redis_data'])#由写后缓冲合并后批量hset+publish
+            redis_logger.info('Redis数据已提交写后缓冲',extra={'device_sn':device_sn,'data_count':len(item['redis_data'])})
             
-            if item.get('enable_alerts',True):
+            if with_alerts and item.get('enable_alerts',True):
                 from logging_config import alert_logger
                 alert_logger.info('告警检测开始',extra={'device_sn':device_sn})
                 
@@ -386,6 +343,21 @@ class HealthDataOptimizer:#健康数据性能优化器V5.0 - 多队列分片版
         except Exception as e:
             health_logger.error('异步处理失败',extra={'device_sn':item.get('device_sn','unknown'),'error':str(e)},exc_info=True)
             
+    def _process_alerts_batch(self,items):#整批告警检测：按设备+时间排序后向量化评估
+        from logging_config import alert_logger
+        items=sorted(items,key=lambda it:(it['device_sn'],str(it['redis_data'].get('timestamp') or '')))
+        try:
+            samples=[item['redis_data'] for item in items]
+            health_ids=[item.get('health_data_id') for item in items]
+            if self.app:
+                with self.app.app_context():
+                    result=generate_alerts_batch(samples,health_ids)
+            else:
+                result=generate_alerts_batch(samples,health_ids)
+            alert_logger.info('批量告警检测完成',extra={'data_count':len(items),'alerts_generated':result.get('alerts_generated',0)})
+        except Exception as e:
+            health_logger.error('批量告警检测失败',extra={'data_count':len(items),'error':str(e)},exc_info=True)
+            
     def get_health_config_fields(self,customer_id):#获取健康数据配置字段
         """根据客户ID获取配置的健康数据字段"""
         try:
@@ -424,91 +396,16 @@ class HealthDataOptimizer:#健康数据性能优化器V5.0 - 多队列分片版
         return date_obj-timedelta(days=days_since_monday)
 
     def _get_user_org_info(self,device_sn):#获取用户组织信息
-        """根据设备SN获取用户和组织信息"""
-        print(f"🔍 开始查询用户组织信息: device_sn={device_sn}")
+        """根据设备SN获取用户和组织信息(经设备归属解析器两级缓存)"""
         try:
-            # 直接使用pymysql连接，避免SQLAlchemy的URL解析问题
-            conn = pymysql.connect(
-                host=MYSQL_HOST,
-                port=MYSQL_PORT,
-                user=MYSQL_USER,
-                password=MYSQL_PASSWORD,
-                database=MYSQL_DATABASE
-            )
-            print(f"✅ 数据库连接成功: {MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DATABASE}")
-            
-            try:
-                with conn.cursor() as cursor:
-                    query_sql = """
-                        SELECT u.id as user_id, uo.org_id
-                        FROM sys_user u 
-                        LEFT JOIN sys_user_org uo ON u.id = uo.user_id
-                        WHERE u.device_sn = %s AND u.is_deleted = 0
-                        LIMIT 1
-                    """
-                    print(f"🔍 执行用户查询SQL: {query_sql} with device_sn={device_sn}")
-                    cursor.execute(query_sql, (device_sn,))
-                    result = cursor.fetchone()
-                    print(f"🔍 用户查询结果: {result}")
-                    
-                    if result:
-                        user_id, org_id = result[0], result[1]
-                        customer_id = None
-                        print(f"✅ 找到用户: user_id={user_id}, org_id={org_id}")
-                        
-                        # 通过org_id查找sys_org_units的ancestors获取租户ID
-                        if org_id:
-                            org_query_sql = """
-                                SELECT ancestors FROM sys_org_units 
-                                WHERE id = %s AND is_deleted = 0
-                                LIMIT 1
-                            """
-                            print(f"🔍 执行组织查询SQL: {org_query_sql} with org_id={org_id}")
-                            cursor.execute(org_query_sql, (org_id,))
-                            org_result = cursor.fetchone()
-                            print(f"🔍 组织查询结果: {org_result}")
-                            
-                            if org_result and org_result[0]:
-                                ancestors = org_result[0]
-                                print(f"🔍 组织ancestors: {ancestors}")
-                                # 解析ancestors格式(0,X,Y...)，获取第二个数字X作为租户ID
-                                parts = ancestors.split(',')
-                                if len(parts) >= 2 and parts[0] == '0':
-                                    try:
-                                        customer_id = int(parts[1])
-                                        print(f"✅ 解析出customer_id: {customer_id}")
-                                    except ValueError:
-                                        print(f"❌ ancestors格式异常: {ancestors}")
-                                        logger.warning(f'ancestors格式异常: {ancestors}')
-                                else:
-                                    print(f"⚠️ ancestors格式不符合预期: {ancestors}")
-                            else:
-                                print(f"⚠️ 未找到组织信息或ancestors为空")
-                        else:
-                            print(f"⚠️ org_id为空")
-                        
-                        # 创建类似SQLAlchemy结果的对象
-                        class UserOrgInfo:
-                            def __init__(self, user_id, org_id, customer_id):
-                                self.user_id = user_id
-                                self.org_id = org_id
-                                self.customer_id = customer_id
-                        
-                        user_org_info = UserOrgInfo(user_id, org_id, customer_id)
-                        print(f"✅ 用户组织信息构建完成: user_id={user_org_info.user_id}, org_id={user_org_info.org_id}, customer_id={user_org_info.customer_id}")
-                        return user_org_info
-                    else:
-                        print(f"❌ 未找到设备对应的用户: {device_sn}")
-                        return None
-            finally:
-                conn.close()
-                print(f"✅ 数据库连接已关闭")
-                
+            info=get_device_resolver().resolve(device_sn)
+            if not info:
+                print(f"❌ 未找到设备对应的用户: {device_sn}")
+                return None
+            print(f"✅ 用户组织信息: user_id={info['user_id']}, org_id={info['org_id']}, customer_id={info['customer_id']}")
+            return UserOrgInfo(info['user_id'],info['org_id'],info['customer_id'])
         except Exception as e:
             print(f"❌ 获取用户组织信息异常: {e}")
-            print(f"❌ 异常详情: {type(e).__name__} - {str(e)}")
-            import traceback
-            print(f"❌ 完整异常堆栈: {traceback.format_exc()}")
             logger.error(f'获取用户组织信息失败: {e}')
             return None
 
@@ -557,29 +454,12 @@ class HealthDataOptimizer:#健康数据性能优化器V5.0 - 多队列分片版
                     timestamp=datetime.now()
             print(f"🔍 处理后时间戳: {timestamp}")
             
-            #正确的重复检测：只用device_sn+timestamp，查询数据库而非内存
+            #快速重复检测：只查Redis近期键集合，不再逐条查库；漏网的重复在刷新时由批次去重和唯一键处理
             duplicate_key=f"{device_sn}:{timestamp.strftime('%Y-%m-%d %H:%M:%S')}"
-            print(f"🔍 重复检测键: {duplicate_key}")
-            
-            #直接查询数据库检查是否重复，而不是依赖内存缓存
-            try:
-                conn = pymysql.connect(host=MYSQL_HOST,port=MYSQL_PORT,user=MYSQL_USER,password=MYSQL_PASSWORD,database=MYSQL_DATABASE)
-                try:
-                    with conn.cursor() as cursor:
-                        cursor.execute("SELECT id FROM t_user_health_data WHERE device_sn = %s AND timestamp = %s LIMIT 1",(device_sn,timestamp))
-                        existing_record = cursor.fetchone()
-                        if existing_record:
-                            print(f"⚠️ 数据库中已存在相同记录: {duplicate_key}, id={existing_record[0]}")
-                            logger.info(f'跳过重复数据(数据库已存在): {duplicate_key}')
-                            return {'success':True,'reason':'duplicate','message':'数据库中已存在相同时间戳数据'}
-                        else:
-                            print(f"✅ 数据库重复检查通过: {duplicate_key}")
-                finally:
-                    conn.close()
-            except Exception as e:
-                print(f"❌ 重复检查失败，继续处理: {e}")
-                logger.warning(f'重复检查失败，继续处理: {e}')
-                #如果数据库查询失败，继续处理数据
+            if get_health_dedup().is_recent(device_sn,timestamp):
+                self._legacy_stats['duplicates']+=1
+                logger.info(f'跳过重复数据(近期已入库): {duplicate_key}')
+                return {'success':True,'reason':'duplicate','message':'数据库中已存在相同时间戳数据'}
             
             #分离字段类型
             fast_fields=['heart_rate','blood_oxygen','temperature','pressure_high','pressure_low','stress','step','distance','calorie','latitude','longitude','altitude','sleep']
@@ -662,7 +542,7 @@ class HealthDataOptimizer:#健康数据性能优化器V5.0 - 多队列分片版
             else:
                 print(f"❌ 数据加入分片处理队列失败: {device_sn}")
                 return {'success': False, 'reason': 'queue_full', 'message': '分片处理队列已满'}
-            # 不再维护内存中的processed_keys，因为重复检测已在数据库层面完成
+            # 不再维护内存中的processed_keys，重复检测由Redis近期键和数据库唯一键完成
             # self.processed_keys.add(duplicate_key)
             return {'success':True,'reason':'queued','message':'数据已加入处理队列'}
             
@@ -739,6 +619,13 @@ class HealthDataOptimizer:#健康数据性能优化器V5.0 - 多队列分片版
         stats['batch_size'] = self.batch_size
         stats['max_workers'] = self.executor._max_workers
         stats['queue_size']=self.sharded_processor.get_queue_size()
+        stats['shard_count']=self.sharded_processor.shard_count
+        stats['device_resolver']=get_device_resolver().get_cache_stats()
+        stats['dedup']=get_health_dedup().get_stats()
+        stats['redis_write_behind']=get_redis_write_behind().get_stats()
+        stats['batch_alerts']=get_batch_alert_evaluator().get_stats()
+        stats['rollup']=get_health_rollup_maintainer().get_stats()
+        stats['stats_counters']=get_stats_counter_store().get_stats()
         stats['performance_window_size'] = len(getattr(self, 'performance_window', []))
         # 不再统计processed_keys_count，因为已移除内存重复检测
         # stats['processed_keys_count']=len(self.processed_keys)
@@ -780,6 +667,7 @@ class HealthDataOptimizer:#健康数据性能优化器V5.0 - 多队列分片版
 
 #全局优化器实例
 optimizer=HealthDataOptimizer()
+health_data_optimizer=optimizer#监控接口(/api/monitoring/shards)使用的别名
 
 def optimized_upload_health_data(health_data):#优化的健康数据上传V3.1
     """配置化健康数据上传处理"""
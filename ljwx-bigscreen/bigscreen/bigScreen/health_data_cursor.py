@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+健康数据跨月分区游标分页
+每个分区表按(timestamp DESC, id DESC)用keyset条件分批读取，多个分区以堆归并成一条有序流；
+翻页使用不透明游标(上一页最后一条的timestamp+id)，第N页与第1页代价相同，总数统计可选
+"""
+
+import json
+import time
+import heapq
+import base64
+import logging
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import bindparam, text
+
+logger = logging.getLogger(__name__)
+
+CURSOR_VERSION = 1
+
+class InvalidCursorError(ValueError):
+    """分页游标无法解析(被篡改或版本不符)"""
+
+class KeysetSource(NamedTuple):
+    """一个分区表数据源: 查询字段(须含timestamp/id)与过滤条件(参数由read_page统一传入)"""
+    table: str
+    fields: Sequence[str]
+    where: Sequence[str]
+
+class KeysetPage(NamedTuple):
+    rows: List[Any]
+    next_cursor: Optional[str]  # None表示没有更多数据
+    total_count: Optional[int]  # 未要求统计时为None
+    stats: Dict[str, Any]
+
+def _format_ts(value) -> str:
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S.%f')
+    return str(value)
+
+def encode_cursor(timestamp, row_id, source: Optional[str] = None) -> str:
+    """游标 = base64(JSON{timestamp, id[, src]})，对调用方不透明；src记录首页实际读取的数据源(如回退到的主表)"""
+    payload = {'v': CURSOR_VERSION, 'ts': _format_ts(timestamp), 'id': int(row_id)}
+    if source:
+        payload['src'] = source
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+def _cursor_payload(token: str) -> Dict[str, Any]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode())
+        payload['ts'], payload['id'] = str(payload['ts']), int(payload['id'])
+    except Exception as e:
+        raise InvalidCursorError(f"无效的分页游标: {e}")
+    if payload.get('v') != CURSOR_VERSION:
+        raise InvalidCursorError(f"不支持的游标版本: {payload.get('v')}")
+    return payload
+
+def decode_cursor(token: Optional[str]) -> Optional[Tuple[str, int]]:
+    """解析游标，返回(timestamp, id)；格式错误抛InvalidCursorError"""
+    if not token:
+        return None
+    payload = _cursor_payload(token)
+    return payload['ts'], payload['id']
+
+def cursor_source(token: Optional[str]) -> Optional[str]:
+    """游标记录的数据源表，未记录时为None"""
+    return _cursor_payload(token).get('src') if token else None
+
+def with_cursor_source(token: Optional[str], source: str) -> Optional[str]:
+    """为下一页游标标记数据源，后续翻页沿用同一数据源"""
+    return encode_cursor(*decode_cursor(token), source=source) if token else None
+
+def _row_key(row) -> Tuple[str, int]:
+    return _format_ts(row.timestamp), row.id
+
+def _default_execute(statement, params):
+    from .models import db
+    return db.session.execute(statement, params).fetchall()
+
+class KeysetPartitionReader:
+    """跨分区keyset读取 + 堆归并"""
+
+    def __init__(self, execute: Optional[Callable[[Any, Dict[str, Any]], List[Any]]] = None, max_chunk: int = 1000):
+        self._execute = execute or _default_execute
+        self.max_chunk = max_chunk  # 单次从一个分区读取的最大行数
+        self.stats = {'pages': 0, 'partition_queries': 0, 'rows_fetched': 0, 'rows_returned': 0,
+                      'count_queries': 0, 'total_page_ms': 0.0}
+
+    @staticmethod
+    def _statement(sql: str, params: Dict[str, Any]):
+        statement = text(sql)
+        expanding = [bindparam(name, expanding=True) for name, value in params.items() if isinstance(value, (list, tuple))]
+        return statement.bindparams(*expanding) if expanding else statement
+
+    def _fetch_chunk(self, source: KeysetSource, params: Dict[str, Any], after: Optional[Tuple[str, int]],
+                     chunk: int, execute) -> List[Any]:
+        conditions = list(source.where) + (['(timestamp < :_k_ts OR (timestamp = :_k_ts AND id < :_k_id))'] if after else [])
+        sql = (f"SELECT {', '.join(source.fields)} FROM {source.table} "
+               f"{'WHERE ' + ' AND '.join(conditions) if conditions else ''} "
+               f"ORDER BY timestamp DESC, id DESC LIMIT :_k_limit")
+        query_params = dict(params, _k_limit=chunk)
+        if after:
+            query_params.update(_k_ts=after[0], _k_id=after[1])
+        return execute(self._statement(sql, query_params), query_params)
+
+    def _table_rows(self, source: KeysetSource, params: Dict[str, Any], after: Optional[Tuple[str, int]],
+                    chunk: int, page_stats: Dict[str, Any], execute, batch=None, pending=None) -> Iterator[Any]:
+        """单分区有序流：每批用上一批最后一行作为keyset起点继续读取；并发模式下提前预取下一批"""
+        while True:
+            rows = pending.result() if pending is not None else self._fetch_chunk(source, params, after, chunk, execute)
+            self.stats['partition_queries'] += 1
+            self.stats['rows_fetched'] += len(rows)
+            page_stats['partition_queries'] += 1
+            page_stats['rows_fetched'] += len(rows)
+            if len(rows) < chunk:
+                yield from rows
+                return
+            after = _row_key(rows[-1])
+            chunk = min(chunk * 2, self.max_chunk)  # 需要继续读时说明在跳页或全量读取，逐步放大批次
+            pending = None
+            if batch is not None and not batch.cancelled:
+                pending = batch.submit(source.table, self._fetch_chunk, source, params, after, chunk, execute)
+            yield from rows
+
+    def stream(self, sources: Sequence[KeysetSource], params: Dict[str, Any], cursor: Optional[str] = None,
+               chunk: Optional[int] = None, page_stats: Optional[Dict[str, Any]] = None,
+               execute=None, batch=None) -> Iterator[Any]:
+        """所有分区按(timestamp, id)降序归并后的行流；传入batch时各分区首批查询同时提交并发执行"""
+        after = decode_cursor(cursor)
+        chunk = max(1, min(chunk or self.max_chunk, self.max_chunk))
+        execute = execute or self._execute
+        page_stats = page_stats if page_stats is not None else {'partition_queries': 0, 'rows_fetched': 0}
+        streams = []
+        for source in sources:
+            pending = batch.submit(source.table, self._fetch_chunk, source, params, after, chunk, execute) if batch else None
+            streams.append(self._table_rows(source, params, after, chunk, page_stats, execute, batch, pending))
+        return heapq.merge(*streams, key=_row_key, reverse=True)
+
+    def read_page(self, sources: Sequence[KeysetSource], params: Dict[str, Any], page_size: Optional[int],
+                  cursor: Optional[str] = None, skip: int = 0, with_count: bool = False,
+                  fanout=None, execute=None) -> KeysetPage:
+        """读取一页；page_size为空时读取全部。skip仅用于兼容旧的page参数(无游标时跳过前几页)。
+        fanout(PartitionFanoutExecutor)存在且分区多于一个时并发查询，execute须使用独立连接"""
+        start = time.time()
+        page_stats = {'partition_queries': 0, 'rows_fetched': 0, 'partitions': len(sources)}
+        batch = fanout.batch() if fanout is not None and len(sources) > 1 else None
+        execute = execute or self._execute
+        rows, next_cursor = [], None
+        try:
+            if page_size:
+                merged = self.stream(sources, params, cursor, chunk=skip + page_size + 1, page_stats=page_stats,
+                                     execute=execute, batch=batch)
+                for position, row in enumerate(merged):
+                    if position < skip:
+                        continue
+                    if len(rows) == page_size:  # 多读一行判断是否还有下一页
+                        next_cursor = encode_cursor(*_row_key(rows[-1]))
+                        break
+                    rows.append(row)
+            else:
+                rows = list(self.stream(sources, params, cursor, page_stats=page_stats, execute=execute, batch=batch))
+        finally:
+            if batch is not None:
+                page_stats['cancelled'] = batch.cancel()  # 页已取满，取消尚未开始的预取
+        total_count = self.count(sources, params, execute=execute, fanout=fanout) if with_count else None
+        if batch is not None:
+            page_stats['partition_latency_ms'] = dict(batch.latency_ms)
+
+        elapsed_ms = (time.time() - start) * 1000
+        page_stats['elapsed_ms'] = round(elapsed_ms, 2)
+        self.stats['pages'] += 1
+        self.stats['rows_returned'] += len(rows)
+        self.stats['total_page_ms'] += elapsed_ms
+        return KeysetPage(rows, next_cursor, total_count, page_stats)
+
+    def count(self, sources: Sequence[KeysetSource], params: Dict[str, Any], execute=None, fanout=None) -> int:
+        """各分区COUNT(*)求和(可选，不影响翻页代价)"""
+        execute = execute or self._execute
+
+        def count_one(source):
+            sql = (f"SELECT COUNT(*) FROM {source.table} "
+                   f"{'WHERE ' + ' AND '.join(source.where) if source.where else ''}")
+            return int(execute(self._statement(sql, params), params)[0][0] or 0)
+
+        self.stats['count_queries'] += len(sources)
+        if fanout is not None and len(sources) > 1:
+            return sum(fanout.batch().map_ordered([(f"{source.table}:count", count_one, source) for source in sources]))
+        return sum(count_one(source) for source in sources)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats['avg_page_ms'] = round(stats['total_page_ms'] / stats['pages'], 2) if stats['pages'] else 0.0
+        stats['total_page_ms'] = round(stats['total_page_ms'], 2)
+        return stats
+
+# 全局读取器实例
+keyset_partition_reader = KeysetPartitionReader()
+
+def get_keyset_partition_reader() -> KeysetPartitionReader:
+    return keyset_partition_reader
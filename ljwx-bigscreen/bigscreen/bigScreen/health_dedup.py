@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+健康数据去重
+批次内按(device_sn, timestamp)内存去重 + Redis按设备的近期时间戳集合(ZSET)过滤热点重传，
+最终由数据库唯一键uk_device_timestamp兜底(INSERT ... ON DUPLICATE KEY)，替代逐条SELECT查重
+"""
+
+import time
+import threading
+import logging
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .redis_helper import RedisHelper
+
+logger = logging.getLogger(__name__)
+
+RECENT_KEY_PREFIX = 'health_recent:'  # health_recent:{device_sn} -> ZSET(member=时间戳字符串, score=epoch秒)
+
+MAIN_FIELDS = ('device_sn', 'user_id', 'org_id', 'customer_id', 'heart_rate', 'blood_oxygen', 'temperature',
+               'pressure_high', 'pressure_low', 'stress', 'step', 'distance', 'calorie',
+               'latitude', 'longitude', 'altitude', 'sleep', 'timestamp', 'upload_method')
+# create_time作为参数传入(而非NOW())，使pymysql executemany能改写为单条多行INSERT；
+# 重复键时id=id不修改行，受影响行数即新插入条数
+MAIN_INSERT_SQL = f"""
+    INSERT INTO t_user_health_data ({', '.join(MAIN_FIELDS)}, create_time)
+    VALUES ({', '.join(['%s'] * (len(MAIN_FIELDS) + 1))})
+    ON DUPLICATE KEY UPDATE id = id
+"""
+
+def make_dedup_key(device_sn, timestamp) -> Tuple[str, str]:
+    """统一去重键：时间戳规范到秒，与唯一键(device_sn, timestamp)一致"""
+    if isinstance(timestamp, datetime):
+        ts = timestamp.strftime('%Y-%m-%d %H:%M:%S')
+    else:
+        ts = str(timestamp or '')[:19]
+    return str(device_sn), ts
+
+def _ts_score(ts: str) -> float:
+    try:
+        return datetime.strptime(ts, '%Y-%m-%d %H:%M:%S').timestamp()
+    except ValueError:
+        return time.time()
+
+class HealthDedupFilter:
+    """健康数据去重过滤器 - Redis不可用时直接放行，由数据库唯一键保证正确性"""
+
+    def __init__(self, window_seconds: int = 86400, max_per_device: int = 5000):
+        self.window_seconds = window_seconds  # 近期集合保留的时间窗口
+        self.max_per_device = max_per_device  # 单设备集合上限，防止异常设备撑大内存
+        self.redis = RedisHelper()
+        self._lock = threading.Lock()
+        self.stats = {'checked': 0, 'batch_duplicates': 0, 'redis_duplicates': 0, 'db_duplicates': 0,
+                      'inserted': 0, 'redis_errors': 0}
+
+    def _incr(self, name: str, value: int = 1):
+        if value:
+            with self._lock:
+                self.stats[name] += value
+
+    def dedup_batch(self, items: Iterable[Any], key_fn: Callable[[Any], Tuple[str, str]]) -> Tuple[List[Any], int]:
+        """批次内去重(保留首条，与数据库先到先得一致)，返回(去重后列表, 重复条数)"""
+        seen = set()
+        unique = []
+        duplicates = 0
+        for item in items:
+            key = key_fn(item)
+            if key in seen:
+                duplicates += 1
+                continue
+            seen.add(key)
+            unique.append(item)
+        self._incr('batch_duplicates', duplicates)
+        return unique, duplicates
+
+    def filter_recent(self, keys: List[Tuple[str, str]]) -> List[bool]:
+        """一次pipeline检查每个键是否已在近期集合中，返回与keys等长的是否重复列表"""
+        if not keys:
+            return []
+        self._incr('checked', len(keys))
+        try:
+            pipe = self.redis.client.pipeline(transaction=False)
+            for device_sn, ts in keys:
+                pipe.zscore(f"{RECENT_KEY_PREFIX}{device_sn}", ts)
+            flags = [score is not None for score in pipe.execute()]
+        except Exception as e:
+            self._incr('redis_errors')
+            logger.warning(f"健康数据近期键检查失败，交由数据库唯一键去重: {e}")
+            return [False] * len(keys)
+        self._incr('redis_duplicates', sum(flags))
+        return flags
+
+    def is_recent(self, device_sn, timestamp) -> bool:
+        """单条检查(入队前的快速判重，只访问Redis)"""
+        return self.filter_recent([make_dedup_key(device_sn, timestamp)])[0]
+
+    def mark_recent(self, keys: Iterable[Tuple[str, str]]):
+        """入库成功后登记近期键，按设备裁剪过期时间戳并续期"""
+        by_device: Dict[str, Dict[str, float]] = {}
+        for device_sn, ts in keys:
+            by_device.setdefault(device_sn, {})[ts] = _ts_score(ts)
+        if not by_device:
+            return
+        cutoff = time.time() - self.window_seconds
+        try:
+            pipe = self.redis.client.pipeline(transaction=False)
+            for device_sn, members in by_device.items():
+                key = f"{RECENT_KEY_PREFIX}{device_sn}"
+                pipe.zadd(key, members)
+                pipe.zremrangebyscore(key, '-inf', cutoff)
+                pipe.zremrangebyrank(key, 0, -self.max_per_device - 1)
+                pipe.expire(key, self.window_seconds)
+            pipe.execute()
+        except Exception as e:
+            self._incr('redis_errors')
+            logger.warning(f"登记健康数据近期键失败: {e}")
+
+    def record_insert(self, total: int, inserted: int):
+        """记录一次入库结果，total-inserted即数据库唯一键拦截的重复条数"""
+        self._incr('inserted', inserted)
+        self._incr('db_duplicates', max(0, total - inserted))
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        stats['total_duplicates'] = stats['batch_duplicates'] + stats['redis_duplicates'] + stats['db_duplicates']
+        stats['window_seconds'] = self.window_seconds
+        return stats
+
+# 全局去重过滤器实例
+health_dedup = HealthDedupFilter()
+
+def get_health_dedup() -> HealthDedupFilter:
+    return health_dedup
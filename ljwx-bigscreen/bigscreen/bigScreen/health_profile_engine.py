@@ -11,6 +11,7 @@ from typing import Dict, List, Optional, Tuple
 import logging
 from .redis_helper import RedisHelper
 from .user_health_data import get_all_health_data_optimized
+from .health_columns import fetch_health_columns
 from .health_baseline_engine import realtime_baseline_engine
 from .health_score_engine import realtime_score_engine
 from .health_recommendation_engine import realtime_recommendation_engine
@@ -525,6 +526,25 @@ class RealTimeHealthProfileEngine:
         """获取历史趋势数据"""
         trends = {}
         
+        try:
+            # 按最长时间维度列式读取一次，各维度按时间切片复用
+            longest = max(config['days'] for config in self.TIME_DIMENSIONS.values())
+            end = datetime.strptime(target_date, '%Y-%m-%d')
+            columns = fetch_health_columns(end - timedelta(days=longest), end, user_id=user_id,
+                                           features=self.HEALTH_FEATURES)
+            for period, config in self.TIME_DIMENSIONS.items():
+                start = end - timedelta(days=config['days'])
+                history_data = columns.since(start)
+                trends[period] = {
+                    'label': config['label'],
+                    'data_points': len(history_data),
+                    'date_range': f"{start:%Y-%m-%d} to {target_date}",
+                    'summary': self._analyze_period_trends(history_data)
+                }
+            return trends
+        except Exception as e:
+            logger.warning(f"列式读取用户 {user_id} 历史数据失败，回退统一查询接口: {e}")
+        
         try:
             # 获取不同时间维度的数据
             for period, config in self.TIME_DIMENSIONS.items():
@@ -559,9 +579,9 @@ class RealTimeHealthProfileEngine:
         
         return trends
     
-    def _analyze_period_trends(self, health_data: List[Dict]) -> Dict:
-        """分析时期趋势"""
-        if not health_data:
+    def _analyze_period_trends(self, health_data) -> Dict:
+        """分析时期趋势(HealthColumns或字典列表)"""
+        if not len(health_data):
             return {}
         
         df = realtime_baseline_engine._convert_to_dataframe(health_data)
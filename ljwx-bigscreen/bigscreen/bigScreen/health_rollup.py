@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+健康数据分级汇总(5分钟/小时/天)
+健康数据入库(单条上传_insert_health_data、批量上传process_health_data_batch)时按设备+指标增量upsert到t_health_rollup：
+count/sum/min/max可叠加，avg=sum/count在读取时计算；取值规则与趋势统计一致(空值与0不计入)。
+批次中混入库内已存在的重复记录时改为按受影响时间段从明细重算(幂等)，历史数据用backfill重建。
+30天以上的趋势查询直接读汇总，不再扫描明细
+"""
+
+import time
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_TABLE = 't_health_rollup'
+ROLLUP_METRICS = ('heart_rate', 'blood_oxygen', 'temperature', 'pressure_high', 'pressure_low',
+                  'stress', 'step', 'distance', 'calorie', 'sleep')
+LEVEL_SECONDS = {'5m': 300, '1h': 3600, '1d': 86400}
+ROLLUP_MIN_DAYS = 30  # 查询跨度达到该天数时走汇总表
+
+ROLLUP_COLUMNS = ('bucket_level', 'bucket_start', 'device_sn', 'metric', 'customer_id', 'org_id', 'user_id',
+                  'sample_count', 'value_sum', 'value_min', 'value_max')
+UPSERT_SQL = f"""
+    INSERT INTO {ROLLUP_TABLE} ({', '.join(ROLLUP_COLUMNS)}, update_time)
+    VALUES ({', '.join(['%s'] * len(ROLLUP_COLUMNS))}, %s)
+    ON DUPLICATE KEY UPDATE
+        sample_count = sample_count + VALUES(sample_count),
+        value_sum = value_sum + VALUES(value_sum),
+        value_min = LEAST(value_min, VALUES(value_min)),
+        value_max = GREATEST(value_max, VALUES(value_max)),
+        customer_id = VALUES(customer_id), org_id = VALUES(org_id), user_id = VALUES(user_id),
+        update_time = VALUES(update_time)
+"""
+
+# 各级桶起点的SQL表达式(不依赖会话时区)
+_BUCKET_SQL = {
+    '5m': "TIMESTAMP(DATE({col}), MAKETIME(HOUR({col}), MINUTE({col}) DIV 5 * 5, 0))",
+    '1h': "TIMESTAMP(DATE({col}), MAKETIME(HOUR({col}), 0, 0))",
+    '1d': "TIMESTAMP(DATE({col}))",
+}
+_PARENT = {'1h': '5m', '1d': '1h'}
+
+def bucket_start(ts: datetime, level: str) -> datetime:
+    if level == '5m':
+        return ts.replace(minute=ts.minute // 5 * 5, second=0, microsecond=0)
+    if level == '1h':
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _align_range(start: datetime, end: datetime, level: str) -> Tuple[datetime, datetime]:
+    """把[start, end)扩展到完整的桶边界"""
+    aligned_end = bucket_start(end, level)
+    if aligned_end < end:
+        aligned_end += timedelta(seconds=LEVEL_SECONDS[level])
+    return bucket_start(start, level), aligned_end
+
+def choose_level(start: datetime, end: datetime) -> str:
+    span = end - start
+    if span <= timedelta(days=2):
+        return '5m'
+    if span <= timedelta(days=14):
+        return '1h'
+    return '1d'
+
+def _parse_ts(value) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.strptime(str(value)[:19], '%Y-%m-%d %H:%M:%S')
+    except (TypeError, ValueError):
+        return None
+
+def _metric_value(value) -> Optional[float]:
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None  # 与趋势统计一致：0视为未采集
+
+def aggregate_records(records: Iterable[Dict[str, Any]]) -> Dict[tuple, list]:
+    """明细记录 -> {(level, bucket, device_sn, metric): [customer_id, org_id, user_id, count, sum, min, max]}"""
+    aggregates: Dict[tuple, list] = {}
+    for record in records:
+        ts = _parse_ts(record.get('timestamp'))
+        device_sn = record.get('device_sn')
+        if ts is None or not device_sn:
+            continue
+        buckets = [(level, bucket_start(ts, level)) for level in LEVEL_SECONDS]
+        for metric in ROLLUP_METRICS:
+            value = _metric_value(record.get(metric))
+            if value is None:
+                continue
+            for level, bucket in buckets:
+                key = (level, bucket, device_sn, metric)
+                item = aggregates.get(key)
+                if item is None:
+                    aggregates[key] = [record.get('customer_id') or 0, record.get('org_id'), record.get('user_id'),
+                                       1, value, value, value]
+                else:
+                    item[3] += 1
+                    item[4] += value
+                    item[5] = min(item[5], value)
+                    item[6] = max(item[6], value)
+    return aggregates
+
+class HealthRollupMaintainer:
+    """入库时维护分级汇总"""
+
+    def __init__(self):
+        self.stats = {'batches': 0, 'records': 0, 'upserted_rows': 0, 'rebuilds': 0, 'errors': 0, 'total_ms': 0.0}
+
+    def apply(self, conn, records: Sequence[Dict[str, Any]], all_new: bool = True):
+        """records均为新插入记录时增量upsert；否则按受影响设备/时间段从明细重算。独立提交，失败不影响明细入库"""
+        if not records:
+            return
+        start = time.time()
+        try:
+            with conn.cursor() as cursor:
+                if all_new:
+                    self.stats['upserted_rows'] += upsert_increments(cursor, aggregate_records(records))
+                else:
+                    self.stats['rebuilds'] += 1
+                    for device_sn, (first, last) in _device_ranges(records).items():
+                        rebuild_rollups(cursor, first, last + timedelta(seconds=1), device_sns=[device_sn])
+            conn.commit()
+            self.stats['batches'] += 1
+            self.stats['records'] += len(records)
+        except Exception as e:
+            conn.rollback()
+            self.stats['errors'] += 1
+            logger.error(f"❌ 健康汇总维护失败(可用backfill重建): {e}")
+        finally:
+            self.stats['total_ms'] += (time.time() - start) * 1000
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats['avg_ms'] = round(stats['total_ms'] / stats['batches'], 2) if stats['batches'] else 0.0
+        stats['total_ms'] = round(stats['total_ms'], 2)
+        return stats
+
+def _device_ranges(records) -> Dict[str, Tuple[datetime, datetime]]:
+    ranges: Dict[str, Tuple[datetime, datetime]] = {}
+    for record in records:
+        ts = _parse_ts(record.get('timestamp'))
+        if ts is None or not record.get('device_sn'):
+            continue
+        first, last = ranges.get(record['device_sn'], (ts, ts))
+        ranges[record['device_sn']] = (min(first, ts), max(last, ts))
+    return ranges
+
+def upsert_increments(cursor, aggregates: Dict[tuple, list]) -> int:
+    """增量叠加到汇总表(按键排序写入，降低并发分片间的死锁概率)"""
+    if not aggregates:
+        return 0
+    now = datetime.now()
+    rows = [(level, bucket, device_sn, metric, *values, now)
+            for (level, bucket, device_sn, metric), values in sorted(aggregates.items())]
+    cursor.executemany(UPSERT_SQL, rows)
+    return len(rows)
+
+def rebuild_rollups(cursor, start: datetime, end: datetime, device_sns: Optional[Sequence[str]] = None) -> Dict[str, int]:
+    """从明细重算[start, end)覆盖的各级汇总桶(先删后插，幂等)：5分钟来自明细，小时来自5分钟，天来自小时"""
+    device_filter, device_params = '', []
+    if device_sns:
+        device_filter = f" AND device_sn IN ({', '.join(['%s'] * len(device_sns))})"
+        device_params = list(device_sns)
+    written = {}
+    for level in ('5m', '1h', '1d'):
+        level_start, level_end = _align_range(start, end, level)
+        cursor.execute(f"DELETE FROM {ROLLUP_TABLE} WHERE bucket_level = %s AND bucket_start >= %s AND bucket_start < %s{device_filter}",
+                       [level, level_start, level_end] + device_params)
+        if level == '5m':
+            bucket = _BUCKET_SQL[level].format(col='timestamp')
+            written[level] = 0
+            for metric in ROLLUP_METRICS:
+                written[level] += cursor.execute(f"""
+                    INSERT INTO {ROLLUP_TABLE} ({', '.join(ROLLUP_COLUMNS)}, update_time)
+                    SELECT '5m', {bucket} AS b, device_sn, '{metric}', MAX(customer_id), MAX(org_id), MAX(user_id),
+                           COUNT(*), SUM({metric}), MIN({metric}), MAX({metric}), NOW()
+                    FROM t_user_health_data
+                    WHERE timestamp >= %s AND timestamp < %s AND is_deleted = 0 AND {metric} > 0{device_filter}
+                    GROUP BY device_sn, b
+                """, [level_start, level_end] + device_params)
+        else:
+            bucket = _BUCKET_SQL[level].format(col='bucket_start')
+            written[level] = cursor.execute(f"""
+                INSERT INTO {ROLLUP_TABLE} ({', '.join(ROLLUP_COLUMNS)}, update_time)
+                SELECT %s, {bucket} AS b, device_sn, metric, MAX(customer_id), MAX(org_id), MAX(user_id),
+                       SUM(sample_count), SUM(value_sum), MIN(value_min), MAX(value_max), NOW()
+                FROM {ROLLUP_TABLE}
+                WHERE bucket_level = %s AND bucket_start >= %s AND bucket_start < %s{device_filter}
+                GROUP BY device_sn, metric, b
+            """, [level, _PARENT[level], level_start, level_end] + device_params)
+    return written
+
+def query_rollup_series(metrics: Sequence[str], start: datetime, end: datetime, level: Optional[str] = None,
+                        org_id=None, user_id=None, device_sns: Optional[Sequence[str]] = None,
+                        exclude_user_id=None, execute=None) -> Dict[datetime, Dict[str, Dict[str, float]]]:
+    """读取汇总序列，多设备按桶合并：{bucket: {metric: {count, sum, min, max, avg}}}"""
+    from sqlalchemy import bindparam, text
+    level = level or choose_level(start, end)
+    conditions = ["bucket_level = :level", "bucket_start >= :start", "bucket_start < :end", "metric IN :metrics"]
+    params: Dict[str, Any] = {'level': level, 'start': bucket_start(start, level), 'end': end, 'metrics': list(metrics)}
+    expanding = [bindparam('metrics', expanding=True)]
+    if org_id is not None:
+        conditions.append("org_id = :org_id")
+        params['org_id'] = org_id
+    if user_id is not None:
+        conditions.append("user_id = :user_id")
+        params['user_id'] = user_id
+    if exclude_user_id is not None:
+        conditions.append("(user_id IS NULL OR user_id <> :exclude_user_id)")
+        params['exclude_user_id'] = exclude_user_id
+    if device_sns:
+        conditions.append("device_sn IN :device_sns")
+        params['device_sns'] = list(device_sns)
+        expanding.append(bindparam('device_sns', expanding=True))
+    statement = text(f"""
+        SELECT bucket_start, metric, SUM(sample_count) AS cnt, SUM(value_sum) AS total,
+               MIN(value_min) AS vmin, MAX(value_max) AS vmax
+        FROM {ROLLUP_TABLE} WHERE {' AND '.join(conditions)}
+        GROUP BY bucket_start, metric ORDER BY bucket_start
+    """).bindparams(*expanding)
+    if execute is None:
+        from .models import db
+        rows = db.session.execute(statement, params).fetchall()
+    else:
+        rows = execute(statement, params)
+    series: Dict[datetime, Dict[str, Dict[str, float]]] = {}
+    for bucket, metric, cnt, total, vmin, vmax in rows:
+        cnt, total = int(cnt or 0), float(total or 0)
+        series.setdefault(_parse_ts(bucket) or bucket, {})[metric] = {
+            'count': cnt, 'sum': total, 'min': float(vmin or 0), 'max': float(vmax or 0),
+            'avg': total / cnt if cnt else None}
+    return series
+
+def merge_rollup_cells(cells: Iterable[Dict[str, float]]) -> Dict[str, float]:
+    """合并多个桶的count/sum/min/max(如日桶合并为月)"""
+    merged = {'count': 0, 'sum': 0.0, 'min': None, 'max': None}
+    for cell in cells:
+        if not cell or not cell.get('count'):
+            continue
+        merged['count'] += cell['count']
+        merged['sum'] += cell['sum']
+        merged['min'] = cell['min'] if merged['min'] is None else min(merged['min'], cell['min'])
+        merged['max'] = cell['max'] if merged['max'] is None else max(merged['max'], cell['max'])
+    merged['avg'] = merged['sum'] / merged['count'] if merged['count'] else None
+    return merged
+
+def should_use_rollup(start: Optional[datetime], end: Optional[datetime]) -> bool:
+    return bool(start and end and (end - start).days >= ROLLUP_MIN_DAYS)
+
+# 全局汇总维护器实例
+health_rollup_maintainer = HealthRollupMaintainer()
+
+def get_health_rollup_maintainer() -> HealthRollupMaintainer:
+    return health_rollup_maintainer
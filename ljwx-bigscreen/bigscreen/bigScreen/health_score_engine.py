@@ -11,6 +11,7 @@ from typing import Dict, List, Optional, Tuple, Any
 import logging
 from .redis_helper import RedisHelper
 from .user_health_data import get_all_health_data_optimized
+from .health_columns import fetch_health_columns
 from .health_baseline_engine import realtime_baseline_engine
 from .health_query_base import health_query_base
 from .models import db, HealthScore
@@ -371,7 +372,16 @@ class RealTimeHealthScoreEngine:
             }
     
     def _get_health_data_unified(self, query_params: Dict) -> Dict:
-        """根据查询参数获取健康数据"""
+        """根据查询参数获取健康数据：优先列式读取指标，失败时回退统一查询接口"""
+        level = query_params['query_level']
+        if level in ('user', 'org', 'customer'):
+            try:
+                scope = {'user': 'user_id', 'org': 'org_id', 'customer': 'customer_id'}[level]
+                columns = fetch_health_columns(query_params['start_date'], query_params['end_date'],
+                                               features=self.HEALTH_FEATURES, **{scope: query_params['identifier']})
+                return {'success': True, 'data': {'healthData': columns}}
+            except Exception as e:
+                logger.warning(f"⚠️ 列式读取失败，回退统一查询接口: {e}")
         try:
             if query_params['query_level'] == 'user':
                 # 用户级健康数据
@@ -471,9 +481,9 @@ class RealTimeHealthScoreEngine:
             logger.warning(f"⚠️ 计算特征 {feature} 评分失败: {str(e)}")
             return None
 
-    def _convert_to_dataframe(self, health_data: List[Dict]) -> pd.DataFrame:
-        """将健康数据转换为pandas DataFrame"""
-        if not health_data:
+    def _convert_to_dataframe(self, health_data) -> pd.DataFrame:
+        """将健康数据(HealthColumns或字典列表)转换为pandas DataFrame"""
+        if not len(health_data):
             return pd.DataFrame()
         
         # 复用基线引擎的转换逻辑
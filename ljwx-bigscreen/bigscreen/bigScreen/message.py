@@ -2,6 +2,9 @@ import json
 from flask import request, jsonify
 from .models import DeviceMessage, DeviceMessageDetail, db, DeviceInfo, UserInfo, UserOrg, OrgInfo
 from .redis_helper import RedisHelper
+from .stats_counters import queue_counter_rows
+from .message_inbox import (get_message_inbox, queue_inbox_rows, is_done, INBOX_LIMIT, INBOX_TTL,
+                            MISSING_TTL)
 from datetime import datetime, timedelta
 from .org import fetch_departments_by_orgId
 from typing import List, Dict, Optional, Tuple
@@ -980,172 +983,151 @@ def send_message(data):
         except Exception as e:
             logger.warning(f"清理处理锁失败: {e}")
     
+def load_device_inbox(device_sn):
+    """
+    从数据库加载设备收件箱(收件箱未初始化或过期时调用)
+    返回(用户信息, 待确认消息, 是否接收投递)；未绑定用户返回(None, [], False)
+    """
+    user = UserInfo.query.filter_by(
+        device_sn=device_sn,
+        is_deleted=0
+    ).with_entities(UserInfo.id, UserInfo.org_id, UserInfo.user_name).first()
+    if not user:
+        return None, [], False
+
+    user_info = {"user_id": user.id, "user_name": user.user_name, "org_id": user.org_id}
+    from .admin_helper import is_admin_user
+    if is_admin_user(user.id):
+        return user_info, [], False
+
+    # 直接查询数据库而不走message_opt分页缓存，避免重建时读到投递前的旧数据
+    MessageModel, MessageDetailModel = get_message_model()
+    rows = get_unified_message_query(userId=user.id).order_by(
+        MessageModel.sent_time.desc()
+    ).limit(INBOX_LIMIT).all()
+    rows = [row for row in rows if not is_done(row.message_status)]
+
+    acknowledged_message_ids = set()
+    if rows:
+        acknowledged_message_ids = {str(detail.message_id) for detail in MessageDetailModel.query.filter(
+            MessageDetailModel.message_id.in_([row.id for row in rows]),
+            MessageDetailModel.device_sn == device_sn
+        ).with_entities(MessageDetailModel.message_id).all()}
+
+    messages = [{
+        'id': row.id,
+        'message': row.message,
+        'message_type': row.message_type,
+        'sender_type': row.sender_type,
+        'receiver_type': row.receiver_type,
+        'message_status': row.message_status,
+        'send_time': row.sent_time.strftime('%Y-%m-%d %H:%M:%S') if row.sent_time else None,
+        'user_id': row.user_id,
+        'user_name': row.user_name,
+        'org_id': row.org_id,
+        'org_name': row.org_name
+    } for row in rows if str(row.id) not in acknowledged_message_ids]
+    return user_info, messages, True
+
+def format_watch_message(msg):
+    """收件箱消息转换为手表端格式(优先级含时间加成，读取时计算)"""
+    message_content = msg.get('message') or ''
+    # 手表端消息内容优化 - 限制长度和格式化
+    if len(message_content) > 200:
+        message_content = message_content[:197] + "..."
+    return {
+        'message_id': str(msg.get('id')),
+        'department_id': msg.get('org_id', ''),
+        'department_name': msg.get('org_name', ''),
+        'user_id': msg.get('user_id'),
+        'user_name': msg.get('user_name'),
+        'message': message_content,
+        'message_type': msg.get('message_type', 'notification'),
+        'message_status': msg.get('message_status', ''),
+        'send_time': msg.get('send_time'),
+        'sender_type': msg.get('sender_type', 'system'),
+        'receiver_type': msg.get('receiver_type', 'device'),
+        'is_public': msg.get('user_id') is None,
+        'priority': calculate_message_priority(msg.get('message_type'), msg.get('send_time')),  # 手表端优先级
+        'watch_display': {
+            'title': get_message_title_for_watch(msg.get('message_type')),
+            'icon': get_message_icon_for_watch(msg.get('message_type')),
+            'vibration_pattern': get_vibration_pattern(msg.get('message_type'))
+        }
+    }
+
+def _meta_int(value):
+    """收件箱meta中的ID为字符串，还原为数据库中的整数"""
+    return int(value) if isinstance(value, str) and value.isdigit() else value or None
+
 @monitor_performance("received_messages_enhanced")
-def received_messages(device_sn):
+def received_messages(device_sn, wait=0, since=None):
     """
     消息接收处理
-    优化缓存策略和数据库查询性能
+    读取设备收件箱(一次Redis往返)，未初始化时从数据库重建；
+    传入since(上次返回的version)和wait秒数时为长轮询，收件箱无变化则最多等待wait秒再返回
     """
     if not device_sn:
         return {"success": False, "error": "device_sn is required"}
-    
-    # 智能缓存策略
-    cache_key = f"received_messages:{device_sn}"
-    
-    try:
-        # 尝试从缓存获取
-        cached_result = redis.get_data(cache_key)
-        if cached_result:
-            logger.debug(f"缓存命中: {cache_key}")
-            return json.loads(cached_result)
-    except Exception as e:
-        logger.warning(f"缓存读取失败: {e}")
-    
+
+    inbox = get_message_inbox()
     try:
-        # 1. 优化用户查询
-        user = UserInfo.query.filter_by(
-            device_sn=device_sn, 
-            is_deleted=0
-        ).with_entities(UserInfo.id, UserInfo.org_id, UserInfo.user_name).first()
-        
-        if not user:
-            error_result = {"success": False, "error": "未找到对应的用户"}
-            # 缓存错误结果30秒
-            redis.setex(cache_key, 30, json.dumps(error_result))
-            return error_result
-
-        user_id = user.id
-        logger.debug(f"用户信息: user_id={user_id}, org_id={user.org_id}")
-
-        # 2. 使用优化的消息查询接口
-        resp = get_all_message_data_optimized(
-            userId=user_id,
-            latest_only=False,
-            page=1,
-            pageSize=50,  # 限制返回数量提高性能
-            include_details=False
-        )
-        
-        if not resp.get("success", True):
-            return {"success": False, "error": "获取消息失败"}
+        if wait and since is not None:
+            inbox.wait(device_sn, int(since), float(wait))
+
+        snapshot = inbox.read(device_sn)
+        if snapshot is None:
+            version = inbox.version(device_sn)  # 加载前的版本号，重建期间有投递/撤回时不写入过时快照
+            user_info, messages, accepts = load_device_inbox(device_sn)
+            meta = user_info or {"user_id": None}
+            inbox.fill(device_sn, messages, meta, accepts=accepts, ttl=INBOX_TTL if user_info else MISSING_TTL,
+                       version=version)
+            snapshot = {"meta": meta, "messages": messages, "version": version or 0}
+
+        meta = snapshot["meta"]
+        if not meta.get("user_id"):
+            return {"success": False, "error": "未找到对应的用户"}
 
-        # 3. 智能数据解析
-        raw_data = resp.get("data", {})
-        messages = raw_data.get("messageData", [])
-        
-        # 4. 高效过滤算法
-        # 一次性获取所有相关的DeviceMessageDetail - 使用统一模型
-        MessageModel, MessageDetailModel = get_message_model()
-        
-        message_ids = [str(m.get("id", m.get("message_id", ""))) for m in messages if m.get("id") or m.get("message_id")]
-        
-        acknowledged_message_ids = set()
-        if message_ids:
-            try:
-                acknowledged_details = MessageDetailModel.query.filter(
-                    MessageDetailModel.message_id.in_(message_ids),
-                    MessageDetailModel.device_sn == device_sn
-                ).with_entities(MessageDetailModel.message_id).all()
-                
-                acknowledged_message_ids = {str(detail.message_id) for detail in acknowledged_details}
-                logger.debug(f"已确认消息IDs: {acknowledged_message_ids}")
-            except Exception as e:
-                logger.warning(f"查询已确认消息失败: {e}")
-        
-        # 5. 智能过滤策略 - 手表端专用优化
-        filtered_messages = []
-        for msg in messages:
-            msg_id = str(msg.get("id", msg.get("message_id", "")))
-            msg_status = msg.get("message_status", "")
-            
-            # 过滤条件：
-            # 1. 消息状态不是已响应
-            # 2. 没有在DeviceMessageDetail中找到确认记录
-            if (msg_status not in ("2", "responded", "acknowledged") and 
-                msg_id not in acknowledged_message_ids):
-                
-                # 数据清洗和格式化 - 手表端优化
-                message_content = msg.get('message', '')
-                
-                # 手表端消息内容优化 - 限制长度和格式化
-                if len(message_content) > 200:
-                    message_content = message_content[:197] + "..."
-                
-                # 计算消息优先级（手表端显示顺序）
-                priority = calculate_message_priority(msg.get('message_type'), msg.get('send_time'))
-                
-                cleaned_msg = {
-                    'message_id': msg_id,
-                    'department_id': msg.get('dept_id', msg.get('org_id', '')),
-                    'department_name': msg.get('dept_name', msg.get('org_name', '')),
-                    'user_id': msg.get('user_id'),
-                    'user_name': msg.get('user_name'),
-                    'message': message_content,
-                    'message_type': msg.get('message_type', 'notification'),
-                    'message_status': msg_status,
-                    'send_time': msg.get('send_time'),
-                    'sender_type': msg.get('sender_type', 'system'),
-                    'receiver_type': msg.get('receiver_type', 'device'),
-                    'is_public': msg.get('is_public', False),
-                    'priority': priority,  # 手表端优先级
-                    'watch_display': {
-                        'title': get_message_title_for_watch(msg.get('message_type')),
-                        'icon': get_message_icon_for_watch(msg.get('message_type')),
-                        'vibration_pattern': get_vibration_pattern(msg.get('message_type'))
-                    }
-                }
-                filtered_messages.append(cleaned_msg)
-        
         # 手表端消息排序 - 按优先级和时间排序
-        filtered_messages.sort(key=lambda x: (x['priority'], x['send_time']), reverse=True)
-        
-        # 6. 构建结果
-        result = {
+        filtered_messages = [format_watch_message(msg) for msg in snapshot["messages"]]
+        filtered_messages.sort(key=lambda x: (x['priority'], x['send_time'] or ''), reverse=True)
+
+        logger.debug(f"消息接收处理完成: device_sn={device_sn}, 待确认消息数={len(filtered_messages)}")
+        return {
             "success": True,
             "data": {
                 "messages": filtered_messages,
                 "total_count": len(filtered_messages),
                 "user_info": {
-                    "user_id": user_id,
-                    "user_name": user.user_name,
-                    "org_id": user.org_id
+                    "user_id": _meta_int(meta.get("user_id")),
+                    "user_name": meta.get("user_name"),
+                    "org_id": _meta_int(meta.get("org_id"))
                 },
                 "device_sn": device_sn,
+                "version": snapshot["version"],
                 "timestamp": datetime.now().isoformat()
             }
         }
-        
-        # 智能缓存TTL策略
-        cache_ttl = 60  # 默认缓存1分钟
-        if len(filtered_messages) == 0:
-            cache_ttl = 30  # 空结果短缓存
-        elif len(filtered_messages) > 10:
-            cache_ttl = 90  # 大量消息长缓存
-        
-        try:
-            redis.setex(cache_key, cache_ttl, json.dumps(result, default=str))
-            logger.debug(f"缓存设置成功: {cache_key}, TTL: {cache_ttl}s")
-        except Exception as e:
-            logger.warning(f"缓存设置失败: {e}")
-        
-        logger.info(f"消息接收处理完成: device_sn={device_sn}, 过滤后消息数={len(filtered_messages)}")
-        return result
-        
+
     except Exception as e:
         logger.error(f"消息接收处理异常: {e}", exc_info=True)
-        error_result = {
+        return {
             "success": False, 
             "error": f"处理异常: {str(e)}",
             "data": {"messages": []}
         }
-        
-        # 错误结果也短时缓存，避免重复处理
-        try:
-            redis.setex(cache_key, 15, json.dumps(error_result))
-        except:
-            pass
-            
-        return error_result
+
+def stream_device_messages(device_sn, duration=300):
+    """
+    SSE推送：先推送当前收件箱，之后收件箱变化时推送最新消息列表，空闲时发送心跳；
+    duration秒后结束，由手表重连
+    """
+    yield f"event: messages\ndata: {json.dumps(received_messages(device_sn), default=str, ensure_ascii=False)}\n\n"
+    for version in get_message_inbox().listen(device_sn, duration):
+        if version is None:
+            yield ": heartbeat\n\n"
+        else:
+            yield f"event: messages\ndata: {json.dumps(received_messages(device_sn), default=str, ensure_ascii=False)}\n\n"
     
 
 def send_message_bak(data):
@@ -1871,6 +1853,8 @@ def save_device_message_data(data):
                 
                 # 批量插入优化
                 db.session.bulk_save_objects(batch_messages, return_defaults=True)
+                queue_counter_rows(db.session, 'message', batch_messages)  # bulk插入不触发ORM事件
+                queue_inbox_rows(db.session, batch_messages)
                 
                 message_count = len(batch_messages)
                 logger.info(f"批量消息创建成功: {message_count}条")
@@ -1902,7 +1886,6 @@ def save_device_message_data(data):
         cache_patterns = [
             f"message_opt:*:{data.get('user_id')}:*" if data.get('user_id') else None,
             f"message_opt:{data.get('org_id')}:*:*" if data.get('org_id') else None,
-            "received_messages:*"  # 清理所有设备的接收消息缓存
         ]
         
         for pattern in cache_patterns:
@@ -1950,13 +1933,13 @@ def send_device_message_data(data):
         raise
 
 
-def receive_device_messages_data(deviceSn):
-    """接收设备消息数据"""
+def receive_device_messages_data(deviceSn, wait=0, since=None):
+    """接收设备消息数据(wait/since为长轮询参数)"""
     try:
         # 记录消息接收日志
         device_logger.info('设备消息查询', extra={'device_sn': deviceSn})
         
-        result = received_messages(deviceSn)
+        result = received_messages(deviceSn, wait=wait, since=since)
         
         # 记录查询结果
         if hasattr(result, 'get_json'):
@@ -2206,7 +2189,6 @@ def acknowledge_message(data):
         
         # 清理相关缓存
         cache_patterns_to_clear = [
-            f"received_messages:{device_sn}",
             f"message_opt:*:{user_id}:*" if user_id else None,
             f"message_opt:{message.org_id}:*:*" if message.org_id else None,
             f"department_user_messages:{message.org_id}:*"
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+设备消息收件箱(手表轮询)
+手表轮询 /DeviceMessage/receive 不再每次查询用户、分页COUNT(*)、查询确认明细再过滤，而是读取按设备维护的Redis收件箱：
+- message_inbox:{device_sn}          HASH 消息ID -> 消息JSON(待确认消息，最多INBOX_LIMIT条，超出丢弃最早的)
+- message_inbox:{device_sn}:meta     HASH 收件箱所属用户；缺失表示未初始化，由读取方从数据库重建一次
+- message_inbox:{device_sn}:version  每次投递/撤回与收件箱修改在同一事务内递增，长轮询据此判断是否有变化；
+                                     重建时以加载数据库前的版本号做乐观锁，期间有投递/撤回则放弃写入
+- message_inbox_channel:{device_sn}  变更通知(长轮询/SSE订阅)
+消息或确认明细提交后由ORM事件维护：新消息投递到目标设备(个人消息/组织及子组织群发)，
+确认明细写入或消息状态变为已响应时从收件箱撤回
+"""
+
+import os
+import json
+import time
+import logging
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from redis.exceptions import WatchError
+
+from .redis_helper import RedisHelper
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'message_inbox:'
+CHANNEL_PREFIX = 'message_inbox_channel:'
+INBOX_TTL = int(os.getenv('MESSAGE_INBOX_TTL', 7 * 86400))  # 到期后下次轮询从数据库重建(自愈)
+MISSING_TTL = 30  # 未绑定用户设备的负缓存
+INBOX_LIMIT = int(os.getenv('MESSAGE_INBOX_LIMIT', 50))  # 与原接收接口每次最多取50条一致
+LONG_POLL_MAX = int(os.getenv('MESSAGE_LONG_POLL_MAX_SECONDS', 30))
+DONE_STATUSES = ('2', 'responded', 'acknowledged')  # 已响应的消息不再下发(不区分大小写)
+MESSAGE_FIELDS = ('id', 'message', 'message_type', 'sender_type', 'receiver_type', 'message_status', 'send_time',
+                  'user_id', 'user_name', 'org_id', 'org_name')
+PENDING_KEY = 'message_inbox_pending'  # session.info中待提交后投递/撤回的消息
+ROW_FIELDS = ('id', 'message', 'message_type', 'sender_type', 'receiver_type', 'message_status', 'sent_time',
+              'user_id', 'org_id', 'device_sn', 'customer_id', 'is_deleted')
+
+USER_SQL = """
+    SELECT device_sn, user_name FROM sys_user WHERE id = %s AND is_deleted = 0
+"""
+ORG_DEVICES_SQL = """
+    SELECT u.device_sn FROM sys_user u
+    JOIN sys_org_closure c ON c.descendant_id = u.org_id
+    WHERE c.ancestor_id = %s AND u.is_deleted = 0 AND u.device_sn IS NOT NULL AND u.device_sn NOT IN ('', '-')
+"""
+ORG_NAME_SQL = "SELECT name FROM sys_org_units WHERE id = %s"
+
+def is_done(status) -> bool:
+    return str(status or '').lower() in DONE_STATUSES
+
+def _key(device_sn: str, kind: Optional[str] = None) -> str:
+    return f"{KEY_PREFIX}{device_sn}" + (f":{kind}" if kind else '')
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+def _format_time(value) -> Optional[str]:
+    if value is None:
+        return None
+    return value.strftime('%Y-%m-%d %H:%M:%S') if hasattr(value, 'strftime') else str(value)[:19]
+
+def _load_targets(row: Dict[str, Any]) -> Tuple[List[str], Optional[str], Optional[str]]:
+    """消息的目标设备：个人消息为用户的设备，群发为组织及子组织全部用户的设备，另加指定设备；返回(设备, 用户名, 组织名)"""
+    from .db_pool import get_db_connection
+    device_sns, user_name, org_name = [], None, None
+    with get_db_connection(readonly=True) as conn, conn.cursor() as cursor:
+        if row.get('user_id'):
+            cursor.execute(USER_SQL, (row['user_id'],))
+            user = cursor.fetchone()
+            if user:
+                device_sns, user_name = ([user[0]] if user[0] else []), user[1]
+        elif row.get('org_id'):
+            cursor.execute(ORG_DEVICES_SQL, (row['org_id'],))
+            device_sns = [r[0] for r in cursor.fetchall()]
+        if row.get('device_sn'):
+            device_sns.append(row['device_sn'])
+        if row.get('org_id'):
+            cursor.execute(ORG_NAME_SQL, (row['org_id'],))
+            org = cursor.fetchone()
+            org_name = org[0] if org else None
+    return list(dict.fromkeys(device_sns)), user_name, org_name
+
+class MessageInbox:
+    """按设备维护的待确认消息收件箱"""
+
+    def __init__(self, redis=None, target_loader: Optional[Callable] = None, clock: Callable[[], float] = time.time):
+        self.redis = redis or RedisHelper()
+        self._target_loader = target_loader or _load_targets
+        self._clock = clock
+        self.stats = {'reads': 0, 'not_ready': 0, 'rebuilds': 0, 'delivered': 0, 'retracted': 0, 'trimmed': 0,
+                      'fill_conflicts': 0, 'skipped_devices': 0, 'waits': 0, 'wakeups': 0, 'wait_timeouts': 0,
+                      'errors': 0}
+
+    @property
+    def _client(self):
+        return getattr(self.redis, 'client', None)
+
+    # ---------------- 读取 ----------------
+    def read(self, device_sn: str) -> Optional[Dict[str, Any]]:
+        """
+        读取收件箱(一次往返)；未初始化或Redis不可用时返回None，由调用方从数据库重建
+
+        Returns:
+            {'meta': 用户信息, 'messages': [按发送时间倒序，最多INBOX_LIMIT条], 'version': 版本号}
+        """
+        if self._client is None:
+            return None
+        try:
+            pipe = self._client.pipeline(transaction=False)
+            pipe.hgetall(_key(device_sn, 'meta'))
+            pipe.hvals(_key(device_sn))
+            pipe.get(_key(device_sn, 'version'))
+            meta, values, version = pipe.execute()
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.warning(f"⚠️ 读取消息收件箱失败: {device_sn}, {e}")
+            return None
+        meta = {_text(k): _text(v) for k, v in (meta or {}).items()}
+        if 'accepts' not in meta:
+            self.stats['not_ready'] += 1
+            return None
+        self.stats['reads'] += 1
+        messages = sorted((json.loads(value) for value in values or []),
+                          key=lambda message: message.get('send_time') or '', reverse=True)[:INBOX_LIMIT]
+        return {'meta': meta, 'messages': messages, 'version': int(version or 0)}
+
+    def version(self, device_sn: str) -> Optional[int]:
+        try:
+            value = self._client.get(_key(device_sn, 'version'))
+            return int(value or 0)
+        except Exception:
+            return None
+
+    def fill(self, device_sn: str, messages: Iterable[Dict[str, Any]], meta: Dict[str, Any],
+             accepts: bool = True, ttl: int = INBOX_TTL, version: Optional[int] = None) -> bool:
+        """
+        从数据库重建后写入收件箱；accepts=False(管理员/未绑定用户)的设备不接收投递
+
+        Args:
+            version: 加载数据库前读取的版本号；此后有投递/撤回(版本已变化)时快照可能过时，
+                     放弃写入并返回False，收件箱保持未初始化，由下次读取重建
+        """
+        if self._client is None:
+            return False
+        items = {str(message['id']): json.dumps({name: message.get(name) for name in MESSAGE_FIELDS}, default=str)
+                 for message in messages}
+        try:
+            with self._client.pipeline(transaction=True) as pipe:
+                pipe.watch(_key(device_sn, 'version'))
+                if version is not None and int(pipe.get(_key(device_sn, 'version')) or 0) != version:
+                    self.stats['fill_conflicts'] += 1
+                    return False
+                pipe.multi()
+                pipe.delete(_key(device_sn))
+                if items:
+                    pipe.hset(_key(device_sn), mapping=items)
+                    pipe.expire(_key(device_sn), ttl)
+                pipe.delete(_key(device_sn, 'meta'))
+                pipe.hset(_key(device_sn, 'meta'), mapping={**{k: '' if v is None else str(v) for k, v in meta.items()},
+                                                            'accepts': '1' if accepts else '0'})
+                pipe.expire(_key(device_sn, 'meta'), ttl)
+                pipe.execute()
+            self.stats['rebuilds'] += 1
+            return True
+        except WatchError:
+            self.stats['fill_conflicts'] += 1
+            logger.info(f"❗️ 重建期间收件箱有投递/撤回，放弃写入: {device_sn}")
+            return False
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.warning(f"⚠️ 重建消息收件箱失败: {device_sn}, {e}")
+            return False
+
+    def invalidate(self, device_sn: str):
+        try:
+            self._client.delete(_key(device_sn, 'meta'))
+        except Exception as e:
+            logger.warning(f"⚠️ 清除消息收件箱失败: {device_sn}, {e}")
+
+    # ---------------- 投递/撤回 ----------------
+    def deliver(self, message: Dict[str, Any], device_sns: Iterable[str]) -> int:
+        """投递到目标设备(跳过不接收投递的设备)，返回投递设备数"""
+        device_sns = [sn for sn in dict.fromkeys(device_sns) if sn]
+        if not device_sns or self._client is None:
+            return 0
+        payload = json.dumps({name: message.get(name) for name in MESSAGE_FIELDS}, default=str)
+        message_id = str(message['id'])
+        pipe = self._client.pipeline(transaction=False)
+        for sn in device_sns:
+            pipe.hget(_key(sn, 'meta'), 'accepts')
+        targets = [sn for sn, accepts in zip(device_sns, pipe.execute()) if accepts is None or _text(accepts) != '0']
+        self.stats['skipped_devices'] += len(device_sns) - len(targets)
+        if not targets:
+            return 0
+        pipe = self._client.pipeline(transaction=True)  # 写入与版本递增原子完成，重建方据版本号发现并发投递
+        for sn in targets:
+            pipe.hset(_key(sn), message_id, payload)
+            pipe.expire(_key(sn), INBOX_TTL)
+            pipe.hlen(_key(sn))
+            self._bump(pipe, sn)
+        results = pipe.execute()
+        versions = dict(zip(targets, results[3::5]))
+        for sn, size in zip(targets, results[2::5]):
+            if int(size) > INBOX_LIMIT:
+                versions[sn] = self._trim(sn) or versions[sn]
+        self._notify(targets, [versions[sn] for sn in targets])
+        self.stats['delivered'] += len(targets)
+        return len(targets)
+
+    def retract(self, message_id, device_sns: Iterable[str]) -> int:
+        """从设备收件箱撤回已确认/已响应的消息，返回实际撤回的设备数"""
+        device_sns = [sn for sn in dict.fromkeys(device_sns) if sn]
+        if not device_sns or self._client is None:
+            return 0
+        pipe = self._client.pipeline(transaction=True)
+        for sn in device_sns:
+            pipe.hdel(_key(sn), str(message_id))
+            self._bump(pipe, sn)
+        results = pipe.execute()
+        removed = [(sn, version) for sn, count, version in zip(device_sns, results[0::3], results[1::3]) if count]
+        if removed:
+            self._notify(*zip(*removed))
+        self.stats['retracted'] += len(removed)
+        return len(removed)
+
+    def _trim(self, device_sn: str, retries: int = 3) -> Optional[int]:
+        """
+        超出上限时丢弃发送时间最早的消息；与版本递增在同一事务内完成(WATCH收件箱与版本号)，
+        期间有其他投递/撤回/重建时重试。返回裁剪后的版本号，无需裁剪或重试耗尽时为None
+        """
+        for _ in range(retries):
+            try:
+                with self._client.pipeline(transaction=True) as pipe:
+                    pipe.watch(_key(device_sn), _key(device_sn, 'version'))
+                    items = pipe.hgetall(_key(device_sn))
+                    ordered = sorted(items.items(), key=lambda item: json.loads(item[1]).get('send_time') or '')
+                    stale = [_text(message_id) for message_id, _ in ordered[:len(ordered) - INBOX_LIMIT]]
+                    if not stale:
+                        return None
+                    pipe.multi()
+                    pipe.hdel(_key(device_sn), *stale)
+                    self._bump(pipe, device_sn)
+                    version = pipe.execute()[1]
+                self.stats['trimmed'] += len(stale)
+                return version
+            except WatchError:
+                continue
+        logger.info(f"❗️ 收件箱裁剪多次冲突，由读取时按上限截断: {device_sn}")
+        return None
+
+    @staticmethod
+    def _bump(pipe, device_sn: str):
+        pipe.incr(_key(device_sn, 'version'))
+        pipe.expire(_key(device_sn, 'version'), INBOX_TTL)
+
+    def _notify(self, device_sns: Iterable[str], versions: Iterable[int]):
+        pipe = self._client.pipeline(transaction=False)
+        for sn, version in zip(device_sns, versions):
+            pipe.publish(f"{CHANNEL_PREFIX}{sn}", version)
+        pipe.execute()
+
+    def apply(self, pending: Iterable[Tuple[str, Dict[str, Any]]]):
+        """处理事务提交后的消息变更：deliver(新消息) / retract_all(消息已响应或删除) / retract(确认明细)"""
+        for action, row in pending:
+            try:
+                if action == 'retract':
+                    self.retract(row['message_id'], [row['device_sn']])
+                    continue
+                device_sns, user_name, org_name = self._target_loader(row)
+                if action == 'retract_all' or is_done(row.get('message_status')) or row.get('is_deleted'):
+                    self.retract(row['id'], device_sns)
+                else:
+                    self.deliver(dict(row, send_time=_format_time(row.get('sent_time')), user_name=user_name,
+                                      org_name=org_name), device_sns)
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.warning(f"⚠️ 消息收件箱更新失败: {action}, 消息ID={row.get('id') or row.get('message_id')}, {e}")
+
+    # ---------------- 推送 ----------------
+    def wait(self, device_sn: str, since: int, timeout: float) -> bool:
+        """长轮询：版本号不等于since时立即返回True，否则订阅变更通知最多等待timeout秒"""
+        if self._client is None:
+            return True
+        self.stats['waits'] += 1
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(f"{CHANNEL_PREFIX}{device_sn}")  # 先订阅再比较版本，避免丢失两者之间的通知
+            current = self.version(device_sn)
+            if current is None or current != int(since):
+                self.stats['wakeups'] += 1
+                return True
+            deadline = self._clock() + min(float(timeout), LONG_POLL_MAX)
+            while self._clock() < deadline:
+                if pubsub.get_message(timeout=max(deadline - self._clock(), 0.01)):
+                    self.stats['wakeups'] += 1
+                    return True
+            self.stats['wait_timeouts'] += 1
+            return False
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.warning(f"⚠️ 消息长轮询等待失败: {device_sn}, {e}")
+            return True
+        finally:
+            pubsub.close()
+
+    def listen(self, device_sn: str, duration: float, heartbeat: float = 15) -> Iterator[Optional[int]]:
+        """SSE：收件箱变化时产出新版本号，空闲heartbeat秒产出None(心跳)，duration秒后结束由客户端重连"""
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(f"{CHANNEL_PREFIX}{device_sn}")
+            deadline = self._clock() + duration
+            while self._clock() < deadline:
+                message = pubsub.get_message(timeout=min(heartbeat, max(deadline - self._clock(), 0.01)))
+                yield int(_text(message['data'])) if message else None
+        finally:
+            pubsub.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats)
+
+# 全局消息收件箱实例
+message_inbox = MessageInbox()
+
+def get_message_inbox() -> MessageInbox:
+    return message_inbox
+
+def _row(target) -> Dict[str, Any]:
+    return {name: getattr(target, name, None) for name in ROW_FIELDS}
+
+def queue_inbox_rows(session, rows: Iterable[Any]):
+    """批量插入(bulk_*不触发ORM事件)时登记待投递消息，事务提交后投递"""
+    session.info.setdefault(PENDING_KEY, []).extend(('deliver', _row(row)) for row in rows)
+
+def install_orm_hooks(session):
+    """ORM新增消息/确认明细、消息状态变为已响应时登记，事务提交后更新收件箱，回滚则丢弃"""
+    from sqlalchemy import event, inspect
+    from sqlalchemy.orm import object_session
+    from .models import DeviceMessage, DeviceMessageDetail
+
+    def queue(target, action, row):
+        target_session = object_session(target)
+        if target_session is not None:  # 提交后属性已过期且不能再发SQL，这里先取值
+            target_session.info.setdefault(PENDING_KEY, []).append((action, row))
+
+    def message_inserted(mapper, connection, target):
+        queue(target, 'deliver', _row(target))
+
+    def message_updated(mapper, connection, target):
+        attrs = inspect(target).attrs
+        changed = attrs.message_status.history.has_changes() or attrs.is_deleted.history.has_changes()
+        if changed and (is_done(target.message_status) or target.is_deleted):
+            queue(target, 'retract_all', _row(target))
+
+    def detail_inserted(mapper, connection, target):
+        if target.device_sn:
+            queue(target, 'retract', {'message_id': target.message_id, 'device_sn': target.device_sn})
+
+    def after_commit(committed):
+        pending = committed.info.pop(PENDING_KEY, None)
+        if pending:
+            get_message_inbox().apply(pending)
+
+    def after_rollback(rolled_back):
+        rolled_back.info.pop(PENDING_KEY, None)
+
+    event.listen(DeviceMessage, 'after_insert', message_inserted)
+    event.listen(DeviceMessage, 'after_update', message_updated)
+    event.listen(DeviceMessageDetail, 'after_insert', detail_inserted)
+    event.listen(session, 'after_commit', after_commit)
+    event.listen(session, 'after_rollback', after_rollback)
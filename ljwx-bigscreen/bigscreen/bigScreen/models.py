@@ -232,6 +232,25 @@ class DeviceInfoHistory(db.Model):
         db.Index('idx_sn_time', 'serial_number', 'timestamp'),
     )
 
+class DeviceStatusRun(db.Model):
+    """设备电量/充电/佩戴状态游程表(差量历史：取值不变的连续上报合并为一行)"""
+    __tablename__ = 't_device_status_run'
+
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    serial_number = db.Column(db.String(255), nullable=False, comment='设备唯一编号')
+    start_time = db.Column(db.DateTime, nullable=False, comment='游程首次上报时间')
+    end_time = db.Column(db.DateTime, nullable=False, comment='游程最后上报时间')
+    battery_level = db.Column(db.Integer, nullable=True, comment='电量')
+    charging_status = db.Column(db.String(16), nullable=True, comment='充电状态')
+    wearable_status = db.Column(db.String(16), nullable=True, comment='佩戴状态')
+    voltage = db.Column(db.Integer, nullable=True, comment='游程内最后一次上报的电压')
+    samples = db.Column(db.Integer, nullable=False, default=1, comment='游程内上报次数')
+
+    __table_args__ = (
+        db.UniqueConstraint('serial_number', 'start_time', name='uk_sn_start'),
+        db.Index('idx_sn_end', 'serial_number', 'end_time'),
+    )
+
 class DeviceInfo(db.Model):
     __tablename__ = 't_device_info'
     
@@ -546,6 +565,32 @@ class AlertLog(db.Model):
     handled_via = db.Column(db.String(50), nullable=True, comment='处理途径（如微信、消息等）')
     result = db.Column(db.String(50), nullable=True, comment='处理结果（如成功、失败等）')
 
+class AlertNotificationOutbox(db.Model):
+    """告警通知发件箱表(与告警同一事务写入，由通知工作池异步发送)"""
+    __tablename__ = 't_alert_notification_outbox'
+    
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    alert_id = db.Column(db.BigInteger, nullable=False, comment='告警ID')
+    channel = db.Column(db.String(20), nullable=False, comment='通知渠道:wechat/system')
+    dedup_key = db.Column(db.String(128), nullable=False, comment='去重键(告警ID:渠道)')
+    device_sn = db.Column(db.String(50), nullable=True, comment='设备序列号')
+    payload = db.Column(db.JSON, nullable=True, comment='通知内容')
+    status = db.Column(db.String(20), default='pending', nullable=False, comment='状态:pending/processing/sent/dead')
+    attempts = db.Column(db.Integer, default=0, nullable=False, comment='已尝试次数')
+    next_attempt_time = db.Column(db.DateTime, default=datetime.now, nullable=False, comment='下次发送时间')
+    locked_by = db.Column(db.String(64), nullable=True, comment='领取批次标识')
+    locked_until = db.Column(db.DateTime, nullable=True, comment='领取租约到期时间')
+    last_error = db.Column(db.String(500), nullable=True, comment='最近一次错误')
+    create_time = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    sent_time = db.Column(db.DateTime, nullable=True, comment='发送成功时间')
+    
+    __table_args__ = (
+        db.UniqueConstraint('dedup_key', name='uk_dedup_key'),
+        db.Index('idx_status_next_attempt', 'status', 'next_attempt_time'),
+        db.Index('idx_locked_by', 'locked_by'),
+        {'comment': '告警通知发件箱表'}
+    )
+
 class HealthBaseline(db.Model):
     __tablename__ = 't_health_baseline'
     
@@ -792,6 +837,32 @@ class OrgManagerCache(db.Model):
 
     __table_args__ = {'comment': '组织/部门/子部门管理'}
 
+class HealthRollup(db.Model):
+    """健康数据分级汇总表(5分钟/小时/天，按设备+指标；avg=value_sum/sample_count)"""
+    __tablename__ = 't_health_rollup'
+    
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    bucket_level = db.Column(db.String(4), nullable=False, comment='汇总粒度:5m/1h/1d')
+    bucket_start = db.Column(db.DateTime, nullable=False, comment='时间桶起点')
+    device_sn = db.Column(db.String(50), nullable=False, comment='设备序列号')
+    metric = db.Column(db.String(32), nullable=False, comment='指标名(与t_user_health_data字段一致)')
+    customer_id = db.Column(db.BigInteger, nullable=False, default=0, comment='租户ID')
+    org_id = db.Column(db.BigInteger, nullable=True, comment='组织ID')
+    user_id = db.Column(db.BigInteger, nullable=True, comment='用户ID')
+    sample_count = db.Column(db.Integer, nullable=False, default=0, comment='有效样本数(不含空值和0)')
+    value_sum = db.Column(db.Float, nullable=False, default=0, comment='取值合计')
+    value_min = db.Column(db.Float, nullable=True, comment='最小值')
+    value_max = db.Column(db.Float, nullable=True, comment='最大值')
+    update_time = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint('bucket_level', 'device_sn', 'metric', 'bucket_start', name='uk_level_device_metric_bucket'),
+        db.Index('idx_org_level_metric_bucket', 'org_id', 'bucket_level', 'metric', 'bucket_start'),
+        db.Index('idx_user_level_metric_bucket', 'user_id', 'bucket_level', 'metric', 'bucket_start'),
+        db.Index('idx_level_bucket', 'bucket_level', 'bucket_start'),
+        {'comment': '健康数据分级汇总表'}
+    )
+
 class HealthSummaryDaily(db.Model):
     __tablename__ = 't_health_summary_daily'
     summary_id = db.Column(db.BigInteger, primary_key=True, autoincrement=True, comment='汇总记录主键')
@@ -1267,3 +1338,16 @@ class HealthRecommendationTrack(db.Model):
         }
 
 
+
+class StatsCounter(db.Model):
+    """大屏日计数快照表(Redis日计数定期写入；org_id=0为租户合计)"""
+    __tablename__ = 't_stats_counter'
+    
+    customer_id = db.Column(db.BigInteger, primary_key=True, comment='租户ID')
+    stat_day = db.Column(db.Date, primary_key=True, comment='统计日期')
+    org_id = db.Column(db.BigInteger, primary_key=True, default=0, comment='组织ID(0为租户合计)')
+    kind = db.Column(db.String(32), primary_key=True, comment='类型:health/alert/alert:<级别>/message/device')
+    value = db.Column(db.BigInteger, nullable=False, default=0, comment='数量')
+    update_time = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    
+    __table_args__ = {'comment': '大屏日计数快照表'}
@@ -9,6 +9,7 @@ from sqlalchemy import text, and_, or_
 # 导入组织架构优化查询服务
 from .org_optimized import get_org_service
 from .org_service import get_unified_org_service
+from .org_forest import get_org_forest
 
 # Configure logging
 logging.basicConfig(filename='org.log', level=logging.INFO,
@@ -756,6 +757,11 @@ def findAllDescendants(customer_id):
     try:
         logger.info(f"开始查询客户 {customer_id} 下的所有部门")
         
+        # 方法0: 进程内组织森林(欧拉序区间，子树为一次切片)
+        org_ids = get_org_forest().descendants(customer_id, customer_id)
+        if org_ids:
+            return sorted(org_ids)
+        
         # 方法1: 使用 sys_org_closure 表查询
         try:
             sql = text("""
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+租户组织森林(进程内)
+每个租户一次查询加载sys_org_units(父节点缺失时用sys_org_closure的depth=1记录补齐)，
+深度优先遍历生成欧拉序区间[tin, tout)：子树 = 先序数组的一个切片，祖先判断 = 区间包含，
+祖先路径在遍历时预先生成。org_change_channel收到组织变更后只重载对应租户，改名等不改变结构的更新原地修改；
+订阅不可用时按TTL兜底。org.py / org_service / OrgOptimizedService 共用
+"""
+
+import json
+import time
+import threading
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .redis_helper import RedisHelper
+
+logger = logging.getLogger(__name__)
+
+ORG_CHANGE_CHANNEL = 'org_change_channel'  # 消息: {"customer_id": ..., "org_id": ..., "action": "CREATE/UPDATE/DELETE", "org": {...}}
+
+ORG_SQL = """
+    SELECT u.id, COALESCE(NULLIF(u.parent_id, 0), c.ancestor_id) AS parent_id, u.name, u.code, u.level,
+           u.customer_id, u.create_time
+    FROM sys_org_units u
+    LEFT JOIN sys_org_closure c ON c.descendant_id = u.id AND c.depth = 1
+    WHERE (u.customer_id = %s OR u.id = %s) AND (u.is_deleted = 0 OR u.is_deleted IS NULL)
+    ORDER BY u.sort, u.id
+"""
+TENANT_SQL = "SELECT customer_id FROM sys_org_units WHERE id = %s"
+
+class OrgNode:
+    __slots__ = ('id', 'parent_id', 'name', 'code', 'level', 'customer_id', 'create_time')
+
+    def __init__(self, id, parent_id, name, code, level, customer_id, create_time=None):
+        self.id = int(id)
+        self.parent_id = int(parent_id) if parent_id else None
+        self.name = name
+        self.code = code
+        self.level = level or 0
+        self.customer_id = customer_id
+        self.create_time = create_time
+
+    def to_dict(self) -> Dict[str, Any]:
+        """与OrgOptimizedService返回格式一致"""
+        create_time = self.create_time
+        if hasattr(create_time, 'strftime'):
+            create_time = create_time.strftime('%Y-%m-%d %H:%M:%S')
+        return {'id': self.id, 'name': self.name, 'code': self.code or '', 'parent_id': self.parent_id,
+                'level': self.level, 'customer_id': self.customer_id, 'create_time': create_time}
+
+class TenantForest:
+    """单个租户的组织森林 + 欧拉序区间索引"""
+
+    def __init__(self, customer_id, nodes: Iterable[OrgNode]):
+        self.customer_id = customer_id
+        self.nodes: Dict[int, OrgNode] = {node.id: node for node in nodes}
+        self.loaded_at = time.time()
+        self._index()
+
+    def _index(self):
+        children: Dict[Optional[int], List[int]] = {}
+        for node in self.nodes.values():
+            parent = node.parent_id if node.parent_id in self.nodes and node.parent_id != node.id else None
+            children.setdefault(parent, []).append(node.id)
+        self.children = children
+        self.order: List[int] = []
+        self.tin: Dict[int, int] = {}
+        self.tout: Dict[int, int] = {}
+        self.paths: Dict[int, Tuple[int, ...]] = {}  # 根到父节点的路径
+        # 先从根遍历；环上的节点不可达，按id作为补充根，visited保证每个节点只访问一次
+        for root in children.get(None, []) + sorted(self.nodes):
+            if root in self.tin:
+                continue
+            stack = [(root, (), False)]
+            while stack:
+                org_id, path, leaving = stack.pop()
+                if leaving:
+                    self.tout[org_id] = len(self.order)
+                    continue
+                if org_id in self.tin:
+                    continue
+                self.tin[org_id] = len(self.order)
+                self.order.append(org_id)
+                self.paths[org_id] = path
+                stack.append((org_id, path, True))
+                child_path = path + (org_id,)
+                for child in reversed(children.get(org_id, [])):
+                    if child not in self.tin:
+                        stack.append((child, child_path, False))
+
+    def __contains__(self, org_id) -> bool:
+        return org_id in self.tin
+
+    def descendants(self, org_id: int, include_self: bool = True) -> List[int]:
+        """子树内全部组织ID(先序)，切片O(子树大小)"""
+        start = self.tin[org_id]
+        return self.order[start if include_self else start + 1:self.tout[org_id]]
+
+    def subtree_size(self, org_id: int) -> int:
+        return self.tout[org_id] - self.tin[org_id]
+
+    def is_descendant(self, org_id: int, ancestor_id: int) -> bool:
+        """O(1)：org_id是否在ancestor_id子树内(含自身)"""
+        if org_id not in self.tin or ancestor_id not in self.tin:
+            return False
+        return self.tin[ancestor_id] <= self.tin[org_id] < self.tout[ancestor_id]
+
+    def ancestors(self, org_id: int) -> Tuple[int, ...]:
+        """从根到直接父节点的路径"""
+        return self.paths[org_id]
+
+    def direct_children(self, org_id: int) -> List[int]:
+        return [child for child in self.children.get(org_id, []) if child in self.tin]
+
+    def roots(self) -> List[int]:
+        return [org_id for org_id in self.order if not self.paths[org_id]]
+
+def _default_loader(customer_id) -> List[OrgNode]:
+    from .db_pool import get_db_connection
+    with get_db_connection(readonly=True) as conn, conn.cursor() as cursor:
+        cursor.execute(ORG_SQL, (customer_id, customer_id))
+        return [OrgNode(*row) for row in cursor.fetchall()]
+
+def _default_tenant_lookup(org_id) -> Optional[int]:
+    from .db_pool import get_db_connection
+    with get_db_connection(readonly=True) as conn, conn.cursor() as cursor:
+        cursor.execute(TENANT_SQL, (org_id,))
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    return int(row[0]) if row[0] else int(org_id)  # 顶级组织customer_id可能为0，租户即自身
+
+class OrgForestCache:
+    """按租户缓存组织森林，变更通知后重载单个租户"""
+
+    def __init__(self, loader: Optional[Callable[[Any], List[OrgNode]]] = None,
+                 tenant_lookup: Optional[Callable[[int], Optional[int]]] = None, ttl: int = 600,
+                 subscribe: bool = True):
+        self._loader = loader or _default_loader
+        self._tenant_lookup = tenant_lookup or _default_tenant_lookup
+        self.ttl = ttl  # 变更通知丢失时的兜底刷新间隔(秒)
+        self._subscribe = subscribe
+        self._forests: Dict[int, TenantForest] = {}
+        self._org_tenants: Dict[int, int] = {}
+        self._dirty: set = set()
+        self._lock = threading.Lock()
+        self._subscriber: Optional[threading.Thread] = None
+        self.stats = {'lookups': 0, 'loads': 0, 'load_errors': 0, 'tenant_lookups': 0, 'invalidations': 0,
+                      'patches': 0, 'last_load_ms': 0.0}
+
+    # ---------------- 加载 ----------------
+    def get_forest(self, customer_id) -> Optional[TenantForest]:
+        customer_id = int(customer_id)
+        forest = self._forests.get(customer_id)
+        if forest is not None and customer_id not in self._dirty and time.time() - forest.loaded_at < self.ttl:
+            return forest
+        with self._lock:
+            forest = self._forests.get(customer_id)
+            if forest is not None and customer_id not in self._dirty and time.time() - forest.loaded_at < self.ttl:
+                return forest
+            start = time.time()
+            self._dirty.discard(customer_id)  # 先清标记，加载期间到达的变更通知会再次置位
+            try:
+                forest = TenantForest(customer_id, self._loader(customer_id))
+            except Exception as e:
+                self.stats['load_errors'] += 1
+                logger.warning(f"组织森林加载失败(customer_id={customer_id})，沿用上次结果: {e}")
+                return self._forests.get(customer_id)
+            self._forests[customer_id] = forest
+            for org_id in forest.nodes:
+                self._org_tenants[org_id] = customer_id
+            self.stats['loads'] += 1
+            self.stats['last_load_ms'] = round((time.time() - start) * 1000, 2)
+            logger.info(f"🌲 组织森林已加载: customer_id={customer_id}, {len(forest.nodes)}个组织, "
+                        f"耗时{self.stats['last_load_ms']}ms")
+        self._ensure_subscriber()
+        return forest
+
+    def tenant_of(self, org_id) -> Optional[int]:
+        """组织所属租户(customer_id)，按组织反查并缓存；组织不存在或查询失败时为None"""
+        org_id = int(org_id)
+        customer_id = self._org_tenants.get(org_id)
+        if customer_id:
+            return customer_id
+        self.stats['tenant_lookups'] += 1
+        try:
+            customer_id = self._tenant_lookup(org_id)
+        except Exception as e:
+            logger.warning(f"组织{org_id}租户反查失败: {e}")
+            return None
+        if not customer_id:
+            return None
+        self._org_tenants[org_id] = int(customer_id)
+        return int(customer_id)
+
+    def forest_for(self, org_id, customer_id=None) -> Optional[TenantForest]:
+        """组织所在租户的森林；未传customer_id时按组织反查租户(结果缓存)"""
+        self.stats['lookups'] += 1
+        org_id = int(org_id)
+        customer_id = customer_id or self.tenant_of(org_id)
+        if not customer_id:
+            return None
+        forest = self.get_forest(customer_id)
+        return forest if forest is not None and org_id in forest else None
+
+    # ---------------- 查询 ----------------
+    def descendants(self, org_id, customer_id=None, include_self: bool = True) -> Optional[List[int]]:
+        """子树组织ID；组织不在缓存中时返回None(调用方走原有查询)"""
+        forest = self.forest_for(org_id, customer_id)
+        return forest.descendants(int(org_id), include_self) if forest else None
+
+    def descendant_nodes(self, org_id, customer_id=None) -> Optional[List[Dict[str, Any]]]:
+        """所有下级组织(不含自身)"""
+        forest = self.forest_for(org_id, customer_id)
+        if forest is None:
+            return None
+        return [forest.nodes[child].to_dict() for child in forest.descendants(int(org_id), include_self=False)]
+
+    def children_nodes(self, org_id, customer_id=None) -> Optional[List[Dict[str, Any]]]:
+        forest = self.forest_for(org_id, customer_id)
+        if forest is None:
+            return None
+        return [forest.nodes[child].to_dict() for child in forest.direct_children(int(org_id))]
+
+    def ancestor_nodes(self, org_id, customer_id=None) -> Optional[List[Dict[str, Any]]]:
+        """从根组织到直接父组织的路径"""
+        forest = self.forest_for(org_id, customer_id)
+        if forest is None:
+            return None
+        return [forest.nodes[ancestor].to_dict() for ancestor in forest.ancestors(int(org_id))]
+
+    def node(self, org_id, customer_id=None) -> Optional[OrgNode]:
+        forest = self.forest_for(org_id, customer_id)
+        return forest.nodes[int(org_id)] if forest else None
+
+    def is_descendant(self, org_id, ancestor_id, customer_id=None) -> bool:
+        forest = self.forest_for(ancestor_id, customer_id)
+        return bool(forest and forest.is_descendant(int(org_id), int(ancestor_id)))
+
+    # ---------------- 变更 ----------------
+    def invalidate(self, customer_id=None):
+        """标记租户(为空时全部)过期，下次查询时重新加载"""
+        self.stats['invalidations'] += 1
+        if customer_id is None:
+            self._dirty.update(self._forests)
+        else:
+            self._dirty.add(int(customer_id))
+
+    def apply_change(self, event: Dict[str, Any]):
+        """处理组织变更事件：父节点未变的更新(改名/编码)原地修改，其余重载该租户"""
+        org = event.get('org') or {}
+        org_id = event.get('org_id') or org.get('id')
+        customer_id = event.get('customer_id') or (self._org_tenants.get(int(org_id)) if org_id else None)
+        forest = self._forests.get(int(customer_id)) if customer_id else None
+        if forest is not None and org_id and event.get('action') == 'UPDATE' and org and not org.get('is_deleted'):
+            node = forest.nodes.get(int(org_id))
+            parent_id = org.get('parent_id')
+            if node is not None and (int(parent_id) if parent_id else None) == node.parent_id:
+                node.name = org.get('name', node.name)
+                node.code = org.get('code', node.code)
+                node.level = org.get('level', node.level)
+                self.stats['patches'] += 1
+                return
+        if customer_id:
+            self.invalidate(customer_id)
+            if org_id and int(customer_id) == int(org_id) and event.get('action') == 'DELETE':
+                self._forests.pop(int(customer_id), None)  # 租户本身被删除
+        else:
+            self.invalidate()
+
+    def _ensure_subscriber(self):
+        if not self._subscribe or self._subscriber is not None:
+            return
+        with self._lock:
+            if self._subscriber is not None:
+                return
+            self._subscriber = threading.Thread(target=self._subscribe_loop, daemon=True, name='OrgForestSubscriber')
+            self._subscriber.start()
+
+    def _subscribe_loop(self):
+        while True:
+            try:
+                pubsub = RedisHelper().client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(ORG_CHANGE_CHANNEL)
+                for message in pubsub.listen():
+                    if message.get('type') != 'message':
+                        continue
+                    try:
+                        event = json.loads(message.get('data'))
+                        if isinstance(event, str):  # RedisTemplate的JSON序列化会把消息再包一层字符串
+                            event = json.loads(event)
+                        self.apply_change(event)
+                    except (TypeError, ValueError) as e:
+                        logger.warning(f"组织变更消息无法解析，全部租户重载: {e}")
+                        self.invalidate()
+            except Exception as e:
+                logger.warning(f"组织变更订阅中断，{self.ttl}s TTL兜底，30秒后重连: {e}")
+                time.sleep(30)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats['tenants'] = len(self._forests)
+        stats['orgs'] = sum(len(forest.nodes) for forest in self._forests.values())
+        stats['dirty'] = len(self._dirty)
+        return stats
+
+def notify_org_change(customer_id, org_id=None, action: str = 'UPDATE', org: Optional[Dict[str, Any]] = None,
+                      redis_client=None):
+    """组织新增/修改/删除后通知所有进程(ljwx-boot同样发布到该频道)"""
+    try:
+        client = redis_client or RedisHelper().client
+        client.publish(ORG_CHANGE_CHANNEL, json.dumps({'customer_id': customer_id, 'org_id': org_id, 'action': action,
+                                                       'org': org or {}, 'ts': int(time.time())}, default=str))
+    except Exception as e:
+        logger.warning(f"组织变更通知发送失败，各进程将在TTL到期后刷新: {e}")
+
+# 全局组织森林实例
+org_forest_cache = OrgForestCache()
+
+def get_org_forest() -> OrgForestCache:
+    return org_forest_cache
@@ -20,6 +20,7 @@ import logging
 import time
 from typing import List, Dict, Optional, Tuple
 from datetime import datetime
+from .org_forest import get_org_forest
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -219,6 +220,11 @@ class OrgOptimizedService:
         Returns:
             所有下级部门列表
         """
+        # 进程内组织森林命中时不再调用API
+        forest_result = get_org_forest().descendant_nodes(org_id, customer_id)
+        if forest_result is not None:
+            return forest_result
+        
         cache_key = self._get_cache_key(["descendants", org_id, customer_id])
         
         # 先检查缓存
@@ -260,6 +266,10 @@ class OrgOptimizedService:
         Returns:
             直接子部门列表
         """
+        forest_result = get_org_forest().children_nodes(org_id, customer_id)
+        if forest_result is not None:
+            return forest_result
+        
         cache_key = self._get_cache_key(["direct_children", org_id, customer_id])
         
         # 先检查缓存
@@ -301,6 +311,10 @@ class OrgOptimizedService:
         Returns:
             从根组织到直接父组织的路径
         """
+        forest_result = get_org_forest().ancestor_nodes(org_id, customer_id)
+        if forest_result is not None:
+            return forest_result
+        
         cache_key = self._get_cache_key(["ancestor_path", org_id, customer_id])
         
         # 先检查缓存
@@ -454,7 +468,8 @@ class OrgOptimizedService:
             'total_cached_items': len(self.cache),
             'cache_expire_time': self.cache_expire_time,
             'oldest_cache_time': min([item['timestamp'] for item in self.cache.values()]) if self.cache else None,
-            'newest_cache_time': max([item['timestamp'] for item in self.cache.values()]) if self.cache else None
+            'newest_cache_time': max([item['timestamp'] for item in self.cache.values()]) if self.cache else None,
+            'org_forest': get_org_forest().get_stats()
         }
 
 # 全局实例，供其他模块使用
@@ -9,6 +9,7 @@ from typing import List, Dict, Optional, Tuple
 from .models import db, OrgInfo, UserOrg, UserInfo
 # tenant_context removed - customerId now passed as parameter
 from .org_optimized import get_org_service
+from .org_forest import get_org_forest
 from collections import defaultdict
 from sqlalchemy import text
 
@@ -192,6 +193,11 @@ class OrgService:
                 customer_id = None
                 logger.info("无Flask上下文，不设置默认customer_id，将根据org_id查询")
         
+        # 进程内组织森林：子树为欧拉序数组的一次切片
+        org_ids = get_org_forest().descendants(org_id, customer_id)
+        if org_ids is not None:
+            return org_ids
+        
         try:
             # 优先使用闭包表查询
             child_orgs = self.org_optimized.find_all_descendants(org_id, customer_id)
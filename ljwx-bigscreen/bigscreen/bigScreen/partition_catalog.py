@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+健康数据分区表目录缓存
+进程内缓存 t_user_health_data* 系列表(主表、月度分区、分区视图、汇总表)及其字段，
+一次information_schema查询加载；create_partitions新增月份后通过partition_catalog_channel通知刷新，
+订阅不可用时按TTL兜底。查询路径判断"有哪些分区、各有哪些字段"无需访问数据库
+"""
+
+import json
+import time
+import threading
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional
+
+from .redis_helper import RedisHelper
+
+logger = logging.getLogger(__name__)
+
+CATALOG_CHANNEL = 'partition_catalog_channel'  # 消息: {"action": "partitions_changed", "tables": [...]}
+TABLE_PREFIX = 't_user_health_data'
+PARTITION_VIEW = 't_user_health_data_partitioned'
+DAILY_SUMMARY_TABLE = 't_user_health_data_daily_summary'
+
+CATALOG_SQL = """
+    SELECT TABLE_NAME, COLUMN_NAME FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME LIKE 't\\_user\\_health\\_data%'
+    ORDER BY TABLE_NAME, ORDINAL_POSITION
+"""
+
+def partition_name(year: int, month: int) -> str:
+    return f"{TABLE_PREFIX}_{year}{month:02d}"
+
+def month_partitions(start_date: Optional[datetime], end_date: Optional[datetime]) -> List[str]:
+    """时间范围覆盖的月度分区表名(与_get_partition_tables一致：缺省为最近30天)"""
+    start_date = start_date or datetime.now() - timedelta(days=30)
+    end_date = end_date or datetime.now()
+    year, month = start_date.year, start_date.month
+    names = []
+    while (year, month) <= (end_date.year, end_date.month):
+        names.append(partition_name(year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return names
+
+def _default_loader() -> Dict[str, FrozenSet[str]]:
+    from .db_pool import get_db_connection
+    tables: Dict[str, set] = {}
+    with get_db_connection(readonly=True) as conn, conn.cursor() as cursor:
+        cursor.execute(CATALOG_SQL)
+        for table_name, column_name in cursor.fetchall():
+            tables.setdefault(table_name, set()).add(column_name.lower())
+    return {name: frozenset(cols) for name, cols in tables.items()}
+
+class PartitionCatalog:
+    """分区表/字段目录 - 进程内缓存，变更通知或TTL到期后重新加载"""
+
+    def __init__(self, loader: Optional[Callable[[], Dict[str, FrozenSet[str]]]] = None, ttl: int = 600,
+                 subscribe: bool = True):
+        self._loader = loader or _default_loader
+        self.ttl = ttl  # 订阅消息丢失时的兜底刷新间隔(秒)
+        self._subscribe = subscribe
+        self._tables: Dict[str, FrozenSet[str]] = {}
+        self._loaded_at = 0.0
+        self._dirty = True
+        self._lock = threading.Lock()
+        self._subscriber: Optional[threading.Thread] = None
+        self.stats = {'lookups': 0, 'loads': 0, 'load_errors': 0, 'invalidations': 0, 'last_load_ms': 0.0}
+
+    # ---------------- 加载 ----------------
+    def _ensure_loaded(self):
+        if not self._dirty and time.time() - self._loaded_at < self.ttl:
+            return
+        with self._lock:
+            if not self._dirty and time.time() - self._loaded_at < self.ttl:
+                return
+            start = time.time()
+            self._dirty = False  # 先清标记，加载期间到达的变更通知会再次置位
+            try:
+                self._tables = self._loader()
+                self.stats['loads'] += 1
+                self.stats['last_load_ms'] = round((time.time() - start) * 1000, 2)
+                logger.info(f"📚 分区目录已加载: {len(self._tables)}张表, 耗时{self.stats['last_load_ms']}ms")
+            except Exception as e:
+                self.stats['load_errors'] += 1
+                logger.warning(f"分区目录加载失败，沿用上次结果: {e}")
+            self._loaded_at = time.time()  # 失败时同样等待TTL，避免每个请求都重试
+        self._ensure_subscriber()
+
+    def invalidate(self):
+        """标记目录过期，下次查询时重新加载"""
+        self._dirty = True
+        self.stats['invalidations'] += 1
+
+    # ---------------- 查询 ----------------
+    def has_table(self, table_name: str) -> bool:
+        self.stats['lookups'] += 1
+        self._ensure_loaded()
+        return table_name in self._tables
+
+    def columns(self, table_name: str) -> FrozenSet[str]:
+        """表字段(小写)，表不存在时为空集合"""
+        self.stats['lookups'] += 1
+        self._ensure_loaded()
+        return self._tables.get(table_name, frozenset())
+
+    def existing_partitions(self, names: Iterable[str]) -> List[str]:
+        """过滤出实际存在的分区表，保持传入顺序"""
+        self.stats['lookups'] += 1
+        self._ensure_loaded()
+        return [name for name in names if name in self._tables]
+
+    def partitions_between(self, start_date: Optional[datetime], end_date: Optional[datetime]) -> List[str]:
+        return self.existing_partitions(month_partitions(start_date, end_date))
+
+    # ---------------- 变更通知 ----------------
+    def _ensure_subscriber(self):
+        if not self._subscribe or self._subscriber is not None:
+            return
+        self._subscriber = threading.Thread(target=self._subscribe_loop, daemon=True, name='PartitionCatalogSubscriber')
+        self._subscriber.start()
+
+    def _subscribe_loop(self):
+        while True:
+            try:
+                pubsub = RedisHelper().client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CATALOG_CHANNEL)
+                for message in pubsub.listen():
+                    if message.get('type') == 'message':
+                        logger.info(f"📚 收到分区变更通知: {message.get('data')}")
+                        self.invalidate()
+            except Exception as e:
+                logger.warning(f"分区目录订阅中断，{self.ttl}s TTL兜底，30秒后重连: {e}")
+                time.sleep(30)
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['tables'] = len(self._tables)
+        stats['partitions'] = sorted(name for name in self._tables if name[len(TABLE_PREFIX) + 1:].isdigit())
+        stats['age_seconds'] = round(time.time() - self._loaded_at, 1) if self._loaded_at else None
+        return stats
+
+def notify_partition_change(tables: Iterable[str] = (), redis_client=None):
+    """分区表新增/删除后通知所有进程刷新目录(create_partitions调用)"""
+    try:
+        client = redis_client or RedisHelper().client
+        client.publish(CATALOG_CHANNEL, json.dumps({'action': 'partitions_changed', 'tables': list(tables),
+                                                   'ts': int(time.time())}))
+    except Exception as e:
+        logger.warning(f"分区变更通知发送失败，各进程将在TTL到期后刷新: {e}")
+
+# 全局分区目录实例
+partition_catalog = PartitionCatalog()
+
+def get_partition_catalog() -> PartitionCatalog:
+    return partition_catalog
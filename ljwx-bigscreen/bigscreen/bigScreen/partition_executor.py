@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+分区查询并发执行器
+跨月查询时各分区SQL在独立的连接池连接上并发执行(并发数可配置，默认4，须小于SQLAlchemy pool_size)，
+调用方按顺序归并结果；一页取满后取消尚未开始的分区查询。按分区记录耗时，便于定位慢月份
+"""
+
+import os
+import time
+import threading
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = int(os.getenv('PARTITION_FANOUT_WORKERS', 4))
+
+class FanoutBatch:
+    """一次请求内提交的分区查询；cancel()后未开始的查询直接取消，已在执行的结果丢弃"""
+
+    def __init__(self, executor: 'PartitionFanoutExecutor'):
+        self._executor = executor
+        self._futures: List[Future] = []
+        self._cancelled = threading.Event()
+        self.latency_ms: Dict[str, float] = {}  # 本次请求各分区累计耗时
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def submit(self, label: str, fn: Callable, *args) -> Future:
+        future = self._executor._submit(self, label, fn, *args)
+        self._futures.append(future)
+        return future
+
+    def map_ordered(self, tasks: List[tuple]) -> List[Any]:
+        """并发执行[(label, fn, *args)]，按提交顺序返回结果；任一失败则取消其余并抛出"""
+        futures = [self.submit(label, fn, *args) for label, fn, *args in tasks]
+        try:
+            return [future.result() for future in futures]
+        except Exception:
+            self.cancel()
+            raise
+
+    def cancel(self):
+        self._cancelled.set()
+        cancelled = sum(1 for future in self._futures if future.cancel())
+        self._executor.stats['cancelled'] += cancelled
+        return cancelled
+
+class PartitionFanoutExecutor:
+    """有界线程池 + 分区耗时统计"""
+
+    def __init__(self, max_workers: int = None):
+        self.max_workers = max(1, max_workers or DEFAULT_MAX_WORKERS)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='PartitionFanout')
+        self._lock = threading.Lock()
+        self.partition_latency: Dict[str, Dict[str, float]] = {}
+        self.stats = {'batches': 0, 'tasks': 0, 'cancelled': 0, 'skipped': 0, 'errors': 0}
+
+    def batch(self) -> FanoutBatch:
+        self.stats['batches'] += 1
+        return FanoutBatch(self)
+
+    def _submit(self, batch: FanoutBatch, label: str, fn: Callable, *args) -> Future:
+        self.stats['tasks'] += 1
+
+        def run():
+            if batch.cancelled:  # 页已取满，排队中的查询不再访问数据库
+                self.stats['skipped'] += 1
+                return []
+            start = time.time()
+            try:
+                return fn(*args)
+            except Exception:
+                self.stats['errors'] += 1
+                raise
+            finally:
+                self._record(batch, label, (time.time() - start) * 1000)
+
+        return self._pool.submit(run)
+
+    def _record(self, batch: FanoutBatch, label: str, elapsed_ms: float):
+        with self._lock:
+            batch.latency_ms[label] = round(batch.latency_ms.get(label, 0.0) + elapsed_ms, 2)
+            item = self.partition_latency.setdefault(label, {'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'last_ms': 0.0})
+            item['calls'] += 1
+            item['total_ms'] += elapsed_ms
+            item['max_ms'] = max(item['max_ms'], elapsed_ms)
+            item['last_ms'] = elapsed_ms
+        if elapsed_ms > 1000:
+            logger.warning(f"🐢 分区查询较慢: {label} 耗时{elapsed_ms:.0f}ms")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            partitions = {label: {'calls': item['calls'],
+                                  'avg_ms': round(item['total_ms'] / item['calls'], 2) if item['calls'] else 0.0,
+                                  'max_ms': round(item['max_ms'], 2), 'last_ms': round(item['last_ms'], 2)}
+                          for label, item in sorted(self.partition_latency.items())}
+        return dict(self.stats, max_workers=self.max_workers, partitions=partitions)
+
+def engine_execute(engine) -> Callable[[Any, Dict[str, Any]], List[Any]]:
+    """返回在engine连接池独立连接上执行语句的函数(工作线程内调用，不占用请求的session)"""
+    def execute(statement, params):
+        with engine.connect() as conn:
+            return conn.execute(statement, params).fetchall()
+    return execute
+
+# 全局分区执行器实例
+partition_fanout_executor = PartitionFanoutExecutor()
+
+def get_partition_fanout_executor() -> PartitionFanoutExecutor:
+    return partition_fanout_executor
@@ -1,13 +1,18 @@
 from flask import Blueprint, request, jsonify
 from sqlalchemy import func, and_, text, or_
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from .models import (
     db, UserInfo, UserOrg, OrgInfo, UserHealthData, 
     AlertInfo, DeviceInfo, DeviceMessage
 )
+from .stats_counters import get_stats_counter_store
+from .single_flight import get_single_flight
+from .org_forest import get_org_forest
 
 realtime_stats_bp = Blueprint('realtime_stats', __name__)
 
+REALTIME_STATS_TTL = 10  # 多块大屏同时轮询时共享同一份结果
+
 def get_subordinate_users(customer_id):
     """根据customerId获取所有相关用户 - 简化版本，直接使用customer_id字段"""
     try:
@@ -35,160 +40,82 @@ def get_subordinate_users(customer_id):
         print(f"获取用户失败: {e}")
         return []
 
-def get_today_health_data_stats(customer_id):
-    """获取当日健康数据统计 - 直接使用customer_id"""
+def _format_count(count):
+    return f"{count / 1000:.1f}K" if count >= 1000 else str(count)
+
+def _growth(today_count, yesterday_count):
+    """与昨日对比的增长率"""
+    if yesterday_count > 0:
+        rate = round((today_count - yesterday_count) / yesterday_count * 100)
+    else:
+        rate = 100 if today_count > 0 else 0
+    return f"+{rate}%" if rate >= 0 else f"{rate}%"
+
+def _resolve_customer_id(args):
+    """请求的租户ID：优先customerId；仅传orgId时反查该组织所属租户，无法确定时为None"""
+    customer_id = args.get('customerId')
+    if customer_id:
+        return customer_id
+    org_id = args.get('orgId')
+    if not org_id or not str(org_id).isdigit():
+        return None
+    tenant = get_org_forest().tenant_of(org_id)
+    return str(tenant) if tenant else None
+
+def get_realtime_stats_data():
+    """实时统计数据 - 当日/昨日数量读取预聚合日计数，待处理告警与未读消息按状态统计，同一租户的并发请求经单飞缓存合并，返回(结果, 状态码)"""
     try:
-        today = date.today()
-        
-        # 直接通过customer_id统计当日健康数据
-        # 方案1：如果UserHealthData表有customer_id字段
-        try:
-            health_count = db.session.query(func.count(UserHealthData.id)).filter(
-                UserHealthData.customer_id == customer_id,
-                func.date(UserHealthData.timestamp) == today
-            ).scalar() or 0
-        except:
-            # 方案2：通过设备关联查询
-            health_count = db.session.query(func.count(UserHealthData.id)).join(
-                DeviceInfo, UserHealthData.device_sn == DeviceInfo.serial_number
-            ).filter(
-                DeviceInfo.customer_id == customer_id,
-                func.date(UserHealthData.timestamp) == today
-            ).scalar() or 0
+        customer_id = _resolve_customer_id(request.args)
+        if not customer_id:
+            return {
+                "success": False,
+                "error": "customerId参数是必需的(或传入可解析所属租户的orgId)"
+            }, 400
         
-        # 计算增长率 (简化为固定值)
-        growth_rate = "+5%"
+        def compute():
+            store = get_stats_counter_store()
+            today = store.get_counters(customer_id)
+            yesterday = store.get_counters(customer_id, date.today() - timedelta(days=1))
         
-        return {
-            "count": f"{health_count / 1000:.1f}K" if health_count >= 1000 else str(health_count),
-            "growth": growth_rate
-        }
-    except Exception as e:
-        print(f"获取健康数据统计失败: {e}")
-        return {"count": "0", "growth": "+0%"}
-
-def get_today_alert_stats(customer_id):
-    """获取当日待处理告警统计 - 直接使用customer_id"""
-    try:
-        # 直接通过设备关联查询告警
-        try:
-            alert_count = db.session.query(func.count(AlertInfo.id)).join(
-                DeviceInfo, AlertInfo.device_sn == DeviceInfo.serial_number
-            ).filter(
-                DeviceInfo.customer_id == customer_id,
+            # 状态类数量(非按天累计)：按customer_id等值条件统计
+            pending_alerts = db.session.query(func.count(AlertInfo.id)).filter(
+                AlertInfo.customer_id == customer_id,
                 AlertInfo.alert_status == 'pending'
             ).scalar() or 0
-        except:
-            # 备用方案：如果AlertInfo有customer_id字段
-            alert_count = db.session.query(func.count(AlertInfo.id)).filter(
-                AlertInfo.alert_status == 'pending'
+            unread_messages = db.session.query(func.count(DeviceMessage.id)).filter(
+                DeviceMessage.customer_id == customer_id,
+                DeviceMessage.message_status == 'PENDING'  # message_status为枚举(DRAFT/PENDING/SENT...)，待处理即未读
             ).scalar() or 0
         
-        # 计算增长率
-        growth_rate = "+12%"
-        
-        return {
-            "count": f"{alert_count / 1000:.1f}K" if alert_count >= 1000 else str(alert_count),
-            "growth": growth_rate
-        }
-    except Exception as e:
-        print(f"获取告警统计失败: {e}")
-        return {"count": "0", "growth": "+0%"}
+            return {
+                "success": True,
+                "data": {
+                    "health_data": {"count": _format_count(today.get('health', 0)),
+                                    "growth": _growth(today.get('health', 0), yesterday.get('health', 0))},
+                    "pending_alerts": {"count": _format_count(pending_alerts),
+                                       "growth": _growth(today.get('alert', 0), yesterday.get('alert', 0))},
+                    "active_devices": {"count": str(today.get('device', 0)),
+                                       "growth": _growth(today.get('device', 0), yesterday.get('device', 0))},
+                    "unread_messages": {"count": str(unread_messages),
+                                        "growth": _growth(today.get('message', 0), yesterday.get('message', 0))},
+                    "system_alerts": today.get('alert:high', 0) + today.get('alert:critical', 0),
+                    "last_updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                }
+            }
 
-def get_today_device_stats(customer_id):
-    """获取当日活跃设备统计 - 直接使用customer_id"""
-    try:
-        # 直接通过customer_id获取活跃设备数量
-        active_device_count = db.session.query(func.count(DeviceInfo.id)).filter(
-            DeviceInfo.customer_id == customer_id,
-            DeviceInfo.status == 'ACTIVE'
-        ).scalar() or 0
+        return get_single_flight().fetch(f'realtime_stats:{customer_id}', compute, ttl=REALTIME_STATS_TTL), 200
         
-        # 计算增长率
-        growth_rate = "+2%"
-        
-        return {
-            "count": str(active_device_count),
-            "growth": growth_rate
-        }
     except Exception as e:
-        print(f"获取设备统计失败: {e}")
-        return {"count": "0", "growth": "+0%"}
-
-def get_today_message_stats(customer_id):
-    """获取当日未读消息统计 - 直接使用customer_id"""
-    try:
-        # 直接通过设备的customer_id获取消息
-        message_count = db.session.query(func.count(DeviceMessage.id)).join(
-            DeviceInfo, DeviceMessage.device_sn == DeviceInfo.serial_number
-        ).filter(
-            DeviceInfo.customer_id == customer_id,
-            DeviceMessage.message_status == '1'  # 1表示未读
-        ).scalar() or 0
-        
-        # 计算增长率
-        growth_rate = "+8%"
-        
         return {
-            "count": str(message_count),
-            "growth": growth_rate
-        }
-    except Exception as e:
-        print(f"获取消息统计失败: {e}")
-        return {"count": "0", "growth": "+0%"}
-
-def get_system_alerts_count():
-    """获取系统告警数量"""
-    try:
-        today = date.today()
-        
-        # 统计系统级告警
-        system_alert_count = db.session.query(func.count(AlertInfo.id)).filter(
-            func.date(AlertInfo.alert_timestamp) == today,
-            AlertInfo.severity_level.in_(['high', 'critical']),
-            AlertInfo.is_deleted == False
-        ).scalar() or 0
-        
-        return system_alert_count
-    except Exception as e:
-        print(f"获取系统告警失败: {e}")
-        return 0
+            "success": False,
+            "error": str(e)
+        }, 500
 
 @realtime_stats_bp.route('/api/realtime_stats', methods=['GET'])
 def get_realtime_stats():
     """获取实时统计数据"""
-    try:
-        customer_id = request.args.get('customerId')
-        if not customer_id:
-            return jsonify({
-                "success": False,
-                "error": "customerId参数是必需的"
-            }), 400
-        
-        # 直接使用customer_id获取各项统计数据，不需要复杂的用户查询
-        health_data_stats = get_today_health_data_stats(customer_id)
-        alert_stats = get_today_alert_stats(customer_id)
-        device_stats = get_today_device_stats(customer_id)
-        message_stats = get_today_message_stats(customer_id)
-        system_alerts_count = get_system_alerts_count()
-        
-        return jsonify({
-            "success": True,
-            "data": {
-                "health_data": health_data_stats,
-                "pending_alerts": alert_stats,
-                "active_devices": device_stats,
-                "unread_messages": message_stats,
-                "system_alerts": system_alerts_count,
-                "last_updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }
-        })
-        
-    except Exception as e:
-        return jsonify({
-            "success": False,
-            "error": str(e)
-        }), 500
+    result, status_code = get_realtime_stats_data()
+    return jsonify(result), status_code
 
 @realtime_stats_bp.route('/api/subordinate_users', methods=['GET'])
 def get_subordinate_users_api():
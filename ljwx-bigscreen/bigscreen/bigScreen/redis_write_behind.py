@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Redis最新值写后缓冲(write-behind)
+上传请求只把health_data:{sn}的最新值放入内存合并表即返回，后台线程每隔几毫秒
+用一个pipeline刷新所有待写键，并在health_data_channel上发布一条批量通知
+"""
+
+import json
+import time
+import threading
+import logging
+from typing import Any, Dict, Optional
+
+from .redis_helper import RedisHelper
+
+logger = logging.getLogger(__name__)
+
+HEALTH_DATA_CHANNEL = 'health_data_channel'  # 批量通知: {"devices": [...], "count": n, "ts": epoch}
+
+def _safe_mapping(mapping: Dict[str, Any]) -> Dict[str, Any]:
+    """与RedisHelper.hset_data一致的值转换(None->'', 非基础类型->str)"""
+    return {k: ('' if v is None else v if isinstance(v, (str, int, float, bytes)) else str(v)) for k, v in mapping.items()}
+
+class RedisWriteBehind:
+    """按设备合并最新值，定时批量刷新到Redis"""
+
+    def __init__(self, flush_interval: float = 0.005, max_batch: int = 500, publish_per_device: bool = False):
+        self.flush_interval = flush_interval  # 刷新间隔(秒)
+        self.max_batch = max_batch  # 待写键达到该数量时立即刷新
+        self.publish_per_device = publish_per_device  # 默认只发批量通知；旧订阅方需要health_data_channel:{sn}单设备通知时开启(同一pipeline内发送)
+        self.redis = RedisHelper()
+
+        self._pending: Dict[str, Dict[str, Any]] = {}  # device_sn -> 合并后的字段
+        self._first_enqueue: Dict[str, float] = {}  # device_sn -> 首次入缓冲时间，用于计算刷新延迟
+        self._cond = threading.Condition(threading.Lock())
+        self._thread: Optional[threading.Thread] = None
+        self.running = False
+        self.stats = {'submitted': 0, 'coalesced': 0, 'flushes': 0, 'keys_flushed': 0, 'errors': 0,
+                      'last_flush_size': 0, 'max_flush_size': 0, 'total_lag_ms': 0.0, 'max_lag_ms': 0.0,
+                      'last_flush_ms': 0.0}
+
+    def start(self):
+        with self._cond:
+            if self.running:
+                return
+            self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True, name='RedisWriteBehind')
+        self._thread.start()
+        logger.info(f"🚀 Redis写后缓冲已启动，刷新间隔{self.flush_interval * 1000:.0f}ms")
+
+    def stop(self, timeout: float = 2.0):
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+        self.flush()  # 退出前写完剩余数据
+
+    def submit(self, device_sn: str, mapping: Dict[str, Any]):
+        """放入最新值，同一设备未刷新前的多次更新合并为一次hset"""
+        if not device_sn or not mapping:
+            return
+        if not self.running:
+            self.start()
+        with self._cond:
+            self.stats['submitted'] += 1
+            current = self._pending.get(device_sn)
+            if current is None:
+                self._pending[device_sn] = dict(mapping)
+                self._first_enqueue[device_sn] = time.time()
+            else:
+                current.update(mapping)  # hset是字段级覆盖，合并后效果与依次写入一致
+                self.stats['coalesced'] += 1
+            if len(self._pending) >= self.max_batch:
+                self._cond.notify()
+
+    def _run(self):
+        while self.running:
+            with self._cond:
+                if len(self._pending) < self.max_batch:
+                    self._cond.wait(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Redis写后缓冲刷新线程异常: {e}")
+                time.sleep(0.5)
+
+    def flush(self) -> int:
+        """刷新当前缓冲，返回写入的键数量"""
+        with self._cond:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            enqueued, self._first_enqueue = self._first_enqueue, {}
+
+        start = time.time()
+        try:
+            pipe = self.redis.client.pipeline(transaction=False)
+            for device_sn, mapping in batch.items():
+                pipe.hset(f"health_data:{device_sn}", mapping=_safe_mapping(mapping))
+                if self.publish_per_device:
+                    pipe.publish(f"{HEALTH_DATA_CHANNEL}:{device_sn}", device_sn)
+            pipe.publish(HEALTH_DATA_CHANNEL, json.dumps({'devices': list(batch), 'count': len(batch), 'ts': int(start)}))
+            pipe.execute()
+        except Exception as e:
+            self._requeue(batch, enqueued)
+            with self._cond:
+                self.stats['errors'] += 1
+            logger.warning(f"Redis写后缓冲刷新失败，{len(batch)}个键已放回缓冲: {e}")
+            return 0
+
+        done = time.time()
+        lags = [(done - t) * 1000 for t in enqueued.values()]
+        with self._cond:
+            self.stats['flushes'] += 1
+            self.stats['keys_flushed'] += len(batch)
+            self.stats['last_flush_size'] = len(batch)
+            self.stats['max_flush_size'] = max(self.stats['max_flush_size'], len(batch))
+            self.stats['total_lag_ms'] += sum(lags)
+            self.stats['max_lag_ms'] = max(self.stats['max_lag_ms'], max(lags, default=0.0))
+            self.stats['last_flush_ms'] = round((done - start) * 1000, 3)
+        return len(batch)
+
+    def _requeue(self, batch: Dict[str, Dict[str, Any]], enqueued: Dict[str, float]):
+        """刷新失败时放回缓冲，期间到达的新值优先"""
+        with self._cond:
+            for device_sn, mapping in batch.items():
+                newer = self._pending.get(device_sn)
+                if newer is not None:
+                    mapping.update(newer)
+                self._pending[device_sn] = mapping
+                self._first_enqueue[device_sn] = min(enqueued.get(device_sn, time.time()),
+                                                     self._first_enqueue.get(device_sn, time.time()))
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            stats = dict(self.stats)
+            stats['pending'] = len(self._pending)
+        stats['avg_flush_size'] = round(stats['keys_flushed'] / stats['flushes'], 2) if stats['flushes'] else 0.0
+        stats['avg_lag_ms'] = round(stats['total_lag_ms'] / stats['keys_flushed'], 3) if stats['keys_flushed'] else 0.0
+        stats['total_lag_ms'] = round(stats['total_lag_ms'], 3)
+        stats['max_lag_ms'] = round(stats['max_lag_ms'], 3)
+        stats['flush_interval_ms'] = self.flush_interval * 1000
+        stats['running'] = self.running
+        return stats
+
+# 全局写后缓冲实例(首次submit时启动刷新线程)
+redis_write_behind = RedisWriteBehind()
+
+def get_redis_write_behind() -> RedisWriteBehind:
+    return redis_write_behind
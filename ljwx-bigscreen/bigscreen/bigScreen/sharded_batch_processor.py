@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+健康数据多队列分片批处理器 v1.0
+按device_sn一致性哈希分片，每个分片独立有界队列+独立刷新线程，
+同一设备的数据始终落在同一分片，保证单设备写入顺序
+"""
+
+import os
+import time
+import queue
+import bisect
+import hashlib
+import threading
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class ShardMetrics:
+    """单个分片的运行指标"""
+    shard_id: int
+    processed_count: int = 0
+    batch_count: int = 0
+    error_count: int = 0
+    rejected_count: int = 0  # 队列满被拒绝的条数
+    enqueued_count: int = 0
+    total_processing_time: float = 0.0
+    last_batch_size: int = 0
+    last_flush_reason: str = ''
+    last_flush_time: float = 0.0
+    is_active: bool = False
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def avg_processing_time(self) -> float:
+        """平均每批处理耗时(秒)"""
+        return self.total_processing_time / self.batch_count if self.batch_count else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'shard_id': self.shard_id,
+            'processed_count': self.processed_count,
+            'batch_count': self.batch_count,
+            'error_count': self.error_count,
+            'rejected_count': self.rejected_count,
+            'enqueued_count': self.enqueued_count,
+            'avg_processing_time_ms': round(self.avg_processing_time * 1000, 2),
+            'last_batch_size': self.last_batch_size,
+            'last_flush_reason': self.last_flush_reason,
+            'last_flush_time': self.last_flush_time,
+            'is_active': self.is_active,
+        }
+
+class ConsistentHashRing:
+    """一致性哈希环 - 带虚拟节点，分片数调整时只迁移少量设备"""
+
+    def __init__(self, node_count: int, virtual_nodes: int = 64):
+        self.node_count = node_count
+        self.virtual_nodes = virtual_nodes
+        self._ring: List[int] = []
+        self._nodes: List[int] = []
+        points = []
+        for node in range(node_count):
+            for v in range(virtual_nodes):
+                points.append((self._hash(f"shard-{node}#{v}"), node))
+        points.sort()
+        self._ring = [p[0] for p in points]
+        self._nodes = [p[1] for p in points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        # md5跨进程稳定，内置hash()受PYTHONHASHSEED影响不能用于分片
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+    def get_node(self, key: str) -> int:
+        idx = bisect.bisect(self._ring, self._hash(key))
+        if idx == len(self._ring):
+            idx = 0
+        return self._nodes[idx]
+
+class ShardedBatchProcessor:
+    """按设备一致性哈希分片的批处理器"""
+
+    def __init__(self, shard_count: Optional[int] = None, batch_size: Optional[int] = None,
+                 max_wait_time: Optional[float] = None, queue_size: Optional[int] = None):
+        cpu_cores = os.cpu_count() or 4
+        # 分片数：默认CPU核心数，限制在2-16之间，可通过环境变量覆盖
+        self.shard_count = shard_count or int(os.getenv('HEALTH_SHARD_COUNT', max(2, min(16, cpu_cores))))
+        self.batch_size = batch_size or int(os.getenv('HEALTH_SHARD_BATCH_SIZE', 200))
+        self.max_wait_time = max_wait_time or float(os.getenv('HEALTH_SHARD_MAX_WAIT', 1.0))  # 最大等待时间(秒)
+        self.queue_size = queue_size or int(os.getenv('HEALTH_SHARD_QUEUE_SIZE', 2000))  # 单分片队列上限
+
+        self.hash_ring = ConsistentHashRing(self.shard_count)
+        self.shard_queues: List[queue.Queue] = [queue.Queue(maxsize=self.queue_size) for _ in range(self.shard_count)]
+        self.shard_metrics: List[ShardMetrics] = [ShardMetrics(shard_id=i) for i in range(self.shard_count)]
+        self.workers: List[threading.Thread] = []
+        self.batch_callback: Optional[Callable[[List[Dict[str, Any]]], Any]] = None
+        self.running = False
+        self.start_time = None
+        self._start_lock = threading.Lock()
+
+        logger.info(f"🚀 ShardedBatchProcessor 初始化: 分片数={self.shard_count}, 批次大小={self.batch_size}, "
+                    f"最大等待={self.max_wait_time}s, 单分片队列上限={self.queue_size}")
+
+    def set_batch_callback(self, callback: Callable[[List[Dict[str, Any]]], Any]):
+        """设置批次刷新回调(接收一个批次的数据列表)"""
+        self.batch_callback = callback
+
+    def start(self):
+        """启动所有分片的刷新线程(幂等)"""
+        with self._start_lock:
+            if self.running:
+                return
+            self.running = True
+            self.start_time = time.time()
+            self.workers = []
+            for shard_id in range(self.shard_count):
+                worker = threading.Thread(target=self._worker, args=(shard_id,), name=f'HealthShard-{shard_id}', daemon=True)
+                worker.start()
+                self.workers.append(worker)
+                self.shard_metrics[shard_id].is_active = True
+            logger.info(f"🚀 分片批处理器已启动，分片线程数: {self.shard_count}")
+
+    def stop(self, timeout: float = 5.0):
+        """停止刷新线程，退出前刷新各分片剩余数据"""
+        with self._start_lock:
+            if not self.running:
+                return
+            self.running = False
+            for worker in self.workers:
+                worker.join(timeout=timeout)
+            self.workers = []
+            logger.info("⛔ 分片批处理器已停止")
+
+    def get_shard_id(self, device_sn: str) -> int:
+        """根据设备SN获取分片编号"""
+        return self.hash_ring.get_node(str(device_sn))
+
+    def add_data(self, item: Dict[str, Any], device_sn: str) -> bool:
+        """非阻塞入队，分片队列满时返回False由调用方返回queue_full"""
+        shard_id = self.get_shard_id(device_sn)
+        metrics = self.shard_metrics[shard_id]
+        try:
+            self.shard_queues[shard_id].put_nowait(item)
+        except queue.Full:
+            with metrics._lock:
+                metrics.rejected_count += 1
+            logger.warning(f"⚠️ 分片{shard_id}队列已满，拒绝数据: {device_sn}")
+            return False
+        with metrics._lock:
+            metrics.enqueued_count += 1
+        return True
+
+    def get_queue_size(self) -> int:
+        """所有分片队列积压总数"""
+        return sum(q.qsize() for q in self.shard_queues)
+
+    def _worker(self, shard_id: int):
+        """分片刷新线程：达到批次大小或超过最大等待时间即刷新"""
+        shard_queue = self.shard_queues[shard_id]
+        batch: List[Dict[str, Any]] = []
+        first_item_time = None
+        while self.running:
+            try:
+                timeout = self.max_wait_time if first_item_time is None else max(0.01, first_item_time + self.max_wait_time - time.time())
+                try:
+                    batch.append(shard_queue.get(timeout=timeout))
+                    if first_item_time is None:
+                        first_item_time = time.time()
+                    # 尽量一次性取满，减少线程唤醒次数
+                    while len(batch) < self.batch_size:
+                        batch.append(shard_queue.get_nowait())
+                except queue.Empty:
+                    pass
+
+                if len(batch) >= self.batch_size:
+                    self._flush(shard_id, batch, 'size')
+                    batch, first_item_time = [], None
+                elif batch and time.time() - first_item_time >= self.max_wait_time:
+                    self._flush(shard_id, batch, 'time')
+                    batch, first_item_time = [], None
+            except Exception as e:
+                logger.error(f"💥 分片{shard_id}刷新线程异常: {e}")
+                time.sleep(1)
+
+        # 停止时排空剩余数据
+        while True:
+            try:
+                batch.append(shard_queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._flush(shard_id, batch, 'shutdown')
+        self.shard_metrics[shard_id].is_active = False
+
+    def _flush(self, shard_id: int, batch: List[Dict[str, Any]], reason: str):
+        """调用批次回调并记录分片指标"""
+        metrics = self.shard_metrics[shard_id]
+        start = time.time()
+        failed = False
+        try:
+            if self.batch_callback:
+                self.batch_callback(batch)
+            else:
+                logger.warning(f"⚠️ 分片{shard_id}未设置批次回调，丢弃{len(batch)}条数据")
+        except Exception as e:
+            failed = True
+            logger.error(f"❌ 分片{shard_id}批次处理失败: {e}, 批次大小: {len(batch)}")
+        elapsed = time.time() - start
+        with metrics._lock:
+            metrics.batch_count += 1
+            metrics.total_processing_time += elapsed
+            metrics.last_batch_size = len(batch)
+            metrics.last_flush_reason = reason
+            metrics.last_flush_time = time.time()
+            if failed:
+                metrics.error_count += 1
+            else:
+                metrics.processed_count += len(batch)
+
+    def get_overall_stats(self) -> Dict[str, Any]:
+        """汇总统计，含各分片明细，供/api/monitoring/shards使用"""
+        shards = []
+        for i, metrics in enumerate(self.shard_metrics):
+            shard_info = metrics.to_dict()
+            shard_info['queue_size'] = self.shard_queues[i].qsize()
+            shard_info['queue_capacity'] = self.queue_size
+            shards.append(shard_info)
+
+        total_batches = sum(m.batch_count for m in self.shard_metrics)
+        total_time = sum(m.total_processing_time for m in self.shard_metrics)
+        total_processed = sum(m.processed_count for m in self.shard_metrics)
+        stats = {
+            'shard_count': self.shard_count,
+            'batch_size': self.batch_size,
+            'max_wait_time': self.max_wait_time,
+            'running': self.running,
+            'total_processed': total_processed,
+            'total_batches': total_batches,
+            'total_errors': sum(m.error_count for m in self.shard_metrics),
+            'total_rejected': sum(m.rejected_count for m in self.shard_metrics),
+            'total_queue_size': sum(s['queue_size'] for s in shards),
+            'avg_processing_time_ms': round(total_time / total_batches * 1000, 2) if total_batches else 0.0,
+            'shards': shards,
+        }
+        if self.start_time and self.running:
+            uptime = time.time() - self.start_time
+            stats['uptime_seconds'] = int(uptime)
+            stats['processing_rate'] = round(total_processed / max(uptime, 1), 2)
+        return stats
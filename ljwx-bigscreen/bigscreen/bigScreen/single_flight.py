@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+热点接口单飞(single-flight)缓存
+大量大屏同时轮询同一租户时，缓存过期只允许一次计算：
+- 进程内：每个键一个leader线程计算，其余线程等待leader结果
+- 进程间：Redis SET NX EX 锁，未抢到锁的进程返回旧值或轮询等待新值
+- 缓存条目记录逻辑过期时间，物理TTL额外保留stale_ttl，过期后先返回旧值再由一个请求刷新
+- XFetch概率提前刷新：越接近过期、计算越慢，越早被某个请求提前刷新，避免同一时刻集中过期
+"""
+
+import json
+import math
+import os
+import random
+import threading
+import time
+import uuid
+import logging
+from typing import Any, Callable, Dict, Optional
+
+from .redis_helper import RedisHelper
+
+logger = logging.getLogger(__name__)
+
+LOCK_PREFIX = 'single_flight_lock:'
+LOCK_TTL = int(os.getenv('SINGLE_FLIGHT_LOCK_TTL', 15))  # 计算超时后锁自动释放
+WAIT_TIMEOUT = float(os.getenv('SINGLE_FLIGHT_WAIT_TIMEOUT', 5))  # 无旧值时等待leader的最长时间
+STALE_TTL = int(os.getenv('SINGLE_FLIGHT_STALE_TTL', 300))  # 逻辑过期后旧值保留时长
+BETA = float(os.getenv('SINGLE_FLIGHT_BETA', 1.0))  # XFetch系数，>1更积极提前刷新
+
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+class _Call:
+    """进程内正在进行的一次计算"""
+    __slots__ = ('event', 'payload', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.payload = None
+        self.error = None
+
+class SingleFlight:
+    """按键合并并发计算的缓存层"""
+
+    def __init__(self, redis=None, lock_ttl: int = LOCK_TTL, wait_timeout: float = WAIT_TIMEOUT,
+                 stale_ttl: int = STALE_TTL, beta: float = BETA, poll_interval: float = 0.05):
+        self.redis = redis
+        self.lock_ttl = lock_ttl
+        self.wait_timeout = wait_timeout
+        self.stale_ttl = stale_ttl
+        self.beta = beta
+        self.poll_interval = poll_interval
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'computes': 0, 'coalesced': 0, 'stale_served': 0,
+                      'early_refreshes': 0, 'remote_waits': 0, 'lock_failures': 0, 'errors': 0}
+
+    @property
+    def _client(self):
+        return getattr(self.redis, 'client', None)  # 降级的SimpleRedis没有client，只做进程内合并
+
+    # ---------------- 对外接口 ----------------
+    def fetch(self, key: str, compute: Callable[[], Any], ttl: int,
+              cacheable: Optional[Callable[[Any], bool]] = None) -> Any:
+        """读取缓存，过期/缺失/被选中提前刷新时只由一个调用方执行compute；返回值为独立副本，可直接修改"""
+        entry = self._read(key)
+        now = time.time()
+        if entry is not None and now < entry['expiry']:
+            if not self._should_refresh_early(entry, now):
+                self.stats['hits'] += 1
+                return entry['value']
+            self.stats['early_refreshes'] += 1
+        elif entry is None:
+            self.stats['misses'] += 1
+        return self._refresh(key, compute, ttl, entry, cacheable)
+
+    def invalidate(self, key: str):
+        """删除缓存条目(数据变更后立即生效)"""
+        try:
+            self.redis.delete(key)
+        except Exception as e:
+            logger.warning(f"单飞缓存删除失败 {key}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats['in_flight'] = len(self._calls)
+        return stats
+
+    # ---------------- 内部实现 ----------------
+    def _should_refresh_early(self, entry: Dict[str, Any], now: float) -> bool:
+        """XFetch: now - delta * beta * ln(rand) >= expiry"""
+        delta = entry.get('delta') or 0
+        return delta > 0 and now - delta * self.beta * math.log(1.0 - random.random()) >= entry['expiry']
+
+    def _refresh(self, key, compute, ttl, entry, cacheable):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            if entry is not None:  # 已有旧值，不必等待
+                self.stats['stale_served'] += 1
+                return entry['value']
+            if call.event.wait(self.wait_timeout) and call.payload is not None:
+                self.stats['coalesced'] += 1
+                return json.loads(call.payload)
+            logger.warning(f"等待单飞计算超时或失败，自行计算: {key}")
+            return compute()
+        try:
+            payload = self._lead(key, compute, ttl, entry, cacheable)
+            call.payload = payload
+            return json.loads(payload)
+        except Exception as e:
+            call.error = e
+            self.stats['errors'] += 1
+            if entry is not None:
+                logger.warning(f"单飞计算失败，返回旧值 {key}: {e}")
+                return entry['value']
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def _lead(self, key, compute, ttl, entry, cacheable) -> str:
+        """进程内leader：抢Redis锁后计算并写缓存，返回序列化结果"""
+        token = self._acquire(key)
+        if token is None:
+            if entry is not None:
+                self.stats['stale_served'] += 1
+                return json.dumps(entry['value'], default=str)
+            entry = self._wait_remote(key)
+            if entry is not None:
+                self.stats['coalesced'] += 1
+                return json.dumps(entry['value'], default=str)
+            logger.warning(f"其他进程计算超时，本进程自行计算: {key}")
+        try:
+            began = time.time()
+            value = compute()
+            delta = time.time() - began
+            self.stats['computes'] += 1
+            payload = json.dumps(value, default=str)
+            if cacheable is None or cacheable(value):
+                self._write(key, payload, ttl, delta)
+            return payload
+        finally:
+            if token:
+                self._release(key, token)
+
+    def _read(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            raw = self.redis.get(key)
+            if not raw:
+                return None
+            entry = json.loads(raw)
+            if isinstance(entry, dict) and 'expiry' in entry and 'value' in entry:
+                return entry
+        except Exception as e:
+            logger.warning(f"单飞缓存读取失败 {key}: {e}")
+        return None  # 旧格式或损坏的条目按未命中处理
+
+    def _write(self, key: str, payload: str, ttl: int, delta: float):
+        entry = '{"expiry": %.3f, "delta": %.3f, "value": %s}' % (time.time() + ttl, delta, payload)
+        try:
+            self.redis.setex(key, int(ttl + self.stale_ttl), entry)
+        except Exception as e:
+            logger.warning(f"单飞缓存写入失败 {key}: {e}")
+
+    def _acquire(self, key: str) -> Optional[str]:
+        """Redis不可用时视为抢锁成功(退化为进程内合并)"""
+        client = self._client
+        if client is None:
+            return ''
+        token = uuid.uuid4().hex
+        try:
+            if client.set(LOCK_PREFIX + key, token, nx=True, ex=self.lock_ttl):
+                return token
+            return None
+        except Exception as e:
+            self.stats['lock_failures'] += 1
+            logger.warning(f"单飞锁获取失败，本进程直接计算 {key}: {e}")
+            return ''
+
+    def _release(self, key: str, token: str):
+        try:
+            self._client.eval(RELEASE_SCRIPT, 1, LOCK_PREFIX + key, token)
+        except Exception as e:
+            logger.warning(f"单飞锁释放失败，{self.lock_ttl}s后自动过期 {key}: {e}")
+
+    def _wait_remote(self, key: str) -> Optional[Dict[str, Any]]:
+        """其他进程持锁计算中：轮询等待新值写入或锁释放"""
+        self.stats['remote_waits'] += 1
+        deadline = time.time() + self.wait_timeout
+        while time.time() < deadline:
+            time.sleep(self.poll_interval)
+            entry = self._read(key)
+            if entry is not None:
+                return entry
+            try:
+                if not self._client.exists(LOCK_PREFIX + key):
+                    return self._read(key)  # 对方计算失败或结果不可缓存
+            except Exception:
+                return None
+        return None
+
+# 全局单飞实例
+_single_flight: Optional[SingleFlight] = None
+_instance_lock = threading.Lock()
+
+def get_single_flight(redis=None) -> SingleFlight:
+    """获取全局单飞实例；首次调用未传redis时使用默认RedisHelper"""
+    global _single_flight
+    if _single_flight is None:
+        with _instance_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight(redis or RedisHelper())
+    return _single_flight
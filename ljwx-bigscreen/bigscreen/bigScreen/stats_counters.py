@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+大屏统计计数器(租户/组织 × 天 × 类型)
+健康数据入库、告警与消息提交时以Redis HINCRBY累加当日计数(健康样本、告警及各级别告警、消息)，
+当日上报设备数用HyperLogLog；统计接口直接读取，不再对明细表做COUNT(*)。
+某天首次读取时按索引范围条件从明细表统计一次写入Redis(之后由增量维护)，
+后台线程定期把计数快照写入t_stats_counter，Redis过期后的历史日期从快照读取
+"""
+
+import os
+import time
+import threading
+import logging
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from redis.exceptions import WatchError
+
+from .redis_helper import RedisHelper
+
+logger = logging.getLogger(__name__)
+
+COUNTER_TABLE = 't_stats_counter'
+COUNTER_KEY = 'stats_counter:{customer_id}:{day}'  # hash字段: "{org_id}|{kind}"，org_id=0为租户合计
+DEVICE_KEY = 'stats_counter_devices:{customer_id}:{day}:{org_id}'  # HyperLogLog: 当日上报设备
+SEEDED_FIELD = '_seeded'  # 已从明细表初始化的标记；缺失时读取方重新统计
+TOTAL_ORG = 0
+REDIS_TTL = int(os.getenv('STATS_COUNTER_TTL_DAYS', 3)) * 86400
+CHECKPOINT_INTERVAL = int(os.getenv('STATS_COUNTER_CHECKPOINT_SECONDS', 60))
+SEED_ATTEMPTS = 3  # 初始化期间计数键被并发累加时的重试次数
+PENDING_KEY = 'stats_counter_pending'  # session.info中待提交后计数的行
+PENDING_FIELDS = ('customer_id', 'org_id', 'severity_level', 'alert_timestamp', 'create_time')
+
+CHECKPOINT_SQL = f"""
+    INSERT INTO {COUNTER_TABLE} (customer_id, org_id, stat_day, kind, value, update_time)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE value = VALUES(value), update_time = VALUES(update_time)
+"""
+
+def _day(value=None) -> str:
+    """记录时间所属日期(YYYY-MM-DD)，缺失时取当天"""
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d')
+    if isinstance(value, date):
+        return value.isoformat()
+    if value:
+        return str(value)[:10]
+    return date.today().isoformat()
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+def _org_scopes(org_id) -> Tuple[int, ...]:
+    """计数同时记入所属组织与租户合计"""
+    try:
+        org_id = int(org_id) if org_id is not None else TOTAL_ORG
+    except (TypeError, ValueError):
+        org_id = TOTAL_ORG
+    return (org_id, TOTAL_ORG) if org_id != TOTAL_ORG else (TOTAL_ORG,)
+
+def _get(row, name):
+    return row.get(name) if isinstance(row, dict) else getattr(row, name, None)
+
+def _load_from_database(customer_id, day: str) -> Tuple[Dict[Tuple[int, str], int], Dict[int, Set[str]]]:
+    """按[day, day+1)范围条件从明细表统计(可使用时间索引)，返回({(org_id, kind): n}, {org_id: 设备集合})"""
+    from sqlalchemy import text
+    from .models import db
+    start = datetime.strptime(day, '%Y-%m-%d')
+    params = {'customer_id': customer_id, 'start': start, 'end': start + timedelta(days=1)}
+    counts: Dict[Tuple[int, str], int] = Counter()
+    devices: Dict[int, Set[str]] = {}
+    for org_id, device_sn, cnt in db.session.execute(text("""
+            SELECT org_id, device_sn, COUNT(*) FROM t_user_health_data
+            WHERE customer_id = :customer_id AND timestamp >= :start AND timestamp < :end
+            GROUP BY org_id, device_sn"""), params):
+        counts[(org_id or TOTAL_ORG, 'health')] += int(cnt)
+        if device_sn:
+            devices.setdefault(org_id or TOTAL_ORG, set()).add(device_sn)
+    for org_id, severity, cnt in db.session.execute(text("""
+            SELECT org_id, severity_level, COUNT(*) FROM t_alert_info
+            WHERE customer_id = :customer_id AND alert_timestamp >= :start AND alert_timestamp < :end
+            GROUP BY org_id, severity_level"""), params):
+        counts[(org_id or TOTAL_ORG, 'alert')] += int(cnt)
+        counts[(org_id or TOTAL_ORG, f'alert:{severity or "medium"}')] += int(cnt)
+    for org_id, cnt in db.session.execute(text("""
+            SELECT org_id, COUNT(*) FROM t_device_message
+            WHERE customer_id = :customer_id AND create_time >= :start AND create_time < :end
+            GROUP BY org_id"""), params):
+        counts[(org_id or TOTAL_ORG, 'message')] += int(cnt)
+    return counts, devices
+
+def _write_checkpoint(rows: List[tuple]):
+    from .db_pool import get_db_connection
+    with get_db_connection() as conn:
+        try:
+            with conn.cursor() as cursor:
+                cursor.executemany(CHECKPOINT_SQL, rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+def _read_checkpoint(customer_id, day: str, org_id) -> Dict[str, int]:
+    from sqlalchemy import text
+    from .models import db
+    rows = db.session.execute(text(f"""
+        SELECT kind, value FROM {COUNTER_TABLE}
+        WHERE customer_id = :customer_id AND stat_day = :day AND org_id = :org_id"""),
+        {'customer_id': customer_id, 'day': day, 'org_id': org_id}).fetchall()
+    return {kind: int(value) for kind, value in rows}
+
+class StatsCounterStore:
+    """Redis日计数 + MySQL快照"""
+
+    def __init__(self, redis=None, loader: Optional[Callable] = None, checkpoint_writer: Optional[Callable] = None,
+                 checkpoint_reader: Optional[Callable] = None, checkpoint_interval: int = CHECKPOINT_INTERVAL,
+                 ttl: int = REDIS_TTL):
+        self.redis = redis or RedisHelper()
+        self._loader = loader or _load_from_database
+        self._checkpoint_writer = checkpoint_writer or _write_checkpoint
+        self._checkpoint_reader = checkpoint_reader or _read_checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.ttl = ttl
+        self._touched: Set[Tuple[str, str]] = set()  # 待写快照的(customer_id, day)
+        self._lock = threading.Lock()
+        self._checkpointer: Optional[threading.Thread] = None
+        self.stats = {'increments': 0, 'redis_errors': 0, 'reads': 0, 'redis_hits': 0, 'checkpoint_hits': 0,
+                      'seeds': 0, 'seed_conflicts': 0, 'invalidations': 0, 'checkpoints': 0, 'checkpoint_rows': 0, 'checkpoint_errors': 0}
+
+    # ---------------- 累加 ----------------
+    def record_health(self, records: Iterable[Any]):
+        """健康样本入库后累加(records需含customer_id/org_id/device_sn/timestamp)"""
+        counts, devices = Counter(), {}
+        for record in records:
+            customer_id = _get(record, 'customer_id')
+            if customer_id is None:
+                continue
+            day = _day(_get(record, 'timestamp'))
+            device_sn = _get(record, 'device_sn')
+            for org_id in _org_scopes(_get(record, 'org_id')):
+                counts[(str(customer_id), day, org_id, 'health')] += 1
+                if device_sn:
+                    devices.setdefault((str(customer_id), day, org_id), set()).add(device_sn)
+        self._apply(counts, devices)
+
+    def record_alerts(self, rows: Iterable[Any]):
+        """告警提交后累加总数与各级别数量"""
+        counts = Counter()
+        for row in rows:
+            customer_id = _get(row, 'customer_id')
+            if customer_id is None:
+                continue
+            day = _day(_get(row, 'alert_timestamp'))
+            severity = _get(row, 'severity_level') or 'medium'
+            for org_id in _org_scopes(_get(row, 'org_id')):
+                counts[(str(customer_id), day, org_id, 'alert')] += 1
+                counts[(str(customer_id), day, org_id, f'alert:{severity}')] += 1
+        self._apply(counts, {})
+
+    def record_messages(self, rows: Iterable[Any]):
+        counts = Counter()
+        for row in rows:
+            customer_id = _get(row, 'customer_id')
+            if customer_id is None:
+                continue
+            day = _day(_get(row, 'create_time'))
+            for org_id in _org_scopes(_get(row, 'org_id')):
+                counts[(str(customer_id), day, org_id, 'message')] += 1
+        self._apply(counts, {})
+
+    def _apply(self, counts: Dict[tuple, int], devices: Dict[tuple, Set[str]]):
+        if not counts and not devices:
+            return
+        keys, touched = set(), set()
+        try:
+            pipe = self.redis.client.pipeline(transaction=False)
+            for (customer_id, day, org_id, kind), n in counts.items():
+                key = COUNTER_KEY.format(customer_id=customer_id, day=day)
+                pipe.hincrby(key, f'{org_id}|{kind}', n)
+                keys.add(key)
+                touched.add((customer_id, day))
+            for (customer_id, day, org_id), device_sns in devices.items():
+                key = DEVICE_KEY.format(customer_id=customer_id, day=day, org_id=org_id)
+                pipe.pfadd(key, *device_sns)
+                keys.add(key)
+            for key in keys:
+                pipe.expire(key, self.ttl)
+            pipe.execute()
+            self.stats['increments'] += sum(counts.values())
+        except Exception as e:
+            self.stats['redis_errors'] += 1
+            logger.warning(f"统计计数累加失败(读取时将从明细表重新统计): {e}")
+            return
+        with self._lock:
+            self._touched.update(touched)
+        self._ensure_checkpointer()
+
+    def invalidate(self, records: Iterable[Any], time_field: str = 'timestamp'):
+        """无法确定哪些记录实际写入时(批次中混有库内重复)清除初始化标记，下次读取重新统计"""
+        keys = {COUNTER_KEY.format(customer_id=_get(r, 'customer_id'), day=_day(_get(r, time_field)))
+                for r in records if _get(r, 'customer_id') is not None}
+        if not keys:
+            return
+        try:
+            pipe = self.redis.client.pipeline(transaction=False)
+            for key in keys:
+                pipe.hdel(key, SEEDED_FIELD)
+            pipe.execute()
+            self.stats['invalidations'] += len(keys)
+        except Exception as e:
+            self.stats['redis_errors'] += 1
+            logger.warning(f"统计计数失效标记失败: {e}")
+
+    # ---------------- 读取 ----------------
+    def read(self, customer_id, day=None, org_id=None) -> Optional[Dict[str, int]]:
+        """读取{kind: 数量}(含device=当日上报设备数)；Redis与快照都没有时返回None"""
+        day, org_id = _day(day), org_id or TOTAL_ORG
+        self.stats['reads'] += 1
+        try:
+            pipe = self.redis.client.pipeline(transaction=False)
+            pipe.hgetall(COUNTER_KEY.format(customer_id=customer_id, day=day))
+            pipe.pfcount(DEVICE_KEY.format(customer_id=customer_id, day=day, org_id=org_id))
+            fields, device_count = pipe.execute()
+        except Exception as e:
+            self.stats['redis_errors'] += 1
+            logger.warning(f"统计计数读取失败: {e}")
+            fields, device_count = {}, 0
+        fields = {_text(k): _text(v) for k, v in (fields or {}).items()}
+        if SEEDED_FIELD in fields:
+            self.stats['redis_hits'] += 1
+            prefix = f'{org_id}|'
+            counters = {k[len(prefix):]: int(v) for k, v in fields.items() if k.startswith(prefix)}
+            counters['device'] = int(device_count or 0)
+            return counters
+        if day < _day():  # 历史日期：Redis已过期时读快照
+            counters = self._checkpoint_reader(customer_id, day, org_id)
+            if counters:
+                self.stats['checkpoint_hits'] += 1
+                return counters
+        return None
+
+    def get_counters(self, customer_id, day=None, org_id=None) -> Dict[str, int]:
+        """O(1)读取计数；该天尚未初始化时从明细表统计一次并写入Redis"""
+        counters = self.read(customer_id, day, org_id)
+        if counters is None:
+            counters = self.seed(customer_id, day, org_id)
+        return counters
+
+    def seed(self, customer_id, day=None, org_id=None) -> Dict[str, int]:
+        """
+        从明细表统计某租户某天的计数，以绝对值覆盖Redis中的计数
+        WATCH计数键：统计期间有增量累加时EXEC失败并重新统计，避免覆盖掉这部分增量
+        """
+        day, org_id = _day(day), org_id or TOTAL_ORG
+        key = COUNTER_KEY.format(customer_id=customer_id, day=day)
+        mapping, devices, written = None, None, False
+        try:
+            with self.redis.client.pipeline(transaction=True) as pipe:
+                for _ in range(SEED_ATTEMPTS):
+                    pipe.watch(key)
+                    mapping, devices = self._load_seed(customer_id, day)
+                    pipe.multi()
+                    pipe.delete(key)
+                    pipe.hset(key, mapping=dict(mapping, **{SEEDED_FIELD: int(time.time())}))
+                    pipe.expire(key, self.ttl)
+                    for scope, device_sns in devices.items():  # HyperLogLog为并集，重复写入无影响
+                        device_key = DEVICE_KEY.format(customer_id=customer_id, day=day, org_id=scope)
+                        pipe.pfadd(device_key, *device_sns)
+                        pipe.expire(device_key, self.ttl)
+                    try:
+                        pipe.execute()
+                        written = True
+                        break
+                    except WatchError:
+                        self.stats['seed_conflicts'] += 1
+        except Exception as e:
+            self.stats['redis_errors'] += 1
+            logger.warning(f"统计计数初始化写入Redis失败: {e}")
+        if mapping is None:
+            mapping, devices = self._load_seed(customer_id, day)
+        prefix = f'{org_id}|'
+        counters = {k[len(prefix):]: int(v) for k, v in mapping.items() if k.startswith(prefix)}
+        counters['device'] = len(devices.get(org_id, ()))
+        if not written:  # 未写入时保持未初始化，下次读取重新统计
+            return counters
+        with self._lock:
+            self._touched.add((str(customer_id), day))
+        self._ensure_checkpointer()
+        logger.info(f"📊 统计计数已初始化: customer_id={customer_id}, day={day}, {len(mapping)}项")
+        return counters
+
+    def _load_seed(self, customer_id, day: str) -> Tuple[Dict[str, int], Dict[int, Set[str]]]:
+        """明细表统计结果展开到所属组织与租户合计：({"{org}|{kind}": n}, {org: 设备集合})"""
+        org_counts, org_devices = self._loader(customer_id, day)
+        self.stats['seeds'] += 1
+        mapping, devices = Counter(), {}
+        for (org, kind), n in org_counts.items():
+            for scope in _org_scopes(org):
+                mapping[f'{scope}|{kind}'] += n
+        for org, device_sns in org_devices.items():
+            for scope in _org_scopes(org):
+                devices.setdefault(scope, set()).update(device_sns)
+        return mapping, devices
+
+    # ---------------- 快照 ----------------
+    def checkpoint(self) -> int:
+        """把有变化的(租户, 天)计数写入t_stats_counter，返回写入行数"""
+        with self._lock:
+            touched, self._touched = self._touched, set()
+        rows, now = [], datetime.now()
+        try:
+            for customer_id, day in sorted(touched):
+                fields = self.redis.client.hgetall(COUNTER_KEY.format(customer_id=customer_id, day=day)) or {}
+                fields = {_text(k): _text(v) for k, v in fields.items()}
+                if SEEDED_FIELD not in fields:  # 未初始化的计数只含部分增量，不落快照
+                    continue
+                orgs = set()
+                for field, value in fields.items():
+                    if field == SEEDED_FIELD:
+                        continue
+                    org, kind = field.split('|', 1)
+                    orgs.add(org)
+                    rows.append((customer_id, int(org), day, kind, int(value), now))
+                pipe = self.redis.client.pipeline(transaction=False)
+                for org in sorted(orgs):
+                    pipe.pfcount(DEVICE_KEY.format(customer_id=customer_id, day=day, org_id=org))
+                for org, device_count in zip(sorted(orgs), pipe.execute()):
+                    rows.append((customer_id, int(org), day, 'device', int(device_count or 0), now))
+            if rows:
+                self._checkpoint_writer(rows)
+            self.stats['checkpoints'] += 1
+            self.stats['checkpoint_rows'] += len(rows)
+            return len(rows)
+        except Exception as e:
+            self.stats['checkpoint_errors'] += 1
+            with self._lock:
+                self._touched.update(touched)  # 下个周期重试
+            logger.warning(f"统计计数快照写入失败: {e}")
+            return 0
+
+    def _ensure_checkpointer(self):
+        if self._checkpointer is not None or self.checkpoint_interval <= 0:
+            return
+        with self._lock:
+            if self._checkpointer is not None:
+                return
+            self._checkpointer = threading.Thread(target=self._checkpoint_loop, daemon=True, name='StatsCounterCheckpoint')
+            self._checkpointer.start()
+
+    def _checkpoint_loop(self):
+        while True:
+            time.sleep(self.checkpoint_interval)
+            self.checkpoint()
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats['pending_checkpoint'] = len(self._touched)
+        return stats
+
+# 全局统计计数器实例
+stats_counter_store = StatsCounterStore()
+
+def get_stats_counter_store() -> StatsCounterStore:
+    return stats_counter_store
+
+def queue_counter_rows(session, kind: str, rows: Iterable[Any]):
+    """批量插入(bulk_*不触发ORM事件)时登记待计数行，事务提交后累加"""
+    session.info.setdefault(PENDING_KEY, []).extend(
+        (kind, {name: _get(row, name) for name in PENDING_FIELDS}) for row in rows)
+
+def install_orm_hooks(session):
+    """ORM新增告警/消息时登记，事务提交后累加计数，回滚则丢弃"""
+    from sqlalchemy import event
+    from sqlalchemy.orm import object_session
+    from .models import AlertInfo, DeviceMessage
+
+    def on_insert(kind):
+        def after_insert(mapper, connection, target):
+            target_session = object_session(target)
+            if target_session is not None:  # 提交后属性已过期且不能再发SQL，这里先取值
+                row = {name: getattr(target, name, None) for name in PENDING_FIELDS}
+                target_session.info.setdefault(PENDING_KEY, []).append((kind, row))
+        return after_insert
+
+    def after_commit(committed):
+        pending = committed.info.pop(PENDING_KEY, None)
+        if not pending:
+            return
+        store = get_stats_counter_store()
+        store.record_alerts(row for kind, row in pending if kind == 'alert')
+        store.record_messages(row for kind, row in pending if kind == 'message')
+
+    def after_rollback(rolled_back):
+        rolled_back.info.pop(PENDING_KEY, None)
+
+    event.listen(AlertInfo, 'after_insert', on_insert('alert'))
+    event.listen(DeviceMessage, 'after_insert', on_insert('message'))
+    event.listen(session, 'after_commit', after_commit)
+    event.listen(session, 'after_rollback', after_rollback)
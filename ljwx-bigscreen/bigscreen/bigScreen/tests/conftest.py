@@ -0,0 +1,295 @@
+"""
+测试共用的内存版Redis
+FakeRedis同时充当RedisHelper(client即自身)与redis-py客户端，所有类型的键存放在同一个store字典中：
+字符串为原值，HASH为dict(值转为str)，ZSET为{member: score}，SET/HyperLogLog/位图为set。
+pipeline()按redis-py语义排队执行，支持WATCH/MULTI(被监视的键在EXEC前被修改时抛出WatchError)；
+executed记录每次pipeline执行的命令名，fail=True时pipeline执行抛出ConnectionError。
+Lua脚本无法在内存中执行，由测试把等价的Python函数登记到scripts[脚本文本] = handler(redis, keys, args)。
+"""
+
+import threading
+
+import pytest
+from redis.exceptions import WatchError
+
+def _bound(value):
+    """ZSET分值区间边界：'-inf'/'+inf'/'(开区间'/数值"""
+    text = value.decode() if isinstance(value, bytes) else str(value)
+    if text.startswith('('):
+        return float(text[1:]), True
+    return float(text), False
+
+def _within(score, low, high):
+    (low, low_open), (high, high_open) = _bound(low), _bound(high)
+    return (score > low if low_open else score >= low) and (score < high if high_open else score <= high)
+
+class FakePipeline:
+    def __init__(self, redis, transaction=False):
+        self.redis, self.transaction = redis, transaction
+        self.ops, self.watched, self.immediate = [], None, False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.reset()
+        return False
+
+    def reset(self):
+        self.ops, self.watched, self.immediate = [], None, False
+
+    def watch(self, *keys):
+        self.watched = {key: self.redis.versions.get(key, 0) for key in keys}
+        self.immediate = True  # WATCH后到MULTI前命令立即执行
+
+    def multi(self):
+        self.ops, self.immediate = [], False
+
+    def __getattr__(self, name):
+        method = getattr(self.redis, name)
+        if self.immediate:
+            return method
+        return lambda *args, **kwargs: self.ops.append((name, args, kwargs))
+
+    def execute(self):
+        ops, watched = self.ops, self.watched
+        self.reset()
+        if self.redis.fail:
+            raise ConnectionError('redis down')
+        if watched and any(self.redis.versions.get(key, 0) != version for key, version in watched.items()):
+            raise WatchError()
+        self.redis.executed.append([name for name, _, _ in ops])
+        return [getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in ops]
+
+class FakePubSub:
+    def __init__(self, redis, ignore_subscribe_messages=False):
+        self.redis, self.channels, self.messages = redis, set(), []
+
+    def subscribe(self, *channels):
+        self.channels.update(channels)
+        self.redis.subscribers.append(self)
+
+    def unsubscribe(self, *channels):
+        self.channels.difference_update(channels)
+
+    def get_message(self, timeout=0.0):
+        if self.messages:
+            return self.messages.pop(0)
+        self.redis.now += timeout  # 无消息时模拟等待，推进FakeRedis时钟
+        return None
+
+    def close(self):
+        if self in self.redis.subscribers:
+            self.redis.subscribers.remove(self)
+
+class FakeRedis:
+    def __init__(self):
+        self.store, self.ttls, self.versions = {}, {}, {}
+        self.published, self.executed, self.subscribers = [], [], []
+        self.scripts, self.evals = {}, 0
+        self.fail, self.now = False, 0.0
+        self.client = self
+        self._lock = threading.Lock()
+
+    def _touch(self, key):
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def pipeline(self, transaction=False):
+        return FakePipeline(self, transaction)
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return FakePubSub(self, ignore_subscribe_messages)
+
+    def publish(self, channel, message):
+        self.published.append((channel, message))
+        for pubsub in list(self.subscribers):
+            if channel in pubsub.channels:
+                pubsub.messages.append({'type': 'message', 'channel': channel, 'data': message})
+        return len(self.subscribers)
+
+    def eval(self, script, numkeys, *keys_and_args):
+        if self.fail:
+            raise ConnectionError('redis down')
+        self.evals += 1
+        args = [str(arg) for arg in keys_and_args]  # Lua收到的KEYS/ARGV均为字符串
+        return self.scripts[script](self, args[:numkeys], args[numkeys:])
+
+    # ---------------- 通用/字符串 ----------------
+    def exists(self, *keys):
+        return sum(key in self.store for key in keys)
+
+    def delete(self, *keys):
+        removed = 0
+        for key in keys:
+            if self.store.pop(key, None) is not None:
+                removed += 1
+                self._touch(key)
+        return removed
+
+    def expire(self, key, ttl):
+        self.ttls[key] = ttl
+        return key in self.store
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def mget(self, keys):
+        return [self.store.get(key) for key in keys]
+
+    def set(self, key, value, nx=False, ex=None):
+        with self._lock:
+            if nx and key in self.store:
+                return None
+            self.store[key] = value
+        if ex is not None:
+            self.ttls[key] = ex
+        self._touch(key)
+        return True
+
+    def setex(self, key, ttl, value):
+        return self.set(key, value, ex=ttl)
+
+    def incrby(self, key, amount=1):
+        self.store[key] = int(self.store.get(key, 0)) + amount
+        self._touch(key)
+        return self.store[key]
+
+    def incr(self, key):
+        return self.incrby(key, 1)
+
+    # ---------------- HASH ----------------
+    def hset(self, key, field=None, value=None, mapping=None):
+        fields = self.store.setdefault(key, {})
+        items = dict(mapping or {})
+        if field is not None:
+            items[field] = value
+        added = sum(name not in fields for name in items)
+        fields.update({name: str(item) for name, item in items.items()})
+        self._touch(key)
+        return added
+
+    def hsetnx(self, key, field, value):
+        fields = self.store.setdefault(key, {})
+        if field in fields:
+            return 0
+        fields[field] = str(value)
+        self._touch(key)
+        return 1
+
+    def hincrby(self, key, field, amount=1):
+        fields = self.store.setdefault(key, {})
+        fields[field] = str(int(fields.get(field, 0)) + amount)
+        self._touch(key)
+        return int(fields[field])
+
+    def hget(self, key, field):
+        return self.store.get(key, {}).get(field)
+
+    def hmget(self, key, fields):
+        return [self.store.get(key, {}).get(field) for field in fields]
+
+    def hgetall(self, key):
+        return dict(self.store.get(key, {}))
+
+    def hvals(self, key):
+        return list(self.store.get(key, {}).values())
+
+    def hlen(self, key):
+        return len(self.store.get(key, {}))
+
+    def hdel(self, key, *fields):
+        removed = sum(self.store.get(key, {}).pop(field, None) is not None for field in fields)
+        if removed:
+            self._touch(key)
+        return removed
+
+    # ---------------- ZSET ----------------
+    def zadd(self, key, mapping, xx=False, gt=False):
+        zset = self.store.setdefault(key, {})
+        changed = 0
+        for member, score in mapping.items():
+            if xx and member not in zset or gt and member in zset and score <= zset[member]:
+                continue
+            changed += member not in zset
+            zset[member] = float(score)
+        self._touch(key)
+        return changed
+
+    def zscore(self, key, member):
+        return self.store.get(key, {}).get(member)
+
+    def zmscore(self, key, members):
+        return [self.store.get(key, {}).get(member) for member in members]
+
+    def zrem(self, key, *members):
+        removed = sum(self.store.get(key, {}).pop(member, None) is not None for member in members)
+        if removed:
+            self._touch(key)
+        return removed
+
+    def zcard(self, key):
+        return len(self.store.get(key, {}))
+
+    def zcount(self, key, low, high):
+        return sum(1 for score in self.store.get(key, {}).values() if _within(score, low, high))
+
+    def zrangebyscore(self, key, low, high, withscores=False):
+        rows = sorted(((m, s) for m, s in self.store.get(key, {}).items() if _within(s, low, high)),
+                      key=lambda row: row[1])
+        return rows if withscores else [member for member, _ in rows]
+
+    def zrevrangebyscore(self, key, high, low, start=None, num=None, withscores=False):
+        rows = sorted(((m, s) for m, s in self.store.get(key, {}).items() if _within(s, low, high)),
+                      key=lambda row: -row[1])
+        if start is not None:
+            rows = rows[start:start + num]
+        return rows if withscores else [member for member, _ in rows]
+
+    def zremrangebyscore(self, key, low, high):
+        zset = self.store.get(key, {})
+        stale = [member for member, score in zset.items() if _within(score, low, high)]
+        for member in stale:
+            del zset[member]
+        return len(stale)
+
+    def zremrangebyrank(self, key, start, end):
+        zset = self.store.get(key, {})
+        ranked = sorted(zset, key=zset.get)
+        end = len(ranked) + end if end < 0 else end
+        stale = ranked[start if start >= 0 else len(ranked) + start:end + 1]
+        for member in stale:
+            del zset[member]
+        return len(stale)
+
+    # ---------------- SET/HyperLogLog/位图 ----------------
+    def sadd(self, key, *members):
+        values = self.store.setdefault(key, set())
+        added = sum(str(member) not in values for member in members)
+        values.update(str(member) for member in members)
+        self._touch(key)
+        return added
+
+    def smembers(self, key):
+        return set(self.store.get(key, ()))
+
+    def pfadd(self, key, *values):
+        self.store.setdefault(key, set()).update(values)
+        self._touch(key)
+        return 1
+
+    def pfcount(self, key):
+        return len(self.store.get(key, ()))
+
+    def setbit(self, key, offset, value):
+        bits = self.store.setdefault(key, set())
+        previous = int(offset in bits)
+        bits.add(offset) if value else bits.discard(offset)
+        self._touch(key)
+        return previous
+
+    def bitcount(self, key):
+        return len(self.store.get(key, ()))
+
+@pytest.fixture
+def fake_redis():
+    return FakeRedis()
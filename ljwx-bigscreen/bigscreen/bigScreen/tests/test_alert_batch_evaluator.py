@@ -0,0 +1,94 @@
+import random
+from datetime import datetime
+
+from ..alert_batch_evaluator import BatchAlertEvaluator, insert_alert_rows
+from ..alert_rule_index import compile_rules
+from .test_alert_rule_index import rule
+from .conftest import FakeRedis
+from .test_alert_streak_store import make_store
+
+INDEX = compile_rules([rule(1, 'heart_rate', 50, 120), rule(2, 'heart_rate', 55, 100, 2),
+                       rule(3, 'bloodPressure', 60, 140), rule(4, 'blood_oxygen', 90, 100),
+                       rule(5, 'temperature', 35.5, 37.5, 3), rule(6, 'stress', None, 80)])
+
+def random_samples(count, seed=7):
+    rng = random.Random(seed)
+    choices = ['', None, 'abc', ' ']
+    samples = []
+    for i in range(count):
+        value = lambda low, high: rng.choice(choices) if rng.random() < 0.1 else str(rng.randint(low, high))
+        sample = {'deviceSn': f'SN{i % 5}', 'timestamp': f'2025-01-01 08:{i // 5:02d}:00', 'customerId': 1,
+                  'heartRate': '', 'heart_rate': value(40, 140), 'pressureHigh': value(50, 160),
+                  'pressureLow': value(50, 100), 'bloodOxygen': '', 'blood_oxygen': value(85, 100),
+                  'temperature': value(35, 38), 'stress': value(10, 95)}
+        if rng.random() < 0.2:
+            sample.pop('pressureHigh')
+        samples.append(sample)
+    return sorted(samples, key=lambda s: (s['deviceSn'], s['timestamp']))
+
+def scalar(samples, store=None):
+    return [(i, r.id) for i, s in enumerate(samples)
+            for r in INDEX.evaluate(s, store, s['deviceSn'] if store else None, s['timestamp'])]
+
+def test_vectorised_matches_scalar_evaluate():
+    samples = random_samples(300)
+    evaluator = BatchAlertEvaluator(index_getter=lambda cid: (INDEX, True))
+    assert [(i, r.id) for i, r in evaluator.evaluate(samples)] == scalar(samples)
+    # 趋势规则跨样本累计：两套独立状态存储结果一致
+    batch = [(i, r.id) for i, r in evaluator.evaluate(samples, make_store(FakeRedis()))]
+    assert batch == scalar(samples, make_store(FakeRedis()))
+    assert {rule_id for _, rule_id in batch} >= {2, 5}
+
+def test_blood_pressure_checks_both_values():
+    evaluator = BatchAlertEvaluator(index_getter=lambda cid: (INDEX, True))
+    samples = [{'pressureHigh': '120', 'pressureLow': '50'}, {'pressureHigh': '150', 'pressureLow': 'x'},
+               {'pressureHigh': '', 'pressureLow': '150'}, {'pressureLow': '100'}]
+    assert [i for i, _ in evaluator.evaluate(samples)] == [0, 2]
+
+class FakeCursor:
+    """模拟t_alert_info：多行INSERT的自增id不连续，表中预置同一健康数据的历史告警"""
+    def __init__(self):
+        self.statements, self.next_id, self.lastrowid, self.result = [], 100, None, []
+        self.table = [(90, 5, 0)]  # (id, health_id, rule_id)
+
+    def execute(self, sql, params):
+        self.statements.append((sql, params))
+        if sql.startswith('SELECT'):
+            first_id, health_ids = params[0], set(params[1:])
+            self.result = [row for row in self.table if row[0] >= first_id and row[1] in health_ids]
+            return
+        columns = sql[sql.index('(') + 1:sql.index(')')].split(', ')
+        width = len(columns)
+        self.lastrowid = self.next_id
+        for offset in range(0, len(params), width):
+            values = dict(zip(columns, params[offset:offset + width]))
+            self.table.append((self.next_id, values['health_id'], values['rule_id']))
+            self.next_id += 7  # 交错模式下自增id可能不连续
+
+    def fetchall(self):
+        return self.result
+
+def test_insert_alert_rows_fills_orm_defaults():
+    cursor = FakeCursor()
+    rows = [{'rule_id': i, 'alert_type': 't', 'device_sn': 'SN1', 'alert_timestamp': datetime.now(),
+             'alert_desc': 'd', 'severity_level': 'high', 'alert_status': 'pending', 'health_id': None,
+             'customer_id': None, 'org_id': None, 'user_id': None} for i in range(3)]
+    assert insert_alert_rows(cursor, rows) == [100, 107, 114]
+    sql, params = cursor.statements[0]
+    columns = sql[sql.index('(') + 1:sql.index(')')].split(', ')
+    values = dict(zip(columns, params))
+    assert 'id' not in columns and len(cursor.statements) == 3
+    assert values['customer_id'] == 0 and values['is_deleted'] is False and values['org_id'] is None
+
+def test_insert_alert_rows_uses_one_multi_row_insert_and_one_select():
+    cursor = FakeCursor()
+    rows = [{'rule_id': rule_id, 'alert_type': 't', 'device_sn': 'SN1', 'alert_timestamp': datetime.now(),
+             'alert_desc': 'd', 'severity_level': 'high', 'alert_status': 'pending', 'health_id': health_id,
+             'customer_id': 1, 'org_id': None, 'user_id': None}
+            for health_id, rule_id in [(5, 1), (5, 2), (6, 1), (None, 3)]]
+    cursor.table.append((95, 5, 1))  # 同一健康数据、同一规则的历史告警(id小于本次首行)不会被取回
+    assert insert_alert_rows(cursor, rows) == [100, 107, 114, 121]
+    insert, select, single = cursor.statements
+    assert insert[0].count('), (') == 2 and len(insert[1]) == 3 * len(single[1])  # 3行一条语句
+    assert select[0].startswith('SELECT id, health_id, rule_id') and select[1] == [100, 5, 6]
+    assert single[1][0] == 3  # 无health_id的告警单独INSERT
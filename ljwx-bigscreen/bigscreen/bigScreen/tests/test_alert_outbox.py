@@ -0,0 +1,77 @@
+import threading
+
+from ..alert_outbox import AlertNotifier, build_outbox_entry, backoff_delay
+
+class FakeStore:
+    def __init__(self, entries):
+        self.pending = list(entries)
+        self.sent, self.retried, self.dead = [], [], []
+
+    def claim(self, limit, lease_seconds):
+        batch, self.pending = self.pending[:limit], self.pending[limit:]
+        for entry in batch:
+            entry['attempts'] = entry.get('attempts', 0) + 1
+        return batch
+
+    def mark_sent(self, entry):
+        self.sent.append(entry['id'])
+
+    def mark_retry(self, entry, error, delay):
+        self.retried.append((entry['id'], delay))
+        self.pending.append(entry)
+
+    def mark_dead(self, entry, error):
+        self.dead.append(entry['id'])
+
+def make_notifier(redis, entries, senders, **kwargs):
+    notifier = AlertNotifier(store=FakeStore(entries), senders=senders, **kwargs)
+    notifier.redis = redis
+    return notifier
+
+def drain(notifier, rounds=10):
+    for _ in range(rounds):
+        notifier.poll_once(100)
+        for executor in notifier._executors.values():
+            executor.submit(lambda: None).result()
+
+def entry(entry_id, openid=None):
+    e = build_outbox_entry(entry_id, {'rule_type': 'heart_rate'}, {'openid': openid, 'user_name': 'u'}, 'SN1')
+    e['id'] = entry_id
+    return e
+
+def test_retry_with_backoff_then_dead_and_redis_dedup(fake_redis):
+    calls = []
+    def flaky(payload):
+        calls.append(payload['alert_type'])
+        raise RuntimeError('wechat timeout')
+    notifier = make_notifier(fake_redis, [entry(1, 'openid-1'), entry(2)], {'wechat': flaky, 'system': lambda p: None}, max_attempts=3)
+    fake_redis.set('alert_outbox_sent:3', 1)  # 已发送但未标记的任务被重新领取
+    notifier.store.pending.append(entry(3))
+    drain(notifier)
+    assert sorted(notifier.store.sent) == [2, 3] and notifier.store.dead == [1]
+    assert len(calls) == 3 and len(notifier.store.retried) == 2
+    assert notifier.get_stats()['deduplicated'] == 1
+    assert backoff_delay(1) <= 5 and 80 <= backoff_delay(6) <= 160 and backoff_delay(30) <= 600
+
+def test_channel_concurrency_is_bounded_per_channel(fake_redis):
+    active, peak, lock = [0], [0], threading.Lock()
+    system_done, all_system_done, unblocked = [], threading.Event(), []
+    def slow(payload):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        unblocked.append(all_system_done.wait(timeout=5))  # 系统通知全部完成前微信通知一直阻塞
+        with lock:
+            active[0] -= 1
+    def system(payload):
+        with lock:
+            system_done.append(payload)
+            if len(system_done) == 4:
+                all_system_done.set()
+    notifier = make_notifier(fake_redis, [entry(i, 'openid') for i in range(6)] + [entry(100 + i) for i in range(4)],
+                             {'wechat': slow, 'system': system}, channel_limits={'wechat': 2, 'system': 4})
+    drain(notifier, rounds=1)
+    for executor in notifier._executors.values():
+        executor.shutdown(wait=True)  # 等待全部已提交的发送完成
+    assert peak[0] == 2 and len(notifier.store.sent) == 10
+    assert all(unblocked) and len(unblocked) == 6  # 微信慢不阻塞系统通知
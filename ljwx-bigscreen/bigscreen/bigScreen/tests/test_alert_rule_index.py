@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+from ..alert_rule_index import AlertRuleIndexCache, compile_rules
+
+def rule(rule_id, sign, tmin=None, tmax=None, trend=None, enabled=True):
+    return {'id': rule_id, 'rule_type': f'{sign}_alert', 'physical_sign': sign, 'threshold_min': tmin,
+            'threshold_max': tmax, 'trend_duration': trend, 'severity_level': 'high',
+            'alert_message': sign, 'is_enabled': enabled}
+
+def test_compile_parses_thresholds_once_and_skips_disabled():
+    index = compile_rules([rule(1, 'heart_rate', '50', '120'), rule(2, 'heart_rate', 'x', '', 'bad'),
+                           rule(3, 'temperature', enabled=False), rule(4, '')])
+    assert index.rule_count == 2
+    r1, r2 = index.by_sign['heart_rate']
+    assert (r1.threshold_min, r1.threshold_max, r1.trend_duration) == (50.0, 120.0, 1)
+    assert (r2.threshold_min, r2.threshold_max, r2.trend_duration) == (0, float('inf'), 1)
+
+def test_evaluate_matches_generate_alerts_semantics():
+    index = compile_rules([rule(1, 'heart_rate', 50, 120), rule(2, 'bloodPressure', 60, 140),
+                           rule(3, 'blood_oxygen', 90, 100), rule(4, 'blood_oxygen', 95, 100, 2)])
+    # heartRate字段只用于匹配规则，取值按physical_sign(heart_rate)，与原实现一致
+    assert [r.id for r in index.evaluate({'heartRate': '150', 'heart_rate': '150'})] == [1]
+    assert index.evaluate({'heartRate': '150'}) == []
+    assert [r.id for r in index.evaluate({'pressureHigh': '150', 'pressureLow': '80'})] == [2]
+    assert index.evaluate({'pressureHigh': 'abc', 'pressureLow': '200'}) == []
+    # 不带趋势状态时trend_duration>1的规则不会因单条样本触发(跨上传计数见test_alert_streak_store)
+    assert [r.id for r in index.evaluate({'bloodOxygen': '', 'blood_oxygen': '85'})] == [3]
+    assert index.evaluate({'bloodOxygen': '', 'blood_oxygen': ' '}) == []
+
+def test_index_rebuilt_only_on_version_change():
+    rules_v1 = [SimpleNamespace(id=1, rule_type='hr', physical_sign='heart_rate', threshold_min=50, threshold_max=120,
+                                trend_duration=1, severity_level='high', alert_message='hr', is_enabled=True)]
+    manager = SimpleNamespace(local={7: rules_v1}, version_cache={7: 1}, start_subscriber=lambda: None)
+    manager.get_alert_rules = lambda cid: manager.local.get(cid, [])
+    cache = AlertRuleIndexCache(cache_manager_getter=lambda: manager, db_loader=lambda: [rule(9, 'heart_rate', 0, 1)])
+    first, hit = cache.get_index(7)
+    assert hit and cache.get_index(7)[0] is first
+    assert cache.stats['rebuilds'] == 1
+    manager.local[7] = list(rules_v1)  # 订阅者收到新版本后替换规则列表
+    manager.version_cache[7] = 2
+    assert cache.get_index(7)[0] is not first
+    assert cache.stats['rebuilds'] == 2
+    fallback, hit = cache.get_index(None)
+    assert not hit and fallback.by_sign['heart_rate'][0].id == 9
@@ -0,0 +1,71 @@
+from ..alert_streak_store import STREAK_SCRIPT, AlertStreakStore, StreakState
+from ..alert_rule_index import compile_rules
+
+def streak_script(redis, keys, args):
+    """STREAK_SCRIPT的Python等价实现(逐条读取-判断-写回HASH字段)"""
+    ttl, results = int(args[0]), []
+    for i in range(1, len(args), 6):
+        key, field = keys[int(args[i]) - 1], args[i + 1]
+        abnormal, required, window, ts = int(args[i + 2]), int(args[i + 3]), int(args[i + 4]), args[i + 5]
+        state = StreakState.loads(redis.hget(key, field) or '0,0,')
+        if ts and state.last_ts and ts <= state.last_ts:
+            results.append(-1)
+            continue
+        fired = state.observe(bool(abnormal), required, window)
+        if ts:
+            state.last_ts = ts
+        redis.hset(key, field, state.dumps())
+        redis.expire(key, ttl)
+        results.append(int(fired))
+    return results
+
+def make_store(redis):
+    store = AlertStreakStore()
+    store.redis = redis
+    redis.scripts[STREAK_SCRIPT] = streak_script
+    return store
+
+def test_consecutive_and_n_of_m_window():
+    state = StreakState()
+    assert [state.observe(a, 3) for a in (True, True, False, True, True, True)] == [False] * 5 + [True]
+    window = StreakState()
+    assert [window.observe(a, 2, 4) for a in (True, False, False, True)] == [False, False, False, True]
+    window = StreakState()
+    assert [window.observe(a, 2, 3) for a in (True, False, False, True)] == [False, False, False, False]
+
+def test_streak_survives_across_uploads_and_processes(fake_redis):
+    redis = fake_redis
+    index = compile_rules([{'id': 4, 'physical_sign': 'blood_oxygen', 'threshold_min': 95, 'threshold_max': 100,
+                            'trend_duration': 2}])
+    store = make_store(redis)
+    sample = {'bloodOxygen': '', 'blood_oxygen': '85'}
+    assert index.evaluate(sample, store, 'SN1', '2025-01-01 08:00:00') == []
+    assert index.evaluate(sample, store, 'SN1', '2025-01-01 08:00:00') == []  # 重放样本不计数
+    assert store.stats['stale_skipped'] == 1
+    assert redis.hget('alert_streak:SN1:blood_oxygen', '4') == '1,1,2025-01-01 08:00:00'
+    assert redis.ttls['alert_streak:SN1:blood_oxygen'] == store.redis_ttl
+
+    other = make_store(redis)  # 另一个进程直接读写Redis中的状态
+    assert [r.id for r in index.evaluate(sample, other, 'SN1', '2025-01-01 08:01:00')] == [4]
+    assert index.evaluate(sample, other, 'SN2', '2025-01-01 08:01:00') == []
+
+def test_interleaved_workers_do_not_lose_increments(fake_redis):
+    worker_a, worker_b = make_store(fake_redis), make_store(fake_redis)
+    # 两个worker交替处理同一设备的样本，第3次连续异常时触发
+    assert worker_a.update('SN1', 'heart_rate', 1, True, 3, ts='2025-01-01 08:00:00') is False
+    assert worker_b.update('SN1', 'heart_rate', 1, True, 3, ts='2025-01-01 08:01:00') is False
+    assert worker_a.update('SN1', 'heart_rate', 1, True, 3, ts='2025-01-01 08:02:00') is True
+    assert worker_b.update('SN1', 'heart_rate', 1, True, 3, ts='2025-01-01 08:01:30') is False  # 乱序样本
+    assert fake_redis.hget('alert_streak:SN1:heart_rate', '1') == '0,0,2025-01-01 08:02:00'
+
+def test_batch_is_one_script_call_and_falls_back_without_redis(fake_redis):
+    store = make_store(fake_redis)
+    fired = store.update_many([('SN1', 'heart_rate', 1, True, 2, None, '2025-01-01 08:00:00'),
+                               ('SN2', 'heart_rate', 1, True, 2, None, '2025-01-01 08:00:00'),
+                               ('SN1', 'heart_rate', 1, True, 2, None, '2025-01-01 08:01:00')])
+    assert fired == [False, False, True] and fake_redis.evals == 1
+
+    fake_redis.fail = True
+    assert store.update_many([('SN2', 'heart_rate', 1, True, 2, None, '2025-01-01 08:01:00'),
+                              ('SN2', 'heart_rate', 1, True, 2, None, '2025-01-01 08:02:00')]) == [False, True]
+    assert store.stats['redis_errors'] == 1
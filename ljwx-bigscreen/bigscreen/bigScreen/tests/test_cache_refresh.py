@@ -0,0 +1,52 @@
+import json
+import time
+
+from ..cache_service import CacheService, REFRESH_LOADERS, refreshable
+
+def test_stale_value_is_returned_immediately_and_refreshed_in_background(fake_redis):
+    calls = []
+
+    @refreshable('org_stats', 'test_ranking')
+    def load(customer_id):
+        calls.append(customer_id)
+        return {'code': 200, 'data': len(calls)}
+
+    try:
+        redis = fake_redis
+        cache = CacheService(redis)
+        data, performance = cache.get_refreshable('org_stats', 'test_ranking', '1')
+        assert data == {'code': 200, 'data': 1} and performance == {'cached': False, 'age': 0, 'stale': False}
+
+        key = cache._make_key('org_stats', 'test_ranking', '1')
+        redis.store[key] = json.dumps({'stored_at': time.time() - 700, 'data': {'code': 200, 'data': 1}})
+        data, performance = cache.get_refreshable('org_stats', 'test_ranking', '1')
+        assert data == {'code': 200, 'data': 1} and performance['stale'] and performance['age'] >= 700
+        assert calls == ['1']  # 读取方不等待加载
+
+        assert cache.refresh_due() == 1
+        data, performance = cache.get_refreshable('org_stats', 'test_ranking', '1')
+        assert data == {'code': 200, 'data': 2} and not performance['stale']
+        assert cache.refresh_due() == 0  # 未到提前刷新时间
+    finally:
+        REFRESH_LOADERS.pop(('org_stats', 'test_ranking'), None)
+
+def test_refresh_skips_key_locked_by_other_process_and_keeps_last_good_value_on_error(fake_redis):
+    @refreshable('device_stats', 'test_wearing')
+    def load(customer_id):
+        raise RuntimeError('db down')
+
+    try:
+        redis = fake_redis
+        cache = CacheService(redis)
+        key = cache._make_key('device_stats', 'test_wearing', '1')
+        redis.store[key] = json.dumps({'stored_at': time.time() - 400, 'data': {'normal': 3}})
+        redis.store[key + ':refreshing'] = '1'
+        assert not cache.refresh('device_stats', 'test_wearing', '1')
+        assert cache.refresh_stats['refresh_skipped'] == 1
+
+        del redis.store[key + ':refreshing']
+        assert not cache.refresh('device_stats', 'test_wearing', '1')
+        assert cache.get_refreshable('device_stats', 'test_wearing', '1')[0] == {'normal': 3}
+        assert key + ':refreshing' not in redis.store
+    finally:
+        REFRESH_LOADERS.pop(('device_stats', 'test_wearing'), None)
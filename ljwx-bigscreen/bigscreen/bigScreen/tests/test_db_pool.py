@@ -0,0 +1,89 @@
+import threading
+import pytest
+from .. import db_pool
+from ..db_pool import MySQLConnectionPool, PoolTimeoutError
+
+class FakeConnection:
+    def __init__(self):
+        self.open = True
+        self.server_status = 0
+        self.pings = 0
+        self.rollbacks = 0
+
+    def ping(self, reconnect=False):
+        self.pings += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.server_status = 0
+
+    def close(self):
+        self.open = False
+
+@pytest.fixture
+def fake_connect(monkeypatch):
+    created = []
+    def connect(**kwargs):
+        conn = FakeConnection()
+        created.append(conn)
+        return conn
+    monkeypatch.setattr(db_pool.pymysql, 'connect', connect)
+    return created
+
+def make_pool(**kwargs):
+    options = dict(max_size=2, min_idle=0, checkout_timeout=0.2, ping_interval=30, max_lifetime=3600)
+    options.update(kwargs)
+    return MySQLConnectionPool('test', 'localhost', 3306, 'root', '', 'ljwx', **options)
+
+def test_connection_is_reused(fake_connect):
+    pool = make_pool()
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+    assert first is second
+    assert len(fake_connect) == 1
+    assert pool.get_stats()['checkouts'] == 2
+
+def test_pool_is_bounded_and_times_out(fake_connect):
+    pool = make_pool(max_size=1)
+    conn = pool.acquire()
+    with pytest.raises(PoolTimeoutError):
+        pool.acquire()
+    stats = pool.get_stats()
+    assert stats['timeouts'] == 1
+    assert stats['in_use'] == 1
+    pool.release(conn)
+
+def test_waiter_gets_released_connection(fake_connect):
+    pool = make_pool(max_size=1, checkout_timeout=2)
+    conn = pool.acquire()
+    result = {}
+    waiter = threading.Thread(target=lambda: result.setdefault('conn', pool.acquire()))
+    waiter.start()
+    threading.Timer(0.05, pool.release, args=(conn,)).start()
+    waiter.join(timeout=2)
+    assert result['conn'] is conn
+    assert pool.get_stats()['waits'] == 1
+
+def test_open_transaction_rolled_back_on_release(fake_connect):
+    pool = make_pool()
+    conn = pool.acquire()
+    conn.server_status = 1  # SERVER_STATUS_IN_TRANS
+    pool.release(conn)
+    assert conn.rollbacks == 1
+
+def test_stale_idle_connection_is_pinged(fake_connect):
+    pool = make_pool(ping_interval=0)
+    conn = pool.acquire()
+    pool.release(conn)
+    assert pool.acquire() is conn
+    assert conn.pings == 1
+
+def test_closed_connection_is_replaced(fake_connect):
+    pool = make_pool()
+    conn = pool.acquire()
+    conn.close()
+    pool.release(conn)
+    assert pool.acquire() is not conn
+    assert pool.get_stats()['size'] == 1
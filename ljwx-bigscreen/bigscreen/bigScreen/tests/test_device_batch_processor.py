@@ -0,0 +1,94 @@
+from .. import device_batch_processor
+from ..device_batch_processor import DeviceBatchProcessor, DEVICE_UPSERT_SQL
+from ..device_history_store import HISTORY_INSERT_SQL
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def executemany(self, sql, rows):
+        rows = list(rows)
+        if any(row[0] == 'BAD' for row in rows):
+            raise RuntimeError('Data too long')
+        self.conn.statements.append((sql, rows))
+
+    def execute(self, sql, row):
+        self.executemany(sql, [row])
+
+class FakeConn:
+    def __init__(self):
+        self.statements, self.commits, self.rollbacks = [], 0, 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+class FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def acquire(self):
+        return self.conn
+
+    def release(self, conn):
+        pass
+
+class FakeResolver:
+    def resolve_many(self, device_sns):
+        return {sn: {'customer_id': 1, 'org_id': 10} for sn in device_sns}
+
+class FakePresence:
+    def __init__(self):
+        self.events = []
+
+    def record_many(self, events):
+        self.events.extend(events)
+
+def make_processor(monkeypatch, redis, conn):
+    presence = FakePresence()
+    monkeypatch.setattr(device_batch_processor, 'get_mysql_pool', lambda: FakePool(conn))
+    monkeypatch.setattr(device_batch_processor, 'get_device_resolver', lambda: FakeResolver())
+    monkeypatch.setattr(device_batch_processor, 'get_device_presence', lambda: presence)
+    processor = DeviceBatchProcessor(batch_size=10, max_workers=1)
+    processor.redis = redis
+    return processor, presence
+
+def upload(sn, ts, wear=1):
+    return {'SerialNumber': sn, 'timestamp': ts, 'wearState': wear, 'chargingStatus': 'NONE', 'batteryLevel': 80}
+
+def test_batch_is_written_as_sets_with_stage_timings(monkeypatch, fake_redis):
+    conn = FakeConn()
+    processor, presence = make_processor(monkeypatch, fake_redis, conn)
+    processor._process_batch([upload('SN1', '2025-03-01 08:00:00'), upload('SN2', '2025-03-01 08:00:01'),
+                              upload('SN1', '2025-03-01 08:00:05', wear=0), {'data': {}}])
+
+    (upsert_sql, devices), (history_sql, history) = conn.statements
+    assert upsert_sql == DEVICE_UPSERT_SQL and history_sql == HISTORY_INSERT_SQL and conn.commits == 1
+    assert [(row[0], row[10]) for row in devices] == [('SN1', 'NOT_WORN'), ('SN2', 'WORN')]  # 设备表保留最后一条
+    assert len(history) == 3
+    assert fake_redis.executed == [['hset', 'publish', 'hset', 'publish']]
+    assert [(e['device_sn'], e['worn'], e['charging']) for e in presence.events] == [
+        ('SN1', True, False), ('SN2', True, False), ('SN1', False, False)]
+
+    stats = processor.get_stats()
+    assert stats['processed'] == 3 and stats['failed'] == 1 and stats['batches'] == 1
+    assert {'normalize', 'upsert', 'history', 'commit', 'redis', 'presence', 'total'} <= set(stats['stage_avg_ms'])
+
+def test_failed_set_write_falls_back_to_rows_and_isolates_bad_device(monkeypatch, fake_redis):
+    conn = FakeConn()
+    processor, presence = make_processor(monkeypatch, fake_redis, conn)
+    processor._process_batch([upload('SN1', '2025-03-01 08:00:00'), upload('BAD', '2025-03-01 08:00:00')])
+    assert [rows[0][0] for _, rows in conn.statements] == ['SN1', 'SN1']
+    assert conn.rollbacks == 2 and [e['device_sn'] for e in presence.events] == ['SN1']
+    assert processor.stats['row_fallbacks'] == 1 and processor.stats['failed'] == 1
@@ -0,0 +1,126 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from ..device_history_analytics import DeviceAccumulator, DeviceHistoryAnalytics, window_points
+from ..device_history_store import stream_status_rows
+
+NOW = datetime(2025, 3, 3, 12, 0, 0)
+DAY1 = datetime(2025, 3, 1)
+
+class RowSource:
+    """按查询区间过滤的游程/历史行，记录每次流式读取的区间"""
+    def __init__(self, rows):
+        self.rows, self.calls = rows, []
+
+    def __call__(self, serial_numbers, start, end):
+        self.calls.append((start, end))
+        return iter([row for row in self.rows if row[0] in serial_numbers and row[2] >= start and row[1] <= end])
+
+ROWS = [
+    # 跨零点的游程：6次上报每48分钟一次，3月1日22:00/22:48/23:36，3月2日00:24/01:12/02:00
+    ('SN1', DAY1 + timedelta(hours=22), DAY1 + timedelta(hours=26), 80, 'NOT_CHARGING', 'WORN', 6),
+    ('SN1', DAY1 + timedelta(days=1, hours=8), DAY1 + timedelta(days=1, hours=8), '60', 'NOT_CHARGING', 'WORN', 1),
+    ('SN1', NOW - timedelta(hours=2), NOW - timedelta(hours=1), 40, 'CHARGING', 'NOT_WORN', 3),
+    ('SN2', DAY1 + timedelta(hours=9), DAY1 + timedelta(hours=9), None, None, 'WORN', 1),
+]
+
+def test_day_partials_count_each_report_once_and_are_cached(fake_redis):
+    source = RowSource(ROWS)
+    analytics = DeviceHistoryAnalytics(redis=fake_redis, row_source=source, clock=lambda: NOW)
+    merged = analytics.summarize(['SN1', 'SN2', 'SN3'], days=2, customer_id=7)
+    whole, = analytics.accumulate(['SN1', 'SN2'], [(DAY1, NOW)])
+
+    sn1 = merged['SN1']
+    assert sn1.samples == whole['SN1'].samples == 10
+    assert (sn1.first_battery, sn1.last_battery, sn1.worn, sn1.charging) == (80, 40, 7, 3)
+    assert sn1.wear_hours == {22: 1, 23: 2, 0: 1, 2: 2, 8: 1} and sn1.charge_hours == {10: 1, 11: 2}
+    assert (sn1.min_battery, sn1.max_battery, sn1.low_battery) == (40, 80, 0)
+    assert abs(sn1.mean_battery() - (6 * 80 + 60 + 3 * 40) / 10) < 1e-9
+    assert abs(sn1.battery_variance() - np.var([80] * 6 + [60] + [40] * 3)) < 1e-9
+    assert 'SN3' not in merged and merged['SN2'].battery_samples == 0
+    assert set(analytics.redis.store) == {'device_analytics:v2:7:20250301', 'device_analytics:v2:7:20250302'}
+
+    # 已结束的日期命中缓存，第二次只流式读取今天
+    source.calls.clear()
+    again = analytics.summarize(['SN1', 'SN2', 'SN3'], days=2, customer_id=7)
+    assert source.calls == [(datetime(2025, 3, 3), NOW)]
+    assert again['SN1'].to_dict() == sn1.to_dict() and analytics.stats['cache_hits'] == 6
+
+def test_running_regression_matches_polyfit_on_expanded_samples():
+    acc = DeviceAccumulator()
+    points = [(DAY1 + timedelta(minutes=m), w, b) for m, w, b in [(0, 1, 90), (30, 3, 85), (95, 2, 70), (200, 1, 64)]]
+    for timestamp, weight, battery in points:
+        acc.add(timestamp, weight, battery, 'NOT_CHARGING', 'WORN')
+    x = [t.timestamp() / 3600 for t, w, _ in points for _ in range(w)]
+    y = [b for _, w, b in points for _ in range(w)]
+    assert abs(acc.slope_per_hour() - np.polyfit(x, y, 1)[0]) < 1e-6
+    assert DeviceAccumulator.from_dict(acc.to_dict()).to_dict() == acc.to_dict()
+
+    # 游程按窗口边界裁剪：9次上报每6小时一次，窗口内只有第5次；窗口内无上报时以权重0的边界点提供状态
+    assert window_points(DAY1, DAY1 + timedelta(days=2), 9, DAY1 + timedelta(days=1),
+                         DAY1 + timedelta(days=1, hours=1)) == [(DAY1 + timedelta(days=1), 1)]
+    assert window_points(DAY1, DAY1 + timedelta(days=2), 9, DAY1 + timedelta(hours=1),
+                         DAY1 + timedelta(hours=2)) == [(DAY1 + timedelta(hours=1), 0)]
+
+def test_run_extended_into_next_day_is_not_counted_twice(fake_redis):
+    day2 = DAY1 + timedelta(days=1)
+    # 3月2日凌晨缓存3月1日时游程只到23:36(3次上报)，之后同一游程延伸到3月2日02:00(共6次)
+    source = RowSource([('SN1', DAY1 + timedelta(hours=22), DAY1 + timedelta(hours=23, minutes=36), 80,
+                         'NOT_CHARGING', 'WORN', 3)])
+    clock = [day2 + timedelta(minutes=1)]
+    analytics = DeviceHistoryAnalytics(redis=fake_redis, row_source=source, clock=lambda: clock[0])
+    assert analytics.summarize(['SN1'], days=1, customer_id=7)['SN1'].samples == 3
+
+    source.rows = [('SN1', DAY1 + timedelta(hours=22), day2 + timedelta(hours=2), 70, 'NOT_CHARGING', 'WORN', 6)]
+    clock[0] = day2 + timedelta(hours=12)
+    merged = analytics.summarize(['SN1'], days=1, customer_id=7)
+    assert source.calls[-1] == (day2, clock[0])  # 3月1日来自缓存
+    assert merged['SN1'].samples == 6 and merged['SN1'].wear_hours == {22: 1, 23: 2, 0: 1, 2: 2}
+
+def test_stream_status_rows_reads_in_batches_with_unbuffered_cursor():
+    class Cursor:
+        def __init__(self):
+            self.batches = [[('SN1',) * 7] * 2, [('SN1',) * 7], []]
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def execute(self, sql, params):
+            self.params = params
+
+        def fetchmany(self, size):
+            return self.batches.pop(0)
+
+    cursor = Cursor()
+
+    @contextmanager
+    def connection():
+        class Conn:
+            def cursor(self, cursor_class=None):
+                assert cursor_class.__name__ == 'SSCursor'
+                return cursor
+        yield Conn()
+
+    rows = list(stream_status_rows(['SN1'], DAY1, NOW, connection_factory=connection, batch_size=2))
+    assert len(rows) == 3 and cursor.params == ['SN1', DAY1, NOW, 'SN1', DAY1, NOW]
+
+def test_comprehensive_trends_are_built_from_accumulators():
+    from ..device import analyze_device_trends_from_accumulators, device_health_radar
+
+    acc = DeviceAccumulator()
+    for hour, battery in enumerate([90, 70, 50, 15, 8]):
+        acc.add(DAY1 + timedelta(hours=hour), 2, battery, 'CHARGING' if hour == 4 else 'NOT_CHARGING', 'WORN')
+    analysis = analyze_device_trends_from_accumulators({'SN1': acc}, days=1)
+    battery = analysis['battery_trends']['SN1']
+    assert (battery['min_battery'], battery['max_battery']) == (8, 90)
+    assert (battery['low_battery_events'], battery['critical_battery_events']) == (4, 2)
+    assert abs(battery['consumption_rate'] - 21.9) < 1e-9  # 与np.polyfit斜率一致，每小时下降21.9%
+    assert analysis['usage_patterns']['SN1']['wear_rate'] == 100
+    assert analysis['charging_patterns']['SN1'] == {'charging_frequency': 2, 'charging_rate': 20.0, 'peak_hour': 4}
+    assert 'SN1' in analysis['predictions']['battery_health_forecast']
+    assert device_health_radar(analysis)['SN1']['usage_efficiency'] == 100
@@ -0,0 +1,77 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from ..device_history_store import (DeviceHistoryWriter, HISTORY_COLUMNS, RUN_UPSERT_SQL, STATIC_INSERT_SQL,
+                                    compact_device_history, encode_history, load_device_snapshots)
+
+T0 = datetime(2025, 3, 1, 8, 0, 0)
+
+def report(minutes, battery, wear='WORN', version='1.0', charging='NOT_CHARGING'):
+    return {'serial_number': 'SN1', 'timestamp': T0 + timedelta(minutes=minutes), 'battery_level': battery,
+            'charging_status': charging, 'wearable_status': wear, 'voltage': 3800 + minutes,
+            'system_software_version': version, 'ip_address': '10.0.0.1', 'network_access_mode': 'wifi',
+            'status': 'ACTIVE', 'update_time': T0, 'is_deleted': 0}
+
+class FakeCursor:
+    def __init__(self, results=()):
+        self.results, self.calls = list(results), []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.calls.append((' '.join(sql.split()), params))
+
+    def executemany(self, sql, rows):
+        self.calls.append((sql, list(rows)))
+
+    def fetchall(self):
+        return self.results.pop(0)
+
+def test_unchanged_reports_extend_runs_and_static_fields_are_written_on_change():
+    runs, statics = {}, {}
+    rows, changes = encode_history([report(0, 80), report(5, 80), report(10, 79), report(15, 79, version='1.1')],
+                                   runs, statics)
+    assert rows == [('SN1', T0, T0 + timedelta(minutes=5), 80, 'NOT_CHARGING', 'WORN', 3805, 2),
+                    ('SN1', T0 + timedelta(minutes=10), T0 + timedelta(minutes=15), 79, 'NOT_CHARGING', 'WORN', 3815, 2)]
+    assert changes == [0, 3]
+
+    # 写入器从数据库读取最后一段游程(电量为int)，同值上报续写该游程且不写静态行
+    cursor = FakeCursor([[('SN1', T0 + timedelta(minutes=10), 79, 'NOT_CHARGING', 'WORN')],
+                         [('SN1', '1.1', '10.0.0.1', 'wifi', 'ACTIVE')]])
+    writer = DeviceHistoryWriter(mode='delta')
+    writer.write(cursor, [report(20, '79', version='1.1')])
+    (upsert, run_rows), = [call for call in cursor.calls if call[0] == RUN_UPSERT_SQL]
+    assert run_rows == [('SN1', T0 + timedelta(minutes=10), T0 + timedelta(minutes=20), '79', 'NOT_CHARGING',
+                         'WORN', 3820, 1)]
+    assert not [call for call in cursor.calls if call[0] == STATIC_INSERT_SQL]
+
+def test_snapshots_rebuild_runs_with_static_fields_and_legacy_rows():
+    runs = [('SN1', T0, T0 + timedelta(minutes=30), 80, 'NOT_CHARGING', 'WORN', 3800, 7),
+            ('SN1', T0 + timedelta(minutes=35), T0 + timedelta(minutes=35), 79, 'CHARGING', 'NOT_WORN', 3790, 1)]
+    history = [('SN1', T0 - timedelta(minutes=5), 81, 'NOT_CHARGING', 'WORN', 3810, '1.0', 'ip', 'wifi', 'ACTIVE'),
+               ('SN1', T0 + timedelta(minutes=20), None, None, None, None, '1.1', 'ip', 'wifi', 'ACTIVE')]
+    cursor = FakeCursor([runs, history, [('SN1', '0.9', 'ip', 'wifi', 'ACTIVE')]])
+
+    @contextmanager
+    def connection():
+        class Conn:
+            def cursor(self):
+                return cursor
+        yield Conn()
+
+    points = load_device_snapshots(['SN1'], connection_factory=connection)
+    assert [(p.timestamp - T0, p.battery_level, p.system_software_version, p.samples) for p in points] == [
+        (timedelta(minutes=-5), 81, '1.0', 1), (timedelta(0), 80, '1.0', 1),
+        (timedelta(minutes=30), 80, '1.1', 6), (timedelta(minutes=35), 79, '1.1', 1)]
+    assert cursor.calls[2][1] == ['SN1', T0 - timedelta(minutes=5)]  # 最早点之前的静态字段
+
+def test_compaction_keeps_static_changes_and_deletes_redundant_rows():
+    legacy = [report(0, 80), report(5, 80), report(10, 79, version='1.1')]
+    cursor = FakeCursor([[(i + 1,) + tuple(row[c] for c in HISTORY_COLUMNS) for i, row in enumerate(legacy)]])
+    result = compact_device_history(cursor, 'SN1', T0 + timedelta(days=1))
+    assert result == {'rows': 3, 'runs': 2, 'kept': 2, 'deleted': 1}
+    assert cursor.calls[-2][1] == [1, 3] and cursor.calls[-1][1] == [2]
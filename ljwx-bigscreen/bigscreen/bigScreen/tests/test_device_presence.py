@@ -0,0 +1,60 @@
+from ..device_presence import DevicePresence
+
+class Clock:
+    now = 10000.0
+
+    def __call__(self):
+        return self.now
+
+def make_presence(redis, rows=()):
+    loads = []
+
+    def loader(customer_id):
+        loads.append(customer_id)
+        return list(rows)
+
+    presence = DevicePresence(redis, device_loader=loader, interval_loader=lambda c: 300, clock=Clock())
+    return presence, loads
+
+def test_counts_offline_list_and_org_wearing_rates_come_from_heartbeats(fake_redis):
+    # 初始化：SN3从未上报，SN4最近一次上报在一小时前
+    presence, loads = make_presence(fake_redis, [('SN3', 20, None, None, None), ('SN4', 20, 6400.0, 'WORN', 'NOT_CHARGING')])
+    presence.record_many([
+        {'customer_id': 1, 'device_sn': 'SN1', 'org_id': 10, 'worn': True, 'charging': False},
+        {'customer_id': 1, 'device_sn': 'SN2', 'org_id': 10, 'worn': False, 'charging': True},
+        {'customer_id': None, 'device_sn': 'SN9'},  # 未绑定租户
+    ])
+    assert presence.summary(1) == {'total': 4, 'online': 2, 'offline': 2, 'worn_online': 1,
+                                   'worn': 2, 'charging': 1, 'interval': 300}
+    assert loads == ['1'] and presence.stats['skipped'] == 1
+
+    offline = presence.offline_devices(1, limit=10)
+    assert offline['total'] == 2 and offline['devices'] == [('SN4', 6400.0), ('SN3', None)]
+
+    presence._clock.now += 200  # 健康数据心跳只刷新最近上报时间，佩戴集合仅刷新佩戴中的设备
+    presence.record_health([{'customer_id': 1, 'device_sn': 'SN1', 'org_id': 10}])
+    presence._clock.now += 200
+    assert presence.statuses(1, ['SN1', 'SN2', 'SN8']) == {'SN1': True, 'SN2': False, 'SN8': None}
+    assert presence.org_wearing_rates(1) == {10: {'total': 2, 'online': 1, 'worn': 1, 'rate': 1.0},
+                                             20: {'total': 2, 'online': 0, 'worn': 0, 'rate': 0.0}}
+
+def test_org_move_and_slot_reuse_across_processes(fake_redis):
+    presence, _ = make_presence(fake_redis)
+    presence.record(1, 'SN1', org_id=10, worn=True)
+    presence.record(1, 'SN1', org_id=11, worn=True)
+    rates = presence.org_wearing_rates(1)
+    assert rates[10]['total'] == 0 and rates[11] == {'total': 1, 'online': 1, 'worn': 1, 'rate': 1.0}
+
+    other = DevicePresence(presence.redis, device_loader=lambda c: [], interval_loader=lambda c: 300,
+                           clock=presence._clock)
+    other.record(1, 'SN1', worn=False)  # 另一进程复用已分配槽位，并按已记录组织更新
+    assert presence.summary(1)['worn'] == 0 and fake_redis.get('presence:1:slot_seq') == 1
+    assert presence.org_wearing_rates(1)[11]['worn'] == 0
+
+def test_half_seeded_index_is_not_ready_for_other_workers(fake_redis):
+    presence, _ = make_presence(fake_redis, [('SN1', 10, 9000.0, 'WORN', 'NOT_CHARGING')])
+    client = fake_redis
+    client.set('presence:1:seeding', 1, nx=True)  # 另一进程正在初始化
+    assert presence.summary(1) is None and not client.exists('presence:1:seeded')
+    client.delete('presence:1:seeding')
+    assert presence.summary(1)['total'] == 1 and client.exists('presence:1:seeded')
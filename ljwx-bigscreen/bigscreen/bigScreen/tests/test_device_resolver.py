@@ -0,0 +1,98 @@
+import json
+from ..device_resolver import DeviceOrgResolver, parse_customer_id
+
+def make_resolver(redis, rows):
+    resolver = DeviceOrgResolver()
+    resolver.redis = redis
+    calls = []
+    def query_db(device_sns):
+        calls.append(list(device_sns))
+        return {sn: dict(rows[sn]) for sn in device_sns if sn in rows}
+    resolver._query_db = query_db
+    return resolver, calls
+
+ROWS = {
+    'SN1': {'device_sn': 'SN1', 'user_id': 1, 'user_name': 'a', 'org_id': 11, 'org_name': 'A', 'customer_id': 100, 'org_path': [100, 10]},
+    'SN2': {'device_sn': 'SN2', 'user_id': 2, 'user_name': 'b', 'org_id': 12, 'org_name': 'B', 'customer_id': 100, 'org_path': [100]},
+}
+
+def test_parse_customer_id():
+    assert parse_customer_id(11, '0,100,10') == 100
+    assert parse_customer_id(100, '0') == 100
+    assert parse_customer_id(11, '0,100', org_customer_id=200) == 200
+    assert parse_customer_id(None, None) is None
+
+def test_resolve_many_single_query_then_cached(fake_redis):
+    resolver, calls = make_resolver(fake_redis, ROWS)
+    result = resolver.resolve_many(['SN1', 'SN2', 'SN3', 'SN1'])
+    assert calls == [['SN1', 'SN2', 'SN3']]
+    assert result['SN1']['customer_id'] == 100
+    assert result['SN3'] is None
+    resolver.resolve_many(['SN1', 'SN2', 'SN3'])
+    assert len(calls) == 1
+    assert resolver.get_cache_stats()['local_hits'] == 3
+
+def test_redis_tier_used_when_local_empty(fake_redis):
+    resolver, calls = make_resolver(fake_redis, ROWS)
+    resolver.resolve('SN1')
+    resolver.clear()
+    assert resolver.resolve('SN1')['user_id'] == 1
+    assert len(calls) == 1
+    assert resolver.stats['redis_hits'] == 1
+
+def test_org_invalidation_drops_descendant_devices(fake_redis):
+    resolver, calls = make_resolver(fake_redis, ROWS)
+    resolver.resolve_many(['SN1', 'SN2'])
+    resolver.handle_message('org:10')
+    resolver.resolve_many(['SN1', 'SN2'])
+    assert calls[-1] == ['SN1']
+
+def test_db_failure_is_not_cached(fake_redis):
+    resolver, calls = make_resolver(fake_redis, ROWS)
+    resolver._query_db = lambda device_sns: None
+    assert resolver.resolve('SN1') is None
+    assert not fake_redis.exists('device_org_info:SN1')
+    resolver._query_db = lambda device_sns: {'SN1': dict(ROWS['SN1'])}
+    assert resolver.resolve('SN1')['org_id'] == 11
+
+def test_lru_bound(fake_redis):
+    resolver, _ = make_resolver(fake_redis, {})
+    resolver.max_size = 2
+    resolver.resolve_many(['X1', 'X2', 'X3'])
+    assert resolver.get_cache_stats()['local_cache_size'] == 2
+    assert json.loads(fake_redis.get('device_org_info:X1')) == {}
+
+def test_org_change_events_from_boot_invalidate_subtree(fake_redis):
+    resolver, calls = make_resolver(fake_redis, ROWS)
+    resolver.resolve_many(['SN1', 'SN2'])
+    event = json.dumps({'customer_id': 100, 'org_id': 10, 'action': 'UPDATE', 'org': {'id': 10, 'parent_id': 100}})
+    resolver.handle_message(json.dumps(event).encode(), b'org_change_channel')  # 双层JSON字符串
+    resolver.resolve_many(['SN1', 'SN2'])
+    assert calls[-1] == ['SN1']
+
+    resolver.handle_message('not json', 'org_change_channel')  # 无法解析时清空本地缓存
+    assert resolver.get_cache_stats()['local_cache_size'] == 0
+
+def test_org_and_user_invalidation_purge_redis_for_devices_cached_by_other_workers(fake_redis):
+    worker_a, _ = make_resolver(fake_redis, ROWS)
+    worker_b, calls_b = make_resolver(fake_redis, ROWS)
+    worker_a.resolve_many(['SN1', 'SN2'])  # 只有worker_a的本地缓存中有这些设备
+    scopes = []
+
+    def affected(user_id=None, org_id=None):
+        scopes.append((user_id, org_id))
+        return ['SN1'] if org_id == '10' or user_id == 2 else []
+    worker_b._affected_devices = affected
+
+    event = json.dumps({'customer_id': 100, 'org_id': 10, 'action': 'MOVE'})
+    worker_b.handle_message(event, 'org_change_channel')
+    assert scopes == [(None, '10')]
+    assert not fake_redis.exists('device_org_info:SN1') and fake_redis.exists('device_org_info:SN2')
+    worker_b.resolve('SN1')
+    assert calls_b == [['SN1']]  # Redis中的旧归属已删除，回源数据库
+
+    worker_b.invalidate_user(2)
+    assert not fake_redis.exists('device_org_info:SN1')
+    assert fake_redis.published[-1] == ('device_org_channel', 'user:2')
+    worker_a.handle_message('user:2', 'device_org_channel')  # 订阅方只失效本地，不重复查询数据库
+    assert scopes == [(None, '10'), (2, None)]
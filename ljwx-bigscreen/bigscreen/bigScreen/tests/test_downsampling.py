@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from ..downsampling import aligned_indices, downsample_points, lttb_indices, minmax_indices, parse_max_points, rows_to_arrays
+
+def test_lttb_is_bounded_deterministic_and_keeps_spikes_inside_envelope():
+    start = datetime(2025, 3, 1)
+    rows = [(start + timedelta(seconds=i), 70 + (i % 7)) for i in range(20000)]
+    rows[12345] = (rows[12345][0], 180)  # 单点异常心率
+    x, y, times = rows_to_arrays(rows)
+
+    indices, mins, maxs = lttb_indices(x, y, 200, with_envelope=True)
+    again, _, _ = lttb_indices(x, y, 200)
+    assert len(indices) == 200 and np.array_equal(indices, again)
+    assert indices[0] == 0 and indices[-1] == len(y) - 1 and np.all(np.diff(indices) > 0)
+    assert 12345 in indices and maxs.max() == 180
+    assert np.all(mins <= y[indices]) and np.all(y[indices] <= maxs)
+
+    peaks = minmax_indices(y, 100)
+    assert len(peaks) <= 100 and 12345 in peaks
+    assert np.array_equal(lttb_indices(x[:50], y[:50], 200)[0], np.arange(50))
+
+def test_aligned_series_share_one_bounded_time_axis():
+    x = np.arange(1000, dtype=float)
+    user = np.where(np.arange(1000) % 3 == 0, np.nan, 60.0)
+    user[500] = 150.0
+    dept = np.full(1000, 97.0)
+    dept[800] = 85.0
+    keep = aligned_indices(x, [user, dept], 50)
+    assert len(keep) <= 50 and {0, 500, 800, 999} <= set(keep.tolist())
+    assert parse_max_points({'maxPoints': '100000'}) == 5000
+    assert parse_max_points({'max_points': 'abc'}, default=300) == 300
+
+def test_trend_points_are_bounded_and_keep_extra_fields():
+    start = datetime(2025, 3, 1)
+    points = [{'timestamp': (start + timedelta(minutes=i)).strftime('%Y-%m-%d %H:%M:%S'), 'value': 70.0 + i % 5,
+               'date': '2025-03-01'} for i in range(3000)]
+    points[1500]['value'] = 160.0
+
+    reduced = downsample_points(points, 100)
+    assert len(reduced) == 100 and reduced[0]['timestamp'] == points[0]['timestamp']
+    assert max(point['max'] for point in reduced) == 160.0 and all(point['date'] == '2025-03-01' for point in reduced)
+    peaks = downsample_points(points, 100, mode='minmax')
+    assert len(peaks) <= 100 and points[1500] in peaks
+    assert downsample_points(points[:50], 100) == points[:50]
@@ -0,0 +1,130 @@
+from contextlib import contextmanager
+from datetime import datetime
+
+from .. import health_batch_upload, user_health_data
+from ..health_dedup import HealthDedupFilter
+
+class FakeCursor:
+    """模拟t_user_health_data：按(device_sn, timestamp)唯一"""
+    def __init__(self, table):
+        self.table = table
+        self.result = []
+        self.executemany_calls = 0
+
+    def execute(self, sql, params):
+        sns = set(params[:-2])
+        low, high = params[-2:]
+        self.result = [(row_id, sn, ts) for (sn, ts), row_id in self.table.items()
+                       if sn in sns and low <= ts.strftime('%Y-%m-%d %H:%M:%S') <= high]
+
+    def executemany(self, sql, rows):
+        self.executemany_calls += 1
+        inserted = 0
+        for row in rows:
+            key = (row[0], row[17])
+            if key not in self.table:
+                self.table[key] = len(self.table) + 1
+                inserted += 1
+        return inserted
+
+    def fetchall(self):
+        return self.result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+class FakeConn:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+    def commit(self):
+        pass
+
+class FakeResolver:
+    def __init__(self):
+        self.calls = []
+
+    def resolve_many(self, sns):
+        self.calls.append(set(sns))
+        return {sn: {'customer_id': 1, 'org_id': 2, 'user_id': 3} for sn in sns}
+
+class FakeRecorder:
+    def __init__(self):
+        self.records = []
+
+    def record_health(self, records):
+        self.records.extend(records)
+
+    def apply(self, conn, records, all_new=True):
+        self.records.append((len(records), all_new))
+
+    def invalidate(self, records):
+        self.records.append(('invalidate', len(records)))
+
+class FakeWriteBehind:
+    def __init__(self):
+        self.latest = {}
+
+    def submit(self, device_sn, mapping):
+        self.latest.setdefault(device_sn, {}).update(mapping)
+
+def setup(monkeypatch, fake_redis, table):
+    cursor = FakeCursor(table)
+    @contextmanager
+    def fake_conn(readonly=False):
+        yield FakeConn(cursor)
+    resolver = FakeResolver()
+    dedup = HealthDedupFilter()
+    dedup.redis = fake_redis
+    write_behind = FakeWriteBehind()
+    alerts = []
+    presence, rollup, counters = FakeRecorder(), FakeRecorder(), FakeRecorder()
+    monkeypatch.setattr(health_batch_upload, 'get_db_connection', fake_conn)
+    monkeypatch.setattr(health_batch_upload, 'get_device_presence', lambda: presence)
+    monkeypatch.setattr(health_batch_upload, 'get_health_rollup_maintainer', lambda: rollup)
+    monkeypatch.setattr(health_batch_upload, 'get_stats_counter_store', lambda: counters)
+    monkeypatch.setattr(health_batch_upload, 'get_device_resolver', lambda: resolver)
+    monkeypatch.setattr(health_batch_upload, 'get_health_dedup', lambda: dedup)
+    monkeypatch.setattr(health_batch_upload, 'get_redis_write_behind', lambda: write_behind)
+    def fake_alerts_batch(samples, health_ids):
+        alerts.extend((data['timestamp'], health_id) for data, health_id in zip(samples, health_ids))
+        return {'success': True, 'alerts_generated': 0}
+    monkeypatch.setattr(health_batch_upload, 'generate_alerts_batch', fake_alerts_batch)
+    monkeypatch.setattr(user_health_data, 'save_daily_weekly_data', lambda *args: None)
+    return cursor, resolver, write_behind, alerts, presence, rollup, counters
+
+def test_batch_upload_inserts_once_and_reports_per_item(monkeypatch, fake_redis):
+    cursor, resolver, write_behind, alerts, presence, rollup, counters = setup(monkeypatch, fake_redis, {('SN1', datetime(2025, 1, 1, 8, 0, 0)): 99})
+    items = [
+        {'deviceSn': 'SN1', 'heart_rate': 70, 'timestamp': '2025-01-01 08:00:00'},  # 库中已存在
+        {'deviceSn': 'SN1', 'heart_rate': 72, 'timestamp': '2025-01-01 08:01:00'},
+        {'deviceSn': 'SN1', 'heart_rate': 72, 'timestamp': '2025-01-01 08:01:00'},  # 批次内重复
+        {'deviceSn': 'SN2', 'heart_rate': 80, 'timestamp': '2025-01-01 08:02:00', 'customerId': 5, 'orgId': 6, 'userId': 7},
+        {'heart_rate': 60},
+    ]
+    result = health_batch_upload.process_health_data_batch(items)
+    statuses = [r['status'] for r in result['results']]
+    assert statuses == ['duplicate', 'inserted', 'duplicate', 'inserted', 'invalid']
+    assert result['results'][0]['id'] == 99
+    assert result['results'][2]['duplicate_of'] == 1
+    assert result['summary']['inserted'] == 2 and result['summary']['duplicate'] == 2
+    assert cursor.executemany_calls == 1
+    assert resolver.calls == [{'SN1'}]  # SN2自带归属信息，不需要查询
+    assert {sn: m['timestamp'] for sn, m in write_behind.latest.items()} == {
+        'SN1': '2025-01-01 08:01:00', 'SN2': '2025-01-01 08:02:00'}
+    assert len(alerts) == 2
+    assert sorted((r['device_sn'], r['customer_id'], r['org_id']) for r in presence.records) == [
+        ('SN1', 1, 2), ('SN2', 5, 6)]  # 仅新入库记录刷新在线索引
+    assert rollup.records == [(2, True)]  # 新记录增量维护分级汇总
+    assert sorted(r['device_sn'] for r in counters.records) == ['SN1', 'SN2']  # 累加大屏日计数
+
+    # 同一批再次上传：全部命中Redis近期键，不再访问数据库
+    again = health_batch_upload.process_health_data_batch(items[1:2])
+    assert again['results'][0]['status'] == 'duplicate'
+    assert cursor.executemany_calls == 1
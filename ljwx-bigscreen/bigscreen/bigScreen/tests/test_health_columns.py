@@ -0,0 +1,157 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from .. import health_columns
+from ..health_columns import HealthColumns, fetch_health_columns, read_columns
+from ..partition_catalog import month_partitions
+
+FEATURES = ['heart_rate', 'temperature', 'step']
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows, self.executed, self.fetches = list(rows), None, 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params):
+        self.executed = (sql, params)
+
+    def fetchmany(self, size):
+        chunk, self.rows = self.rows[:size], self.rows[size:]
+        self.fetches += 1
+        return chunk
+
+# create_partitions.py建立的月度分区：没有sleep、customer_id字段；2025年1月为更早的归档表，没有is_deleted
+PARTITION_COLUMNS = {'id', 'device_sn', 'user_id', 'org_id', 'timestamp', 'heart_rate', 'pressure_high', 'pressure_low',
+                     'blood_oxygen', 'stress', 'temperature', 'step', 'distance', 'calorie', 'is_deleted'}
+MAIN_COLUMNS = PARTITION_COLUMNS | {'customer_id', 'sleep'}
+
+class FakeCatalog:
+    """分区目录：2025年1、2月分区存在"""
+    tables = {'t_user_health_data': MAIN_COLUMNS, 't_user_health_data_202501': PARTITION_COLUMNS - {'is_deleted'},
+              't_user_health_data_202502': PARTITION_COLUMNS}
+
+    def columns(self, table):
+        return frozenset(self.tables.get(table, ()))
+
+    def partitions_between(self, start, end):
+        return [name for name in month_partitions(start, end) if name in self.tables]
+
+def epoch(text):
+    return (datetime.strptime(text, '%Y-%m-%d %H:%M:%S') - datetime(1970, 1, 1)).total_seconds()
+
+ROWS = [('SN1', 7.0, 10.0, epoch('2025-03-01 08:00:00'), 72.0, 36.5, -1.0),
+        ('SN1', 7.0, 10.0, epoch('2025-03-05 08:00:00'), 250.0, -1.0, 1200.0),
+        ('SN2', 8.0, 11.0, epoch('2025-03-09 08:00:00'), 65.0, 36.8, 300.0)]
+
+def test_chunks_become_typed_columns_and_missing_values_are_nan():
+    cursor = FakeCursor(ROWS)
+    columns = read_columns(cursor, 'SQL', [1], FEATURES, chunk_size=2)
+    assert cursor.fetches == 3 and len(columns) == 3
+    assert columns['user_id'].dtype == np.int64 and columns['user_id'].tolist() == [7, 7, 8]
+    assert columns['timestamp'][1] == np.datetime64('2025-03-05T08:00:00')
+    assert np.isnan(columns['step'][0]) and np.isnan(columns['temperature'][1])
+
+    df = columns.to_dataframe({'heart_rate': (30.0, 200.0), 'temperature': (30.0, 45.0), 'step': (0.0, 50000.0)})
+    assert df['heart_rate'].dropna().tolist() == [72.0, 65.0]  # 250超出范围
+    assert df['step'].dropna().tolist() == [1200.0, 300.0]
+    assert len(columns.since(datetime(2025, 3, 4))) == 2
+    assert len(HealthColumns.empty(FEATURES)) == 0
+
+def test_fetch_scopes_query_and_includes_end_day(monkeypatch):
+    monkeypatch.setattr(health_columns, 'get_partition_catalog', FakeCatalog)
+    cursor = FakeCursor(ROWS[:1])
+
+    class Conn:
+        def cursor(self, cursor_class=None):
+            return cursor
+
+    @contextmanager
+    def connection():
+        yield Conn()
+
+    today = datetime.now()
+    columns = fetch_health_columns(today, today, customer_id=5, features=FEATURES,
+                                   connection_factory=connection)
+    sql, params = cursor.executed
+    assert 'customer_id = %s' in sql and 'IFNULL(step, -1) * 1E0' in sql
+    assert 't_user_health_data\n' in sql and 'is_deleted = 0' in sql
+    assert params[0] == 5 and params[2] - params[1] == timedelta(days=1)
+
+    cursor.rows = ROWS[:1]
+    fetch_health_columns('2025-03-01', '2025-03-01', customer_id=5, features=FEATURES,
+                         connection_factory=connection)
+    sql, params = cursor.executed
+    assert params == [5, datetime(2025, 3, 1), datetime(2025, 3, 2)]
+    assert columns['device_sn'].tolist() == ['SN1']
+
+def test_history_windows_read_month_partitions_then_fall_back_to_main_table(monkeypatch):
+    monkeypatch.setattr(health_columns, 'get_partition_catalog', FakeCatalog)
+    tables = {'t_user_health_data_202501': [ROWS[0]], 't_user_health_data_202502': ROWS[1:], 't_user_health_data': []}
+    executed = []
+
+    class Cursor(FakeCursor):
+        def execute(self, sql, params):
+            table = sql.split('FROM ')[1].split()[0]
+            executed.append((table, 'is_deleted' in sql))
+            self.rows = list(tables[table])
+
+    class Conn:
+        def cursor(self, cursor_class=None):
+            return Cursor([])
+
+    @contextmanager
+    def connection():
+        yield Conn()
+
+    columns = fetch_health_columns('2025-01-10', '2025-02-20', user_id=7, features=FEATURES,
+                                   connection_factory=connection)
+    assert executed == [('t_user_health_data_202501', False), ('t_user_health_data_202502', True)]
+    assert len(columns) == 3 and columns['user_id'].tolist() == [7, 7, 8]
+
+    executed.clear()
+    tables['t_user_health_data_202502'] = []
+    tables['t_user_health_data_202501'] = []
+    tables['t_user_health_data'] = ROWS[:1]
+    columns = fetch_health_columns('2025-01-10', '2025-02-20', user_id=7, features=FEATURES,
+                                   connection_factory=connection)
+    assert executed[-1] == ('t_user_health_data', True) and len(columns) == 1  # 分区均无数据时回退主表
+
+def test_partitions_without_sleep_or_customer_id_are_read_by_their_own_columns(monkeypatch):
+    monkeypatch.setattr(health_columns, 'get_partition_catalog', FakeCatalog)
+    tables = {'t_user_health_data_202501': [ROWS[0] + (-1.0,)], 't_user_health_data_202502': [ROWS[1] + (-1.0,)],
+              't_user_health_data': [ROWS[2] + (7.5,)]}
+    executed = {}
+
+    class Cursor(FakeCursor):
+        def execute(self, sql, params):
+            table = sql.split('FROM ')[1].split()[0]
+            executed[table] = sql
+            self.rows = list(tables[table])
+
+    class Conn:
+        def cursor(self, cursor_class=None):
+            return Cursor([])
+
+    @contextmanager
+    def connection():
+        yield Conn()
+
+    features = FEATURES + ['sleep']
+    columns = fetch_health_columns('2025-01-10', '2025-02-20', user_id=7, features=features,
+                                   connection_factory=connection)
+    partition_sql = executed['t_user_health_data_202502']
+    assert 'IFNULL(sleep' not in partition_sql and '-1 * 1E0' in partition_sql  # 分区无sleep列，读为缺失值
+    assert len(columns) == 2 and np.isnan(columns['sleep']).all()
+
+    executed.clear()  # 按租户过滤：分区没有customer_id，跳过后回退主表
+    columns = fetch_health_columns('2025-01-10', '2025-02-20', customer_id=5, features=features,
+                                   connection_factory=connection)
+    assert list(executed) == ['t_user_health_data'] and 'IFNULL(sleep, -1)' in executed['t_user_health_data']
+    assert columns['sleep'].tolist() == [7.5]
@@ -0,0 +1,139 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+
+from ..health_data_cursor import (KeysetPartitionReader, KeysetSource, InvalidCursorError,
+                                  encode_cursor, decode_cursor, cursor_source, with_cursor_source)
+
+@pytest.fixture
+def reader():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    conn = engine.connect()
+    rows = {'t_user_health_data_202501': [], 't_user_health_data_202502': []}
+    for table in rows:
+        conn.execute(text(f"CREATE TABLE {table} (id INTEGER, device_sn TEXT, timestamp TEXT, heart_rate INTEGER)"))
+    for i in range(1, 41):
+        table = 't_user_health_data_202501' if i % 3 else 't_user_health_data_202502'  # 两表时间交错，验证归并
+        ts = f"2025-01-{i // 4 + 1:02d} 08:00:00"  # 每个时间戳有多条，验证id作为第二排序键
+        conn.execute(text(f"INSERT INTO {table} VALUES (:id, :sn, :ts, :hr)"),
+                     {'id': i, 'sn': 'A' if i % 2 else 'B', 'ts': ts, 'hr': 60 + i})
+    reader = KeysetPartitionReader(execute=lambda stmt, params: conn.execute(stmt, params).fetchall(), max_chunk=8)
+    reader.sources = [KeysetSource(table, ['id', 'device_sn', 'timestamp', 'heart_rate'], ['device_sn IN :device_sns'])
+                      for table in rows]
+    yield reader
+    conn.close()
+
+def test_cursor_pages_match_full_ordered_scan(reader):
+    params = {'device_sns': ['A', 'B']}
+    expected = [row.id for row in reader.read_page(reader.sources, params, None).rows]
+    assert len(expected) == 40
+    assert expected == sorted(expected, key=lambda i: (f"2025-01-{i // 4 + 1:02d}", i), reverse=True)
+
+    seen, cursor = [], None
+    while True:
+        page = reader.read_page(reader.sources, params, 7, cursor=cursor)
+        assert page.total_count is None
+        seen.extend(row.id for row in page.rows)
+        # 游标页只读取本页所需的行(每个分区至多page_size+1行)
+        assert page.stats['rows_fetched'] <= 2 * 8
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+    assert seen == expected
+
+    legacy = reader.read_page(reader.sources, params, 7, skip=14, with_count=True)  # 兼容page=3
+    assert [row.id for row in legacy.rows] == expected[14:21]
+    assert legacy.total_count == 40
+
+def test_filters_apply_to_every_partition(reader):
+    page = reader.read_page(reader.sources, {'device_sns': ['B']}, 100, with_count=True)
+    assert page.total_count == 20 and page.next_cursor is None
+    assert all(row.device_sn == 'B' for row in page.rows)
+
+def test_cursor_round_trip_and_tampering():
+    token = encode_cursor('2025-01-02 08:00:00', 17)
+    assert decode_cursor(token) == ('2025-01-02 08:00:00', 17)
+    with pytest.raises(InvalidCursorError):
+        decode_cursor('not-a-cursor')
+
+def test_fanout_reads_partitions_concurrently_and_cancels_leftovers(reader):
+    import threading
+    import time
+    from ..partition_executor import PartitionFanoutExecutor
+
+    lock, active, peak = threading.Lock(), [0], [0]
+    base_execute = reader._execute
+
+    def slow_execute(statement, params):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.05)
+        try:
+            with lock:
+                return base_execute(statement, params)
+        finally:
+            with lock:
+                active[0] -= 1
+
+    fanout = PartitionFanoutExecutor(max_workers=2)
+    params = {'device_sns': ['A', 'B']}
+    expected = [row.id for row in reader.read_page(reader.sources, params, None).rows]
+    page = reader.read_page(reader.sources, params, 5, fanout=fanout, execute=slow_execute)
+    assert [row.id for row in page.rows] == expected[:5]
+    assert peak[0] == 2  # 两个分区首批查询同时执行
+    assert set(page.stats['partition_latency_ms']) == set(source.table for source in reader.sources)
+    assert fanout.get_stats()['partitions']['t_user_health_data_202501']['calls'] >= 1
+
+    # 继续用游标翻页，结果与串行一致
+    seen, cursor = [], None
+    while True:
+        page = reader.read_page(reader.sources, params, 9, cursor=cursor, fanout=fanout, execute=slow_execute)
+        seen.extend(row.id for row in page.rows)
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+    assert seen == expected
+
+def test_cursor_source_round_trip():
+    token = encode_cursor('2025-01-02 08:00:00', 17, source='t_user_health_data')
+    assert decode_cursor(token) == ('2025-01-02 08:00:00', 17)
+    assert cursor_source(token) == 't_user_health_data'
+    assert cursor_source(encode_cursor('2025-01-02 08:00:00', 17)) is None
+    assert cursor_source(with_cursor_source(encode_cursor('2025-01-02 08:00:00', 17), 'main')) == 'main'
+
+def test_partition_fallback_to_main_table_keeps_paging(monkeypatch):
+    from .. import user_health_data
+
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    conn = engine.connect()
+    for table in ('t_user_health_data', 't_user_health_data_202501'):
+        conn.execute(text(f"CREATE TABLE {table} (id INTEGER, device_sn TEXT, timestamp TEXT, heart_rate INTEGER)"))
+    for i in range(1, 6):  # 数据只在主表，分区表为空
+        conn.execute(text("INSERT INTO t_user_health_data VALUES (:id, 'A', :ts, 70)"), {'id': i, 'ts': f"2025-01-01 08:0{i}:00"})
+    queried = []
+
+    def execute(statement, params):
+        queried.append(str(statement).split(' FROM ')[1].split()[0])
+        return conn.execute(statement, params).fetchall()
+
+    class FakeCatalog:
+        def columns(self, table):
+            return frozenset({'id', 'device_sn', 'timestamp', 'heart_rate'})
+
+    reader = KeysetPartitionReader(execute=execute)
+    monkeypatch.setattr(user_health_data, 'get_keyset_partition_reader', lambda: reader)
+    monkeypatch.setattr(user_health_data, 'get_partition_catalog', FakeCatalog)
+    monkeypatch.setattr(user_health_data, '_get_partition_tables', lambda sd, ed: ['t_user_health_data_202501'])
+    fields = ['device_sn', 'timestamp', 'heart_rate']
+
+    rows, _, cursor = user_health_data._query_partitioned_tables(['A'], None, None, 1, 3, fields, None, False)
+    assert [row.id for row in rows] == [5, 4, 3]
+    assert queried == ['t_user_health_data_202501', 't_user_health_data']
+    assert cursor_source(cursor) == 't_user_health_data'
+
+    queried.clear()
+    rows, _, cursor = user_health_data._query_partitioned_tables(['A'], None, None, 1, 3, fields, cursor, False)
+    assert [row.id for row in rows] == [2, 1] and cursor is None
+    assert queried == ['t_user_health_data']  # 第二页直接读主表，不再查询空分区
+    conn.close()
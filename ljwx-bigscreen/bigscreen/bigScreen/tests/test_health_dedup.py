@@ -0,0 +1,35 @@
+from datetime import datetime
+from ..health_dedup import HealthDedupFilter, make_dedup_key
+
+def make_filter(redis):
+    dedup = HealthDedupFilter(window_seconds=10 ** 9)
+    dedup.redis = redis
+    return dedup
+
+def test_make_dedup_key_normalizes_timestamp():
+    assert make_dedup_key('SN1', datetime(2025, 1, 1, 8, 0, 0)) == ('SN1', '2025-01-01 08:00:00')
+    assert make_dedup_key('SN1', '2025-01-01 08:00:00.123') == ('SN1', '2025-01-01 08:00:00')
+
+def test_dedup_batch_keeps_first(fake_redis):
+    dedup = make_filter(fake_redis)
+    items = [('SN1', 't1', 'a'), ('SN1', 't1', 'b'), ('SN2', 't1', 'c')]
+    unique, dups = dedup.dedup_batch(items, lambda it: (it[0], it[1]))
+    assert [it[2] for it in unique] == ['a', 'c']
+    assert dups == 1
+
+def test_recent_keys_roundtrip(fake_redis):
+    dedup = make_filter(fake_redis)
+    keys = [make_dedup_key('SN1', datetime(2025, 1, 1, 8, 0, 0)), make_dedup_key('SN2', datetime(2025, 1, 1, 8, 0, 0))]
+    assert dedup.filter_recent(keys) == [False, False]
+    dedup.mark_recent(keys[:1])
+    assert dedup.filter_recent(keys) == [True, False]
+    assert dedup.is_recent('SN1', datetime(2025, 1, 1, 8, 0, 0))
+    dedup.record_insert(5, 3)
+    stats = dedup.get_stats()
+    assert stats['redis_duplicates'] == 2 and stats['db_duplicates'] == 2 and stats['inserted'] == 3
+
+def test_redis_failure_lets_data_through(fake_redis):
+    dedup = make_filter(fake_redis)
+    dedup.redis.client = None
+    assert dedup.filter_recent([('SN1', 't')]) == [False]
+    assert dedup.get_stats()['redis_errors'] == 1
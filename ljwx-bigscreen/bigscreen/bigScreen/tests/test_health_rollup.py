@@ -0,0 +1,68 @@
+from datetime import datetime
+
+from ..health_rollup import (HealthRollupMaintainer, aggregate_records, bucket_start, choose_level,
+                             merge_rollup_cells)
+
+class FakeCursor:
+    def __init__(self):
+        self.executed = []
+        self.many = []
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+    def execute(self, sql, params=None):
+        self.executed.append((' '.join(sql.split()), params))
+        return 0
+    def executemany(self, sql, rows):
+        self.many.append(rows)
+        return len(rows)
+
+class FakeConn:
+    def __init__(self):
+        self.cursor_obj = FakeCursor()
+        self.commits = 0
+    def cursor(self):
+        return self.cursor_obj
+    def commit(self):
+        self.commits += 1
+    def rollback(self):
+        pass
+
+RECORDS = [
+    {'device_sn': 'A', 'org_id': 9, 'user_id': 5, 'customer_id': 1, 'timestamp': '2025-03-01 10:01:00', 'heart_rate': 70, 'step': 0},
+    {'device_sn': 'A', 'org_id': 9, 'user_id': 5, 'customer_id': 1, 'timestamp': '2025-03-01 10:04:59', 'heart_rate': 90, 'step': 120},
+    {'device_sn': 'A', 'org_id': 9, 'user_id': 5, 'customer_id': 1, 'timestamp': datetime(2025, 3, 1, 10, 40), 'heart_rate': 80},
+]
+
+def test_aggregate_records_per_level_skips_zero_values():
+    agg = aggregate_records(RECORDS)
+    five = agg[('5m', datetime(2025, 3, 1, 10, 0), 'A', 'heart_rate')]
+    assert five[3:] == [2, 160.0, 70.0, 90.0]
+    hour = agg[('1h', datetime(2025, 3, 1, 10, 0), 'A', 'heart_rate')]
+    assert hour[3:] == [3, 240.0, 70.0, 90.0]
+    assert agg[('1d', datetime(2025, 3, 1), 'A', 'step')][3] == 1  # step=0视为未采集
+    assert ('5m', datetime(2025, 3, 1, 10, 40), 'A', 'heart_rate') in agg
+
+def test_maintainer_upserts_new_rows_and_rebuilds_when_duplicates_present():
+    maintainer, conn = HealthRollupMaintainer(), FakeConn()
+    maintainer.apply(conn, RECORDS, all_new=True)
+    rows = conn.cursor_obj.many[0]
+    assert len(rows) == len(aggregate_records(RECORDS)) and rows == sorted(rows, key=lambda r: r[:4])
+    assert conn.commits == 1
+
+    conn = FakeConn()
+    maintainer.apply(conn, RECORDS, all_new=False)
+    deletes = [params for sql, params in conn.cursor_obj.executed if sql.startswith('DELETE')]
+    # 按设备重算受影响的5分钟/小时/天桶
+    assert deletes[0][:3] == ['5m', datetime(2025, 3, 1, 10, 0), datetime(2025, 3, 1, 10, 45)]
+    assert deletes[1][:3] == ['1h', datetime(2025, 3, 1, 10, 0), datetime(2025, 3, 1, 11, 0)]
+    assert deletes[2][:3] == ['1d', datetime(2025, 3, 1), datetime(2025, 3, 2)] and deletes[2][3] == 'A'
+    assert maintainer.get_stats()['rebuilds'] == 1
+
+def test_levels_and_cell_merge():
+    assert bucket_start(datetime(2025, 3, 1, 10, 59, 30), '5m') == datetime(2025, 3, 1, 10, 55)
+    assert choose_level(datetime(2025, 1, 1), datetime(2025, 3, 1)) == '1d'
+    merged = merge_rollup_cells([{'count': 2, 'sum': 150.0, 'min': 70.0, 'max': 80.0},
+                                 {'count': 1, 'sum': 95.0, 'min': 95.0, 'max': 95.0}, {}])
+    assert merged == {'count': 3, 'sum': 245.0, 'min': 70.0, 'max': 95.0, 'avg': 245.0 / 3}
@@ -0,0 +1,96 @@
+import json
+
+from .. import message_inbox
+from ..message_inbox import MessageInbox
+from .conftest import FakePipeline
+
+def message(message_id, send_time, **extra):
+    return dict({'id': message_id, 'message': f'消息{message_id}', 'message_type': 'task', 'message_status': '1',
+                 'send_time': send_time, 'user_id': None, 'org_id': 5}, **extra)
+
+def test_deliver_skips_non_accepting_devices_trims_and_retracts(monkeypatch, fake_redis):
+    monkeypatch.setattr(message_inbox, 'INBOX_LIMIT', 2)
+    redis = fake_redis
+    inbox = MessageInbox(redis=redis)
+    assert inbox.read('SN1') is None  # 未初始化，由调用方从数据库重建
+    inbox.fill('SN1', [message(1, '2025-03-01 08:00:00')], {'user_id': 7, 'user_name': '张三', 'org_id': 5})
+    inbox.fill('ADMIN', [], {'user_id': 1}, accepts=False)
+
+    assert inbox.deliver(message(2, '2025-03-01 09:00:00'), ['SN1', 'ADMIN', 'SN2']) == 2
+    assert inbox.deliver(message(3, '2025-03-01 10:00:00'), ['SN1']) == 1
+    snapshot = inbox.read('SN1')
+    assert [m['id'] for m in snapshot['messages']] == [3, 2]  # 超出上限丢弃最早的消息1
+    assert snapshot['meta']['user_id'] == '7' and snapshot['version'] == 3  # 裁剪与投递一样递增版本
+    assert redis.published[-1] == ('message_inbox_channel:SN1', 3)  # 通知裁剪后的版本
+    assert inbox.read('ADMIN')['messages'] == [] and inbox.read('SN2') is None
+    assert json.loads(redis.store['message_inbox:SN2']['2'])['message'] == '消息2'  # 未初始化设备也先收下
+
+    assert inbox.retract(2, ['SN1', 'SN2', 'ADMIN']) == 2
+    assert [m['id'] for m in inbox.read('SN1')['messages']] == [3]
+    assert redis.published[-2:] == [('message_inbox_channel:SN1', 4), ('message_inbox_channel:SN2', 2)]
+
+def test_apply_resolves_targets_and_long_poll_waits_for_changes(fake_redis):
+    rows = []
+    redis = fake_redis
+    inbox = MessageInbox(redis=redis, target_loader=lambda row: (rows.append(row) or ['SN1', 'SN2'], '张三', '一队'),
+                         clock=lambda: redis.now)
+    for sn in ('SN1', 'SN2'):
+        inbox.fill(sn, [], {'user_id': sn})
+
+    inbox.apply([('deliver', {'id': 9, 'message': '集合', 'message_status': 'PENDING', 'sent_time': None,
+                              'user_id': None, 'org_id': 5})])
+    assert inbox.read('SN2')['messages'][0]['org_name'] == '一队'
+    inbox.apply([('retract', {'message_id': 9, 'device_sn': 'SN1'})])
+    assert inbox.read('SN1')['messages'] == [] and len(inbox.read('SN2')['messages']) == 1
+    inbox.apply([('retract_all', {'id': 9, 'message_status': 'ACKNOWLEDGED'})])
+    assert inbox.read('SN2')['messages'] == [] and len(rows) == 2
+
+    assert inbox.wait('SN1', since=0, timeout=5) is True  # 版本已变化，立即返回
+    assert inbox.wait('SN1', since=inbox.version('SN1'), timeout=5) is False and redis.now >= 5
+    assert inbox.stats['wait_timeouts'] == 1
+
+def test_fill_keeps_deliveries_that_land_during_the_database_load(fake_redis):
+    redis = fake_redis
+    inbox = MessageInbox(redis=redis)
+    version = inbox.version('SN1')
+    assert inbox.deliver(message(2, '2025-03-01 09:00:00'), ['SN1']) == 1  # 读库之后、写入之前投递
+    assert inbox.fill('SN1', [message(1, '2025-03-01 08:00:00')], {'user_id': 7}, version=version) is False
+    assert inbox.read('SN1') is None and inbox.stats['fill_conflicts'] == 1  # 不写入过时快照，下次读取重建
+
+    version = inbox.version('SN1')
+    snapshot = [message(1, '2025-03-01 08:00:00'), message(2, '2025-03-01 09:00:00')]
+    assert inbox.fill('SN1', snapshot, {'user_id': 7}, version=version) is True
+    assert [m['id'] for m in inbox.read('SN1')['messages']] == [2, 1]
+
+    class RacingPipeline(FakePipeline):
+        def multi(self):  # WATCH之后、EXEC之前撤回
+            super().multi()
+            redis.pipeline = lambda transaction=False: FakePipeline(redis)
+            inbox.retract(2, ['SN1'])
+
+    inbox.invalidate('SN1')
+    redis.pipeline = lambda transaction=False: RacingPipeline(redis)
+    assert inbox.fill('SN1', snapshot, {'user_id': 7}, version=inbox.version('SN1')) is False
+    assert inbox.read('SN1') is None and inbox.stats['fill_conflicts'] == 2
+
+def test_trim_retries_on_concurrent_delivery_and_read_caps_the_inbox(monkeypatch, fake_redis):
+    monkeypatch.setattr(message_inbox, 'INBOX_LIMIT', 2)
+    redis = fake_redis
+    inbox = MessageInbox(redis=redis)
+    inbox.fill('SN1', [message(1, '2025-03-01 08:00:00'), message(2, '2025-03-01 09:00:00')], {'user_id': 7})
+    races = []
+
+    class RacingPipeline(FakePipeline):
+        def multi(self):  # 裁剪WATCH之后、EXEC之前又有一条投递
+            super().multi()
+            if self.watched and not races:
+                races.append(1)
+                inbox.deliver(message(4, '2025-03-01 11:00:00'), ['SN1'])
+
+    redis.pipeline = lambda transaction=False: RacingPipeline(redis)
+    assert inbox.deliver(message(3, '2025-03-01 10:00:00'), ['SN1']) == 1
+    assert sorted(redis.store['message_inbox:SN1']) == ['3', '4']  # 重试后按最新内容裁剪，未丢失并发投递
+    assert inbox.version('SN1') == 3 and inbox.stats['trimmed'] == 2  # 投递2次+裁剪1次，冲突的裁剪未写入
+
+    redis.hset('message_inbox:SN1', mapping={'5': json.dumps(message(5, '2025-03-01 07:00:00'))})  # 裁剪未完成
+    assert [m['id'] for m in inbox.read('SN1')['messages']] == [4, 3]
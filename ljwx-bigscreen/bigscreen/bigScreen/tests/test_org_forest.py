@@ -0,0 +1,47 @@
+from ..org_forest import OrgForestCache, OrgNode, TenantForest
+
+def make_nodes():
+    #      1
+    #    /   \
+    #   2     3
+    #  / \     \
+    # 4   5     6
+    return [OrgNode(1, None, '租户', 'T', 0, 1), OrgNode(2, 1, '一部', 'A', 1, 1), OrgNode(3, 1, '二部', 'B', 1, 1),
+            OrgNode(4, 2, '一组', 'A1', 2, 1), OrgNode(5, 2, '二组', 'A2', 2, 1), OrgNode(6, 3, '三组', 'B1', 2, 1)]
+
+def test_euler_intervals_answer_subtree_and_ancestor_queries():
+    forest = TenantForest(1, make_nodes())
+    assert forest.descendants(1) == [1, 2, 4, 5, 3, 6]
+    assert forest.descendants(2, include_self=False) == [4, 5]
+    assert forest.subtree_size(3) == 2
+    assert forest.is_descendant(5, 2) and forest.is_descendant(6, 1) and not forest.is_descendant(6, 2)
+    assert forest.ancestors(5) == (1, 2)
+    assert forest.direct_children(1) == [2, 3]
+
+    cyclic = TenantForest(9, [OrgNode(7, 8, 'x', None, 0, 9), OrgNode(8, 7, 'y', None, 0, 9)])  # 脏数据成环
+    assert sorted(cyclic.descendants(7)) == [7, 8]
+
+def test_cache_loads_tenant_once_and_reloads_on_change_event():
+    nodes, loads = make_nodes(), []
+
+    def loader(customer_id):
+        loads.append(customer_id)
+        return list(nodes)
+
+    cache = OrgForestCache(loader=loader, tenant_lookup=lambda org_id: 1, subscribe=False)
+    for _ in range(10):
+        assert cache.descendants(2) == [2, 4, 5]
+        assert [org['id'] for org in cache.ancestor_nodes(4)] == [1, 2]
+    assert loads == [1]
+    assert cache.stats['tenant_lookups'] == 1
+
+    cache.apply_change({'customer_id': 1, 'org_id': 4, 'action': 'UPDATE',
+                        'org': {'id': 4, 'parent_id': 2, 'name': '一组(改名)'}})
+    assert cache.descendant_nodes(2)[0]['name'] == '一组(改名)'
+    assert loads == [1]  # 改名原地修改，不重载
+
+    nodes.append(OrgNode(7, 5, '新组', 'A21', 3, 1))
+    cache.apply_change({'customer_id': 1, 'org_id': 7, 'action': 'CREATE'})
+    assert cache.descendants(2) == [2, 4, 5, 7]
+    assert loads == [1, 1]
+    assert cache.descendants(99, 1) is None  # 未知组织交给原有查询
@@ -0,0 +1,36 @@
+from datetime import datetime
+
+from ..partition_catalog import PartitionCatalog, month_partitions
+
+def make_catalog(tables, ttl=600):
+    loads = []
+    def loader():
+        loads.append(1)
+        return {name: frozenset(cols) for name, cols in tables.items()}
+    return PartitionCatalog(loader=loader, ttl=ttl, subscribe=False), loads
+
+def test_month_partitions_cross_year():
+    assert month_partitions(datetime(2024, 11, 15), datetime(2025, 2, 1)) == [
+        't_user_health_data_202411', 't_user_health_data_202412', 't_user_health_data_202501', 't_user_health_data_202502']
+
+def test_lookups_hit_memory_until_invalidated():
+    tables = {'t_user_health_data_202501': {'device_sn', 'timestamp', 'heart_rate'}}
+    catalog, loads = make_catalog(tables)
+    for _ in range(20):
+        assert catalog.partitions_between(datetime(2024, 12, 1), datetime(2025, 2, 1)) == ['t_user_health_data_202501']
+        assert 'heart_rate' in catalog.columns('t_user_health_data_202501')
+    assert not catalog.has_table('t_user_health_data_daily_summary')
+    assert len(loads) == 1
+
+    tables['t_user_health_data_202502'] = {'device_sn', 'timestamp'}  # create_partitions新增月份后通知
+    catalog.invalidate()
+    assert catalog.partitions_between(datetime(2025, 1, 1), datetime(2025, 2, 1)) == [
+        't_user_health_data_202501', 't_user_health_data_202502']
+    assert len(loads) == 2
+
+def test_ttl_refresh_and_load_failure_keeps_previous():
+    catalog, loads = make_catalog({'t_user_health_data': {'id'}}, ttl=0)
+    assert catalog.has_table('t_user_health_data')
+    catalog._loader = lambda: (_ for _ in ()).throw(RuntimeError('db down'))
+    assert catalog.has_table('t_user_health_data')
+    assert catalog.stats['load_errors'] == 1
@@ -0,0 +1,60 @@
+import pytest
+from flask import Flask
+
+from .. import realtime_stats_api
+from ..models import db, AlertInfo, DeviceMessage
+from ..org_forest import OrgForestCache
+
+class PassThroughFlight:
+    def __init__(self):
+        self.keys = []
+
+    def fetch(self, key, compute, ttl):
+        self.keys.append(key)
+        return compute()
+
+class FakeCounterStore:
+    def get_counters(self, customer_id, day=None, org_id=None):
+        return {'health': 1200, 'alert': 2, 'device': 3, 'message': 1}
+
+@pytest.fixture
+def app(monkeypatch):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    flight = PassThroughFlight()
+    forest = OrgForestCache(loader=lambda customer_id: [], tenant_lookup={10: 1, 20: 2}.get, subscribe=False)
+    monkeypatch.setattr(realtime_stats_api, 'get_single_flight', lambda: flight)
+    monkeypatch.setattr(realtime_stats_api, 'get_stats_counter_store', FakeCounterStore)
+    monkeypatch.setattr(realtime_stats_api, 'get_org_forest', lambda: forest)
+    with app.app_context():
+        DeviceMessage.__table__.create(db.engine)
+        AlertInfo.__table__.create(db.engine)
+        for index, status in enumerate(['PENDING', 'PENDING', 'SENT', 'ACKNOWLEDGED']):
+            db.session.add(DeviceMessage(id=index + 1, message_id=f'm{index}', customer_id=1, title='t',
+                                         message='m', message_status=status))
+        db.session.add(DeviceMessage(id=9, message_id='other', customer_id=2, title='t', message='m'))
+        db.session.commit()
+        app.flight = flight
+        yield app
+
+def _stats(app, query):
+    with app.test_request_context(f'/api/realtime_stats?{query}'):
+        return realtime_stats_api.get_realtime_stats_data()
+
+def test_unread_messages_count_pending_status(app):
+    result, status = _stats(app, 'customerId=1')
+    assert status == 200
+    assert result['data']['unread_messages']['count'] == '2'
+    assert result['data']['health_data']['count'] == '1.2K'
+
+def test_org_id_resolves_to_its_tenant(app):
+    result, status = _stats(app, 'orgId=20')
+    assert status == 200
+    assert app.flight.keys == ['realtime_stats:2']
+    assert result['data']['unread_messages']['count'] == '1'
+
+def test_unknown_org_without_customer_is_rejected(app):
+    assert _stats(app, 'orgId=99')[1] == 400
+    assert _stats(app, '')[1] == 400
+    assert app.flight.keys == []
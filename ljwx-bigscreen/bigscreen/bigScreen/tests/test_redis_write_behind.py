@@ -0,0 +1,32 @@
+import json
+from ..redis_write_behind import RedisWriteBehind
+
+def make_buffer(redis):
+    buffer = RedisWriteBehind()
+    buffer.redis = redis
+    buffer.running = True  # 不启动后台线程，测试中手动flush
+    return buffer
+
+def test_coalesces_per_device_into_one_pipeline(fake_redis):
+    buffer = make_buffer(fake_redis)
+    buffer.submit('SN1', {'heartRate': '70', 'step': '10'})
+    buffer.submit('SN1', {'heartRate': '75', 'customerId': None})
+    buffer.submit('SN2', {'heartRate': '80'})
+    assert buffer.flush() == 2
+    assert fake_redis.executed == [['hset', 'hset', 'publish']]  # 默认不发单设备通知
+    assert fake_redis.hgetall('health_data:SN1') == {'heartRate': '75', 'step': '10', 'customerId': ''}
+    (channel, message), = fake_redis.published
+    assert channel == 'health_data_channel' and json.loads(message)['devices'] == ['SN1', 'SN2']
+    stats = buffer.get_stats()
+    assert stats['coalesced'] == 1 and stats['flushes'] == 1 and stats['last_flush_size'] == 2
+
+def test_failed_flush_requeues_with_newer_values_winning(fake_redis):
+    buffer = make_buffer(fake_redis)
+    buffer.submit('SN1', {'heartRate': '70', 'step': '10'})
+    fake_redis.fail = True
+    assert buffer.flush() == 0
+    buffer.submit('SN1', {'heartRate': '90'})
+    fake_redis.fail = False
+    assert buffer.flush() == 1
+    assert fake_redis.hgetall('health_data:SN1') == {'heartRate': '90', 'step': '10'}
+    assert buffer.get_stats()['errors'] == 1
@@ -0,0 +1,66 @@
+import time
+import threading
+from ..sharded_batch_processor import ShardedBatchProcessor, ConsistentHashRing
+
+def test_same_device_always_same_shard():
+    processor = ShardedBatchProcessor(shard_count=8, batch_size=10, max_wait_time=0.1, queue_size=10)
+    shard_ids = {processor.get_shard_id('A5GTQ24B26000732') for _ in range(100)}
+    assert len(shard_ids) == 1
+
+def test_hash_ring_spreads_devices():
+    ring = ConsistentHashRing(8)
+    counts = [0] * 8
+    for i in range(8000):
+        counts[ring.get_node(f'DEVICE{i:06d}')] += 1
+    assert min(counts) > 500
+
+def test_hash_ring_resize_moves_few_devices():
+    old_ring, new_ring = ConsistentHashRing(8), ConsistentHashRing(9)
+    devices = [f'DEVICE{i:06d}' for i in range(5000)]
+    moved = sum(1 for d in devices if old_ring.get_node(d) != new_ring.get_node(d))
+    assert moved < len(devices) * 0.25
+
+def test_queue_full_returns_false_without_blocking():
+    processor = ShardedBatchProcessor(shard_count=1, batch_size=10, max_wait_time=0.1, queue_size=2)
+    assert processor.add_data({'device_sn': 'A'}, 'A')
+    assert processor.add_data({'device_sn': 'A'}, 'A')
+    start = time.time()
+    assert processor.add_data({'device_sn': 'A'}, 'A') is False
+    assert time.time() - start < 0.1
+    assert processor.get_overall_stats()['total_rejected'] == 1
+
+def test_flush_by_size_and_time():
+    batches = []
+    lock = threading.Lock()
+    def callback(batch):
+        with lock:
+            batches.append(len(batch))
+    processor = ShardedBatchProcessor(shard_count=1, batch_size=5, max_wait_time=0.2, queue_size=100)
+    processor.set_batch_callback(callback)
+    processor.start()
+    try:
+        for i in range(7):
+            processor.add_data({'i': i}, 'DEV')
+        time.sleep(0.6)
+    finally:
+        processor.stop()
+    assert batches == [5, 2]
+    stats = processor.get_overall_stats()
+    assert stats['total_processed'] == 7
+    assert stats['total_batches'] == 2
+    assert stats['shards'][0]['last_flush_reason'] == 'time'
+
+def test_callback_error_counted_per_shard():
+    def callback(batch):
+        raise RuntimeError('db down')
+    processor = ShardedBatchProcessor(shard_count=2, batch_size=1, max_wait_time=0.1, queue_size=10)
+    processor.set_batch_callback(callback)
+    processor.start()
+    try:
+        processor.add_data({}, 'DEV1')
+        time.sleep(0.3)
+    finally:
+        processor.stop()
+    stats = processor.get_overall_stats()
+    assert stats['total_errors'] == 1
+    assert stats['shards'][processor.get_shard_id('DEV1')]['error_count'] == 1
@@ -0,0 +1,51 @@
+import json
+import threading
+import time
+
+from ..single_flight import SingleFlight, LOCK_PREFIX
+from .conftest import FakeRedis
+
+class FakeRedisHelper(FakeRedis):
+    def eval(self, script, numkeys, key, token):
+        """释放锁脚本：值等于本进程token时删除"""
+        if self.store.get(key) == token:
+            del self.store[key]
+            return 1
+        return 0
+
+def test_concurrent_misses_compute_once_and_callers_get_independent_copies():
+    flight = SingleFlight(FakeRedisHelper(), beta=0)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return {'performance': {'cached': False}}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.fetch('total_unified:1', compute, ttl=30)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1 and len(results) == 8
+    results[0]['performance']['cached'] = True  # 调用方修改结果不影响其他调用方
+    assert sum(result['performance']['cached'] for result in results) == 1
+    assert flight.fetch('total_unified:1', compute, ttl=30) == {'performance': {'cached': False}}
+    assert len(calls) == 1 and flight.stats['hits'] == 1
+
+def test_expired_entry_is_served_stale_while_other_process_holds_lock():
+    redis = FakeRedisHelper()
+    redis.setex('overview:1', 330, json.dumps({'expiry': time.time() - 1, 'delta': 0.5, 'value': {'n': 1}}))
+    redis.store[LOCK_PREFIX + 'overview:1'] = 'other-process'
+    flight = SingleFlight(redis)
+    assert flight.fetch('overview:1', lambda: {'n': 2}, ttl=30) == {'n': 1}
+    assert flight.stats['stale_served'] == 1
+
+    del redis.store[LOCK_PREFIX + 'overview:1']  # 锁释放后由本进程刷新，失败结果不写缓存
+    assert flight.fetch('overview:1', lambda: {'n': 2, 'success': False}, ttl=30,
+                        cacheable=lambda value: value.get('success', True)) == {'n': 2, 'success': False}
+    assert flight.fetch('overview:1', lambda: {'n': 3}, ttl=30) == {'n': 3}
+    assert json.loads(redis.store['overview:1'])['value'] == {'n': 3}
+    assert LOCK_PREFIX + 'overview:1' not in redis.store
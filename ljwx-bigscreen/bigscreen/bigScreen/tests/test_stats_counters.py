@@ -0,0 +1,72 @@
+from collections import Counter
+
+from ..stats_counters import StatsCounterStore, queue_counter_rows, PENDING_KEY
+
+class FakeLoader:
+    def __init__(self, counts, devices):
+        self.counts, self.devices, self.calls = Counter(counts), devices, 0
+
+    def __call__(self, customer_id, day):
+        self.calls += 1
+        return self.counts, self.devices
+
+def make_store(redis, loader, writer=None):
+    return StatsCounterStore(redis=redis, loader=loader, checkpoint_writer=writer,
+                             checkpoint_reader=lambda *args: {}, checkpoint_interval=0)
+
+def test_seed_once_then_increments_are_read_without_database(fake_redis):
+    loader = FakeLoader({(10, 'health'): 5, (11, 'alert'): 1, (11, 'alert:high'): 1}, {10: {'SN1', 'SN2'}})
+    store = make_store(fake_redis, loader)
+    assert store.get_counters(1, '2025-03-01') == {'health': 5, 'alert': 1, 'alert:high': 1, 'device': 2}
+
+    store.record_health([{'customer_id': 1, 'org_id': 10, 'device_sn': 'SN3', 'timestamp': '2025-03-01 08:00:00'},
+                         {'customer_id': 1, 'org_id': 10, 'device_sn': 'SN1', 'timestamp': '2025-03-01 08:00:05'}])
+    store.record_alerts([{'customer_id': 1, 'org_id': 11, 'severity_level': 'critical',
+                          'alert_timestamp': '2025-03-01 08:01:00'}])
+    store.record_messages([{'customer_id': 1, 'org_id': None, 'create_time': '2025-03-01 09:00:00'}])
+    assert store.get_counters(1, '2025-03-01') == {'health': 7, 'alert': 2, 'alert:high': 1, 'alert:critical': 1,
+                                                    'message': 1, 'device': 3}
+    assert store.get_counters(1, '2025-03-01', org_id=10) == {'health': 7, 'device': 3}
+    assert loader.calls == 1
+
+    store.invalidate([{'customer_id': 1, 'timestamp': '2025-03-01 10:00:00'}])  # 批次含重复记录时重新统计
+    assert store.get_counters(1, '2025-03-01')['health'] == 5
+    assert loader.calls == 2
+
+def test_checkpoint_skips_unseeded_days_and_bulk_rows_are_snapshotted(fake_redis):
+    written = []
+    store = make_store(fake_redis, FakeLoader({(10, 'health'): 2}, {10: {'SN1'}}), writer=written.extend)
+    store.record_health([{'customer_id': 2, 'org_id': 10, 'device_sn': 'SN1', 'timestamp': '2025-03-02 08:00:00'}])
+    assert store.checkpoint() == 0  # 未初始化的计数只含部分增量
+
+    store.get_counters(1, '2025-03-01')
+    store.checkpoint()
+    assert sorted((org, kind, value) for _, org, _, kind, value, _ in written) == [
+        (0, 'device', 1), (0, 'health', 2), (10, 'device', 1), (10, 'health', 2)]
+
+    class Session:
+        info = {}
+
+    class Alert:
+        customer_id, org_id, severity_level, alert_timestamp = 1, 10, 'low', None
+
+    queue_counter_rows(Session, 'alert', [Alert()])
+    assert Session.info[PENDING_KEY] == [('alert', {'customer_id': 1, 'org_id': 10, 'severity_level': 'low',
+                                                     'alert_timestamp': None, 'create_time': None})]
+
+def test_seed_retries_when_increments_land_during_the_database_read(fake_redis):
+    store = None
+
+    class RacingLoader(FakeLoader):
+        def __call__(self, customer_id, day):
+            if self.calls == 0:  # 统计明细期间有新样本提交并累加
+                store.record_health([{'customer_id': 1, 'org_id': 10, 'device_sn': 'SN2',
+                                      'timestamp': '2025-03-01 08:00:00'}])
+                self.counts[(10, 'health')] += 1
+            return super().__call__(customer_id, day)
+
+    loader = RacingLoader({(10, 'health'): 5}, {10: {'SN1'}})
+    store = make_store(fake_redis, loader)
+    assert store.get_counters(1, '2025-03-01')['health'] == 6
+    assert loader.calls == 2 and store.stats['seed_conflicts'] == 1
+    assert store.get_counters(1, '2025-03-01')['health'] == 6 and loader.calls == 2
@@ -9,6 +9,16 @@ from .alert import send_wechat_alert, generate_alerts
 import os
 from decimal import Decimal
 from .device import fetch_customer_id_by_deviceSn, fetch_user_info_by_deviceSn, get_device_user_org_info
+from .health_dedup import get_health_dedup, make_dedup_key, MAIN_FIELDS
+from .device_presence import get_device_presence
+from .stats_counters import get_stats_counter_store
+from .redis_write_behind import get_redis_write_behind
+from .partition_catalog import get_partition_catalog, month_partitions, PARTITION_VIEW, DAILY_SUMMARY_TABLE
+from .health_data_cursor import KeysetSource, InvalidCursorError, cursor_source, with_cursor_source, get_keyset_partition_reader
+from .partition_executor import get_partition_fanout_executor, engine_execute
+from .health_rollup import get_health_rollup_maintainer, ROLLUP_METRICS, choose_level, merge_rollup_cells, query_rollup_series, should_use_rollup
+from .org_forest import get_org_forest
+from .downsampling import aligned_indices, lttb_indices, minmax_indices, parse_max_points, rows_to_arrays
 from .health_daping_analyzer import analyze_health_trends
 from .health_daping_analyzer import generate_health_score
 from collections import defaultdict
@@ -370,20 +380,12 @@ redis = RedisHelper()
 
 
 def save_health_data(heartRate, pressureHigh, pressureLow, bloodOxygen, temperature, stress, step, timestamp, deviceSn, distance, calorie, latitude, longitude, altitude, uploadMethod, sleep=None, customerId=None, orgId=None, userId=None):
+    health_data_id, _ = _insert_health_data(heartRate, pressureHigh, pressureLow, bloodOxygen, temperature, stress, step, timestamp, deviceSn, distance, calorie, latitude, longitude, altitude, uploadMethod, sleep, customerId, orgId, userId)
+    return health_data_id
+
+def _insert_health_data(heartRate, pressureHigh, pressureLow, bloodOxygen, temperature, stress, step, timestamp, deviceSn, distance, calorie, latitude, longitude, altitude, uploadMethod, sleep=None, customerId=None, orgId=None, userId=None):
+    """直接插入，由唯一键uk_device_timestamp判重，返回(记录ID, 是否重复)"""
     try:
-        #检查是否已存在相同记录
-        from sqlalchemy import and_
-        existing = db.session.query(UserHealthData.id).filter(
-            and_(
-                UserHealthData.device_sn == deviceSn,
-                UserHealthData.timestamp == timestamp
-            )
-        ).first()
-        
-        if existing:
-            print(f"记录已存在: device_sn={deviceSn}, timestamp={timestamp}, id={existing.id}")
-            return existing.id
-        
         # Create an instance of UserHealthData
         health_data = UserHealthData(
             upload_method=uploadMethod,
@@ -410,30 +412,50 @@ def save_health_data(heartRate, pressureHigh, pressureLow, bloodOxygen, temperat
         # Add the instance to the session and commit
         db.session.add(health_data)
         db.session.commit()
+        get_health_dedup().mark_recent([make_dedup_key(deviceSn, timestamp)])
+        _after_health_insert([{field: getattr(health_data, field, None) for field in MAIN_FIELDS}])
 
         # Return the ID of the inserted record
         print("save_health_data.health_data.id:", health_data.id)
-        return health_data.id
+        return health_data.id, False
 
     except Exception as err:
         db.session.rollback()  # Rollback the session in case of error
-        #检查是否为重复键错误
+        #检查是否为重复键错误(只有真正重复时才回查ID)
         if 'Duplicate entry' in str(err) or 'uk_device_timestamp' in str(err):
             print(f"重复记录跳过: device_sn={deviceSn}, timestamp={timestamp}")
-            #尝试查询已存在的记录ID
-            try:
-                existing = db.session.query(UserHealthData.id).filter(
-                    and_(
-                        UserHealthData.device_sn == deviceSn,
-                        UserHealthData.timestamp == timestamp
-                    )
-                ).first()
-                return existing.id if existing else None
-            except:
-                return None
+            get_health_dedup().record_insert(1, 0)
+            get_health_dedup().mark_recent([make_dedup_key(deviceSn, timestamp)])
+            return _find_health_data_id(deviceSn, timestamp), True
         else:
             print(f"Failed to insert data into the database: {err}")
-            return None
+            return None, False
+
+def _after_health_insert(records):
+    """单条入库成功后：增量维护分级汇总、累加大屏日计数；数据到达即心跳，刷新设备在线索引"""
+    try:
+        from .db_pool import get_db_connection
+        with get_db_connection() as conn:
+            get_health_rollup_maintainer().apply(conn, records)
+    except Exception as e:
+        logger.error(f"❌ 健康汇总维护失败(可用backfill重建): {e}")
+    get_stats_counter_store().record_health(records)
+    get_device_presence().record_health(records)
+
+def _find_health_data_id(deviceSn, timestamp):
+    """按唯一键回查已存在记录ID(只在判定重复后调用)"""
+    try:
+        from sqlalchemy import and_
+        existing = db.session.query(UserHealthData.id).filter(
+            and_(
+                UserHealthData.device_sn == deviceSn,
+                UserHealthData.timestamp == timestamp
+            )
+        ).first()
+        return existing.id if existing else None
+    except Exception:
+        db.session.rollback()
+        return None
 
 def fetch_health_data_by_id(id):
     """通过ID查询健康数据-支持主表和分区表联合查询"""
@@ -467,11 +489,9 @@ def fetch_health_data_by_id(id):
         # 如果主表没有，尝试查询分区表
         from sqlalchemy import text
         try:
-            # 检查分区视图是否存在
-            view_check = text("SHOW TABLES LIKE 't_user_health_data_partitioned'")
-            view_exists = db.session.execute(view_check).fetchone()
-            
-            if view_exists:
+            # 检查分区视图是否存在(分区目录缓存)
+            catalog = get_partition_catalog()
+            if catalog.has_table(PARTITION_VIEW):
                 # 查询分区视图
                 partition_query = text("""
                     SELECT heart_rate, pressure_high, pressure_low, blood_oxygen, 
@@ -514,8 +534,7 @@ def fetch_health_data_by_id(id):
                 check_date = current_date - timedelta(days=months_back * 30)
                 table_name = f"t_user_health_data_{check_date.year}{check_date.month:02d}"
                 
-                table_exists = text(f"SHOW TABLES LIKE '{table_name}'")
-                if db.session.execute(table_exists).fetchone():
+                if catalog.has_table(table_name):
                     month_query = text(f"""
                         SELECT heart_rate, pressure_high, pressure_low, blood_oxygen,
                                temperature, stress, step, timestamp, device_sn,
@@ -620,17 +639,78 @@ def get_health_data_by_date(date=None, orgId=None, userId=None): #重构为调
         print(f"按日期查询健康数据错误: {e}")
         return {'success': False, 'error': str(e)}
 
-def get_health_trends(orgId=None, userId=None, startDate=None, endDate=None): #重构健康趋势-调用统一接口#
-    """重构健康趋势分析，使用统一数据接口"""
+def _health_trends_from_rollup(org_id, user_id, start_date, end_date): #分级汇总趋势(30天以上)#
+    """个人与部门对比趋势改读t_health_rollup；范围不足30天或汇总尚未回填时返回None走明细"""
+    sd, ed = _parse_range_dates(start_date, end_date)
+    if not should_use_rollup(sd, ed):
+        return None
+    try:
+        user = UserInfo.query.filter_by(id=user_id, is_deleted=False).first()
+        if not user:
+            return None
+        _, filtered_metrics, _ = _resolve_enabled_metrics(user.org_id)
+        enabled_metrics = [m for m in filtered_metrics if m in ROLLUP_METRICS]
+        level = choose_level(sd, ed)
+        user_rollup = query_rollup_series(enabled_metrics, sd, ed, level, user_id=user.id)
+        if not user_rollup:
+            return None
+        dept_rollup = query_rollup_series(enabled_metrics, sd, ed, level, org_id=org_id or user.org_id, exclude_user_id=user.id)
+        
+        all_times = sorted(set(user_rollup) | set(dept_rollup))
+        user_series = {}
+        dept_series = {m: [] for m in enabled_metrics}
+        for t in all_times:
+            label = t.strftime('%Y-%m-%d %H:%M')
+            user_series[label] = {m: (user_rollup.get(t, {}).get(m) or {}).get('avg') for m in enabled_metrics}
+            for m in enabled_metrics:
+                dept_series[m].append((dept_rollup.get(t, {}).get(m) or {}).get('avg'))
+        
+        return {
+            'timestamps': [t.strftime('%Y-%m-%d %H:%M') for t in all_times],
+            'dept': dept_series,
+            'users': {user.user_name or '用户': user_series},
+            'enabled_metrics': enabled_metrics,
+            'data_summary': {
+                'user_points': sum(cell['count'] for cells in user_rollup.values() for cell in cells.values()),
+                'dept_points': sum(cell['count'] for cells in dept_rollup.values() for cell in cells.values()),
+                'time_points': len(all_times)
+            },
+            'data_source': f'rollup_{level}'
+        }
+    except Exception as e:
+        print(f"⚠️ 汇总趋势查询失败，回退明细聚合: {e}")
+        return None
+
+def _downsample_trend_result(result, max_points): #趋势结果按时间轴降采样#
+    """个人与部门各指标曲线共用时间轴，时间点超过max_points时取各曲线LTTB选中点的并集，覆盖完整时间范围"""
+    timestamps = result['timestamps']
+    if len(timestamps) <= max_points:
+        return result
+    x = np.array([datetime.strptime(t, '%Y-%m-%d %H:%M').timestamp() for t in timestamps])
+    to_array = lambda values: np.array([np.nan if v is None else v for v in values], dtype=float)
+    series = [to_array(values) for values in result['dept'].values()]
+    for user_series in result['users'].values():
+        series.extend(to_array([user_series[t].get(m) for t in timestamps]) for m in result['enabled_metrics'])
+    keep = aligned_indices(x, series, max_points)
+    result['timestamps'] = [timestamps[i] for i in keep]
+    result['dept'] = {m: [values[i] for i in keep] for m, values in result['dept'].items()}
+    result['users'] = {name: {timestamps[i]: user_series[timestamps[i]] for i in keep}
+                       for name, user_series in result['users'].items()}
+    result['data_summary']['time_points'] = len(keep)
+    return result
+
+def get_health_trends(orgId=None, userId=None, startDate=None, endDate=None, maxPoints=None): #重构健康趋势-调用统一接口#
+    """重构健康趋势分析，使用统一数据接口；时间点按maxPoints(默认300)降采样"""
     try:
         # 参数处理
         org_id = orgId or request.args.get('orgId')
         user_id = userId or request.args.get('userId')
         start_date = startDate or request.args.get('startDate')
         end_date = endDate or request.args.get('endDate')
+        max_points = maxPoints or parse_max_points(request.args, default=300)
         
         # 缓存策略
-        cache_key = f"health_trends_v3:{org_id}:{user_id}:{start_date}:{end_date}"
+        cache_key = f"health_trends_v4:{org_id}:{user_id}:{start_date}:{end_date}:{max_points}"
         cached = redis.get_data(cache_key)
         if cached:
             print(f"✅ 健康趋势缓存命中: {cache_key}")
@@ -640,6 +720,13 @@ def get_health_trends(orgId=None, userId=None, startDate=None, endDate=None): #
         if not user_id:
             return jsonify({'error': '必须选择用户才能查看个人与部门对比趋势'}), 400
         
+        # 30天以上直接读分级汇总，不再拉取明细重新聚合
+        rollup_result = _health_trends_from_rollup(org_id, user_id, start_date, end_date)
+        if rollup_result:
+            rollup_result = _downsample_trend_result(rollup_result, max_points)
+            redis.set_data(cache_key, json.dumps(rollup_result, default=str), 300)
+            return jsonify(rollup_result)
+        
         # 使用统一接口获取数据
         user_result = get_all_health_data_optimized(
             orgId=org_id, 
@@ -706,13 +793,9 @@ def get_health_trends(orgId=None, userId=None, startDate=None, endDate=None): #
                         except (ValueError, TypeError):
                             pass
         
-        # 统一时间轴
+        # 统一时间轴(完整范围，构建结果后统一降采样)
         all_times = sorted(set(list(user_aggregated.keys()) + list(dept_aggregated.keys())))
         
-        # 限制时间点数量
-        if len(all_times) > 300:
-            all_times = all_times[-300:]
-        
         # 构建结果
         user_series = {}
         dept_series = {m: [] for m in enabled_metrics}
@@ -743,6 +826,8 @@ def get_health_trends(orgId=None, userId=None, startDate=None, endDate=None): #
             }
         }
         
+        result = _downsample_trend_result(result, max_points)
+        
         # 缓存结果
         redis.set_data(cache_key, json.dumps(result, default=str), 300)
         print(f"💾 健康趋势数据已缓存: {cache_key}")
@@ -834,8 +919,97 @@ def get_health_baseline(orgId, userId=None, startDate=None, endDate=None):
             'message': '健康基线数据获取失败'
         })
 
+def _build_dimension_stats(time_groups, time_series, enabled_metrics): #按时间分组的count/sum/min/max生成统计结果#
+    def cell(time_key, metric):
+        return time_groups[time_key].get(metric) or {'count': 0, 'sum': 0.0, 'min': None, 'max': None}
+    
+    def avg(time_key, metric):
+        c = cell(time_key, metric)
+        return round(c['sum'] / c['count'], 2) if c['count'] else 0
+    
+    stats = {metric: [] for metric in enabled_metrics}
+    
+    # 心率特殊处理（包含min/max）
+    if 'heart_rate' in enabled_metrics:
+        stats['heart_rate'] = []
+        for time_key in time_series:
+            c = cell(time_key, 'heart_rate')
+            if c['count']:
+                stats['heart_rate'].append({
+                    'avg': avg(time_key, 'heart_rate'),
+                    'min': round(c['min'], 2),
+                    'max': round(c['max'], 2)
+                })
+            else:
+                stats['heart_rate'].append({'avg': 0, 'min': 0, 'max': 0})
+    
+    # 血压特殊处理
+    if 'pressure_high' in enabled_metrics and 'pressure_low' in enabled_metrics:
+        stats['pressure'] = []
+        for time_key in time_series:
+            stats['pressure'].append({
+                'high': avg(time_key, 'pressure_high'),
+                'low': avg(time_key, 'pressure_low')
+            })
+    
+    # 其他指标处理
+    for metric in ['blood_oxygen', 'stress', 'temperature']:
+        if metric in enabled_metrics:
+            for time_key in time_series:
+                stats[metric].append(avg(time_key, metric))
+    
+    # 活动数据处理
+    if any(m in enabled_metrics for m in ['step', 'distance', 'calorie', 'sleep']):
+        stats['activity'] = []
+        for time_key in time_series:
+            activity_data = {
+                'steps': int(cell(time_key, 'step')['sum']) if 'step' in enabled_metrics else 0,
+                'distance': round(cell(time_key, 'distance')['sum'], 2) if 'distance' in enabled_metrics else 0,
+                'calorie': round(cell(time_key, 'calorie')['sum'], 2) if 'calorie' in enabled_metrics else 0,
+                'sleep': round(cell(time_key, 'sleep')['sum'], 2) if 'sleep' in enabled_metrics else 0
+            }
+            stats['activity'].append(activity_data)
+    return stats
+
+def _health_stats_from_rollup(orgId, userId, start_time, end_time, time_format): #分级汇总统计(月/年维度)#
+    """日汇总按time_format合并(年维度合并为月)；汇总尚未回填时返回None走明细"""
+    try:
+        if userId:
+            user = UserInfo.query.filter_by(id=userId, is_deleted=False).first()
+            if not user:
+                return None
+            config_org_id, scope = user.org_id, {'user_id': user.id}
+        else:
+            config_org_id, scope = orgId, {'org_id': orgId}
+        _, filtered_metrics, _ = _resolve_enabled_metrics(config_org_id)
+        enabled_metrics = [m for m in filtered_metrics if m in ROLLUP_METRICS]
+        series = query_rollup_series(enabled_metrics, start_time, end_time, '1d', **scope)
+        if not series:
+            return None
+        
+        buckets = defaultdict(lambda: defaultdict(list))
+        for day, cells in series.items():
+            for metric, c in cells.items():
+                buckets[day.strftime(time_format)][metric].append(c)
+        time_groups = {key: {metric: merge_rollup_cells(cells) for metric, cells in metrics.items()}
+                       for key, metrics in buckets.items()}
+        time_series = sorted(time_groups.keys())
+        return {
+            'success': True,
+            'data': {
+                'time_series': time_series,
+                'stats': _build_dimension_stats(time_groups, time_series, enabled_metrics),
+                'enabled_metrics': enabled_metrics,
+                'data_count': max((sum(c['count'] for c in metrics.values() if c) for metrics in time_groups.values()), default=0),
+                'data_source': 'rollup_1d'
+            }
+        }
+    except Exception as e:
+        print(f"⚠️ 汇总统计查询失败，回退明细聚合: {e}")
+        return None
+
 def fetch_health_stats_by_dimension(orgId=None, userId=None, dimension='day'): #重构统计查询-调用统一接口#
-    """重构健康统计查询，使用统一数据接口"""
+    """重构健康统计查询，使用统一数据接口；月/年维度读分级汇总"""
     try:
         # 时间范围设置
         now = datetime.now()
@@ -852,6 +1026,12 @@ def fetch_health_stats_by_dimension(orgId=None, userId=None, dimension='day'): #
             start_time = now - timedelta(days=365)
             time_format = '%Y-%m'
         
+        if should_use_rollup(start_time, now):
+            rollup_result = _health_stats_from_rollup(orgId, userId, start_time, now, time_format)
+            if rollup_result:
+                rollup_result['data']['dimension'] = dimension
+                return rollup_result
+        
         # 使用统一接口获取数据
         result = get_all_health_data_optimized(
             orgId=orgId,
@@ -870,8 +1050,8 @@ def fetch_health_stats_by_dimension(orgId=None, userId=None, dimension='day'): #
         
         print(f"📊 统计查询 - 维度: {dimension}, 数据量: {len(health_data)}, 启用指标: {enabled_metrics}")
         
-        # 时间分组聚合
-        time_groups = defaultdict(lambda: defaultdict(list))
+        # 时间分组聚合(count/sum/min/max)
+        time_groups = defaultdict(dict)
         
         for data in health_data:
             if not data.get('timestamp'):
@@ -884,58 +1064,17 @@ def fetch_health_stats_by_dimension(orgId=None, userId=None, dimension='day'): #
                 if metric in data and data[metric] and str(data[metric]) != '0':
                     try:
                         value = float(data[metric])
-                        time_groups[time_key][metric].append(value)
                     except (ValueError, TypeError):
-                        pass
+                        continue
+                    c = time_groups[time_key].setdefault(metric, {'count': 0, 'sum': 0.0, 'min': value, 'max': value})
+                    c['count'] += 1
+                    c['sum'] += value
+                    c['min'] = min(c['min'], value)
+                    c['max'] = max(c['max'], value)
         
         # 计算统计结果
         time_series = sorted(time_groups.keys())
-        stats = {metric: [] for metric in enabled_metrics}
-        
-        # 心率特殊处理（包含min/max）
-        if 'heart_rate' in enabled_metrics:
-            stats['heart_rate'] = []
-            for time_key in time_series:
-                values = time_groups[time_key].get('heart_rate', [])
-                if values:
-                    stats['heart_rate'].append({
-                        'avg': round(sum(values)/len(values), 2),
-                        'min': round(min(values), 2),
-                        'max': round(max(values), 2)
-                    })
-                else:
-                    stats['heart_rate'].append({'avg': 0, 'min': 0, 'max': 0})
-        
-        # 血压特殊处理
-        if 'pressure_high' in enabled_metrics and 'pressure_low' in enabled_metrics:
-            stats['pressure'] = []
-            for time_key in time_series:
-                high_values = time_groups[time_key].get('pressure_high', [])
-                low_values = time_groups[time_key].get('pressure_low', [])
-                stats['pressure'].append({
-                    'high': round(sum(high_values)/len(high_values), 2) if high_values else 0,
-                    'low': round(sum(low_values)/len(low_values), 2) if low_values else 0
-                })
-        
-        # 其他指标处理
-        for metric in ['blood_oxygen', 'stress', 'temperature']:
-            if metric in enabled_metrics:
-                for time_key in time_series:
-                    values = time_groups[time_key].get(metric, [])
-                    avg_val = round(sum(values)/len(values), 2) if values else 0
-                    stats[metric].append(avg_val)
-        
-        # 活动数据处理
-        if any(m in enabled_metrics for m in ['step', 'distance', 'calorie', 'sleep']):
-            stats['activity'] = []
-            for time_key in time_series:
-                activity_data = {
-                    'steps': int(sum(time_groups[time_key].get('step', []))) if 'step' in enabled_metrics else 0,
-                    'distance': round(sum(time_groups[time_key].get('distance', [])), 2) if 'distance' in enabled_metrics else 0,
-                    'calorie': round(sum(time_groups[time_key].get('calorie', [])), 2) if 'calorie' in enabled_metrics else 0,
-                    'sleep': round(sum(time_groups[time_key].get('sleep', [])), 2) if 'sleep' in enabled_metrics else 0
-                }
-                stats['activity'].append(activity_data)
+        stats = _build_dimension_stats(time_groups, time_series, enabled_metrics)
         
         return {
             'success': True,
@@ -1104,8 +1243,8 @@ def fetch_health_data_by_orgIdAndUserId1(orgId=None, userId=None): #极致优化
         print(f"健康数据查询错误:{e}")
         return {"success":False,"error":str(e),"data":{"healthData":[],"totalRecords":0,"statistics":{},"departmentStats":{},"deviceCount":0,"orgId":str(orgId),"userId":str(userId) if userId else None}}
 
-def get_page_health_data_by_orgIdAndUserId(orgId=None, userId=None, startDate=None, endDate=None, page=1, pageSize=100): #重构为调用统一优化接口#
-    """重构分页查询，调用统一优化接口"""
+def get_page_health_data_by_orgIdAndUserId(orgId=None, userId=None, startDate=None, endDate=None, page=1, pageSize=100, cursor=None, withCount=None): #重构为调用统一优化接口#
+    """重构分页查询，调用统一优化接口；传入cursor(上一页的nextCursor)时按游标翻页，深页与首页代价相同"""
     try:
         page, pageSize = int(page or 1), min(int(pageSize or 100), 500)  #限制每页最大500条#
         
@@ -1117,7 +1256,9 @@ def get_page_health_data_by_orgIdAndUserId(orgId=None, userId=None, startDate=No
             endDate=endDate,
             latest_only=False,
             page=page,
-            pageSize=pageSize
+            pageSize=pageSize,
+            cursor=cursor,
+            with_count=withCount
         )
         
         if not result.get('success'):
@@ -1132,7 +1273,9 @@ def get_page_health_data_by_orgIdAndUserId(orgId=None, userId=None, startDate=No
                         "currentPage": page,
                         "pageSize": pageSize,
                         "totalCount": 0,
-                        "totalPages": 0
+                        "totalPages": 0,
+                        "nextCursor": None,
+                        "hasMore": False
                     }
                 }
             }
@@ -1140,10 +1283,11 @@ def get_page_health_data_by_orgIdAndUserId(orgId=None, userId=None, startDate=No
         # 获取数据和分页信息
         data = result.get('data', {})
         health_data_list = data.get('healthData', [])
-        total_records = data.get('totalRecords', 0)
+        total_records = data.get('totalRecords')
+        pagination = data.get('pagination') or {}
         
-        # 计算分页信息
-        total_pages = (total_records + pageSize - 1) // pageSize if pageSize else 1
+        # 计算分页信息(游标翻页未统计总数时为None)
+        total_pages = (total_records + pageSize - 1) // pageSize if total_records is not None and pageSize else None
         
         return {
             "success": True,
@@ -1155,7 +1299,9 @@ def get_page_health_data_by_orgIdAndUserId(orgId=None, userId=None, startDate=No
                     "currentPage": page,
                     "pageSize": pageSize,
                     "totalCount": total_records,
-                    "totalPages": total_pages
+                    "totalPages": total_pages,
+                    "nextCursor": pagination.get('nextCursor'),
+                    "hasMore": pagination.get('hasMore', False)
                 }
             }
         }
@@ -1173,7 +1319,9 @@ def get_page_health_data_by_orgIdAndUserId(orgId=None, userId=None, startDate=No
                     "currentPage": page,
                     "pageSize": pageSize,
                     "totalCount": 0,
-                    "totalPages": 0
+                    "totalPages": 0,
+                    "nextCursor": None,
+                    "hasMore": False
                 }
             }
         }
@@ -1767,20 +1915,18 @@ def upload_health_data(health_data):
        
        # 判断是否为批量上传
        if isinstance(data, list):
-           # 批量上传
-           for item in data:
-               process_single_health_data(item)
+           # 批量上传：整批解析、一次多行写入、pipeline写Redis，返回逐条结果
+           from .health_batch_upload import process_health_data_batch
+           batch_result = process_health_data_batch(data)
+           return jsonify({"status": "success", "message": "数据已接收并处理", **batch_result})
        else:
            # 单个上传
            process_single_health_data(data)
        
        return jsonify({"status": "success", "message": "数据已接收并处理"})
 
-def process_single_health_data(data):
-    print(f"🏥 process_single_health_data 接收到的数据: {data}")
-    print(f"🏥 数据类型: {type(data)}")
-    print(f"🏥 数据键: {list(data.keys()) if isinstance(data, dict) else '非字典类型'}")
-    
+def normalize_health_item(data):
+    """解析单条上传数据(兼容下划线/驼峰/拼音缩写字段)，返回统一字段字典"""
     # 修复数值字段解析问题：使用 is not None 判断而不是 or 操作符，避免0值被误判为空
     uploadMethod = data.get("upload_method") or data.get("uploadMethod") or "wifi"  # 默认使用wifi作为上传方式
     
@@ -1828,6 +1974,103 @@ def process_single_health_data(data):
     orgId = data.get("org_id") or data.get("orgId") 
     userId = data.get("user_id") or data.get("userId")
     
+    # 处理时间戳
+    if isinstance(timestamp, str):
+        try:
+            timestamp = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            timestamp = datetime.now()
+    elif timestamp is None:
+        timestamp = datetime.now()
+
+    return {
+        "uploadMethod": uploadMethod,
+        "heartRate": heartRate,
+        "pressureHigh": pressureHigh,
+        "pressureLow": pressureLow,
+        "bloodOxygen": bloodOxygen,
+        "temperature": temperature,
+        "stress": stress,
+        "step": step,
+        "timestamp": timestamp,
+        "deviceSn": deviceSn,
+        "distance": distance,
+        "calorie": calorie,
+        "latitude": latitude,
+        "longitude": longitude,
+        "altitude": altitude,
+        "sleepData": sleepData,
+        "exerciseDailyData": exerciseDailyData,
+        "exerciseDailyWeekData": exerciseDailyWeekData,
+        "scientificSleepData": scientificSleepData,
+        "workoutData": workoutData,
+        "customerId": customerId,
+        "orgId": orgId,
+        "userId": userId,
+    }
+
+def build_health_redis_mapping(item, customerId, orgId, userId):
+    """构建health_data:{sn}最新值哈希(同时作为告警检测输入)"""
+    def safe_str(value):#安全字符串转换
+        return str(value) if value is not None else ''
+    
+    return {
+        "uploadMethod": safe_str(item["uploadMethod"]),
+        "heartRate": safe_str(item["heartRate"]),
+        "pressureHigh": safe_str(item["pressureHigh"]),
+        "pressureLow": safe_str(item["pressureLow"]),
+        "bloodOxygen": safe_str(item["bloodOxygen"]),
+        "temperature": safe_str(item["temperature"]),
+        "stress": safe_str(item["stress"]),
+        "step": safe_str(item["step"]),
+        "timestamp": safe_str(item["timestamp"]),
+        "deviceSn": safe_str(item["deviceSn"]),
+        "distance": safe_str(item["distance"]),
+        "calorie": safe_str(item["calorie"]),
+        "latitude": safe_str(item["latitude"]),
+        "longitude": safe_str(item["longitude"]),
+        "altitude": safe_str(item["altitude"]),
+        "customerId": customerId,  # 添加customerId用于告警规则缓存
+        "customer_id": customerId,  # 兼容性字段名
+        "orgId": orgId,            # 添加orgId
+        "userId": userId,          # 添加userId
+        "sleepData": json.dumps(item["sleepData"]) if item["sleepData"] else '',
+        "exerciseDailyData": json.dumps(item["exerciseDailyData"]) if item["exerciseDailyData"] else '',
+        "exerciseDailyWeekData": json.dumps(item["exerciseDailyWeekData"]) if item["exerciseDailyWeekData"] else '',
+        "scientificSleepData": json.dumps(item["scientificSleepData"]) if item["scientificSleepData"] else '',
+        "workoutData": json.dumps(item["workoutData"]) if item["workoutData"] else ''
+    }
+
+def process_single_health_data(data):
+    print(f"🏥 process_single_health_data 接收到的数据: {data}")
+    print(f"🏥 数据类型: {type(data)}")
+    print(f"🏥 数据键: {list(data.keys()) if isinstance(data, dict) else '非字典类型'}")
+    
+    item = normalize_health_item(data)
+    uploadMethod = item["uploadMethod"]
+    heartRate = item["heartRate"]
+    pressureHigh = item["pressureHigh"]
+    pressureLow = item["pressureLow"]
+    bloodOxygen = item["bloodOxygen"]
+    temperature = item["temperature"]
+    stress = item["stress"]
+    step = item["step"]
+    timestamp = item["timestamp"]
+    deviceSn = item["deviceSn"]
+    distance = item["distance"]
+    calorie = item["calorie"]
+    latitude = item["latitude"]
+    longitude = item["longitude"]
+    altitude = item["altitude"]
+    sleepData = item["sleepData"]
+    exerciseDailyData = item["exerciseDailyData"]
+    exerciseDailyWeekData = item["exerciseDailyWeekData"]
+    scientificSleepData = item["scientificSleepData"]
+    workoutData = item["workoutData"]
+    customerId = item["customerId"]
+    orgId = item["orgId"]
+    userId = item["userId"]
+
     print(f"🏥 解析后的关键字段:")
     print(f"  - deviceSn: {deviceSn}")
     print(f"  - heartRate: {heartRate}")
@@ -1839,35 +2082,16 @@ def process_single_health_data(data):
     print(f"  - orgId: {orgId}")
     print(f"  - userId: {userId}")
 
-    # 处理时间戳
-    if isinstance(timestamp, str):
-        try:
-            timestamp = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
-        except ValueError:
-            timestamp = datetime.now()
-    elif timestamp is None:
-        timestamp = datetime.now()
-
     # 检查必要字段
     if not deviceSn:
         print("设备SN不能为空")
         return None
         
-    #检查是否已存在相同记录
-    from sqlalchemy import and_
-    try:
-        existing = db.session.query(UserHealthData.id).filter(
-            and_(
-                UserHealthData.device_sn == deviceSn,
-                UserHealthData.timestamp == timestamp
-            )
-        ).first()
-        
-        if existing:
-            print(f"记录已存在，跳过插入: device_sn={deviceSn}, timestamp={timestamp}, id={existing.id}")
-            return existing.id
-    except Exception as e:
-        print(f"检查重复记录时出错: {e}")
+    #快速重复检测：只查Redis近期键集合，数据库唯一键兜底
+    if get_health_dedup().is_recent(deviceSn, timestamp):
+        existing_id = _find_health_data_id(deviceSn, timestamp)  # 仅在命中重复时回查ID，保持原返回值
+        print(f"记录近期已入库，跳过插入: device_sn={deviceSn}, timestamp={timestamp}, id={existing_id}")
+        return existing_id
 
     # 解析sleepData并计算sleep数值
     sleep_hours = parse_sleep_data(sleepData)
@@ -1884,49 +2108,23 @@ def process_single_health_data(data):
         print(f"🔍 补充后的客户信息: customerId={customerId}, orgId={orgId}, userId={userId}")
 
     # 保存到数据库
-    health_data_id = save_health_data(
+    health_data_id, is_duplicate = _insert_health_data(
         heartRate, pressureHigh, pressureLow, bloodOxygen, temperature, stress, step, 
         timestamp, deviceSn, distance, calorie, latitude, longitude, altitude, 
         uploadMethod, sleep_hours, customerId, orgId, userId
     )
     
+    if is_duplicate:
+        print(f"记录已存在，跳过后续处理: device_sn={deviceSn}, timestamp={timestamp}, id={health_data_id}")
+        return health_data_id
+    
     if not health_data_id:
         print("数据保存失败")
         return None
     
-    def safe_str(value):#安全字符串转换
-        return str(value) if value is not None else ''
-    
-    health_data_new = {
-        "uploadMethod": safe_str(uploadMethod),
-        "heartRate": safe_str(heartRate),
-        "pressureHigh": safe_str(pressureHigh),
-        "pressureLow": safe_str(pressureLow),
-        "bloodOxygen": safe_str(bloodOxygen),
-        "temperature": safe_str(temperature),
-        "stress": safe_str(stress),
-        "step": safe_str(step),
-        "timestamp": safe_str(timestamp),
-        "deviceSn": safe_str(deviceSn),
-        "distance": safe_str(distance),
-        "calorie": safe_str(calorie),
-        "latitude": safe_str(latitude),
-        "longitude": safe_str(longitude),
-        "altitude": safe_str(altitude),
-        "customerId": customerId,  # 添加customerId用于告警规则缓存
-        "customer_id": customerId,  # 兼容性字段名
-        "orgId": orgId,            # 添加orgId
-        "userId": userId,          # 添加userId
-        "sleepData": json.dumps(sleepData) if sleepData else '',
-        "exerciseDailyData": json.dumps(exerciseDailyData) if exerciseDailyData else '',
-        "exerciseDailyWeekData": json.dumps(exerciseDailyWeekData) if exerciseDailyWeekData else '',
-        "scientificSleepData": json.dumps(scientificSleepData) if scientificSleepData else '',
-        "workoutData": json.dumps(workoutData) if workoutData else ''
-    }
+    health_data_new = build_health_redis_mapping(item, customerId, orgId, userId)
     
-    redis.hset_data(f"health_data:{deviceSn}", mapping=health_data_new)
-    print("redis_client.hset", redis.hgetall_data(f"health_data:{deviceSn}"))
-    redis.publish(f"health_data_channel:{deviceSn}", deviceSn)
+    get_redis_write_behind().submit(deviceSn, health_data_new)  # 最新值与通知由写后缓冲批量刷新
     print("begin to check for alerts")
     generate_alerts(health_data_new, health_data_id)
     print("alerts checked")
@@ -2037,7 +2235,52 @@ def get_health_data_config_by_org(org_id): #获取组织健康数据配置#
         default_metrics = ['heart_rate', 'blood_oxygen', 'pressure', 'pressure_high', 'pressure_low', 'temperature', 'stress', 'step', 'distance', 'calorie', 'sleep']
         return {metric: True for metric in default_metrics}
 
-def get_all_health_data_optimized(orgId=None, userId=None, startDate=None, endDate=None, latest_only=False, page=1, pageSize=None, include_daily=False, include_weekly=False): #统一健康数据查询入口-支持动态配置和分区表#
+def _resolve_enabled_metrics(query_org_id): #按组织配置解析启用指标#
+    """返回(启用指标, 健康数据表中存在的启用指标, 忽略的非健康数据字段)"""
+    # 获取动态健康数据配置
+    enabled_metrics_config = get_health_data_config_by_org(query_org_id)
+    enabled_metrics = [metric for metric, enabled in enabled_metrics_config.items() if enabled]
+
+    # 业务逻辑：location关联 - latitude, longitude, altitude是根据location配置的
+    if 'location' in enabled_metrics:
+        if 'latitude' not in enabled_metrics:
+            enabled_metrics.append('latitude')
+        if 'longitude' not in enabled_metrics:
+            enabled_metrics.append('longitude')
+        if 'altitude' not in enabled_metrics:
+            enabled_metrics.append('altitude')
+
+    # 业务逻辑：heart_rate与pressure关联 - pressure_high, pressure_low是根据heart_rate模拟的
+    if 'heart_rate' in enabled_metrics:
+        if 'pressure_high' not in enabled_metrics:
+            enabled_metrics.append('pressure_high')
+        if 'pressure_low' not in enabled_metrics:
+            enabled_metrics.append('pressure_low')
+
+    # 兼容性：如果配置中有pressure，也自动包含pressure_high和pressure_low
+    if 'pressure' in enabled_metrics:
+        if 'pressure_high' not in enabled_metrics:
+            enabled_metrics.append('pressure_high')
+        if 'pressure_low' not in enabled_metrics:
+            enabled_metrics.append('pressure_low')
+
+    print(f"🔧 组织{query_org_id}启用的指标: {enabled_metrics}")
+
+    # 健康数据表真实字段白名单 - 只包含数据库表中实际存在的字段
+    valid_health_fields = [
+        'heart_rate', 'blood_oxygen', 'temperature', 'pressure_high', 'pressure_low', 
+        'stress', 'step', 'distance', 'calorie', 'latitude', 'longitude', 'altitude', 'sleep'
+    ]
+
+    # 过滤掉不属于健康数据表的字段
+    filtered_metrics = [metric for metric in enabled_metrics if metric in valid_health_fields]
+    ignored_fields = [metric for metric in enabled_metrics if metric not in valid_health_fields]
+
+    if ignored_fields:
+        print(f"⚠️  忽略非健康数据字段: {ignored_fields}")
+    return enabled_metrics, filtered_metrics, ignored_fields
+
+def get_all_health_data_optimized(orgId=None, userId=None, startDate=None, endDate=None, latest_only=False, page=1, pageSize=None, include_daily=False, include_weekly=False, cursor=None, with_count=None): #统一健康数据查询入口-支持动态配置和分区表#
     """
     统一的健康数据查询接口，支持按月分表和快慢表查询，使用动态健康数据配置
     
@@ -2051,6 +2294,8 @@ def get_all_health_data_optimized(orgId=None, userId=None, startDate=None, endDa
         pageSize: 每页大小
         include_daily: 是否包含每日数据
         include_weekly: 是否包含每周数据
+        cursor: 分页游标(上一页返回的nextCursor)，传入时忽略page，任意深度翻页代价相同
+        with_count: 是否统计总数，默认仅首页(无游标)统计
     
     Returns:
         dict: 包含健康数据和统计信息的字典
@@ -2069,7 +2314,9 @@ def get_all_health_data_optimized(orgId=None, userId=None, startDate=None, endDa
         else:
             pageSize = None
         mode = 'latest' if latest_only else 'range'
-        cache_key = f"health_opt_v6:{orgId}:{userId}:{startDate}:{endDate}:{mode}:{page}:{pageSize}:{include_daily}:{include_weekly}"
+        if with_count is None:
+            with_count = not cursor  # 游标翻页默认不再统计总数
+        cache_key = f"health_opt_v8:{orgId}:{userId}:{startDate}:{endDate}:{mode}:{page}:{pageSize}:{include_daily}:{include_weekly}:{cursor}:{with_count}"
         
         # 缓存检查
         cached = redis.get_data(cache_key)
@@ -2102,10 +2349,11 @@ def get_all_health_data_optimized(orgId=None, userId=None, startDate=None, endDa
             # 🚀 重大优化：消除N+1查询问题，直接使用用户表的org字段！
             query_org_id = orgId
             
-            # 🎉 方式1：直接通过org_id查询用户，一次性获取所有数据
+            # 🎉 方式1：直接通过org_id查询用户，一次性获取所有数据(组织森林命中时一次IN覆盖整棵子树)
             try:
+                subtree = get_org_forest().descendants(orgId)
                 users = UserInfo.query.filter(
-                    UserInfo.org_id == orgId,
+                    UserInfo.org_id.in_(subtree) if subtree else UserInfo.org_id == orgId,
                     UserInfo.is_deleted.is_(False)
                 ).all()
                 
@@ -2165,47 +2413,8 @@ def get_all_health_data_optimized(orgId=None, userId=None, startDate=None, endDa
         if not user_list:
             return {"success": True, "data": {"healthData": [], "totalRecords": 0, "pagination": {"currentPage": page, "pageSize": pageSize, "totalCount": 0, "totalPages": 0}}}
         
-        # 获取动态健康数据配置
-        enabled_metrics_config = get_health_data_config_by_org(query_org_id)
-        enabled_metrics = [metric for metric, enabled in enabled_metrics_config.items() if enabled]
-        
-        # 业务逻辑：location关联 - latitude, longitude, altitude是根据location配置的
-        if 'location' in enabled_metrics:
-            if 'latitude' not in enabled_metrics:
-                enabled_metrics.append('latitude')
-            if 'longitude' not in enabled_metrics:
-                enabled_metrics.append('longitude')
-            if 'altitude' not in enabled_metrics:
-                enabled_metrics.append('altitude')
-        
-        # 业务逻辑：heart_rate与pressure关联 - pressure_high, pressure_low是根据heart_rate模拟的
-        if 'heart_rate' in enabled_metrics:
-            if 'pressure_high' not in enabled_metrics:
-                enabled_metrics.append('pressure_high')
-            if 'pressure_low' not in enabled_metrics:
-                enabled_metrics.append('pressure_low')
-        
-        # 兼容性：如果配置中有pressure，也自动包含pressure_high和pressure_low
-        if 'pressure' in enabled_metrics:
-            if 'pressure_high' not in enabled_metrics:
-                enabled_metrics.append('pressure_high')
-            if 'pressure_low' not in enabled_metrics:
-                enabled_metrics.append('pressure_low')
-        
-        print(f"🔧 组织{query_org_id}启用的指标: {enabled_metrics}")
-        
-        # 健康数据表真实字段白名单 - 只包含数据库表中实际存在的字段
-        valid_health_fields = [
-            'heart_rate', 'blood_oxygen', 'temperature', 'pressure_high', 'pressure_low', 
-            'stress', 'step', 'distance', 'calorie', 'latitude', 'longitude', 'altitude', 'sleep'
-        ]
-        
-        # 过滤掉不属于健康数据表的字段
-        filtered_metrics = [metric for metric in enabled_metrics if metric in valid_health_fields]
-        ignored_fields = [metric for metric in enabled_metrics if metric not in valid_health_fields]
-        
-        if ignored_fields:
-            print(f"⚠️  忽略非健康数据字段: {ignored_fields}")
+        # 获取动态健康数据配置(位置/血压关联指标、字段白名单过滤)
+        enabled_metrics, filtered_metrics, ignored_fields = _resolve_enabled_metrics(query_org_id)
         
         # 动态构建查询字段 - 根据配置决定查询哪些字段
         base_fields = ['device_sn', 'timestamp', 'upload_method', 'user_id', 'org_id']
@@ -2226,6 +2435,7 @@ def get_all_health_data_optimized(orgId=None, userId=None, startDate=None, endDa
         all_sns = [x[0] for x in user_list if x[0]]  # 兼容：保留设备SN列表，用于回退查询
         health_data_list = []
         total_count = 0
+        next_cursor = None
         
         print(f"🎯 动态查询字段: {query_fields}")
         print(f"👥 查询用户ID: {all_user_ids}")
@@ -2292,53 +2502,32 @@ def get_all_health_data_optimized(orgId=None, userId=None, startDate=None, endDa
                     total_count = 0
                 
         else:
-            # 时间范围查询模式 - 优先使用新的查询方式
+            # 时间范围查询模式 - keyset游标分页(timestamp, id)，深页与首页代价相同
             try:
                 if userId:
-                    # 单用户查询
-                    query = db.session.query(UserHealthData).filter(
-                        UserHealthData.user_id == userId,
-                        UserHealthData.org_id == query_org_id
-                    )
-                    if startDate:
-                        query = query.filter(UserHealthData.timestamp >= startDate)
-                    if endDate:
-                        query = query.filter(UserHealthData.timestamp <= endDate)
-                    
-                    total_count = query.count()
-                    if pageSize:
-                        offset = (page - 1) * pageSize
-                        results = query.order_by(UserHealthData.timestamp.desc()).offset(offset).limit(pageSize).all()
-                    else:
-                        results = query.order_by(UserHealthData.timestamp.desc()).all()
-                        
+                    filters = [('user_id', 'user_id = :user_id'), ('org_id', 'org_id = :org_id')]
+                    filter_params = {'user_id': userId, 'org_id': query_org_id}
                 elif orgId:
-                    # 组织查询
-                    query = db.session.query(UserHealthData).filter(
-                        UserHealthData.org_id == orgId,
-                        UserHealthData.user_id.in_(all_user_ids)
-                    )
-                    if startDate:
-                        query = query.filter(UserHealthData.timestamp >= startDate)
-                    if endDate:
-                        query = query.filter(UserHealthData.timestamp <= endDate)
-                    
-                    total_count = query.count()
-                    if pageSize:
-                        offset = (page - 1) * pageSize
-                        results = query.order_by(UserHealthData.timestamp.desc()).offset(offset).limit(pageSize).all()
-                    else:
-                        results = query.order_by(UserHealthData.timestamp.desc()).all()
+                    filters = [('org_id', 'org_id = :org_id'), ('user_id', 'user_id IN :user_ids')]
+                    filter_params = {'org_id': orgId, 'user_ids': list(all_user_ids)}
+                else:
+                    filters, filter_params = None, None
+                
+                if filters:
+                    sd, ed = _parse_range_dates(startDate, endDate)
+                    results, total_count, next_cursor = _query_keyset_page(['t_user_health_data'], filters, filter_params, sd, ed, page, pageSize, query_fields, cursor, with_count)
                 else:
                     results = []
                     total_count = 0
                     
-                print(f"✅ 新范围查询成功，获得 {total_count} 条记录")
+                print(f"✅ 新范围查询成功，获得 {len(results)} 条记录")
                 
+            except InvalidCursorError:
+                raise  # 游标无效，直接返回错误
             except Exception as e:
                 print(f"❌ 新范围查询失败，回退到device_sn查询: {e}")
                 # 回退到原有的查询方式
-                results, total_count = _query_range_data_optimized(all_sns, startDate, endDate, page, pageSize, query_fields, query_strategy)
+                results, total_count, next_cursor = _query_range_data_optimized(all_sns, startDate, endDate, page, pageSize, query_fields, query_strategy, cursor, with_count)
         
         # 构建用户映射，包含部门信息 - 同时支持device_sn和user_id映射
         sn_to_user = {x[0]: (x[1], x[2], x[3], x[4]) for x in user_list if x[0]}  # device_sn -> (user_name, user_id, dept_name, dept_id)
@@ -2368,27 +2557,29 @@ def get_all_health_data_optimized(orgId=None, userId=None, startDate=None, endDa
         
         # 数据转换 - 根据动态配置构建响应，使用前端期望的字段名
         # 添加最终的设备级别去重保护 - 优先使用device_sn进行去重，确保每个设备只有一条最新记录
-        seen_devices = set()
-        unique_results = []
-        
-        # 先按时间戳降序排序，确保最新的记录优先
-        sorted_results = sorted(results, key=lambda r: (getattr(r, 'timestamp', datetime.min), getattr(r, 'id', 0)), reverse=True)
-        
-        for r in sorted_results:
-            device_key = getattr(r, 'device_sn', None)
-            user_key = getattr(r, 'user_id', None)
+        # 范围查询按页返回全部记录(已按timestamp, id降序)，去重只针对最新记录模式
+        if latest_only:
+            seen_devices = set()
+            unique_results = []
             
-            # 优先使用device_sn作为去重键，如果没有则使用user_id
-            primary_key = device_key or user_key
+            # 先按时间戳降序排序，确保最新的记录优先
+            sorted_results = sorted(results, key=lambda r: (getattr(r, 'timestamp', datetime.min), getattr(r, 'id', 0)), reverse=True)
             
-            if primary_key and primary_key not in seen_devices:
-                seen_devices.add(primary_key)
-                unique_results.append(r)
-            elif not primary_key:
-                unique_results.append(r)  # 保留没有标识的记录
-        
-        print(f"🔍 设备级去重前: {len(results)} 条记录，去重后: {len(unique_results)} 条记录")
-        results = unique_results
+            for r in sorted_results:
+                device_key = getattr(r, 'device_sn', None)
+                user_key = getattr(r, 'user_id', None)
+                
+                # 优先使用device_sn作为去重键，如果没有则使用user_id
+                primary_key = device_key or user_key
+                
+                if primary_key and primary_key not in seen_devices:
+                    seen_devices.add(primary_key)
+                    unique_results.append(r)
+                elif not primary_key:
+                    unique_results.append(r)  # 保留没有标识的记录
+            
+            print(f"🔍 设备级去重前: {len(results)} 条记录，去重后: {len(unique_results)} 条记录")
+            results = unique_results
         
         for r in results:
             if not r:
@@ -2479,7 +2670,10 @@ def get_all_health_data_optimized(orgId=None, userId=None, startDate=None, endDa
                 }
             }
         else:
-            total_pages = (total_count + pageSize - 1) // pageSize if pageSize and pageSize > 0 else 1
+            if total_count is None:
+                total_pages = None  # 游标翻页未统计总数
+            else:
+                total_pages = (total_count + pageSize - 1) // pageSize if pageSize and pageSize > 0 else 1
             result = {
                 "success": True,
                 "data": {
@@ -2489,7 +2683,9 @@ def get_all_health_data_optimized(orgId=None, userId=None, startDate=None, endDa
                         "currentPage": page,
                         "pageSize": pageSize,
                         "totalCount": total_count,
-                        "totalPages": total_pages
+                        "totalPages": total_pages,
+                        "nextCursor": next_cursor,
+                        "hasMore": next_cursor is not None
                     },
                     "enabledMetrics": filtered_metrics,
                     "ignoredFields": ignored_fields,
@@ -2614,251 +2810,126 @@ def _query_latest_data_optimized(device_sns, query_fields, enabled_db_fields, st
         (UserHealthData.timestamp == subq.c.max_ts)
     ).order_by(UserHealthData.timestamp.desc()).all()
 
-def _query_range_data_optimized(device_sns, startDate, endDate, page, pageSize, query_fields, strategy): #优化范围数据查询#
-    """优化的范围数据查询，支持分区表"""
-    from datetime import datetime, timedelta
-    from sqlalchemy import text
-    
-    # 解析时间参数
-    if startDate:
-        try:
-            sd = datetime.strptime(startDate, '%Y-%m-%d') if isinstance(startDate, str) else startDate
-        except:
-            sd = None
-    else:
+def _parse_range_dates(startDate, endDate): #解析范围查询时间，结束日期包含当天#
+    try:
+        sd = datetime.strptime(startDate, '%Y-%m-%d') if isinstance(startDate, str) else startDate
+    except ValueError:
         sd = None
-    
-    if endDate:
-        try:
-            ed = datetime.strptime(endDate, '%Y-%m-%d') if isinstance(endDate, str) else endDate
-            ed = ed + timedelta(days=1)
-        except:
-            ed = None
-    else:
+    try:
+        ed = datetime.strptime(endDate, '%Y-%m-%d') if isinstance(endDate, str) else endDate
+        ed = ed + timedelta(days=1) if ed else None
+    except ValueError:
         ed = None
+    return sd, ed
+
+def _keyset_sources(tables, filters, query_fields): #按分区目录构建keyset数据源#
+    """只选择表中存在的字段；缺少过滤字段或timestamp/id的表跳过"""
+    catalog = get_partition_catalog()
+    main_columns = frozenset(c.name for c in UserHealthData.__table__.columns)
+    sources = []
+    for table in tables:
+        columns = catalog.columns(table) or (main_columns if table == 't_user_health_data' else frozenset())  # 目录不可用时主表按模型字段
+        if not columns:
+            print(f"⚠️ 分区表 {table} 不存在，跳过")
+            continue
+        if not {'id', 'timestamp'} <= columns or any(column not in columns for column, _ in filters):
+            print(f"⚠️ 表 {table} 缺少分页/过滤字段，跳过")
+            continue
+        fields = [field for field in query_fields if field.lower() in columns]
+        fields += [field for field in ('id', 'customer_id') if field in columns and field not in fields]
+        where = [condition for _, condition in filters]
+        if 'is_deleted' in columns:
+            where.append('is_deleted = 0')
+        sources.append(KeysetSource(table, fields, where))
+    return sources
+
+def _query_keyset_page(tables, filters, params, start_date, end_date, page, pageSize, query_fields, cursor=None, with_count=True): #keyset游标分页#
+    """跨表(timestamp, id)游标分页 + 堆归并，返回(记录, 总数或None, 下一页游标)。
+    无游标时按page跳过前几页(兼容旧参数)，带游标时直接从游标位置读取"""
+    filters = list(filters)
+    params = dict(params)
+    if start_date:
+        filters.append(('timestamp', 'timestamp >= :start_date'))
+        params['start_date'] = start_date
+    if end_date:
+        filters.append(('timestamp', 'timestamp < :end_date'))
+        params['end_date'] = end_date
+    sources = _keyset_sources(tables, filters, query_fields)
+    if not sources:
+        return [], 0 if with_count else None, None
+    skip = 0 if cursor or not pageSize else (page - 1) * pageSize
+    fanout, execute = None, None
+    if len(sources) > 1:  # 跨月查询：各分区在独立连接上并发执行
+        fanout, execute = get_partition_fanout_executor(), engine_execute(db.engine)
+    result = get_keyset_partition_reader().read_page(sources, params, pageSize, cursor=cursor, skip=skip, with_count=with_count,
+                                                     fanout=fanout, execute=execute)
+    print(f"📄 游标分页: 表{len(sources)}个, 返回{len(result.rows)}条, 分区查询{result.stats['partition_queries']}次, "
+          f"耗时{result.stats['elapsed_ms']}ms, 分区耗时{result.stats.get('partition_latency_ms', {})}")
+    return result.rows, result.total_count, result.next_cursor
+
+def _query_range_data_optimized(device_sns, startDate, endDate, page, pageSize, query_fields, strategy, cursor=None, with_count=True): #优化范围数据查询#
+    """优化的范围数据查询，支持分区表，返回(记录, 总数, 下一页游标)"""
+    sd, ed = _parse_range_dates(startDate, endDate)
     
     # 根据策略选择查询方法
     if strategy in ["partitioned_table", "partitioned_table_with_daily"]:
-        return _query_partitioned_tables(device_sns, sd, ed, page, pageSize, query_fields)
+        return _query_partitioned_tables(device_sns, sd, ed, page, pageSize, query_fields, cursor, with_count)
     elif strategy == "summary_table_with_partitioned":
-        return _query_with_summary_tables(device_sns, sd, ed, page, pageSize, query_fields)
+        return _query_with_summary_tables(device_sns, sd, ed, page, pageSize, query_fields, cursor, with_count)
     else:
         # 主表查询
-        return _query_main_table(device_sns, sd, ed, page, pageSize)
+        return _query_main_table(device_sns, sd, ed, page, pageSize, query_fields, cursor, with_count)
 
-def _query_partitioned_tables(device_sns, start_date, end_date, page, pageSize, query_fields): #分区表查询-修复字段检测#
-    """查询分区表数据，动态检测字段存在性，避免查询不存在的字段"""
+def _query_partitioned_tables(device_sns, start_date, end_date, page, pageSize, query_fields, cursor=None, with_count=True): #分区表查询-keyset游标+堆归并#
+    """按月分区表游标分页：每个分区按(timestamp, id)降序keyset读取，堆归并后取一页，不再整体排序切片"""
+    if cursor_source(cursor) == 't_user_health_data':  # 首页已回退主表，后续页继续读主表
+        return _query_main_table_fallback(device_sns, start_date, end_date, page, pageSize, query_fields, cursor, with_count)
     try:
-        # 获取需要查询的分区表
         partition_tables = _get_partition_tables(start_date, end_date)
         print(f"🔍 开始查询分区表: {partition_tables}")
+        results, total_count, next_cursor = _query_keyset_page(
+            partition_tables, [('device_sn', 'device_sn IN :device_sns')], {'device_sns': list(device_sns)},
+            start_date, end_date, page, pageSize, query_fields, cursor, with_count)
         
-        all_results = []
-        total_count = 0
-        
-        print(f"📋 原始查询字段: {query_fields}")
-        
-        for table_name in partition_tables:
-            try:
-                # 检查表是否存在
-                table_exists_query = text("SHOW TABLES LIKE :table_name")
-                exists = db.session.execute(table_exists_query, {'table_name': table_name}).fetchone()
-                
-                if not exists:
-                    print(f"⚠️ 分区表 {table_name} 不存在，跳过")
-                    continue
-                
-                print(f"✅ 分区表 {table_name} 存在")
-                
-                # 动态检测表结构中存在的字段
-                desc_query = text(f"DESCRIBE {table_name}")
-                table_columns = db.session.execute(desc_query).fetchall()
-                existing_columns = {col[0].lower() for col in table_columns}
-                print(f"🔍 {table_name} 存在字段: {sorted(existing_columns)}")
-                
-                # 过滤出实际存在的字段
-                valid_fields = []
-                for field in query_fields:
-                    field_lower = field.lower()
-                    if field_lower in existing_columns:
-                        valid_fields.append(field)
-                    else:
-                        print(f"⚠️ 字段 {field} 在表 {table_name} 中不存在，跳过")
-                
-                if not valid_fields:
-                    print(f"❌ 表 {table_name} 没有有效字段，跳过")
-                    continue
-                    
-                field_list = ', '.join(valid_fields)
-                print(f"📋 {table_name} 实际查询字段: {field_list}")
-                
-                # 查询分区表
-                conditions = ["is_deleted = 0"] if 'is_deleted' in existing_columns else []
-                params = {'device_sns': tuple(device_sns)}
-                
-                if start_date and 'timestamp' in existing_columns:
-                    conditions.append("timestamp >= :start_date")
-                    params['start_date'] = start_date
-                if end_date and 'timestamp' in existing_columns:
-                    conditions.append("timestamp <= :end_date") 
-                    params['end_date'] = end_date
-                
-                print(f"🔍 查询条件: {conditions}, 设备数量: {len(device_sns)}")
-                
-                # 先获取总数
-                where_clause = f"WHERE device_sn IN :device_sns" if 'device_sn' in existing_columns else "WHERE 1=1"
-                if conditions:
-                    where_clause += f" AND {' AND '.join(conditions)}"
-                    
-                count_query = text(f"SELECT COUNT(*) FROM {table_name} {where_clause}")
-                table_count = db.session.execute(count_query, params).scalar()
-                total_count += table_count
-                
-                print(f"📊 分区表 {table_name}: {table_count} 条记录")
-                
-                if table_count > 0:
-                    # 获取数据
-                    order_clause = "ORDER BY timestamp DESC" if 'timestamp' in existing_columns else ""
-                    # 只在分页模式下添加LIMIT
-                    limit_clause = "LIMIT 1000" if pageSize and pageSize > 0 else ""
-                    data_query = text(f"""
-                        SELECT {field_list}
-                        FROM {table_name}
-                        {where_clause}
-                        {order_clause}
-                        {limit_clause}
-                    """)
-                    
-                    table_results = db.session.execute(data_query, params).fetchall()
-                    print(f"🔢 分区表 {table_name} 实际返回: {len(table_results)} 条记录")
-                    
-                    if table_results:
-                        print(f"📝 第一条记录示例: {dict(table_results[0]._mapping) if hasattr(table_results[0], '_mapping') else 'N/A'}")
-                    
-                    all_results.extend(table_results)
-                
-            except Exception as e:
-                print(f"❌ 查询分区表 {table_name} 失败: {e}")
-                import traceback
-                traceback.print_exc()
-                continue
-        
-        print(f"📈 分区表查询汇总: 总数={total_count}, 实际数据={len(all_results)}")
-        
-        if len(all_results) == 0:
+        if not results and not cursor:
             print("❗️ 分区表查询无数据，回退到主表查询")
-            return _query_main_table(device_sns, start_date, end_date, page, pageSize)
-        
-        # 修复排序逻辑 - 确保正确访问timestamp字段
-        try:
-            # 检查第一条记录的结构
-            if all_results:
-                first_record = all_results[0]
-                if hasattr(first_record, '_mapping'):
-                    # SQLAlchemy Row对象
-                    all_results.sort(key=lambda x: x._mapping.get('timestamp', x._mapping.get('timestamp', '')), reverse=True)
-                elif hasattr(first_record, 'timestamp'):
-                    # 有timestamp属性
-                    all_results.sort(key=lambda x: x.timestamp, reverse=True)
-                else:
-                    # 尝试按索引排序
-                    all_results.sort(key=lambda x: x[1] if len(x) > 1 else '', reverse=True)
-                
-                print(f"✅ 排序完成")
-        except Exception as sort_error:
-            print(f"⚠️ 排序失败，使用原始顺序: {sort_error}")
-        
-        # 分页处理
-        start_index = (page - 1) * pageSize
-        end_index = start_index + pageSize
-        paged_results = all_results[start_index:end_index]
+            return _query_main_table_fallback(device_sns, start_date, end_date, page, pageSize, query_fields, cursor, with_count)
         
-        print(f"📄 分页结果: 第{page}页, 每页{pageSize}条, 返回{len(paged_results)}条")
-        
-        return paged_results, total_count
+        print(f"📈 分区表查询: 总数={total_count}, 本页={len(results)}")
+        return results, total_count, next_cursor
         
+    except InvalidCursorError:
+        raise
     except Exception as e:
         print(f"❌ 分区表查询完全失败，回退到主表: {e}")
         import traceback
         traceback.print_exc()
-        return _query_main_table(device_sns, start_date, end_date, page, pageSize)
+        return _query_main_table_fallback(device_sns, start_date, end_date, page, pageSize, query_fields, cursor, with_count)
+
+def _query_main_table_fallback(device_sns, start_date, end_date, page, pageSize, query_fields=None, cursor=None, with_count=True): #分区回退主表查询#
+    """分区无数据时改读主表，下一页游标标记主表来源，保证翻页不再回到空分区"""
+    results, total_count, next_cursor = _query_main_table(device_sns, start_date, end_date, page, pageSize, query_fields, cursor, with_count)
+    return results, total_count, with_cursor_source(next_cursor, 't_user_health_data')
 
-def _query_main_table(device_sns, start_date, end_date, page, pageSize): #主表查询#
-    """主表查询逻辑"""
+def _query_main_table(device_sns, start_date, end_date, page, pageSize, query_fields=None, cursor=None, with_count=True): #主表查询#
+    """主表查询逻辑(keyset游标分页)"""
     print(f"🔍 _query_main_table 参数: device_sns={len(device_sns)}, start_date={start_date}, end_date={end_date}, pageSize={pageSize}")
-    
-    base_query = UserHealthData.query.filter(UserHealthData.device_sn.in_(device_sns))
-    
-    if start_date:
-        base_query = base_query.filter(UserHealthData.timestamp >= start_date)
-        print(f"✅ 添加开始时间过滤: >= {start_date}")
-    if end_date:
-        base_query = base_query.filter(UserHealthData.timestamp <= end_date)
-        print(f"✅ 添加结束时间过滤: <= {end_date}")
-    
-    total_count = base_query.count()
-    print(f"📊 查询到符合条件的总记录数: {total_count}")
-    
-    # 只有在需要分页时才应用分页限制
-    query = base_query.order_by(UserHealthData.timestamp.desc())
-    if pageSize and pageSize > 0:
-        query = query.offset((page-1)*pageSize).limit(pageSize)
-        print(f"📄 应用分页限制: page={page}, pageSize={pageSize}")
-    else:
-        print(f"📄 不分页，获取所有数据")
-    
-    results = query.all()
-    print(f"📋 实际返回记录数: {len(results)}")
-    
-    if results:
-        first_record = results[0]
-        last_record = results[-1]
-        print(f"⏰ 数据时间范围: {last_record.timestamp} 到 {first_record.timestamp}")
-    
-    return results, total_count
+    query_fields = query_fields or [c.name for c in UserHealthData.__table__.columns]
+    return _query_keyset_page(['t_user_health_data'], [('device_sn', 'device_sn IN :device_sns')], {'device_sns': list(device_sns)},
+                              start_date, end_date, page, pageSize, query_fields, cursor, with_count)
 
 def _get_partition_tables(start_date, end_date): #获取分区表列表#
-    """根据时间范围获取需要查询的分区表"""
-    from datetime import datetime, timedelta
-    import calendar
-    
-    tables = []
-    
-    if not start_date:
-        start_date = datetime.now() - timedelta(days=30)
-    if not end_date:
-        end_date = datetime.now()
-    
-    # 按月生成分区表名
-    current = start_date.replace(day=1)
-    
-    while current <= end_date:
-        table_name = f"t_user_health_data_{current.year}{current.month:02d}"
-        tables.append(table_name)
-        
-        # 移动到下个月
-        if current.month == 12:
-            current = current.replace(year=current.year + 1, month=1)
-        else:
-            current = current.replace(month=current.month + 1)
-    
-    # 如果没有分区表，回退到主表
-    if not tables:
-        tables = ['t_user_health_data']
-    
-    return tables
+    """根据时间范围获取需要查询的分区表(候选月份，是否存在由分区目录判断)"""
+    return month_partitions(start_date, end_date) or ['t_user_health_data']
 
-def _query_with_summary_tables(device_sns, start_date, end_date, page, pageSize, query_fields): #汇总表查询#
+def _query_with_summary_tables(device_sns, start_date, end_date, page, pageSize, query_fields, cursor=None, with_count=True): #汇总表查询#
     """使用汇总表查询大范围历史数据"""
     try:
         # 尝试查询每日汇总表
         from sqlalchemy import text
         
-        # 检查每日汇总表是否存在
-        summary_exists_query = text("SHOW TABLES LIKE 't_user_health_data_daily_summary'")
-        summary_exists = db.session.execute(summary_exists_query).fetchone()
-        
-        if summary_exists:
+        # 检查每日汇总表是否存在(分区目录缓存)；游标翻页来自明细分区，不切换到汇总表
+        if not cursor and get_partition_catalog().has_table(DAILY_SUMMARY_TABLE):
             # 使用汇总表查询
             conditions = []
             params = {'device_sns': tuple(device_sns)}
@@ -2875,7 +2946,6 @@ def _query_with_summary_tables(device_sns, start_date, end_date, page, pageSize,
                 FROM t_user_health_data_daily_summary 
                 WHERE device_sn IN :device_sns {' AND ' + ' AND '.join(conditions) if conditions else ''}
             """)
-            total_count = db.session.execute(count_query, params).scalar()
             
             # 构建基础查询
             base_query = f"""
@@ -2909,14 +2979,21 @@ def _query_with_summary_tables(device_sns, start_date, end_date, page, pageSize,
             
             data_query = text(base_query)
             
-            results = db.session.execute(data_query, params).fetchall()
-            return results, total_count
+            # 明细与总数在独立连接上并发查询
+            execute = engine_execute(db.engine)
+            tasks = [(DAILY_SUMMARY_TABLE, execute, data_query, params)]
+            if with_count:
+                tasks.append((f"{DAILY_SUMMARY_TABLE}:count", execute, count_query, params))
+            outputs = get_partition_fanout_executor().batch().map_ordered(tasks)
+            results = outputs[0]
+            total_count = outputs[1][0][0] if with_count else None
+            return results, total_count, None  # 汇总表按天聚合，仍用页码分页
         
     except Exception as e:
         print(f"❌ 汇总表查询失败: {e}")
     
     # 回退到分区表查询
-    return _query_partitioned_tables(device_sns, start_date, end_date, page, pageSize, query_fields)
+    return _query_partitioned_tables(device_sns, start_date, end_date, page, pageSize, query_fields, cursor, with_count)
 
 
 
@@ -3550,43 +3627,35 @@ def get_health_data_stats(device_sn, start_time, end_time):
         print(f"获取健康数据统计失败: {e}")
         return {}
 
-def get_waveform_data(device_sn, metric, start_time, end_time):
-    """获取波形数据"""
+def get_waveform_data(device_sn, metric, start_time, end_time, max_points=None, mode='lttb'):
+    """获取波形数据：只查询时间与指标两列，超过max_points时LTTB降采样(附桶内min/max)或按桶保留峰谷(mode=minmax)"""
     try:
-        # 获取指定时间范围内的数据，按时间排序
-        query = db.session.query(UserHealthData).filter(
+        column = {'heart_rate': UserHealthData.heart_rate, 'blood_oxygen': UserHealthData.blood_oxygen,
+                  'temperature': UserHealthData.temperature}.get(metric)
+        if column is None:
+            return []
+        rows = db.session.query(UserHealthData.timestamp, column).filter(
             UserHealthData.device_sn == device_sn,
             UserHealthData.timestamp.between(start_time, end_time),
-            UserHealthData.is_deleted.is_(False)
-        ).order_by(UserHealthData.timestamp.asc())
-        
-        records = query.all()
-        
-        waveform_points = []
-        for record in records:
-            if metric == 'heart_rate':
-                value = record.heart_rate
-            elif metric == 'blood_oxygen':
-                value = record.blood_oxygen
-            elif metric == 'temperature':
-                value = record.temperature
-            else:
-                value = 0
-            
-            if value is not None and value > 0:
-                waveform_points.append({
-                    'timestamp': record.timestamp.isoformat(),
-                    'value': float(value)
-                })
-        
-        return waveform_points
+            UserHealthData.is_deleted.is_(False),
+            column > 0
+        ).order_by(UserHealthData.timestamp.asc()).all()
+        
+        x, y, times = rows_to_arrays(rows)
+        if not max_points or len(y) <= max_points:
+            return [{'timestamp': t.isoformat(), 'value': float(v)} for t, v in zip(times, y)]
+        if mode == 'minmax':
+            return [{'timestamp': times[i].isoformat(), 'value': float(y[i])} for i in minmax_indices(y, max_points)]
+        indices, mins, maxs = lttb_indices(x, y, max_points, with_envelope=True)
+        return [{'timestamp': times[i].isoformat(), 'value': float(y[i]), 'min': float(lo), 'max': float(hi)}
+                for i, lo, hi in zip(indices, mins, maxs)]
         
     except Exception as e:
         print(f"获取波形数据失败: {e}")
         return []
 
-def get_health_trends_comprehensive(device_sn, metrics, start_time, end_time):
-    """获取综合健康趋势数据"""
+def get_health_trends_comprehensive(device_sn, metrics, start_time, end_time, max_points=None):
+    """获取综合健康趋势数据(按天)，单个指标超过max_points天时LTTB降采样"""
     try:
         # 按天分组统计数据
         from sqlalchemy import func, text
@@ -3625,6 +3694,12 @@ def get_health_trends_comprehensive(device_sn, metrics, start_time, end_time):
             if 'calorie' in metrics and stat.total_calories:
                 trends['calorie'].append({'date': date_str, 'value': float(stat.total_calories)})
         
+        for metric, points in trends.items():
+            if max_points and len(points) > max_points:
+                x = np.array([datetime.strptime(p['date'], '%Y-%m-%d').timestamp() for p in points])
+                indices, _, _ = lttb_indices(x, np.array([p['value'] for p in points], dtype=float), max_points)
+                trends[metric] = [points[i] for i in indices]
+        
         return trends
         
     except Exception as e:
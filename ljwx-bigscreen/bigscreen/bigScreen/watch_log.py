@@ -6,12 +6,13 @@
 
 from flask import request, jsonify, render_template
 from datetime import datetime
-import mysql.connector
+import pymysql
 from config import SQLALCHEMY_DATABASE_URI
+from .db_pool import get_db_connection
 import re
 
 def get_db_config():
-    """从SQLALCHEMY_DATABASE_URI解析数据库配置"""
+    """从SQLALCHEMY_DATABASE_URI解析数据库配置(连接已统一走db_pool，此函数仅保留兼容)"""
     uri = SQLALCHEMY_DATABASE_URI
     pattern = r'mysql://([^:]+):([^@]+)@([^:]+):(\d+)/(.+)'
     match = re.match(pattern, uri)
@@ -64,10 +65,16 @@ def upload_watch_log():
 def save_watch_log(device_sn, timestamp, log_level, log_content):
     """保存手表日志到数据库"""
     try:
-        config = get_db_config()
-        cnx = mysql.connector.connect(**config)
-        cursor = cnx.cursor()
-        
+        with get_db_connection() as cnx, cnx.cursor() as cursor:
+            _save_watch_log(cnx, cursor, device_sn, timestamp, log_level, log_content)
+    except pymysql.MySQLError as err:
+        print(f"保存手表日志失败: {err}")
+
+_watch_log_table_ready = False
+
+def _save_watch_log(cnx, cursor, device_sn, timestamp, log_level, log_content):
+    global _watch_log_table_ready
+    if not _watch_log_table_ready:
         create_table_sql = """
         CREATE TABLE IF NOT EXISTS t_watch_logs (
             id INT AUTO_INCREMENT PRIMARY KEY,
@@ -81,23 +88,17 @@ def save_watch_log(device_sn, timestamp, log_level, log_content):
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
         """
         cursor.execute(create_table_sql)
-        
-        insert_sql = """
-        INSERT INTO t_watch_logs (device_sn, timestamp, log_level, log_content)
-        VALUES (%s, %s, %s, %s)
-        """
-        
-        data = (device_sn, timestamp, log_level, log_content)
-        cursor.execute(insert_sql, data)
-        cnx.commit()
-        print(f"手表日志已保存: {device_sn} - {log_level} - {timestamp}")
-        
-    except mysql.connector.Error as err:
-        print(f"保存手表日志失败: {err}")
-    finally:
-        if cnx.is_connected():
-            cursor.close()
-            cnx.close()
+        _watch_log_table_ready = True  # 每个进程只建表检查一次
+    
+    insert_sql = """
+    INSERT INTO t_watch_logs (device_sn, timestamp, log_level, log_content)
+    VALUES (%s, %s, %s, %s)
+    """
+    
+    data = (device_sn, timestamp, log_level, log_content)
+    cursor.execute(insert_sql, data)
+    cnx.commit()
+    print(f"手表日志已保存: {device_sn} - {log_level} - {timestamp}")
 
 def watch_logs_page():
     """手表日志显示页面"""
@@ -113,10 +114,6 @@ def get_watch_logs():
         page = int(request.args.get('page', 1))
         page_size = int(request.args.get('pageSize', 50))
         
-        config = get_db_config()
-        cnx = mysql.connector.connect(**config)
-        cursor = cnx.cursor(dictionary=True)
-        
         where_conditions = []
         params = []
         
@@ -139,9 +136,6 @@ def get_watch_logs():
         where_clause = " WHERE " + " AND ".join(where_conditions) if where_conditions else ""
         
         count_sql = f"SELECT COUNT(*) as total FROM t_watch_logs{where_clause}"
-        cursor.execute(count_sql, params)
-        total = cursor.fetchone()['total']
-        
         offset = (page - 1) * page_size
         query_sql = f"""
         SELECT device_sn, timestamp, log_level, log_content, created_at
@@ -151,8 +145,11 @@ def get_watch_logs():
         LIMIT %s OFFSET %s
         """
         
-        cursor.execute(query_sql, params + [page_size, offset])
-        logs = cursor.fetchall()
+        with get_db_connection(readonly=True) as cnx, cnx.cursor(pymysql.cursors.DictCursor) as cursor:
+            cursor.execute(count_sql, params)
+            total = cursor.fetchone()['total']
+            cursor.execute(query_sql, params + [page_size, offset])
+            logs = cursor.fetchall()
         
         for log in logs:
             if log['timestamp']:
@@ -171,21 +168,13 @@ def get_watch_logs():
             }
         })
         
-    except mysql.connector.Error as err:
+    except pymysql.MySQLError as err:
         print(f"查询手表日志失败: {err}")
         return jsonify({"success": False, "message": f"查询失败: {str(err)}"})
-    finally:
-        if cnx.is_connected():
-            cursor.close()
-            cnx.close()
 
 def get_watch_log_stats():
     """获取手表日志统计信息"""
     try:
-        config = get_db_config()
-        cnx = mysql.connector.connect(**config)
-        cursor = cnx.cursor(dictionary=True)
-        
         stats_sql = """
         SELECT 
             log_level,
@@ -197,9 +186,6 @@ def get_watch_log_stats():
         ORDER BY count DESC
         """
         
-        cursor.execute(stats_sql)
-        level_stats = cursor.fetchall()
-        
         device_sql = """
         SELECT 
             COUNT(DISTINCT device_sn) as device_count,
@@ -208,8 +194,11 @@ def get_watch_log_stats():
         WHERE created_at >= DATE_SUB(NOW(), INTERVAL 24 HOUR)
         """
         
-        cursor.execute(device_sql)
-        device_stats = cursor.fetchone()
+        with get_db_connection(readonly=True) as cnx, cnx.cursor(pymysql.cursors.DictCursor) as cursor:
+            cursor.execute(stats_sql)
+            level_stats = cursor.fetchall()
+            cursor.execute(device_sql)
+            device_stats = cursor.fetchone()
         
         return jsonify({
             "success": True,
@@ -220,10 +209,6 @@ def get_watch_log_stats():
             }
         })
         
-    except mysql.connector.Error as err:
+    except pymysql.MySQLError as err:
         print(f"获取日志统计失败: {err}")
         return jsonify({"success": False, "message": f"统计失败: {str(err)}"})
-    finally:
-        if cnx.is_connected():
-            cursor.close()
-            cnx.close()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""把t_device_info_history中的整行历史压缩为差量存储(t_device_status_run游程 + 静态字段变更行)
+
+用法:
+    python compact_device_history.py                       # 压缩今天0点之前的全部设备历史
+    python compact_device_history.py --before 2025-06-01 --device A5GTQ24B26000732
+先执行 database_migrations/device_status_run.sql 建表；逐设备压缩并提交，可中断后续跑(已压缩的行不再处理)。
+压缩完成后设置 DEVICE_HISTORY_MODE=delta 切换写入方式；切换前写入的整行历史可再次执行本脚本压缩
+"""
+import os
+os.environ['IS_DOCKER'] = 'false'
+import argparse
+import time
+from datetime import datetime
+import pymysql
+from config import MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DATABASE
+from bigScreen.device_history_store import compact_device_history
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='压缩设备历史为差量存储')
+    parser.add_argument('--before', help='只压缩该日期之前的历史 YYYY-MM-DD(默认今天0点)')
+    parser.add_argument('--device', action='append', help='只压缩指定设备(可重复)')
+    return parser.parse_args()
+
+def compact(before, device_sns=None):
+    conn = pymysql.connect(host=MYSQL_HOST, port=MYSQL_PORT, user=MYSQL_USER,
+                           password=MYSQL_PASSWORD, database=MYSQL_DATABASE)
+    totals = {'rows': 0, 'runs': 0, 'kept': 0, 'deleted': 0}
+    try:
+        if not device_sns:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT DISTINCT serial_number FROM t_device_info_history WHERE timestamp < %s", (before,))
+                device_sns = [row[0] for row in cursor.fetchall()]
+        for index, device_sn in enumerate(device_sns, 1):
+            began = time.time()
+            try:
+                with conn.cursor() as cursor:
+                    result = compact_device_history(cursor, device_sn, before)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                print(f"❌ {device_sn} 压缩失败: {e}")
+                raise
+            for key, count in result.items():
+                totals[key] += count
+            if result['rows']:
+                print(f"✅ [{index}/{len(device_sns)}] {device_sn}: {result['rows']}行 -> 游程{result['runs']}段, "
+                      f"保留静态变更{result['kept']}行, 删除{result['deleted']}行, 耗时{time.time() - began:.1f}s")
+    finally:
+        conn.close()
+    print(f"🎉 设备历史压缩完成: {totals}")
+    return totals
+
+if __name__ == '__main__':
+    args = parse_args()
+    before = datetime.strptime(args.before, '%Y-%m-%d') if args.before else \
+        datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    compact(before, args.device)
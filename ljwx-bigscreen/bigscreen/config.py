@@ -94,6 +94,21 @@ DB_POOL_CONFIG = {
     'echo': False,  # 关闭SQL日志
 }
 
+# 原生pymysql连接池配置(上传热路径使用，见bigScreen/db_pool.py)
+RAW_DB_POOL_CONFIG = {
+    'max_size': int(os.getenv('MYSQL_RAW_POOL_SIZE', 20)),  # 单进程最大连接数
+    'min_idle': int(os.getenv('MYSQL_RAW_POOL_MIN_IDLE', 2)),  # 预热空闲连接数
+    'checkout_timeout': float(os.getenv('MYSQL_RAW_POOL_TIMEOUT', 5)),  # 获取连接最大等待(秒)
+    'ping_interval': int(os.getenv('MYSQL_RAW_POOL_PING_INTERVAL', 30)),  # 空闲超过该秒数出池前ping检查
+    'max_lifetime': int(os.getenv('MYSQL_RAW_POOL_MAX_LIFETIME', 3600)),  # 连接最长存活(秒)，避免被wait_timeout断开
+}
+
+# 只读副本配置(可选)，未配置MYSQL_REPLICA_HOST时读请求回落到主库
+MYSQL_REPLICA_HOST = os.getenv('MYSQL_REPLICA_HOST', '')
+MYSQL_REPLICA_PORT = int(os.getenv('MYSQL_REPLICA_PORT', MYSQL_PORT))
+MYSQL_REPLICA_USER = os.getenv('MYSQL_REPLICA_USER', MYSQL_USER)
+MYSQL_REPLICA_PASSWORD = os.getenv('MYSQL_REPLICA_PASSWORD', MYSQL_PASSWORD)
+
 # 性能优化配置
 PERFORMANCE_CONFIG = {
     'batch_size': 200,  # 增加批处理大小
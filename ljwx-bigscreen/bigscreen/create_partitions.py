@@ -6,6 +6,7 @@ import pymysql
 from config import MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DATABASE
 from datetime import datetime, timedelta
 import calendar
+from bigScreen.partition_catalog import notify_partition_change
 
 def create_monthly_partitions():
     """创建按月分区表并归档数据"""
@@ -46,6 +47,7 @@ def create_monthly_partitions():
             print(f"📅 需要创建的月份分区: {len(months_to_create)}个")
             
             # 3. 为每个月创建分区表
+            created_tables = []
             for year, month in months_to_create:
                 table_name = f"t_user_health_data_{year}{month:02d}"
                 
@@ -91,6 +93,7 @@ def create_monthly_partitions():
                 """
                 
                 cursor.execute(create_table_sql)
+                created_tables.append(table_name)
                 print(f"✅ 创建分区表: {table_name}")
                 
                 # 4. 归档数据到分区表
@@ -167,6 +170,10 @@ def create_monthly_partitions():
             conn.commit()
             print("\n🎉 分区表创建和数据归档完成!")
             
+            # 8. 通知应用进程刷新分区目录缓存(视图已重建，无新表时同样通知)
+            notify_partition_change(created_tables)
+            print(f"📣 已发送分区变更通知: 新增{len(created_tables)}张分区表")
+            
     except Exception as e:
         print(f"❌ 创建分区失败: {e}")
         conn.rollback()
@@ -30,8 +30,11 @@ import com.ljwx.modules.system.service.ISysOrgUnitsService;
 import lombok.extern.slf4j.Slf4j;
 import org.springframework.beans.factory.annotation.Autowired;
 import org.springframework.context.ApplicationEventPublisher;
+import org.springframework.data.redis.core.RedisTemplate;
 import org.springframework.stereotype.Service;
 import org.springframework.transaction.annotation.Transactional;
+import org.springframework.transaction.support.TransactionSynchronization;
+import org.springframework.transaction.support.TransactionSynchronizationManager;
 
 import com.ljwx.modules.system.event.SysOrgUnitsChangeEvent;
 
@@ -52,9 +55,15 @@ import cn.hutool.core.util.StrUtil;
 @Service
 public class SysOrgUnitsServiceImpl extends ServiceImpl<SysOrgUnitsMapper, SysOrgUnits> implements ISysOrgUnitsService {
 
+    /** ljwx-bigscreen组织森林缓存订阅的组织变更频道 */
+    private static final String ORG_CHANGE_CHANNEL = "org_change_channel";
+
     @Autowired
     private ApplicationEventPublisher eventPublisher;
 
+    @Autowired
+    private RedisTemplate<String, Object> redisTemplate;
+
     @Override
     public IPage<SysOrgUnits> listSysOrgUnitsPage(PageQuery pageQuery, SysOrgUnitsBO sysOrgUnitsBO) {
         System.out.println("🔍 SysOrgUnitsService.listSysOrgUnitsPage - 查询参数:");
@@ -163,6 +172,10 @@ public class SysOrgUnitsServiceImpl extends ServiceImpl<SysOrgUnitsMapper, SysOr
     public boolean updateById(SysOrgUnits entity) {
         SysOrgUnits oldEntity = this.getById(entity.getId());
         boolean result = super.updateById(entity);
+        if (result) {
+            SysOrgUnits current = this.getById(entity.getId());
+            publishOrgChange(current != null ? current : entity, "UPDATE");
+        }
 
         //System.out.println("entity.getIsDeleted():" + entity.getIsDeleted());
         /* 
@@ -273,9 +286,45 @@ public class SysOrgUnitsServiceImpl extends ServiceImpl<SysOrgUnitsMapper, SysOr
             // 发布组织机构变更事件
             eventPublisher.publishEvent(new SysOrgUnitsChangeEvent(this, entity, "CREATE"));
         }
+        if (result) {
+            publishOrgChange(entity, "CREATE");
+        }
         
         return result;
     }
 
+    /**
+     * 事务提交后发布组织变更事件(ljwx-bigscreen据此重载对应租户的组织森林)
+     * @param org 变更后的组织
+     * @param action CREATE/UPDATE
+     */
+    private void publishOrgChange(SysOrgUnits org, String action) {
+        Long customerId = org.getCustomerId() != null && org.getCustomerId() != 0 ? org.getCustomerId() : org.getId();
+        String message = String.format(
+            "{\"customer_id\":%d,\"org_id\":%d,\"action\":\"%s\",\"org\":{\"id\":%d,\"parent_id\":%d,\"name\":\"%s\",\"code\":\"%s\",\"level\":%d,\"is_deleted\":%d},\"timestamp\":%d}",
+            customerId, org.getId(), action, org.getId(), org.getParentId() == null ? 0 : org.getParentId(),
+            StrUtil.nullToEmpty(org.getName()).replace("\\", "\\\\").replace("\"", "\\\""),
+            StrUtil.nullToEmpty(org.getCode()).replace("\\", "\\\\").replace("\"", "\\\""),
+            org.getLevel() == null ? 0 : org.getLevel(), org.getIsDeleted() == null ? 0 : org.getIsDeleted(),
+            System.currentTimeMillis());
+        Runnable publish = () -> {
+            try {
+                redisTemplate.convertAndSend(ORG_CHANGE_CHANNEL, message);
+            } catch (Exception e) {
+                log.error("❌ 组织变更事件发布失败: orgId={}, error={}", org.getId(), e.getMessage());
+            }
+        };
+        if (TransactionSynchronizationManager.isSynchronizationActive()) {
+            TransactionSynchronizationManager.registerSynchronization(new TransactionSynchronization() {
+                @Override
+                public void afterCommit() {
+                    publish.run();
+                }
+            });
+        } else {
+            publish.run();
+        }
+    }
+
 }
 
@@ -29,6 +29,14 @@ except ImportError:
     get_alert_rules_cache_manager = None
     CACHE_MANAGER_AVAILABLE = False
 
+try:
+    from bigScreen.alert_streak_store import get_alert_streak_store
+    STREAK_STORE_AVAILABLE = True
+except ImportError:
+    print("警告：无法导入告警趋势状态存储，异常计数仅在进程内保存")
+    get_alert_streak_store = None
+    STREAK_STORE_AVAILABLE = False
+
 # 设置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -174,16 +182,27 @@ class DeviceInfoCache:
             return None
 
 class AbnormalCountTracker:
-    """异常计数跟踪器"""
+    """异常计数跟踪器 - 优先使用大屏的Redis趋势状态存储(跨进程/跨上传共享)，不可用时退回进程内计数"""
     
     def __init__(self, ttl=3600):  # 1小时过期
+        self.store = get_alert_streak_store() if STREAK_STORE_AVAILABLE else None
         self.counts = LRUCache(maxsize=50000)  # device_sn:physical_sign -> count
         self.lock = threading.RLock()
         self.timestamps = {}  # 记录最后更新时间
         self.ttl = ttl
     
+    def observe(self, device_sn: str, rule: AlertRule, is_abnormal: bool, ts: Optional[str] = None) -> bool:
+        """计入一次样本，连续异常达到trend_duration时返回True并清零"""
+        required = max(int(rule.trend_duration or 1), 1)
+        if self.store is not None:
+            return self.store.update(device_sn, rule.physical_sign, rule.id, is_abnormal, required, ts=ts)
+        if self.update_count(device_sn, rule.physical_sign, is_abnormal) >= required:
+            self.update_count(device_sn, rule.physical_sign, False)  # 重置计数，避免重复告警
+            return True
+        return False
+    
     def update_count(self, device_sn: str, physical_sign: str, is_abnormal: bool) -> int:
-        """更新异常计数"""
+        """更新异常计数(进程内)"""
         key = f"{device_sn}:{physical_sign}"
         current_time = time.time()
         
@@ -206,7 +225,7 @@ class AbnormalCountTracker:
                 return 0
     
     def get_count(self, device_sn: str, physical_sign: str) -> int:
-        """获取当前异常计数"""
+        """获取当前异常计数(进程内)"""
         key = f"{device_sn}:{physical_sign}"
         with self.lock:
             return self.counts.get(key, 0)
@@ -385,13 +404,8 @@ class OptimizedAlertGenerator:
                 # 获取对应的健康数据值
                 is_abnormal, violation_info = self._check_rule_violation(health_data, rule)
                 
-                # 更新异常计数
-                abnormal_count = self.abnormal_tracker.update_count(
-                    device_sn, rule.physical_sign, is_abnormal
-                )
-                
-                # 检查是否需要生成告警
-                if abnormal_count >= rule.trend_duration:
+                # 更新异常计数并检查是否需要生成告警
+                if self.abnormal_tracker.observe(device_sn, rule, is_abnormal, health_data.get('timestamp')):
                     alert_candidate = AlertCandidate(
                         rule_id=rule.id,
                         rule_type=rule.rule_type,
@@ -404,13 +418,10 @@ class OptimizedAlertGenerator:
                         customer_id=device_info.customer_id,
                         alert_timestamp=datetime.now(),
                         alert_value=violation_info,
-                        threshold_violated=f"连续{abnormal_count}次异常"
+                        threshold_violated=f"连续{rule.trend_duration}次异常"
                     )
                     alert_candidates.append(alert_candidate)
                     
-                    # 重置计数，避免重复告警
-                    self.abnormal_tracker.update_count(device_sn, rule.physical_sign, False)
-                    
             except Exception as e:
                 logger.error(f"评估规则失败 rule_id={rule.id}: {e}")
                 continue
@@ -507,6 +518,8 @@ class OptimizedAlertGenerator:
         stats['rule_cache_size'] = len(self.rule_cache.cache)
         stats['device_cache_size'] = len(self.device_cache.cache)
         stats['abnormal_tracker_size'] = len(self.abnormal_tracker.counts)
+        if self.abnormal_tracker.store is not None:
+            stats['abnormal_tracker_store'] = self.abnormal_tracker.store.get_stats()
         return stats
     
     def clear_caches(self):
@@ -5,6 +5,9 @@
 数据库辅助工具
 用于直接查询数据库获取用户和健康数据
 
+离线脚本(run_health_processing.sh)独立运行，读取自身db_config.json，每个实例复用一条长连接；
+不依赖大屏应用的config模块，因此不接入bigScreen.db_pool连接池
+
 @Author: bruno.gao <gaojunivas@gmail.com>
 @ProjectName: ljwx-boot
 @CreateTime: 2025-01-26